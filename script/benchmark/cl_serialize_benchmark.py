@@ -0,0 +1,59 @@
+#:  -*- coding: utf-8 -*-
+import pickle
+import sys
+import time
+
+from chanlun import cl, cl_serialize
+from chanlun.cl_utils import query_cl_chart_config
+from chanlun.exchange.exchange_db import ExchangeDB
+
+"""
+缠论数据对象的序列化性能对比（pickle 与 cl_serialize 紧凑格式）
+
+python cl_serialize_benchmark.py [市场，默认 a] [代码，默认 SH.000001] [周期，默认 5m] [K线数量，默认 5000]
+"""
+
+
+def bench(name: str, dumps, loads, cd, nums: int = 5):
+    dump_times = []
+    load_times = []
+    data = b""
+    for _ in range(nums):
+        s_time = time.time()
+        data = dumps(cd)
+        dump_times.append(time.time() - s_time)
+        s_time = time.time()
+        loads(data)
+        load_times.append(time.time() - s_time)
+    print(
+        f"{name:<20} 大小：{len(data) / 1024:>8.0f} KB  "
+        f"序列化：{min(dump_times) * 1000:>7.1f} ms  反序列化：{min(load_times) * 1000:>7.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    market = sys.argv[1] if len(sys.argv) > 1 else "a"
+    code = sys.argv[2] if len(sys.argv) > 2 else "SH.000001"
+    frequency = sys.argv[3] if len(sys.argv) > 3 else "5m"
+    limit = int(sys.argv[4]) if len(sys.argv) > 4 else 5000
+
+    ex = ExchangeDB(market)
+    klines = ex.klines(code, frequency, args={"limit": limit})
+    cd = cl.CL(code, frequency, query_cl_chart_config(market, code)).process_klines(
+        klines
+    )
+    print(f"{market} {code} {frequency} K线数量：{len(cd.get_src_klines())}")
+
+    bench("pickle", pickle.dumps, pickle.loads, cd)
+    for compress in [None, "zlib", "zstd", "lz4"]:
+        try:
+            cl_serialize.dumps([], compress)
+        except ImportError:
+            print(f"cl_serialize {compress} 未安装压缩库，跳过")
+            continue
+        bench(
+            f"cl_serialize {compress}",
+            lambda _cd: cl_serialize.dumps(_cd, compress),
+            cl_serialize.loads,
+            cd,
+        )
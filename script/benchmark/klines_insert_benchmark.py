@@ -0,0 +1,105 @@
+#:  -*- coding: utf-8 -*-
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from chanlun import config
+
+"""
+K线批量写入数据库的性能对比（逐行 SELECT + INSERT/UPDATE 与 批量 UPSERT）
+
+使用单独的数据库，避免影响正式的行情数据
+python klines_insert_benchmark.py [写入的K线数量，默认 1000000]
+"""
+
+config.DB_DATABASE = "chanlun_benchmark"
+
+from chanlun.db import db  # noqa: E402
+
+# 逐行写入的方式太慢，只使用部分数据计算每秒写入数量
+ROW_BY_ROW_NUMS = 20000
+
+
+def make_klines(code: str, nums: int) -> pd.DataFrame:
+    dates = pd.date_range("2000-01-04 09:35:00", periods=nums, freq="5min")
+    prices = np.random.random(nums) * 100
+    return pd.DataFrame(
+        {
+            "code": code,
+            "date": dates.tz_localize("Asia/Shanghai"),
+            "open": prices,
+            "high": prices + 1,
+            "low": prices - 1,
+            "close": prices,
+            "volume": np.random.random(nums) * 10000,
+        }
+    )
+
+
+def klines_insert_row_by_row(market: str, code: str, frequency: str, klines):
+    """
+    之前 sqlite 的写入方式，每根K线查询一次，再插入或更新
+    """
+    with db.Session() as session:
+        table = db.klines_tables(market, code)
+        for _, _k in klines.iterrows():
+            _in_k = {
+                "code": code,
+                "f": frequency,
+                "dt": _k["date"].replace(tzinfo=None),
+                "o": _k["open"],
+                "c": _k["close"],
+                "h": _k["high"],
+                "l": _k["low"],
+                "v": _k["volume"],
+            }
+            db_k = (
+                session.query(table)
+                .filter(
+                    table.code == code,
+                    table.f == frequency,
+                    table.dt == _in_k["dt"],
+                )
+                .first()
+            )
+            if db_k is None:
+                session.add(table(**_in_k))
+            else:
+                session.query(table).filter(
+                    table.code == code,
+                    table.f == frequency,
+                    table.dt == _in_k["dt"],
+                ).update(_in_k)
+        session.commit()
+
+
+if __name__ == "__main__":
+    nums = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print(f"数据库类型：{config.DB_TYPE}，写入K线数量：{nums}")
+
+    klines = make_klines("SH.999998", ROW_BY_ROW_NUMS)
+    db.klines_delete("a", "SH.999998")
+    s_time = time.time()
+    klines_insert_row_by_row("a", "SH.999998", "5m", klines)
+    row_speed = len(klines) / (time.time() - s_time)
+    print(f"逐行写入：{row_speed:.0f} 条/秒 （{len(klines)} 条）")
+
+    klines = make_klines("SH.999999", nums)
+    db.klines_delete("a", "SH.999999")
+    s_time = time.time()
+    db.klines_insert("a", "SH.999999", "5m", klines)
+    bulk_speed = len(klines) / (time.time() - s_time)
+    print(f"批量写入：{bulk_speed:.0f} 条/秒 （{len(klines)} 条）")
+
+    # 全部是已存在的数据，测试更新的速度
+    s_time = time.time()
+    db.klines_insert("a", "SH.999999", "5m", klines)
+    update_speed = len(klines) / (time.time() - s_time)
+    print(f"批量更新：{update_speed:.0f} 条/秒 （{len(klines)} 条）")
+
+    print(f"批量写入提升：{bulk_speed / row_speed:.1f} 倍")
+
+    db.klines_delete("a", "SH.999998")
+    db.klines_delete("a", "SH.999999")
@@ -59,14 +59,19 @@ if __name__ == "__main__":
     xg_by_same.bi_weight = 0.6  # 笔相似度占比权重
     xg_by_same.xd_weight = 0.1  # 线段相似度占比权重
 
+    # 使用特征索引：先增量更新索引（只计算最新K线有变化的代码），再在索引中查询相似度
+    # 不使用索引的，run_type 设置为 process 使用多进程逐个代码计算
+    use_index = True
+    if use_index:
+        xg_by_same.refresh_index(target_frequency, find_codes, cl_config)
     same_codes = xg_by_same.run(
         target_code=target_code,
         frequency=target_frequency,
         target_end_datetime=target_end_datetime,
         find_codes=find_codes,
         cl_config=cl_config,
-        run_type="process",
-    )  # 使用多进行运行相似度选股
+        run_type="index" if use_index else "process",
+    )
 
     # 按照相似度进行排序
     same_codes = sorted(same_codes, key=lambda x: x["similarity"], reverse=True)
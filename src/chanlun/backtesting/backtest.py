@@ -1,3 +1,4 @@
+import contextlib
 import copy
 import datetime
 import gc
@@ -6,7 +7,8 @@ import os
 import pickle
 import time
 import traceback
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import repeat
 from multiprocessing import get_context
 from pathlib import Path
 
@@ -25,7 +27,8 @@ from chanlun.backtesting.backtest_klines import BackTestKlines
 from chanlun.backtesting.backtest_trader import BackTestTrader
 from chanlun.backtesting.base import POSITION, Strategy
 from chanlun.backtesting.klines_generator import KlinesGenerator
-from chanlun.backtesting.optimize import OptimizationSetting
+from chanlun.backtesting.klines_shm import KlinesSharedMemory
+from chanlun.backtesting.optimize import OptimizationSetting, TPESampler
 from chanlun.cl_interface import ICL
 from chanlun.exchange.exchange import (
     convert_currency_kline_frequency,
@@ -95,17 +98,6 @@ class BackTest:
 
         self.save_file: str = config.get("save_file")
 
-        # 交易对象
-        self.trader = BackTestTrader(
-            "回测",
-            self.mode,
-            market=self.market,
-            init_balance=self.init_balance,
-            fee_rate=self.fee_rate,
-            max_pos=self.max_pos,
-            log=self.log.info,
-        )
-        self.trader.set_strategy(self.strategy)
         self.datas = BackTestKlines(
             self.market,
             self.start_datetime,
@@ -113,18 +105,39 @@ class BackTest:
             self.frequencys,
             self.cl_config,
         )
-        self.trader.set_data(self.datas)
+        # 交易对象
+        self.trader = self.new_trader()
 
         # 回测循环加载下次周期，默认None 为回测最小周期
         self.next_frequency = None
-        # 回测中是否将数据批量加载到内存中，True 会占用大量内存，如果内存不足，建议设置为 False
-        self.load_data_to_cache = True
+        # 回测中是否将数据批量加载到内存中，True 会占用大量内存，如果内存不足，建议设置为 False 或 "mmap"（使用内存映射文件）
+        self.load_data_to_cache: bool | str = True
 
         # 参数优化，评价指标字段，默认为最终盈利百分比总和
         self.evaluate = "profit_rate"
 
         self._process_re_again = False
 
+        # 参数优化时，共享内存中已经加载好的K线数据 代码 : (共享内存名称, 布局信息)
+        self._shared_klines: dict[str, tuple[str, dict]] = {}
+
+    def new_trader(self) -> BackTestTrader:
+        """
+        创建新的交易对象（没有任何回测结果）
+        """
+        trader = BackTestTrader(
+            "回测",
+            self.mode,
+            market=self.market,
+            init_balance=self.init_balance,
+            fee_rate=self.fee_rate,
+            max_pos=self.max_pos,
+            log=self.log.info,
+        )
+        trader.set_strategy(self.strategy)
+        trader.set_data(self.datas)
+        return trader
+
     def save(self):
         """
         保存回测结果到配置的文件中
@@ -270,6 +283,7 @@ class BackTest:
         _et = time.time()
 
         self.log.info(f"运行完成，执行时间：{_et - _st}")
+        self.log.info(f"每次循环的平均耗时：{self.datas.use_times_per_step()}")
         return True
 
     def run_by_code(self, code: str):
@@ -330,25 +344,9 @@ class BackTest:
                 BT = BackTest()
                 # print(f"f: {f}")
                 BT.load(f)
-                # 汇总结果
-                for mmd, res in BT.trader.results.items():
-                    for _k, _v in res.items():
-                        self.trader.results[mmd][_k] += _v
-                # 历史持仓合并
-                for _code, _poss in BT.trader.positions_history.items():
-                    self.trader.positions_history[_code] = _poss
-                # 持仓盈亏合并
-                for _dt, _hold_profits in BT.trader.hold_profit_history.items():
-                    if _dt not in self.trader.hold_profit_history:
-                        self.trader.hold_profit_history[_dt] = 0
-                    self.trader.hold_profit_history[_dt] += _hold_profits
-                # 合并订单记录
-                for _code, _orders in BT.trader.orders.items():
-                    self.trader.orders[_code] = _orders
-                # 资金历史记录
-                balance_history[BT.base_code] = BT.trader.balance_history
-                # 手续费合并
-                self.trader.fee_total += BT.trader.fee_total
+                self._merge_process_result(
+                    BT.base_code, self._trader_result(BT.trader), balance_history
+                )
 
                 # 释放内存
                 BT.trader = None
@@ -359,9 +357,7 @@ class BackTest:
 
                 # 整理并汇总资金变动历史
             try:
-                bh_df = pd.DataFrame(balance_history.values())
-                bh_df = bh_df.T.sort_index().fillna(method="ffill").fillna(0)
-                self.trader.balance_history = bh_df.sum(axis=1)
+                self._merge_balance_history(balance_history)
             except Exception:  # noqa: BLE001
                 self.log.error("合并资金历史记录异常")
                 self.log.error(traceback.format_exc())
@@ -376,9 +372,160 @@ class BackTest:
                 gc.collect()
         return True
 
-    def run_params(self, new_cl_setting: dict):
+    def run_by_code_shm(self, code: str, shm_name: str, shm_layout: dict) -> dict:
+        """
+        使用共享内存中的K线数据，回测指定的代码，返回精简的回测结果（不保存回测文件）
+        """
+        self.datas.set_klines_shm(code, shm_name, shm_layout)
+
+        # 使用新的交易对象，返回的结果只包含当前代码的回测结果
+        self.trader = self.new_trader()
+        self.base_code = code
+        self.codes = [code]
+        self.load_data_to_cache = True
+        self.run(self.next_frequency)
+
+        return self._trader_result(self.trader)
+
+    def run_process_shm(
+        self,
+        next_frequency: str | None = None,
+        max_workers: int | None = None,
+    ):
+        """
+        多进程执行回测模式（共享内存）
+        主进程读取每个代码的K线数据，通过共享内存传递给子进程，子进程回测完成后返回精简的结果，
+        主进程在每个代码完成后就进行合并，不需要保存与加载每个代码的回测文件
+        """
+        if self.mode != "signal":
+            raise Exception(f"多进程回测，不支持 {self.mode} 回测模式")  # noqa: TRY002
+
+        if next_frequency is None:
+            next_frequency = self.frequencys[-1]
+        self.next_frequency = next_frequency
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        start = time.time()
+        balance_history = {}
+        codes = iter(self.codes)
+        # 运行中的任务 future : (代码, 共享内存)
+        running = {}
+        bar = tqdm(total=len(self.codes), desc="多进程回测")
+        # 发送给子进程的回测对象，不包含主进程中合并的回测结果（每次提交任务都会序列化）
+        worker_bt = copy.copy(self)
+        worker_bt.trader = None
+        with ProcessPoolExecutor(
+            max_workers, mp_context=get_context("spawn")
+        ) as executor:
+
+            def submit_next():
+                code = next(codes, None)
+                if code is None:
+                    return False
+                shm, layout = KlinesSharedMemory.create(
+                    self.datas.load_klines_arrays(code)
+                )
+                running[
+                    executor.submit(worker_bt.run_by_code_shm, code, shm.name, layout)
+                ] = (code, shm)
+                return True
+
+            try:
+                # 提前准备好下一批的数据，子进程运行完成后可以直接开始下一个
+                for _ in range(max_workers * 2):
+                    if submit_next() is False:
+                        break
+                while len(running) > 0:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for _future in done:
+                        code, shm = running.pop(_future)
+                        shm.close()
+                        shm.unlink()
+                        try:
+                            self._merge_process_result(
+                                code, _future.result(), balance_history
+                            )
+                        except Exception:  # noqa: BLE001
+                            self.log.error(f"执行 {code} 回测异常")
+                            self.log.error(traceback.format_exc())
+                        bar.update(1)
+                        submit_next()
+            finally:
+                # 异常退出时，释放还未完成任务的共享内存
+                for code, shm in running.values():
+                    shm.close()
+                    shm.unlink()
+                bar.close()
+
+        try:
+            self._merge_balance_history(balance_history)
+        except Exception:  # noqa: BLE001
+            self.log.error("合并资金历史记录异常")
+            self.log.error(traceback.format_exc())
+
+        self.log.info(f"多进程回测完成，耗时{int(time.time() - start)}秒")
+        self.log.info("合并回测结果完成，可调用 save 方法进行保存")
+        return True
+
+    @staticmethod
+    def _trader_result(trader: BackTestTrader) -> dict:
+        """
+        多进程回测中，需要合并的回测结果
+        """
+        return {
+            "results": trader.results,
+            "positions_history": trader.positions_history,
+            "hold_profit_history": trader.hold_profit_history,
+            "orders": trader.orders,
+            "balance_history": trader.balance_history,
+            "fee_total": trader.fee_total,
+        }
+
+    def _merge_process_result(self, code: str, res: dict, balance_history: dict):
+        """
+        合并多进程回测中，单个代码的回测结果
+        :param code: 回测的代码
+        :param res: 回测结果，包含 results/positions_history/hold_profit_history/orders/balance_history/fee_total
+        :param balance_history: 记录每个代码的资金变动历史，全部完成后调用 _merge_balance_history 汇总
+        """
+        # 汇总结果
+        for mmd, mmd_res in res["results"].items():
+            for _k, _v in mmd_res.items():
+                self.trader.results[mmd][_k] += _v
+        # 历史持仓合并
+        for _code, _poss in res["positions_history"].items():
+            self.trader.positions_history[_code] = _poss
+        # 持仓盈亏合并
+        for _dt, _hold_profits in res["hold_profit_history"].items():
+            if _dt not in self.trader.hold_profit_history:
+                self.trader.hold_profit_history[_dt] = 0
+            self.trader.hold_profit_history[_dt] += _hold_profits
+        # 合并订单记录
+        for _code, _orders in res["orders"].items():
+            self.trader.orders[_code] = _orders
+        # 资金历史记录
+        balance_history[code] = res["balance_history"]
+        # 手续费合并
+        self.trader.fee_total += res["fee_total"]
+
+    def _merge_balance_history(self, balance_history: dict):
+        """
+        整理并汇总资金变动历史
+        """
+        bh_df = pd.DataFrame(balance_history.values())
+        bh_df = bh_df.T.sort_index().ffill().fillna(0)
+        self.trader.balance_history = bh_df.sum(axis=1)
+
+    def run_params(
+        self,
+        new_cl_setting: dict,
+        start_datetime: str | None = None,
+        end_datetime: str | None = None,
+    ):
         """
         参数优化，执行不同的参数配置
+        start_datetime / end_datetime 可以指定回测的时间段（用于逐步淘汰的参数优化），默认为回测配置的时间段
 
         注意事项：如果有修改过 Strategy 策略文件，并需要重新进行参数优化的，需要手动将 notebook/data/bk/_optimization_*.pkl 文件删除
         注意事项：如果有修改过 Strategy 策略文件，并需要重新进行参数优化的，需要手动将 notebook/data/bk/_optimization_*.pkl 文件删除
@@ -391,8 +538,12 @@ class BackTest:
                 copy_cl_config["default"][k] = v
             else:
                 copy_cl_config[k] = v
+        if start_datetime is None:
+            start_datetime = self.start_datetime
+        if end_datetime is None:
+            end_datetime = self.end_datetime
         # 生成一个唯一的key，用于避免重复执行相同配置的回测
-        key = f"{self.base_code}_{self.market}_{self.codes}_{self.frequencys}_{self.start_datetime}_{self.end_datetime}_{type(self.strategy)}_{copy_cl_config}"
+        key = f"{self.base_code}_{self.market}_{self.codes}_{self.frequencys}_{start_datetime}_{end_datetime}_{type(self.strategy)}_{copy_cl_config}"
         key = hashlib.md5(key.encode(encoding="UTF-8")).hexdigest()
         # 保存到新的文件中，进行落地
         new_save_file = f"./data/bk/_optimization_{key}.pkl"
@@ -413,9 +564,9 @@ class BackTest:
                 # 回测的周期，这里设置里，在策略中才能取到对应周期的数据
                 "frequencys": self.frequencys,
                 # 回测开始的时间
-                "start_datetime": self.start_datetime,
+                "start_datetime": start_datetime,
                 # 回测的结束时间
-                "end_datetime": self.end_datetime,
+                "end_datetime": end_datetime,
                 # mode 为 trade 生效，初始账户资金
                 "init_balance": self.init_balance,
                 # mode 为 trade 生效，交易手续费率
@@ -428,6 +579,8 @@ class BackTest:
         )
 
         BT.load_data_to_cache = self.load_data_to_cache
+        if len(self._shared_klines) > 0:
+            BT.load_data_to_cache = True
 
         BT.log.info(
             f"执行参数优化，参数配置：{new_cl_setting}，落地文件：{new_save_file}"
@@ -437,6 +590,9 @@ class BackTest:
             # 判断文件不存在，执行回测，文件存在，加载回测结果
             if os.path.isfile(new_save_file) is False:
                 BT.log.info(f"落地文件：{new_save_file} 不存在，开始执行回测")
+                # 使用共享内存中已经加载好的K线数据，不需要再从数据库中读取
+                for _code, (_name, _layout) in self._shared_klines.items():
+                    BT.datas.set_klines_shm(_code, _name, _layout)
                 BT.run(
                     self.next_frequency
                 )  # 节省参数优化执行的时间，这里可以手动设置每次循环的周期
@@ -466,7 +622,10 @@ class BackTest:
         max_workers: int | None = None,
         next_frequency: str | None = None,
         evaluate: str = "profit_rate",
-        load_data_to_cache: bool = True,
+        load_data_to_cache: bool | str = True,
+        search_mode: str = "grid",
+        search_args: dict | None = None,
+        share_klines: bool = False,
     ):
         """
         运行参数优化
@@ -474,11 +633,21 @@ class BackTest:
         @param max_workers: 最大运行进程数
         @param next_frequency: 回测每次循环的周期
         @param evaluate: 评价的指标 允许 profit_rate /  max_profit_rate
-        @param load_data_to_cache: 批量优化，如果使用加载数据到内存中的做法，会占用太多内存，这里可以设置为 False，直接读取数据到方式执行
+        @param load_data_to_cache: 批量优化，如果使用加载数据到内存中的做法，会占用太多内存，这里可以设置为 False，直接读取数据到方式执行，或设置为 "mmap" 使用内存映射文件
+        @param search_mode: 参数搜索方式
+            grid 穷举所有的参数组合
+            halving 逐步淘汰，先在较短的时间段回测所有组合，只保留表现最好的一部分，在更长的时间段继续回测，最后一轮为完整的回测时间段
+            tpe 贝叶斯优化，根据已完成的回测结果，选择更可能表现好的参数组合进行回测
+        @param search_args: 搜索方式的参数
+            halving : eta 每轮保留 1/eta 的组合，默认 3；rounds 淘汰的轮数，默认 3
+            tpe : n_trials 回测的组合数量，默认 参数空间的 1/5（最少 20）；其他参数见 TPESampler
+        @param share_klines: 是否在开始前一次性加载所有代码的K线数据到共享内存中，每个参数组合的回测直接使用，不再重复读取数据库
         """
         cl_settings: list[dict] = optimization_setting.generate_cl_settings()
+        if search_args is None:
+            search_args = {}
 
-        self.log.info("开始执行穷举算法优化")
+        self.log.info(f"开始执行参数优化，搜索方式：{search_mode}")
         self.log.info(f"参数优化空间：{len(cl_settings)}")
 
         self.next_frequency = next_frequency  # 每次循环的周期
@@ -487,15 +656,28 @@ class BackTest:
 
         start = time.perf_counter()
 
-        with ProcessPoolExecutor(
-            max_workers, mp_context=get_context("spawn")
-        ) as executor:
-            results = list(executor.map(self.run_params, cl_settings))
+        with (
+            self._share_klines(share_klines),
+            ProcessPoolExecutor(
+                max_workers, mp_context=get_context("spawn")
+            ) as executor,
+        ):
+            if search_mode == "halving":
+                results = self._search_halving(executor, cl_settings, **search_args)
+            elif search_mode == "tpe":
+                results = self._search_tpe(
+                    executor,
+                    optimization_setting,
+                    max_workers or os.cpu_count() or 1,
+                    **search_args,
+                )
+            else:
+                results = list(executor.map(self.run_params, cl_settings))
             results.sort(reverse=True, key=lambda _r: _r["end_balance"])
 
             end = time.perf_counter()
             cost: int = int(end - start)
-            self.log.info(f"穷举算法优化完成，耗时{cost}秒")
+            self.log.info(f"参数优化完成，回测组合数量：{len(results)}，耗时{cost}秒")
             try:
                 for r in results:
                     try:
@@ -530,6 +712,101 @@ class BackTest:
                 # 确保资源被释放
                 gc.collect()
 
+    @contextlib.contextmanager
+    def _share_klines(self, enable: bool):
+        """
+        加载所有回测代码的K线数据到共享内存中，在 run_params 中使用，退出时释放共享内存
+        """
+        shms = []
+        try:
+            if enable:
+                codes = list(self.codes)
+                if self.base_code not in codes:
+                    codes.append(self.base_code)
+                for _code in tqdm(codes, desc="加载K线数据到共享内存"):
+                    shm, layout = KlinesSharedMemory.create(
+                        self.datas.load_klines_arrays(_code)
+                    )
+                    shms.append(shm)
+                    self._shared_klines[_code] = (shm.name, layout)
+            yield
+        finally:
+            self._shared_klines = {}
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    def _search_halving(
+        self,
+        executor: ProcessPoolExecutor,
+        cl_settings: list[dict],
+        eta: int = 3,
+        rounds: int = 3,
+    ) -> list[dict]:
+        """
+        逐步淘汰的参数搜索
+        第 i 轮（从 0 开始）回测 开始时间 到 总时长 / eta^(rounds - 1 - i) 的时间段，保留结果最好的 1/eta 进入下一轮
+        返回最后一轮（完整时间段）的回测结果
+        """
+        start_dt = datetime.datetime.strptime(self.start_datetime, "%Y-%m-%d %H:%M:%S")
+        end_dt = datetime.datetime.strptime(self.end_datetime, "%Y-%m-%d %H:%M:%S")
+        candidates = cl_settings
+        results = []
+        for _r in range(rounds):
+            if _r == rounds - 1:
+                round_end = self.end_datetime
+            else:
+                round_end = fun.datetime_to_str(
+                    start_dt + (end_dt - start_dt) / eta ** (rounds - 1 - _r)
+                )
+            self.log.info(
+                f"逐步淘汰第 {_r + 1} 轮，组合数量：{len(candidates)}，回测时间段：{self.start_datetime} - {round_end}"
+            )
+            results = list(
+                executor.map(
+                    self.run_params,
+                    candidates,
+                    repeat(self.start_datetime),
+                    repeat(round_end),
+                )
+            )
+            if _r == rounds - 1:
+                break
+            results.sort(reverse=True, key=lambda _res: _res["end_balance"])
+            keep_nums = max(1, len(results) // eta)
+            candidates = [_res["params"] for _res in results[:keep_nums]]
+        return results
+
+    def _search_tpe(
+        self,
+        executor: ProcessPoolExecutor,
+        optimization_setting: OptimizationSetting,
+        batch_nums: int,
+        n_trials: int | None = None,
+        **sampler_args,
+    ) -> list[dict]:
+        """
+        TPE 贝叶斯优化的参数搜索，每次按照进程数量采样一批参数进行回测，根据结果更新采样分布
+        """
+        sampler = TPESampler(optimization_setting.cl_config_params, **sampler_args)
+        if n_trials is None:
+            n_trials = max(20, sampler.space_size() // 5)
+        n_trials = min(n_trials, sampler.space_size())
+
+        results = []
+        while len(results) < n_trials:
+            settings = sampler.ask(min(batch_nums, n_trials - len(results)))
+            if len(settings) == 0:
+                break
+            for _res in executor.map(self.run_params, settings):
+                sampler.tell(_res["params"], _res["end_balance"])
+                results.append(_res)
+            best = max(results, key=lambda _r: _r["end_balance"])
+            self.log.info(
+                f"TPE 已完成 {len(results)}/{n_trials}，当前最好结果：{best['end_balance']} 参数：{best['params']}"
+            )
+        return results
+
     def show_charts(
         self,
         code,
@@ -4,12 +4,16 @@ import hashlib
 import json
 import time
 
+import numpy as np
 import pandas as pd
 import pytz
 from tqdm.auto import tqdm
 
 from chanlun import cl, fun
 from chanlun.backtesting.base import MarketDatas
+from chanlun.backtesting.klines_aggregator import KlinesFrequencyAggregator
+from chanlun.backtesting.klines_mmap import KlinesMmapCache
+from chanlun.backtesting.klines_shm import KlinesSharedMemory
 from chanlun.cl_interface import ICL, Config
 from chanlun.exchange.exchange_db import ExchangeDB
 from chanlun.tools.klines_tool import klines_to_heikin_ashi_klines
@@ -66,19 +70,31 @@ class BackTestKlines(MarketDatas):
 
         # 是否使用 cache 保存所有k线数据，True 会将代码周期时间段内所有数据读取并保存到内存，False 在每次使用的时候从数据库中获取
         # True 在多代码时会占用太多内存，这时可以设置为 False 增加使用数据库按需获取，增加运行时间，减少占用内存空间
-        self.load_data_to_cache = True
+        # 设置为 "mmap" 会将数据一次性写入到内存映射文件中，按需读取，内存占用不会随代码数量增加，多进程回测共用系统页缓存
+        self.load_data_to_cache: bool | str = True
         self.load_kline_nums = 10000  # 每次重新加载的K线数量
         self.cl_data_kline_max_nums = 50000  # 缠论数据中最大保存的k线数量
         self.del_volume_zero = False  # 是否删除成交量为 0 的K线数据
+        # 是否增量合成大周期K线，只合并大周期最后一根K线包含的小周期K线（load_data_to_cache 为 True 时有效）
+        self.convert_klines_incremental = True
 
         # 保存k线数据
         self.all_klines: dict[str, pd.DataFrame] = {}
+        # k线数据的时间戳（纳秒）与当前回放位置的游标，游标随着回放时间单调递增
+        self.all_klines_ts: dict[str, np.ndarray] = {}
+        self.all_klines_cursor: dict[str, int] = {}
 
         # 每个周期缓存的k线数据，避免多次请求重复计算
         self.cache_klines: dict[str, dict[str, pd.DataFrame]] = {}
 
         self.ex = ExchangeDB(self.market)
 
+        # 内存映射文件缓存，load_data_to_cache 为 "mmap" 时使用
+        self.mmap_cache: KlinesMmapCache | None = None
+
+        # 大周期K线增量合成
+        self.klines_aggregator = KlinesFrequencyAggregator(self.ex)
+
         # 用于循环的日期列表
         self.loop_datetime_list: dict[str, list] = {}
 
@@ -93,6 +109,7 @@ class BackTestKlines(MarketDatas):
             "convert_klines": 0,
             "get_cl_data": 0,
             "query_db_klines": 0,
+            "steps": 0,  # 回放的次数，用于计算每次循环的平均耗时
         }
 
     def init(self, base_code: str, frequency: str | list):
@@ -103,13 +120,22 @@ class BackTestKlines(MarketDatas):
         if isinstance(frequency, str):
             frequency = [frequency]
         for _f in frequency:
-            klines = self.ex.klines(
-                base_code,
-                _f,
-                start_date=fun.datetime_to_str(self.start_date),
-                end_date=fun.datetime_to_str(self.end_date),
-                args={"limit": None},
-            )
+            key = f"{base_code}_{_f}"
+            if key in self.all_klines:
+                # 已经设置了缓存数据，不需要再从数据库中获取
+                klines = self.all_klines[key]
+                klines = klines[
+                    (klines["date"] >= self.start_date)
+                    & (klines["date"] <= self.end_date)
+                ]
+            else:
+                klines = self.ex.klines(
+                    base_code,
+                    _f,
+                    start_date=fun.datetime_to_str(self.start_date),
+                    end_date=fun.datetime_to_str(self.end_date),
+                    args={"limit": None},
+                )
             if klines is None:
                 self.loop_datetime_list[_f] = []
                 continue
@@ -127,8 +153,13 @@ class BackTestKlines(MarketDatas):
         """
         self.cache_klines = {}
         self.all_klines = {}
+        self.all_klines_ts = {}
+        self.all_klines_cursor = {}
         self.cache_cl_datas = {}
         self.cl_datas = {}
+        if self.mmap_cache is not None:
+            self.mmap_cache.close()
+        self.klines_aggregator.clear()
         return True
 
     def next(self, frequency: str = ""):
@@ -143,9 +174,17 @@ class BackTestKlines(MarketDatas):
         # 清除之前的 cl_datas 、klines 缓存，重新计算
         self.cache_cl_datas = {}
         self.cache_klines = {}
+        self._use_times["steps"] += 1
         self.bar.update(1)
         return True
 
+    def use_times_per_step(self) -> dict:
+        """
+        每次回放循环，各项操作的平均耗时（秒）
+        """
+        steps = max(self._use_times["steps"], 1)
+        return {_k: _v / steps for _k, _v in self._use_times.items() if _k != "steps"}
+
     def last_k_info(self, code) -> dict:
         kline = self.klines(code, self.frequencys[-1])
         return {
@@ -248,7 +287,28 @@ class BackTestKlines(MarketDatas):
 
         _time = time.time()
         klines = {}
-        if self.load_data_to_cache:
+        if self.load_data_to_cache == "mmap":
+            # 使用内存映射文件
+            if self.mmap_cache is None:
+                self.mmap_cache = KlinesMmapCache(self.ex)
+            # 后对其的，不能包含当前日期
+            include_end = self.market not in ["currency", "futures", "us"]
+            now_ts = fun.datetime_to_int(self.now_date)
+            for _f in self.frequencys:
+                self.mmap_cache.load(
+                    code,
+                    _f,
+                    self._cal_start_date_by_frequency(self.start_date, _f),
+                    fun.datetime_to_str(self.end_date),
+                )
+                values = self.mmap_cache.window(
+                    code, _f, now_ts, include_end, self.load_kline_nums
+                )
+                kline = self.ex.klines_from_arrays(code, values)
+                if self.del_volume_zero and len(kline) > 0:
+                    kline = kline[kline["volume"] != 0].reset_index(drop=True)
+                klines[_f] = kline
+        elif self.load_data_to_cache:
             # 使用缓存
             for _f in self.frequencys:
                 key = f"{code}_{_f}"
@@ -263,28 +323,20 @@ class BackTestKlines(MarketDatas):
                         end_date=fun.datetime_to_str(self.end_date),
                         args={"limit": None},
                     )
-                    self.all_klines[key] = all_klines.sort_values("date").reset_index(
-                        drop=True
-                    )
+                    self._set_all_klines(key, all_klines)
 
+            # 后对其的，不能包含当前日期
+            side = "left" if self.market in ["currency", "futures", "us"] else "right"
+            now_ts = pd.Timestamp(self.now_date).value
             for _f in self.frequencys:
                 key = f"{code}_{_f}"
-                if self.market in [
-                    "currency",
-                    "futures",
-                    "us",
-                ]:  # 后对其的，不能包含当前日期
-                    kline = self.all_klines[key][
-                        self.all_klines[key]["date"] < self.now_date
-                    ][-self.load_kline_nums : :]
-                else:
-                    kline = self.all_klines[key][
-                        self.all_klines[key]["date"] <= self.now_date
-                    ][-self.load_kline_nums : :]
+                end_i = self._move_klines_cursor(key, now_ts, side)
+                kline = self.all_klines[key].iloc[
+                    max(0, end_i - self.load_kline_nums) : end_i
+                ]
                 if self.del_volume_zero and len(kline) > 0:
                     kline = kline[kline["volume"] != 0]
-                kline = kline.sort_values("date").reset_index(drop=True)
-                klines[_f] = kline
+                klines[_f] = kline.reset_index(drop=True)
         else:
             # 使用数据库按需查询
             for _f in self.frequencys:
@@ -318,6 +370,67 @@ class BackTestKlines(MarketDatas):
         self.cache_klines[code] = klines
         return klines[frequency]
 
+    def load_klines_arrays(self, code: str) -> dict[str, dict[str, np.ndarray]]:
+        """
+        获取代码回测时间段内所有周期的K线列数组，格式与 ExchangeDB.klines_arrays 一致
+        """
+        return {
+            _f: self.ex.klines_arrays(
+                code,
+                _f,
+                start_date=self._cal_start_date_by_frequency(self.start_date, _f),
+                end_date=fun.datetime_to_str(self.end_date),
+                args={"limit": None},
+            )
+            for _f in self.frequencys
+        }
+
+    def set_klines_arrays(
+        self, code: str, frequency: str, values: dict[str, np.ndarray]
+    ):
+        """
+        使用已经加载好的K线列数组（如多进程回测时，主进程通过共享内存传递的数据）作为回放的缓存数据，不再从数据库中获取
+        """
+        self._set_all_klines(
+            f"{code}_{frequency}", self.ex.klines_from_arrays(code, values)
+        )
+
+    def set_klines_shm(self, code: str, shm_name: str, shm_layout: dict):
+        """
+        使用共享内存中的K线列数组（KlinesSharedMemory.create 创建）作为回放的缓存数据
+        """
+        shm, values = KlinesSharedMemory.attach(shm_name, shm_layout)
+        try:
+            for _f in shm_layout.keys():
+                self.set_klines_arrays(code, _f, values[_f])
+        finally:
+            # K线数据已经复制到 DataFrame 中，释放映射的数组后关闭共享内存
+            del values
+            shm.close()
+
+    def _set_all_klines(self, key: str, all_klines: pd.DataFrame):
+        self.all_klines[key] = all_klines.sort_values("date").reset_index(drop=True)
+        self.all_klines_ts[key] = (
+            pd.DatetimeIndex(self.all_klines[key]["date"]).as_unit("ns").asi8
+        )
+        self.all_klines_cursor[key] = 0
+
+    def _move_klines_cursor(self, key: str, now_ts: int, side: str) -> int:
+        """
+        移动 key 的回放游标到 now_ts 时间位置，返回游标位置（截止的k线索引，不包含）
+        回放时间是递增的，只需要从上次的游标位置往后查找
+        """
+        ts = self.all_klines_ts[key]
+        cursor = self.all_klines_cursor[key]
+        if cursor > 0 and (
+            ts[cursor - 1] > now_ts or (side == "left" and ts[cursor - 1] == now_ts)
+        ):
+            # 回放时间往回退了，重新全部查找
+            cursor = 0
+        cursor += int(np.searchsorted(ts[cursor:], now_ts, side=side))
+        self.all_klines_cursor[key] = cursor
+        return cursor
+
     def convert_klines(self, code: str, klines: dict[str, pd.DataFrame]):
         """
         转换 kline，去除未来的 kline数据
@@ -327,6 +440,10 @@ class BackTestKlines(MarketDatas):
         for i in range(len(self.frequencys), 1, -1):
             min_f = self.frequencys[i - 1]
             max_f = self.frequencys[i - 2]
+            max_klines = self._incremental_convert_klines(code, min_f, max_f, klines)
+            if max_klines is not None:
+                klines[max_f] = max_klines
+                continue
             new_kline = self.ex.convert_kline_frequency(klines[min_f][-120::], max_f)
             if new_kline is None:
                 continue
@@ -354,6 +471,28 @@ class BackTestKlines(MarketDatas):
         self._use_times["convert_klines"] += time.time() - _time
         return klines
 
+    def _incremental_convert_klines(
+        self, code: str, min_f: str, max_f: str, klines: dict[str, pd.DataFrame]
+    ) -> pd.DataFrame | None:
+        """
+        增量合成大周期的最后一根K线，不能使用增量合成的返回 None
+        """
+        if (
+            self.convert_klines_incremental is False
+            or self.load_data_to_cache is not True
+            or self.del_volume_zero
+        ):
+            return None
+        min_key = f"{code}_{min_f}"
+        if min_key not in self.all_klines:
+            return None
+        key = f"{code}_{min_f}_{max_f}"
+        if not self.klines_aggregator.build(
+            key, self.all_klines[min_key], self.all_klines_ts[min_key], max_f
+        ):
+            return None
+        return self.klines_aggregator.update(key, klines[min_f], klines[max_f])
+
     def _cal_start_date_by_frequency(self, start_date: datetime, frequency) -> str:
         """
         按照周期，计算行情获取的开始时间
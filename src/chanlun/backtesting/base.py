@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 import talib
 
+from chanlun.backtesting import indicators
 from chanlun.cl_interface import BI, ICL, XD, ZS
 from chanlun.cl_utils import cal_zs_macd_infos
 from chanlun.fun import get_logger
@@ -328,33 +329,23 @@ class Strategy(ABC):
         """
         返回 MA 指标
         """
-        if is_all_prices:
-            prices = np.array([k.c for k in cd.get_klines()])
-        else:
-            prices = np.array([k.c for k in cd.get_klines()[-(period + 120) :]])
-        ma = talib.MA(prices, timeperiod=period)
-        return ma
+        window = None if is_all_prices else period + 120
+        return indicators.indicator_values(cd, indicators.MA, (period,), window)["ma"]
 
     @staticmethod
     def idx_ema(cd: ICL, period=5, is_all_prices=False):
         """
         返回 EMA 指标
         """
-        if is_all_prices:
-            prices = np.array([k.c for k in cd.get_klines()])
-        else:
-            prices = np.array([k.c for k in cd.get_klines()[-(period + 120) :]])
-        ma = talib.EMA(prices, timeperiod=period)
-        return ma
+        window = None if is_all_prices else period + 120
+        return indicators.indicator_values(cd, indicators.EMA, (period,), window)["ema"]
 
     @staticmethod
     def idx_boll(cd: ICL, period=20):
         """
         返回 boll 指标
         """
-        prices = np.array([k.c for k in cd.get_klines()[-(period + 120) :]])
-        boll_up, boll_mid, boll_low = talib.BBANDS(prices, timeperiod=period)
-        return {"up": boll_up, "mid": boll_mid, "low": boll_low}
+        return indicators.indicator_values(cd, indicators.BOLL, (period,), period + 120)
 
     @staticmethod
     def idx_rsi(cd: ICL, period=14):
@@ -362,9 +353,9 @@ class Strategy(ABC):
         # RSI的基本原理是在一个正常的股市中，多空买卖双方的力道必须得到均衡，股价才能稳定；而RSI是对于固定期间内，股价上涨总幅度平均值占总幅度平均值的比例。
         # 1. RSI值于0 - 100 之间呈常态分配，当6日RSI值为80‰以上时，股市呈超买现象，若出现M头，市场风险较大；当6日RSI值在20‰以下时，股市呈超卖现象，若出现W头，市场机会增大。
         # 2. RSI一般选用6日、12日、24日作为参考基期，基期越长越有趋势性(慢速RSI)，基期越短越有敏感性(快速RSI)。当快速RSI由下往上突破慢速RSI时，机会增大；当快速RSI由上而下跌破慢速RSI时，风险增大。
-        prices = np.array([k.c for k in cd.get_klines()[-(period + 120) :]])
-        rsi = talib.RSI(prices, timeperiod=period)
-        return rsi
+        return indicators.indicator_values(cd, indicators.RSI, (period,), period + 120)[
+            "rsi"
+        ]
 
     @staticmethod
     def idx_atr(cd: ICL, period=14, end_datetime=None):
@@ -380,29 +371,9 @@ class Strategy(ABC):
         # 用法：
         #     在上升通道中，ATR真实波幅向上时，且TR黄线上穿ATR蓝线，此时K线收阴者可买入。下降通道中不买。
 
-        close_prices = np.array(
-            [
-                k.c
-                for k in cd.get_klines()[-(period + 500) :]
-                if end_datetime is None or k.date <= end_datetime
-            ]
-        )
-        high_prices = np.array(
-            [
-                k.h
-                for k in cd.get_klines()[-(period + 500) :]
-                if end_datetime is None or k.date <= end_datetime
-            ]
-        )
-        low_prices = np.array(
-            [
-                k.l
-                for k in cd.get_klines()[-(period + 500) :]
-                if end_datetime is None or k.date <= end_datetime
-            ]
-        )
-        atr = talib.ATR(high_prices, low_prices, close_prices, timeperiod=period)
-        return atr
+        return indicators.indicator_values(
+            cd, indicators.ATR, (period,), period + 500, end_datetime
+        )["atr"]
 
     @staticmethod
     def idx_cci(cd: ICL, period=14):
@@ -411,11 +382,9 @@ class Strategy(ABC):
         # 1. 当CCI＞﹢100 时，表明股价已经进入非常态区间——超买区间，股价的异动现象应多加关注。
         # 2. 当CCI＜-100 时，表明股价已经进入另一个非常态区间——超卖区间，投资者可以逢低吸纳股票。
         # 3. 当CCI介于﹢100——-100 之间时表明股价处于窄幅振荡整理的区间——常态区间，投资者应以观望为主。
-        close_prices = np.array([k.c for k in cd.get_klines()[-(period + 120) :]])
-        high_prices = np.array([k.h for k in cd.get_klines()[-(period + 120) :]])
-        low_prices = np.array([k.l for k in cd.get_klines()[-(period + 120) :]])
-        cci = talib.CCI(high_prices, low_prices, close_prices, timeperiod=period)
-        return cci
+        return indicators.indicator_values(cd, indicators.CCI, (period,), period + 120)[
+            "cci"
+        ]
 
     @staticmethod
     def idx_kdj(cd: ICL, period=9, M1=3, M2=3, end_datetime=None):
@@ -427,49 +396,20 @@ class Strategy(ABC):
         # 4. KD值于50 % 左右徘徊或交叉时，无意义。
         # 5. 投机性太强的个股不适用。
         # 6. 可观察KD值同股价的背离，以确认高低点。
-        close_prices = np.array(
-            [
-                k.c
-                for k in cd.get_klines()[-(period + 500) :]
-                if end_datetime is None or k.date <= end_datetime
-            ]
-        )
-        high_prices = np.array(
-            [
-                k.h
-                for k in cd.get_klines()[-(period + 500) :]
-                if end_datetime is None or k.date <= end_datetime
-            ]
-        )
-        low_prices = np.array(
-            [
-                k.l
-                for k in cd.get_klines()[-(period + 500) :]
-                if end_datetime is None or k.date <= end_datetime
-            ]
+        return indicators.indicator_values(
+            cd, indicators.KDJ, (period, M1, M2), period + 500, end_datetime
         )
-        k, d, j = MyTT.KDJ(
-            close_prices, high_prices, low_prices, N=period, M1=M1, M2=M2
-        )
-        return {"k": k, "d": d, "j": j}
 
     @staticmethod
     def idx_macd(cd: ICL, fast=12, slow=26, signal=9, end_datetime=None):
         # 指标说明：
         # MACD
-        close_prices = np.array(
-            [
-                k.c
-                for k in cd.get_klines()[-(slow + 500) :]
-                if end_datetime is None or k.date <= end_datetime
-            ]
-        )
-        macd_dif, macd_dea, macd_hist = talib.MACD(
-            close_prices, fastperiod=fast, slowperiod=slow, signalperiod=signal
+        macd = indicators.indicator_values(
+            cd, indicators.MACD, (fast, slow, signal), slow + 500, end_datetime
         )
-        macd_hist *= 2
+        macd["hist"] *= 2
 
-        return {"dif": macd_dif, "dea": macd_dea, "hist": macd_hist}
+        return macd
 
     @staticmethod
     def idx_mtm(cd: ICL, N=12, M=6):
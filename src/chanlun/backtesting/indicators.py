@@ -0,0 +1,561 @@
+"""
+策略指标的增量计算
+
+每个缠论数据对象（ICL）对应一个列式的K线视图（开高低收量数组），新增的K线追加到数组末尾；
+指标（MA、EMA、BOLL、RSI、ATR、CCI、KDJ、MACD）保存每根K线计算后的状态，新增K线时只需要计算新的K线，
+最后几根K线发生变化（比如最后一根K线的价格更新，或者缠论K线的合并），从变化的位置恢复状态重新计算。
+
+指标从第一根K线开始计算，计算方式与 talib / MyTT 一致；
+从头计算时，除最后 CHECK_NUMS 根以外的历史K线使用 talib / pandas 一次性计算（fill），只有最后几根K线逐根计算并保存状态
+"""
+
+import bisect
+import math
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+import talib
+
+from chanlun.cl_interface import ICL
+
+# 每次同步时，检查缓存中最后几根K线是否发生变化；指标也保存最后这几根K线的状态，用于回退重新计算
+CHECK_NUMS = 8
+
+# 各对象的K线视图 {缠论对象: KlineColumns}，对象释放后自动删除
+_columns: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_columns_lock = threading.Lock()
+
+
+def _reserve(arr: np.ndarray, nums: int) -> np.ndarray:
+    """
+    数组容量不足时，按照两倍扩容（最后一个维度）
+    """
+    if arr.shape[-1] >= nums:
+        return arr
+    new_arr = np.full(
+        arr.shape[:-1] + (max(nums, arr.shape[-1] * 2, 64),), np.nan, dtype=float
+    )
+    new_arr[..., : arr.shape[-1]] = arr
+    return new_arr
+
+
+def _window_sum(x: np.ndarray, i: int, period: int) -> float:
+    """
+    第 i 个元素结束的 period 个元素之和（不足 period 个则为从头开始的和）
+    """
+    return float(np.sum(x[max(0, i - period + 1) : i + 1]))
+
+
+def _ewm_state(x: np.ndarray, mean: float, alpha: float):
+    """
+    pandas ewm(alpha, adjust=False) 计算完 x 之后的状态 (均值, 旧权重)，与 _ewm 逐个计算的结果一致
+
+    @param x: 计算的序列
+    @param mean: 最后的均值
+    @param alpha: 平滑系数
+    """
+    if math.isnan(mean):
+        return mean, 1.0
+    # 均值之后的空值，每个空值使旧权重衰减一次
+    not_nan = np.flatnonzero(~np.isnan(x))
+    return mean, (1 - alpha) ** (len(x) - 1 - not_nan[-1])
+
+
+class Indicator:
+    """
+    增量计算的指标，子类实现 step 方法：根据上一根K线的状态，计算第 i 根K线的指标值与新的状态
+    """
+
+    # 指标输出的名称
+    names: tuple[str, ...] = ()
+
+    def __init__(self, *params):
+        self.params = params
+        self.out = np.full((len(self.names), 0), np.nan, dtype=float)
+        # 已经计算的K线数量
+        self.computed = 0
+        # 最近几根K线计算后的状态 {K线位置: 状态}
+        self.states: dict[int, object] = {}
+
+    def step(self, cols: "KlineColumns", i: int, state):
+        """
+        计算第 i 根K线的指标
+
+        @param cols: K线视图
+        @param i: K线的位置
+        @param state: 第 i - 1 根K线计算后的状态，第一根K线为 None
+        @return: (新的状态, 指标值的元组)
+        """
+        raise NotImplementedError
+
+    def fill(self, cols: "KlineColumns", nums: int):
+        """
+        一次性计算前 nums 根K线的指标，结果与逐根 step 计算一致
+
+        @param cols: K线视图
+        @param nums: 计算的K线数量
+        @return: (指标值数组 (指标数量, nums), 第 nums - 1 根K线计算后的状态)，不支持一次性计算返回 None
+        """
+        return
+
+    def truncate(self, nums: int):
+        """
+        K线从 nums 位置开始发生变化，恢复到第 nums - 1 根K线的状态，没有保存该状态则从头计算
+        """
+        if nums >= self.computed:
+            return
+        if nums == 0 or (nums - 1) not in self.states:
+            self.computed = 0
+            self.states = {}
+            return
+        self.computed = nums
+        self.states = {_i: _s for _i, _s in self.states.items() if _i < nums}
+
+    def update(self, cols: "KlineColumns"):
+        """
+        计算到最新的K线
+        """
+        if self.computed >= cols.n:
+            return
+        self.out = _reserve(self.out, cols.n)
+        if self.computed == 0 and cols.n > CHECK_NUMS:
+            filled = self.fill(cols, cols.n - CHECK_NUMS)
+            if filled is not None:
+                self.out[:, : cols.n - CHECK_NUMS] = filled[0]
+                self.computed = cols.n - CHECK_NUMS
+                self.states = {self.computed - 1: filled[1]}
+        state = self.states.get(self.computed - 1)
+        for i in range(self.computed, cols.n):
+            state, values = self.step(cols, i, state)
+            self.out[:, i] = values
+            self.states[i] = state
+            self.states.pop(i - CHECK_NUMS, None)
+        self.computed = cols.n
+
+    def series(self, name: str) -> np.ndarray:
+        return self.out[self.names.index(name), : self.computed]
+
+
+class KlineColumns:
+    """
+    列式的K线视图（date 列表，o/h/l/c/v 数组），以及在视图上增量计算的指标
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.dates: list = []
+        self.cols = np.full((5, 0), np.nan, dtype=float)
+        # 最后 CHECK_NUMS 根K线的 (date, o, h, l, c, a)，用于检查K线是否发生变化
+        self.tails: list[tuple] = []
+        self.indicators: dict[tuple, Indicator] = {}
+        self.lock = threading.RLock()
+
+    @property
+    def o(self) -> np.ndarray:
+        return self.cols[0]
+
+    @property
+    def h(self) -> np.ndarray:
+        return self.cols[1]
+
+    @property
+    def l(self) -> np.ndarray:
+        return self.cols[2]
+
+    @property
+    def c(self) -> np.ndarray:
+        return self.cols[3]
+
+    @property
+    def v(self) -> np.ndarray:
+        return self.cols[4]
+
+    def _same(self, k, i: int) -> bool:
+        return (k.date, k.o, k.h, k.l, k.c, k.a) == self.tails[i - self.n]
+
+    def sync(self, klines: list):
+        """
+        同步K线：检查缓存最后 CHECK_NUMS 根K线，从第一根发生变化的位置开始更新，追加新的K线
+        检查范围内的第一根K线也发生变化（或者第一根K线不同），则全部重新加载
+        """
+        nums = len(klines)
+        start = max(0, self.n - CHECK_NUMS)
+        if (
+            self.n == 0
+            or nums <= start
+            or klines[0].date != self.dates[0]
+            or not self._same(klines[start], start)
+        ):
+            change_idx = 0
+        else:
+            change_idx = min(self.n, nums)
+            for i in range(start + 1, min(self.n, nums)):
+                if not self._same(klines[i], i):
+                    change_idx = i
+                    break
+        if change_idx == self.n == nums:
+            return
+
+        self.cols = _reserve(self.cols, nums)
+        new_klines = klines[change_idx:]
+        self.dates[change_idx:] = [_k.date for _k in new_klines]
+        if len(new_klines) > 0:
+            self.cols[:, change_idx:nums] = np.array(
+                [[_k.o, _k.h, _k.l, _k.c, _k.a] for _k in new_klines], dtype=float
+            ).T
+        self.n = nums
+        self.tails = [
+            (_k.date, _k.o, _k.h, _k.l, _k.c, _k.a) for _k in klines[-CHECK_NUMS:]
+        ]
+        for _ind in self.indicators.values():
+            _ind.truncate(change_idx)
+
+    def indicator(self, indicator_cls: type, *params) -> Indicator:
+        """
+        获取计算到最新K线的指标
+        """
+        key = (indicator_cls, *params)
+        ind = self.indicators.get(key)
+        if ind is None:
+            ind = indicator_cls(*params)
+            self.indicators[key] = ind
+        ind.update(self)
+        return ind
+
+
+def kline_columns(cd: ICL) -> KlineColumns:
+    """
+    获取缠论数据对象同步到最新K线的视图，对象不支持弱引用时，每次新建视图
+    """
+    try:
+        with _columns_lock:
+            cols = _columns.get(cd)
+            if cols is None:
+                cols = KlineColumns()
+                _columns[cd] = cols
+    except TypeError:
+        cols = KlineColumns()
+    with cols.lock:
+        cols.sync(cd.get_klines())
+    return cols
+
+
+def indicator_values(
+    cd: ICL,
+    indicator_cls: type,
+    params: tuple,
+    window: int | None = None,
+    end_datetime=None,
+) -> dict[str, np.ndarray]:
+    """
+    获取指标最后 window 根K线的值（返回数组的副本）
+
+    @param cd: 缠论数据对象
+    @param indicator_cls: 指标类
+    @param params: 指标参数
+    @param window: 返回最后的K线数量，None 返回全部
+    @param end_datetime: 只返回最后 window 根K线中，时间小于等于该时间的值
+    """
+    cols = kline_columns(cd)
+    with cols.lock:
+        ind = cols.indicator(indicator_cls, *params)
+        start = 0 if window is None else max(0, cols.n - window)
+        end = cols.n
+        if end_datetime is not None:
+            end = max(start, bisect.bisect_right(cols.dates, end_datetime))
+        return {_n: ind.series(_n)[start:end].copy() for _n in ind.names}
+
+
+class MA(Indicator):
+    """
+    简单移动平均，与 talib.MA 一致
+    """
+
+    names = ("ma",)
+
+    def step(self, cols, i, state):
+        (period,) = self.params
+        c = cols.c
+        total = (0.0 if state is None else state) + c[i]
+        if i >= period:
+            total -= c[i - period]
+        return total, (total / period if i >= period - 1 else np.nan,)
+
+    def fill(self, cols, nums):
+        (period,) = self.params
+        c = cols.c[:nums]
+        return talib.MA(c, period)[np.newaxis], _window_sum(c, nums - 1, period)
+
+
+class EMA(Indicator):
+    """
+    指数移动平均，使用前 period 根K线的平均值作为初始值，与 talib.EMA 一致
+    """
+
+    names = ("ema",)
+
+    def step(self, cols, i, state):
+        (period,) = self.params
+        c = cols.c
+        if i < period - 1:
+            return None, (np.nan,)
+        if i == period - 1:
+            ema = float(np.sum(c[:period])) / period
+        else:
+            ema = (c[i] - state) * (2 / (period + 1)) + state
+        return ema, (ema,)
+
+    def fill(self, cols, nums):
+        (period,) = self.params
+        ema = talib.EMA(cols.c[:nums], period)
+        return ema[np.newaxis], (None if nums < period else float(ema[-1]))
+
+
+class BOLL(Indicator):
+    """
+    布林带（中轨为简单移动平均，上下轨为 2 倍标准差），与 talib.BBANDS 一致
+    """
+
+    names = ("up", "mid", "low")
+
+    def step(self, cols, i, state):
+        (period,) = self.params
+        c = cols.c
+        total, total_sq = (0.0, 0.0) if state is None else state
+        total += c[i]
+        total_sq += c[i] * c[i]
+        if i >= period:
+            total -= c[i - period]
+            total_sq -= c[i - period] * c[i - period]
+        if i < period - 1:
+            return (total, total_sq), (np.nan, np.nan, np.nan)
+        mid = total / period
+        var = total_sq / period - mid * mid
+        std = math.sqrt(var) if var > 0 else 0.0
+        return (total, total_sq), (mid + 2 * std, mid, mid - 2 * std)
+
+    def fill(self, cols, nums):
+        (period,) = self.params
+        c = cols.c[:nums]
+        state = (_window_sum(c, nums - 1, period), _window_sum(c * c, nums - 1, period))
+        return np.array(talib.BBANDS(c, period, 2, 2)), state
+
+
+class RSI(Indicator):
+    """
+    相对强弱指标（Wilder 平滑），与 talib.RSI 一致
+    """
+
+    names = ("rsi",)
+
+    def step(self, cols, i, state):
+        (period,) = self.params
+        c = cols.c
+        if i == 0:
+            return (0.0, 0.0), (np.nan,)
+        gain, loss = state
+        diff = c[i] - c[i - 1]
+        if i <= period:
+            # 前 period 个涨跌幅累加，之后计算平均值
+            gain += max(diff, 0.0)
+            loss += max(-diff, 0.0)
+            if i < period:
+                return (gain, loss), (np.nan,)
+            gain /= period
+            loss /= period
+        else:
+            gain = (gain * (period - 1) + max(diff, 0.0)) / period
+            loss = (loss * (period - 1) + max(-diff, 0.0)) / period
+        total = gain + loss
+        rsi = 100 * (gain / total) if not -1e-8 < total < 1e-8 else 0.0
+        return (gain, loss), (rsi,)
+
+    def fill(self, cols, nums):
+        (period,) = self.params
+        c = cols.c[:nums]
+        diff = np.diff(c)
+        gains, losses = np.maximum(diff, 0.0), np.maximum(-diff, 0.0)
+        if nums - 1 <= period:
+            # 还没有计算平均值，状态为涨跌幅的累加
+            state = (float(np.sum(gains)), float(np.sum(losses)))
+            if nums - 1 == period:
+                state = (state[0] / period, state[1] / period)
+        else:
+            # 前 period 个的平均值作为初始值，之后 Wilder 平滑
+            state = tuple(
+                float(
+                    pd.Series(np.r_[np.mean(_x[:period]), _x[period:]])
+                    .ewm(alpha=1 / period, adjust=False)
+                    .mean()
+                    .iloc[-1]
+                )
+                for _x in (gains, losses)
+            )
+        return talib.RSI(c, period)[np.newaxis], state
+
+
+class ATR(Indicator):
+    """
+    平均真实波幅（Wilder 平滑），与 talib.ATR 一致
+    """
+
+    names = ("atr",)
+
+    def step(self, cols, i, state):
+        (period,) = self.params
+        if i == 0:
+            return 0.0, (np.nan,)
+        h, l, pre_c = cols.h[i], cols.l[i], cols.c[i - 1]
+        tr = max(h - l, abs(h - pre_c), abs(l - pre_c))
+        if i < period:
+            return state + tr, (np.nan,)
+        if i == period:
+            atr = (state + tr) / period
+        else:
+            atr = (state * (period - 1) + tr) / period
+        return atr, (atr,)
+
+    def fill(self, cols, nums):
+        (period,) = self.params
+        h, l, c = cols.h[:nums], cols.l[:nums], cols.c[:nums]
+        atr = talib.ATR(h, l, c, period)
+        if nums - 1 >= period:
+            state = float(atr[-1])
+        else:
+            # 还没有计算平均值，状态为真实波幅的累加
+            tr = np.maximum.reduce(
+                [h[1:] - l[1:], np.abs(h[1:] - c[:-1]), np.abs(l[1:] - c[:-1])]
+            )
+            state = float(np.sum(tr))
+        return atr[np.newaxis], state
+
+
+class CCI(Indicator):
+    """
+    顺势指标，与 talib.CCI 一致（平均绝对偏差需要遍历周期内的数据）
+    """
+
+    names = ("cci",)
+
+    def step(self, cols, i, state):
+        (period,) = self.params
+        if i < period - 1:
+            return None, (np.nan,)
+        s = i - period + 1
+        tps = (cols.h[s : i + 1] + cols.l[s : i + 1] + cols.c[s : i + 1]) / 3
+        avg = float(np.sum(tps)) / period
+        dev = float(np.sum(np.abs(tps - avg)))
+        diff = tps[-1] - avg
+        cci = diff / (0.015 * (dev / period)) if diff != 0 and dev != 0 else 0.0
+        return None, (cci,)
+
+    def fill(self, cols, nums):
+        (period,) = self.params
+        cci = talib.CCI(cols.h[:nums], cols.l[:nums], cols.c[:nums], period)
+        return cci[np.newaxis], None
+
+
+def _ewm(state, x: float, alpha: float):
+    """
+    pandas ewm(alpha, adjust=False) 的一步计算，state 为 (均值, 旧权重)
+    """
+    mean, old_wt = (np.nan, 1.0) if state is None else state
+    if math.isnan(mean):
+        return (mean, old_wt) if math.isnan(x) else (x, 1.0)
+    old_wt *= 1 - alpha
+    if math.isnan(x):
+        return mean, old_wt
+    if mean != x:
+        mean = (old_wt * mean + alpha * x) / (old_wt + alpha)
+    return mean, 1.0
+
+
+class KDJ(Indicator):
+    """
+    KDJ 指标，与 MyTT.KDJ 一致
+    """
+
+    names = ("k", "d", "j")
+
+    def step(self, cols, i, state):
+        period, m1, m2 = self.params
+        k_state, d_state = (None, None) if state is None else state
+        rsv = np.nan
+        if i >= period - 1:
+            s = i - period + 1
+            llv = float(np.min(cols.l[s : i + 1]))
+            hhv = float(np.max(cols.h[s : i + 1]))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rsv = float(np.float64(cols.c[i] - llv) / np.float64(hhv - llv) * 100)
+        k_state = _ewm(k_state, rsv, 2 / (m1 * 2))
+        d_state = _ewm(d_state, k_state[0], 2 / (m2 * 2))
+        k, d = k_state[0], d_state[0]
+        return (k_state, d_state), (k, d, k * 3 - d * 2)
+
+    def fill(self, cols, nums):
+        period, m1, m2 = self.params
+        llv = talib.MIN(cols.l[:nums], period)
+        hhv = talib.MAX(cols.h[:nums], period)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsv = (cols.c[:nums] - llv) / (hhv - llv) * 100
+        k = pd.Series(rsv).ewm(alpha=2 / (m1 * 2), adjust=False).mean().values
+        d = pd.Series(k).ewm(alpha=2 / (m2 * 2), adjust=False).mean().values
+        state = (
+            _ewm_state(rsv, float(k[-1]), 2 / (m1 * 2)),
+            _ewm_state(k, float(d[-1]), 2 / (m2 * 2)),
+        )
+        return np.array([k, d, k * 3 - d * 2]), state
+
+
+class MACD(Indicator):
+    """
+    MACD 指标（hist 为 dif - dea），与 talib.MACD 一致
+    快线与慢线的 EMA 在第 slow 根K线同时开始，快线使用前 fast 根K线的平均值作为初始值
+    """
+
+    names = ("dif", "dea", "hist")
+
+    def step(self, cols, i, state):
+        fast, slow, signal = self.params
+        if fast > slow:
+            fast, slow = slow, fast
+        c = cols.c
+        if i < slow - 1:
+            return None, (np.nan, np.nan, np.nan)
+        if i == slow - 1:
+            fast_ema = float(np.sum(c[slow - fast : slow])) / fast
+            slow_ema = float(np.sum(c[:slow])) / slow
+            dif_total = 0.0
+            dea = np.nan
+        else:
+            fast_ema, slow_ema, dif_total, dea = state
+            fast_ema = (c[i] - fast_ema) * (2 / (fast + 1)) + fast_ema
+            slow_ema = (c[i] - slow_ema) * (2 / (slow + 1)) + slow_ema
+        dif = fast_ema - slow_ema
+        signal_start = slow + signal - 2
+        if i < signal_start:
+            dif_total += dif
+            return (fast_ema, slow_ema, dif_total, dea), (np.nan, np.nan, np.nan)
+        if i == signal_start:
+            dea = (dif_total + dif) / signal
+        else:
+            dea = (dif - dea) * (2 / (signal + 1)) + dea
+        return (fast_ema, slow_ema, dif_total, dea), (dif, dea, dif - dea)
+
+    def fill(self, cols, nums):
+        fast, slow, signal = self.params
+        if fast > slow:
+            fast, slow = slow, fast
+        c = cols.c[:nums]
+        out = np.array(talib.MACD(c, fast, slow, signal))
+        if nums < slow:
+            return out, None
+        # 快线从第 slow 根K线开始，使用前 fast 根K线的平均值作为初始值
+        fast_emas = talib.EMA(c[slow - fast :], fast)[fast - 1 :]
+        slow_emas = talib.EMA(c, slow)[slow - 1 :]
+        difs = fast_emas - slow_emas
+        dif_total = float(np.sum(difs[: signal - 1]))
+        state = (float(fast_emas[-1]), float(slow_emas[-1]), dif_total, out[1, -1])
+        return out, state
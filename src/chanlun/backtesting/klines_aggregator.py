@@ -0,0 +1,136 @@
+"""
+回测中大周期K线的增量合成
+
+回放时，大周期只有最后一根正在形成的K线需要用小周期K线合成，之前的K线都是已经完成的。
+第一次使用时，将回测区间内所有的小周期K线，使用交易所的周期转换方法（与 convert_kline_frequency 相同的交易时间规则）一次性转换，
+转换时 open/close 列替换为K线的序号，合并后 first/last 的结果就是每根大周期K线包含的小周期K线序号范围；
+之后每次回放，根据最后一根小周期K线找到所属的大周期K线，只合并这根大周期K线包含的小周期K线，替换大周期的最后一根K线
+"""
+
+import numpy as np
+import pandas as pd
+
+from chanlun.base import Market
+from chanlun.exchange.exchange_db import ExchangeDB
+
+
+class KlinesFrequencyAggregator:
+    """
+    大周期K线增量合成
+    """
+
+    def __init__(self, ex: ExchangeDB):
+        self.ex = ex
+        # 数字货币的周期转换会删除成交量为 0 的K线，序号范围内的K线不一定都参与合并，不使用增量合成
+        self.enable = ex.market not in [
+            Market.CURRENCY.value,
+            Market.CURRENCY_SPOT.value,
+        ]
+
+        # key : 小周期K线所属的大周期K线信息，None 表示不能使用增量合成
+        self.buckets: dict[str, dict | None] = {}
+
+    def build(
+        self, key: str, min_klines: pd.DataFrame, min_ts: np.ndarray, to_f: str
+    ) -> bool:
+        """
+        计算每根小周期K线所属的大周期K线（已经计算过则跳过）
+        :param key: 代码与周期的唯一标识
+        :param min_klines: 回测区间内所有的小周期K线（按时间正序）
+        :param min_ts: 小周期K线的时间戳（纳秒）
+        :param to_f: 要合成的大周期
+        :return: 是否可以使用增量合成
+        """
+        if key in self.buckets:
+            return self.buckets[key] is not None
+        self.buckets[key] = None
+        if self.enable is False or len(min_klines) == 0:
+            return False
+
+        index_klines = min_klines[["code", "date", "volume"]].reset_index(drop=True)
+        rows = np.arange(len(index_klines))
+        for _c in ["open", "high", "low", "close"]:
+            index_klines[_c] = rows.astype(float)
+        try:
+            period_klines = self.ex.convert_kline_frequency(index_klines, to_f)
+        except Exception:
+            # 有不在交易时间内的K线，无法转换
+            return False
+        if period_klines is None or len(period_klines) == 0:
+            return False
+
+        first_i = period_klines["open"].to_numpy(dtype=np.int64)
+        last_i = period_klines["close"].to_numpy(dtype=np.int64)
+        # 每根大周期K线包含的小周期K线，需要是连续且不重叠的
+        if np.any(last_i < first_i) or np.any(first_i[1:] <= last_i[:-1]):
+            return False
+
+        row_bucket = np.searchsorted(first_i, rows, side="right") - 1
+        row_bucket[(row_bucket < 0) | (rows > last_i[np.maximum(row_bucket, 0)])] = -1
+
+        self.buckets[key] = {
+            "min_ts": min_ts,
+            "row_bucket": row_bucket,
+            "start_ts": min_ts[first_i],
+            "date_ts": pd.DatetimeIndex(period_klines["date"]).as_unit("ns").asi8,
+            "max_nums": int((last_i - first_i).max()) + 1,
+        }
+        return True
+
+    def update(
+        self, key: str, min_klines: pd.DataFrame, max_klines: pd.DataFrame
+    ) -> pd.DataFrame | None:
+        """
+        用小周期K线合成大周期最后一根K线，并替换大周期中包含未来数据的K线
+        :param key: 代码与周期的唯一标识（需要先调用 build）
+        :param min_klines: 截止到当前回放时间的小周期K线
+        :param max_klines: 截止到当前回放时间的大周期K线
+        :return: 更新后的大周期K线，无法合成则返回 None
+        """
+        info = self.buckets.get(key)
+        if info is None or len(min_klines) == 0 or len(max_klines) == 0:
+            return None
+
+        # 只需要使用末尾的K线，找到最后一根小周期K线所属的大周期K线，以及大周期K线的开始位置
+        tail_klines = min_klines.iloc[-info["max_nums"] :]
+        tail_ts = self._ns_values(tail_klines["date"])
+        i = int(np.searchsorted(info["min_ts"], tail_ts[-1]))
+        if i >= len(info["min_ts"]) or info["min_ts"][i] != tail_ts[-1]:
+            return None
+        bucket = info["row_bucket"][i]
+        if bucket < 0:
+            return None
+        start_i = int(np.searchsorted(tail_ts, info["start_ts"][bucket]))
+
+        bar_ts = info["date_ts"][bucket]
+        bar = {
+            "code": tail_klines["code"].iat[-1],
+            "date": pd.Timestamp(bar_ts, tz="UTC").tz_convert(max_klines["date"].dt.tz),
+            "open": tail_klines["open"].to_numpy()[start_i],
+            "high": tail_klines["high"].to_numpy()[start_i:].max(),
+            "low": tail_klines["low"].to_numpy()[start_i:].min(),
+            "close": tail_klines["close"].to_numpy()[-1],
+            "volume": tail_klines["volume"].to_numpy()[start_i:].sum(),
+        }
+        if "position" in max_klines.columns and "position" in tail_klines.columns:
+            bar["position"] = tail_klines["position"].to_numpy()[-1]
+
+        # 删除大周期中时间大于等于合成K线的数据（前对其的K线包含未来数据），一般只有最后一根
+        max_ts = self._ns_values(max_klines["date"].iloc[-10:])
+        if max_ts[0] >= bar_ts:
+            max_ts = self._ns_values(max_klines["date"])
+        cut_i = len(max_klines) - int(np.count_nonzero(max_ts >= bar_ts))
+        return pd.concat(
+            [
+                max_klines.iloc[:cut_i],
+                pd.DataFrame([bar], columns=max_klines.columns),
+            ],
+            ignore_index=True,
+        )
+
+    @staticmethod
+    def _ns_values(dates: pd.Series) -> np.ndarray:
+        return dates.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    def clear(self):
+        self.buckets = {}
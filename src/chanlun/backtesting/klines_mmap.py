@@ -0,0 +1,181 @@
+"""
+回测K线的内存映射缓存
+
+将回测时间段内每个 代码/周期 的K线列数据，一次性写入到 .npy 文件中，回测过程中使用 np.load(mmap_mode="r") 读取，
+每次获取K线只是在日期列上二分查找，返回文件映射数组的切片，不会将所有数据加载到内存中；
+多进程回测时，各个进程读取的是同一份文件，共用系统的页缓存
+
+缓存目录的名称包含数据库中K线的统计信息（数量、最后日期、收盘价与成交量的总和），补充或修正数据后会重新生成，
+旧版本的缓存目录在生成新版本时删除；超过保留天数没有使用的缓存目录，在创建缓存对象时清理
+"""
+
+import hashlib
+import os
+import pathlib
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from chanlun.config import get_data_path
+from chanlun.exchange.exchange_db import ExchangeDB
+
+
+class KlinesMmapCache:
+    """
+    K线内存映射文件缓存
+    """
+
+    def __init__(
+        self,
+        ex: ExchangeDB,
+        cache_path: str | pathlib.Path | None = None,
+        keep_days: float = 7,
+    ):
+        """
+        :param ex: 数据库行情对象
+        :param cache_path: 缓存目录，默认为数据目录下的 backtest_mmap/{市场}
+        :param keep_days: 缓存目录超过多少天没有使用则删除，0 不进行清理
+        """
+        self.ex = ex
+        if cache_path is None:
+            cache_path = get_data_path() / "backtest_mmap" / ex.market
+        self.cache_path = pathlib.Path(cache_path)
+        if self.cache_path.is_dir() is False:
+            self.cache_path.mkdir(parents=True)
+        self.keep_days = keep_days
+
+        # 已经打开的映射数组 key : {列名 : np.memmap}
+        self.columns: dict[str, dict[str, np.ndarray]] = {}
+
+        if self.keep_days > 0:
+            self.clean(self.keep_days)
+
+    def columns_prefix(
+        self, code: str, frequency: str, start_date: str, end_date: str
+    ) -> str:
+        """
+        代码、周期与时间范围对应的缓存目录名称前缀（不同数据版本的缓存目录使用相同的前缀）
+        """
+        key = hashlib.md5(
+            f"{self.ex.market}_{code}_{frequency}_{start_date}_{end_date}".encode()
+        ).hexdigest()
+        code_name = code.replace(".", "_").replace("/", "_").replace("@", "_")
+        return f"{code_name}_{frequency}_{key}"
+
+    def columns_path(
+        self, code: str, frequency: str, start_date: str, end_date: str
+    ) -> pathlib.Path:
+        """
+        当前数据库中的数据对应的缓存目录
+        """
+        stats = self.ex.klines_stats(code, frequency, start_date, end_date)
+        version = hashlib.md5(
+            f"{stats['rows']}_{stats['last_dt']}_{stats['checksum']!r}".encode()
+        ).hexdigest()[:16]
+        return (
+            self.cache_path
+            / f"{self.columns_prefix(code, frequency, start_date, end_date)}_{version}"
+        )
+
+    def build(self, code: str, frequency: str, start_date: str, end_date: str):
+        """
+        从数据库中读取K线，写入到列文件中（当前版本已经存在则跳过），并删除旧版本的缓存目录
+        """
+        columns_path = self.columns_path(code, frequency, start_date, end_date)
+        if columns_path.is_dir():
+            # 更新目录的修改时间，记录最后使用的时间
+            os.utime(columns_path)
+            return columns_path
+
+        values = self.ex.klines_arrays(
+            code,
+            frequency,
+            start_date=start_date,
+            end_date=end_date,
+            args={"limit": None},
+        )
+        # 先写入到临时目录，完成后在改名，避免多进程同时生成时读取到不完整的文件
+        tmp_path = self.cache_path / f"_tmp_{uuid.uuid4().hex}"
+        tmp_path.mkdir(parents=True)
+        for _c, _v in values.items():
+            np.save(tmp_path / f"{_c}.npy", np.ascontiguousarray(_v))
+        try:
+            tmp_path.rename(columns_path)
+        except OSError:
+            # 其他进程已经生成好了
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        # 删除数据变化之前的旧版本（其他进程正在使用的，删除失败则等待之后清理）
+        prefix = self.columns_prefix(code, frequency, start_date, end_date)
+        for _p in self.cache_path.glob(f"{prefix}_*"):
+            if _p != columns_path:
+                shutil.rmtree(_p, ignore_errors=True)
+        return columns_path
+
+    def load(
+        self, code: str, frequency: str, start_date: str, end_date: str
+    ) -> dict[str, np.ndarray]:
+        """
+        获取映射的列数组，不存在则先进行生成
+        """
+        key = f"{code}_{frequency}"
+        if key in self.columns:
+            return self.columns[key]
+        columns_path = self.build(code, frequency, start_date, end_date)
+        self.columns[key] = {
+            _f.stem: np.load(_f, mmap_mode="r") for _f in columns_path.glob("*.npy")
+        }
+        return self.columns[key]
+
+    def window(
+        self,
+        code: str,
+        frequency: str,
+        end_ts: int,
+        include_end: bool,
+        nums: int,
+    ) -> dict[str, np.ndarray]:
+        """
+        获取截止到 end_ts 时间戳（秒）的最后 nums 根K线的列数组切片（需要先调用 load）
+        :param include_end: 是否包含 end_ts 时间的K线
+        """
+        columns = self.columns[f"{code}_{frequency}"]
+        end_i = int(
+            np.searchsorted(
+                columns["date"], end_ts, side="right" if include_end else "left"
+            )
+        )
+        start_i = max(0, end_i - nums)
+        return {_c: _v[start_i:end_i] for _c, _v in columns.items()}
+
+    def close(self):
+        """
+        释放打开的映射数组
+        """
+        self.columns = {}
+
+    def clean(self, keep_days: float) -> int:
+        """
+        删除超过 keep_days 天没有使用的缓存目录（包括异常退出时遗留的临时目录）
+        :return: 删除的目录数量
+        """
+        expire_time = time.time() - keep_days * 86400
+        nums = 0
+        for _p in self.cache_path.iterdir():
+            try:
+                if _p.is_dir() and _p.stat().st_mtime < expire_time:
+                    shutil.rmtree(_p)
+                    nums += 1
+            except OSError:
+                pass
+        return nums
+
+    def clear(self):
+        """
+        删除所有生成的缓存文件
+        """
+        self.close()
+        shutil.rmtree(self.cache_path, ignore_errors=True)
+        return True
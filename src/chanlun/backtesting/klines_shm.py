@@ -0,0 +1,57 @@
+"""
+回测K线的共享内存
+
+多进程回测时，主进程将代码回测所需各个周期的K线列数组，一次性写入到一块共享内存中，
+子进程根据共享内存的名称与布局信息，直接映射出列数组使用，不需要再从数据库中读取
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class KlinesSharedMemory:
+    """
+    K线列数组共享内存
+    """
+
+    @staticmethod
+    def create(
+        values: dict[str, dict[str, np.ndarray]],
+    ) -> tuple[shared_memory.SharedMemory, dict]:
+        """
+        创建共享内存，并写入K线列数组
+        :param values: {周期 : {列名 : 数组}}
+        :return: 共享内存对象，布局信息 {周期 : {列名 : (偏移, 长度, dtype)}}
+        """
+        layout = {}
+        offset = 0
+        for _f, _columns in values.items():
+            layout[_f] = {}
+            for _c, _v in _columns.items():
+                layout[_f][_c] = (offset, len(_v), _v.dtype.str)
+                offset += _v.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for _f, _columns in values.items():
+            for _c, _v in _columns.items():
+                _offset, _len, _dtype = layout[_f][_c]
+                np.ndarray(_len, dtype=_dtype, buffer=shm.buf, offset=_offset)[:] = _v
+        return shm, layout
+
+    @staticmethod
+    def attach(
+        name: str, layout: dict
+    ) -> tuple[shared_memory.SharedMemory, dict[str, dict[str, np.ndarray]]]:
+        """
+        子进程中打开共享内存，返回映射的列数组（共享内存关闭前有效）
+        """
+        # 进程池的子进程与主进程使用同一个资源跟踪进程，共享内存由主进程负责释放
+        shm = shared_memory.SharedMemory(name=name)
+        values = {
+            _f: {
+                _c: np.ndarray(_len, dtype=_dtype, buffer=shm.buf, offset=_offset)
+                for _c, (_offset, _len, _dtype) in _columns.items()
+            }
+            for _f, _columns in layout.items()
+        }
+        return shm, values
@@ -1,6 +1,9 @@
 """
 策略参数优化
 """
+
+import math
+import random
 from itertools import product
 from typing import List
 
@@ -32,3 +35,111 @@ class OptimizationSetting:
             settings.append(setting)
 
         return settings
+
+
+class TPESampler:
+    """
+    TPE（Tree-structured Parzen Estimator）参数采样，用于离散的参数优化空间
+
+    根据已完成试验的评价结果，将试验分为较好的 gamma 比例与其他的两组，分别统计每个参数取值在两组中的分布，
+    采样时选择 好组概率 / 坏组概率 最大的取值，逐步集中到表现好的参数区域，而不需要穷举所有的组合
+    """
+
+    def __init__(
+        self,
+        cl_config_params: dict,
+        n_startup_trials: int = 10,
+        gamma: float = 0.25,
+        n_ei_candidates: int = 24,
+        seed: int = None,
+    ):
+        """
+        @param cl_config_params: 参数优化空间，OptimizationSetting.cl_config_params
+        @param n_startup_trials: 开始的随机试验数量，之后才根据试验结果进行采样
+        @param gamma: 较好一组所占的比例
+        @param n_ei_candidates: 每个参数从好组分布中抽取的候选数量
+        @param seed: 随机数种子
+        """
+        self.params = cl_config_params
+        self.n_startup_trials = n_startup_trials
+        self.gamma = gamma
+        self.n_ei_candidates = n_ei_candidates
+        self.rng = random.Random(seed)
+
+        # 完成的试验 (参数, 评价结果)
+        self.trials: List[tuple] = []
+        # 已经采样过的参数（包括还未完成的）
+        self.asked = set()
+
+    def space_size(self) -> int:
+        return math.prod(len(_v) for _v in self.params.values())
+
+    def ask(self, nums: int = 1) -> List[dict]:
+        """
+        采样 nums 个未试验过的参数，参数空间都试验完成后，返回的数量会少于 nums
+        """
+        settings = []
+        for _ in range(nums):
+            if len(self.asked) >= self.space_size():
+                break
+            setting = None
+            for _ in range(100):
+                _s = self._sample()
+                if self._key(_s) not in self.asked:
+                    setting = _s
+                    break
+            if setting is None:
+                # 参数空间快试验完了，从剩余的组合中随机选择
+                keys = self.params.keys()
+                remain = [
+                    dict(zip(keys, _p))
+                    for _p in product(*self.params.values())
+                    if self._key(dict(zip(keys, _p))) not in self.asked
+                ]
+                setting = self.rng.choice(remain)
+            self.asked.add(self._key(setting))
+            settings.append(setting)
+        return settings
+
+    def tell(self, setting: dict, value: float):
+        """
+        记录试验的评价结果（越大越好）
+        """
+        self.asked.add(self._key(setting))
+        self.trials.append((setting, value))
+
+    def _sample(self) -> dict:
+        if len(self.trials) < self.n_startup_trials:
+            return {_k: self.rng.choice(_v) for _k, _v in self.params.items()}
+
+        trials = sorted(self.trials, key=lambda _t: _t[1], reverse=True)
+        n_good = max(1, math.ceil(self.gamma * len(trials)))
+        good = [_t[0] for _t in trials[:n_good]]
+        bad = [_t[0] for _t in trials[n_good:]]
+
+        setting = {}
+        for _k, _values in self.params.items():
+            # 每个取值加 1 的先验，避免没有出现过的取值概率为 0
+            l_weights = self._value_weights(_k, _values, good)
+            g_weights = self._value_weights(_k, _values, bad)
+            candidates = self.rng.choices(
+                range(len(_values)), weights=l_weights, k=self.n_ei_candidates
+            )
+            best_i = max(candidates, key=lambda _i: l_weights[_i] / g_weights[_i])
+            setting[_k] = _values[best_i]
+        return setting
+
+    @staticmethod
+    def _value_weights(key: str, values: list, settings: List[dict]) -> List[float]:
+        counts = [1.0] * len(values)
+        for _s in settings:
+            for _i, _v in enumerate(values):
+                if _s[key] == _v:
+                    counts[_i] += 1
+                    break
+        total = sum(counts)
+        return [_c / total for _c in counts]
+
+    @staticmethod
+    def _key(setting: dict) -> str:
+        return repr(sorted(setting.items()))
@@ -0,0 +1,382 @@
+"""
+缠论数据对象的紧凑序列化
+
+直接 pickle 缠论对象时，每根原始K线（Kline）与缠论K线（CLKline）都会保存成一个完整的对象，数据量大、读写慢。
+这里在 pickle 的基础上，将 Kline / CLKline 对象的属性按列保存成 numpy 数组，对象图中引用这些K线的地方，
+（分型、笔、线段、中枢等）只保存K线在数组中的序号，读取时先根据数组批量创建K线对象，再恢复其他对象的引用。
+
+文件格式：[4 字节标识][1 字节压缩方式][数据]，数据是 pickle 后的 (K线列数组, 对象图) 元组，可选 zlib / zstd / lz4 压缩
+不是这个格式的数据（之前直接 pickle 的缓存文件），按照 pickle 格式读取
+"""
+
+import datetime
+import gc
+import io
+import pickle
+import zlib
+from operator import attrgetter
+
+import numpy as np
+import pandas as pd
+
+from chanlun.cl_interface import CLKline, Kline
+
+MAGIC = b"CLS1"
+
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_UTC = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+ONE_US = datetime.timedelta(microseconds=1)
+
+COMPRESS_TYPES = {None: 0, "zlib": 1, "zstd": 2, "lz4": 3}
+
+# 按列保存的对象属性（与 __init__ 中的属性一致），属性不一致的对象（比如动态添加了属性）按照普通对象 pickle
+KLINE_ATTRS = ("index", "date", "h", "l", "o", "c", "a")
+CL_KLINE_ATTRS = (
+    "k_index",
+    "date",
+    "h",
+    "l",
+    "o",
+    "c",
+    "a",
+    "klines",
+    "index",
+    "n",
+    "q",
+    "up_qs",
+)
+# 可以保存为 numpy 数组的属性值类型
+COLUMN_DTYPES = {
+    float: np.float64,
+    int: np.int64,
+    bool: np.bool_,
+    np.float64: np.float64,
+    np.int64: np.int64,
+    np.bool_: np.bool_,
+}
+
+
+class _DatePool:
+    """
+    K线中使用的日期对象（Kline 与 CLKline 共用同一个日期对象，只保存一次）
+    带时区的保存 UTC 时间戳（微秒），不带时区的保存本地时间；时区与日期类型按序号保存，恢复后的日期与原对象相同
+    """
+
+    def __init__(self):
+        self.dates: list = []
+        self.ids: dict[int, int] = {}
+
+    def append(self, date) -> int | None:
+        """
+        添加日期对象，返回在日期列表中的序号，不支持的类型返回 None
+        """
+        _i = self.ids.get(id(date))
+        if _i is not None:
+            return _i
+        date_type = type(date)
+        if date_type is pd.Timestamp:
+            if date.nanosecond != 0:
+                return None
+        elif date_type is not datetime.datetime or date.fold != 0:
+            return None
+        _i = self.ids[id(date)] = len(self.dates)
+        self.dates.append(date)
+        return _i
+
+    def to_arrays(self) -> dict:
+        values = np.empty(len(self.dates), dtype=np.int64)
+        groups = np.empty(len(self.dates), dtype=np.int16)
+        # 按照 (日期类型, 时区) 分组
+        group_keys: dict[tuple, int] = {}
+        group_rows: list[list[int]] = []
+        for _i, _d in enumerate(self.dates):
+            _key = (type(_d) is pd.Timestamp, _d.tzinfo)
+            _g = group_keys.get(_key)
+            if _g is None:
+                _g = group_keys[_key] = len(group_rows)
+                group_rows.append([])
+            group_rows[_g].append(_i)
+            groups[_i] = _g
+        for (is_ts, tz), _g in group_keys.items():
+            rows = group_rows[_g]
+            if is_ts:
+                values[rows] = [self.dates[_i].value // 1000 for _i in rows]
+            else:
+                epoch = EPOCH if tz is None else EPOCH_UTC
+                values[rows] = [(self.dates[_i] - epoch) // ONE_US for _i in rows]
+        return {
+            "date": values,
+            "date_group": groups,
+            "date_groups": list(group_keys.keys()),
+        }
+
+    @staticmethod
+    def from_arrays(arrays: dict) -> list:
+        values = arrays["date"]
+        groups = arrays["date_group"]
+        dates = np.empty(len(values), dtype=object)
+        for _g, (is_ts, tz) in enumerate(arrays["date_groups"]):
+            rows = np.flatnonzero(groups == _g)
+            if is_ts:
+                index = pd.DatetimeIndex(values[rows].astype("datetime64[us]"))
+                if tz is not None:
+                    index = index.tz_localize("UTC").tz_convert(tz)
+                dates[rows] = list(index)
+            elif tz is None:
+                dates[rows] = values[rows].astype("datetime64[us]").tolist()
+            else:
+                dates[rows] = [
+                    (EPOCH_UTC + datetime.timedelta(microseconds=_v)).astimezone(tz)
+                    for _v in values[rows].tolist()
+                ]
+        return dates.tolist()
+
+
+class _Table:
+    """
+    按列保存的一类对象
+    """
+
+    def __init__(self, cls: type, attrs: tuple, dates: _DatePool):
+        self.cls = cls
+        self.attrs = attrs
+        self.attrs_keys = dict.fromkeys(attrs).keys()
+        self.dates = dates
+        self.date_ids: list[int] = []
+        self.objs: list = []
+
+    def append(self, obj) -> bool:
+        if obj.__dict__.keys() != self.attrs_keys:
+            return False
+        date_i = self.dates.append(obj.date)
+        if date_i is None:
+            return False
+        self.date_ids.append(date_i)
+        self.objs.append(obj)
+        return True
+
+    def to_arrays(self, special: dict) -> dict:
+        """
+        转换为列数组，special 中是特殊处理的列
+        """
+        arrays = {"date": np.array(self.date_ids, dtype=np.int64)}
+        for _a in self.attrs:
+            if _a != "date" and _a not in special:
+                arrays[_a] = self._column(list(map(attrgetter(_a), self.objs)))
+        arrays.update(special)
+        return arrays
+
+    @staticmethod
+    def _column(values: list) -> tuple[str, object]:
+        """
+        所有值的类型相同且是数值类型，保存为 numpy 数组，并记录是 Python 类型（py）还是 numpy 类型（np），其他的保存原列表（obj）
+        """
+        types = set(map(type, values))
+        if len(types) == 1:
+            _t = types.pop()
+            if _t in COLUMN_DTYPES:
+                try:
+                    array = np.array(values, dtype=COLUMN_DTYPES[_t])
+                except OverflowError:
+                    return "obj", values
+                return ("np" if _t is COLUMN_DTYPES[_t] else "py"), array
+        return "obj", values
+
+    @staticmethod
+    def create(cls: type, attrs: tuple, arrays: dict, special: dict) -> list:
+        """
+        根据列数组批量创建对象
+        """
+        columns = []
+        for _a in attrs:
+            if _a in special:
+                columns.append(special[_a])
+            else:
+                kind, values = arrays[_a]
+                if kind == "py":
+                    values = values.tolist()
+                elif kind == "np":
+                    values = list(values)
+                columns.append(values)
+        objs = []
+        for _values in zip(*columns):
+            _o = cls.__new__(cls)
+            _o.__dict__.update(zip(attrs, _values))
+            objs.append(_o)
+        return objs
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Kline 与 CLKline 对象保存到列数组中，对象图中只保存序号（Kline 为非负数，CLKline 为负数）
+    """
+
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.dates = _DatePool()
+        self.klines = _Table(Kline, KLINE_ATTRS, self.dates)
+        self.cl_klines = _Table(CLKline, CL_KLINE_ATTRS, self.dates)
+        # CLKline 包含的原始K线序号（CSR 格式）
+        self.cl_klines_k_offsets = [0]
+        self.cl_klines_k_indexes: list[int] = []
+        self.ids: dict[int, int] = {}
+
+    def persistent_id(self, obj):
+        obj_type = type(obj)
+        if obj_type is Kline:
+            return self._kline_id(obj)
+        if obj_type is CLKline:
+            _id = self.ids.get(id(obj))
+            if _id is not None:
+                return _id
+            k_ids = []
+            for _k in obj.klines if type(obj.klines) is list else [None]:
+                _k_id = self._kline_id(_k) if type(_k) is Kline else None
+                if _k_id is None:
+                    return None
+                k_ids.append(_k_id)
+            if self.cl_klines.append(obj) is False:
+                return None
+            _id = -len(self.cl_klines.objs)
+            self.ids[id(obj)] = _id
+            self.cl_klines_k_indexes.extend(k_ids)
+            self.cl_klines_k_offsets.append(len(self.cl_klines_k_indexes))
+            return _id
+        return None
+
+    def _kline_id(self, obj: Kline) -> int | None:
+        _id = self.ids.get(id(obj))
+        if _id is not None:
+            return _id
+        if self.klines.append(obj) is False:
+            return None
+        _id = len(self.klines.objs) - 1
+        self.ids[id(obj)] = _id
+        return _id
+
+    def tables(self) -> dict:
+        return {
+            "dates": self.dates.to_arrays(),
+            "klines": self.klines.to_arrays({}),
+            "cl_klines": self.cl_klines.to_arrays(
+                {
+                    "klines": (
+                        np.array(self.cl_klines_k_offsets, dtype=np.int64),
+                        np.array(self.cl_klines_k_indexes, dtype=np.int64),
+                    )
+                }
+            ),
+        }
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, tables: dict):
+        super().__init__(file)
+        dates = _DatePool.from_arrays(tables["dates"])
+        self.klines = _Table.create(
+            Kline,
+            KLINE_ATTRS,
+            tables["klines"],
+            {"date": [dates[_i] for _i in tables["klines"]["date"].tolist()]},
+        )
+        k_offsets, k_indexes = tables["cl_klines"]["klines"]
+        k_offsets = k_offsets.tolist()
+        k_indexes = k_indexes.tolist()
+        k_lists = [
+            [self.klines[_i] for _i in k_indexes[k_offsets[_n] : k_offsets[_n + 1]]]
+            for _n in range(len(k_offsets) - 1)
+        ]
+        self.cl_klines = _Table.create(
+            CLKline,
+            CL_KLINE_ATTRS,
+            tables["cl_klines"],
+            {
+                "date": [dates[_i] for _i in tables["cl_klines"]["date"].tolist()],
+                "klines": k_lists,
+            },
+        )
+
+    def persistent_load(self, pid):
+        return self.klines[pid] if pid >= 0 else self.cl_klines[-pid - 1]
+
+
+def dumps(obj: object, compress: str | None = None) -> bytes:
+    """
+    序列化缠论数据对象（也可以是包含缠论对象的任意可以 pickle 的对象）
+
+    @param obj: 要序列化的对象
+    @param compress: 压缩方式 None 不压缩 / zlib / zstd（需要安装 zstandard）/ lz4（需要安装 lz4）
+    @return: 序列化后的数据
+    """
+    if compress not in COMPRESS_TYPES:
+        raise ValueError(f"不支持的压缩方式 {compress}")
+    buf = io.BytesIO()
+    pickler = _Pickler(buf)
+    pickler.dump(obj)
+    data = pickle.dumps(
+        (pickler.tables(), buf.getvalue()), protocol=pickle.HIGHEST_PROTOCOL
+    )
+    return MAGIC + bytes([COMPRESS_TYPES[compress]]) + _compress(data, compress)
+
+
+def compress_dumps(data: bytes, compress: str | None) -> bytes:
+    """
+    压缩没有压缩的 dumps 数据（可以先根据未压缩的数据大小估算对象占用的内存，再压缩保存）
+    """
+    if compress not in COMPRESS_TYPES:
+        raise ValueError(f"不支持的压缩方式 {compress}")
+    if data[: len(MAGIC) + 1] != MAGIC + bytes([COMPRESS_TYPES[None]]):
+        raise ValueError("数据不是没有压缩的 dumps 数据")
+    if compress is None:
+        return data
+    return (
+        MAGIC
+        + bytes([COMPRESS_TYPES[compress]])
+        + _compress(data[len(MAGIC) + 1 :], compress)
+    )
+
+
+def loads(data: bytes) -> object:
+    """
+    反序列化 dumps 的数据，不是 dumps 格式的数据按照 pickle 读取
+    """
+    # 反序列化时会创建大量的对象，暂停垃圾回收，避免反复触发
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if data[: len(MAGIC)] != MAGIC:
+            return pickle.loads(data)
+        compress = {_v: _k for _k, _v in COMPRESS_TYPES.items()}[data[len(MAGIC)]]
+        tables, obj_data = pickle.loads(_decompress(data[len(MAGIC) + 1 :], compress))
+        return _Unpickler(io.BytesIO(obj_data), tables).load()
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _compress(data: bytes, compress: str | None) -> bytes:
+    if compress == "zlib":
+        return zlib.compress(data, 1)
+    if compress == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if compress == "lz4":
+        import lz4.frame
+
+        return lz4.frame.compress(data)
+    return data
+
+
+def _decompress(data: bytes, compress: str | None) -> bytes:
+    if compress == "zlib":
+        return zlib.decompress(data)
+    if compress == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compress == "lz4":
+        import lz4.frame
+
+        return lz4.frame.decompress(data)
+    return data
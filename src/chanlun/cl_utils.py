@@ -3,11 +3,11 @@ import math
 import numpy as np
 import pandas as pd
 
-from chanlun import fun
 from chanlun.cl_interface import BI, FX, ICL, LINE, MACD_INFOS, ZS, Config, Kline
 from chanlun.db import db
-from chanlun.exchange import exchange
-from chanlun.file_db import FileCacheDB
+from chanlun.file_db import fdb
+from chanlun.macd_index import macd_index
+from chanlun.tv_chart import cl_data_to_tv_chart  # noqa: F401
 
 
 def web_batch_get_cl_datas(
@@ -26,58 +26,46 @@ def web_batch_get_cl_datas(
     :return: 返回计算好的缠论数据对象，List 列表格式，按照传入的 klines.keys 顺序返回 如上调用：[0] 返回 30m 周期数据 [1] 返回 5m 数据
     """
     cls = []
-    fdb = FileCacheDB()
+    # 使用共用的文件缓存对象，计算过的缠论对象会保留在内存中，下次直接增量计算；返回的是复制的对象，可以在其他线程中读取
     for f, k in klines.items():
         cls.append(fdb.get_web_cl_data(market, code, f, cl_config, k))
     return cls
 
 
-def cal_klines_macd_infos(start_k: Kline, end_k: Kline, cd: ICL) -> MACD_INFOS:
+def _range_macd_infos(cd: ICL, start_index: int, end_index: int) -> MACD_INFOS:
     """
-    计算线中macd信息
+    通过 macd 索引，计算K线区间内 macd 穿越零轴、金叉死叉的次数
     """
     infos = MACD_INFOS()
-
-    idx = cd.get_idx()
-    dea = np.array(idx["macd"]["dea"][start_k.index : end_k.index + 1])
-    dif = np.array(idx["macd"]["dif"][start_k.index : end_k.index + 1])
-    if len(dea) < 2 or len(dif) < 2:
+    index = macd_index(cd)
+    if min(end_index + 1, index.n) - start_index < 2:
         return infos
-    zero = np.zeros(len(dea))
-
-    infos.dif_up_cross_num = len(up_cross(dif, zero))
-    infos.dif_down_cross_num = len(down_cross(dif, zero))
-    infos.dea_up_cross_num = len(up_cross(dea, zero))
-    infos.dea_down_cross_num = len(down_cross(dea, zero))
-    infos.gold_cross_num = len(up_cross(dif, dea))
-    infos.die_cross_num = len(down_cross(dif, dea))
-    infos.last_dif = dif[-1]
-    infos.last_dea = dea[-1]
+
+    cross_nums = index.cross_nums(start_index, end_index)
+    infos.dif_up_cross_num = cross_nums["dif_up_cross"]
+    infos.dif_down_cross_num = cross_nums["dif_down_cross"]
+    infos.dea_up_cross_num = cross_nums["dea_up_cross"]
+    infos.dea_down_cross_num = cross_nums["dea_down_cross"]
+    infos.gold_cross_num = cross_nums["gold_cross"]
+    infos.die_cross_num = cross_nums["die_cross"]
+    last_index = min(end_index, index.n - 1)
+    infos.last_dif = index.value("dif", last_index)
+    infos.last_dea = index.value("dea", last_index)
     return infos
 
 
-def cal_line_macd_infos(line: LINE, cd: ICL) -> MACD_INFOS:
+def cal_klines_macd_infos(start_k: Kline, end_k: Kline, cd: ICL) -> MACD_INFOS:
     """
     计算线中macd信息
     """
-    infos = MACD_INFOS()
+    return _range_macd_infos(cd, start_k.index, end_k.index)
 
-    idx = cd.get_idx()
-    dea = np.array(idx["macd"]["dea"][line.start.k.k_index : line.end.k.k_index + 1])
-    dif = np.array(idx["macd"]["dif"][line.start.k.k_index : line.end.k.k_index + 1])
-    if len(dea) < 2 or len(dif) < 2:
-        return infos
-    zero = np.zeros(len(dea))
-
-    infos.dif_up_cross_num = len(up_cross(dif, zero))
-    infos.dif_down_cross_num = len(down_cross(dif, zero))
-    infos.dea_up_cross_num = len(up_cross(dea, zero))
-    infos.dea_down_cross_num = len(down_cross(dea, zero))
-    infos.gold_cross_num = len(up_cross(dif, dea))
-    infos.die_cross_num = len(down_cross(dif, dea))
-    infos.last_dif = dif[-1]
-    infos.last_dea = dea[-1]
-    return infos
+
+def cal_line_macd_infos(line: LINE, cd: ICL) -> MACD_INFOS:
+    """
+    计算线中macd信息
+    """
+    return _range_macd_infos(cd, line.start.k.k_index, line.end.k.k_index)
 
 
 def cal_macd_bis_is_bc(bis: list[BI], cd: ICL) -> tuple[bool, bool]:
@@ -109,16 +97,17 @@ def cal_macd_bis_is_bc(bis: list[BI], cd: ICL) -> tuple[bool, bool]:
             return False, False
 
     macd_idx = cd.get_idx()["macd"]
+    index = macd_index(cd)
     # 如果最后一笔内部没有找到 红绿柱子，则直接返回 True
     if direction == "up":
-        macd_up_hist_max_val = max(
-            macd_idx["hist"][bis[-1].start.k.k_index : bis[-1].end.k.k_index + 1]
+        macd_up_hist_max_val = index.range_max(
+            "hist", bis[-1].start.k.k_index, bis[-1].end.k.k_index
         )
         if macd_up_hist_max_val <= 0:
             return True, True
     elif direction == "down":
-        macd_down_hist_min_val = min(
-            macd_idx["hist"][bis[-1].start.k.k_index : bis[-1].end.k.k_index + 1]
+        macd_down_hist_min_val = index.range_min(
+            "hist", bis[-1].start.k.k_index, bis[-1].end.k.k_index
         )
         if macd_down_hist_min_val >= 0:
             return True, True
@@ -137,7 +126,7 @@ def cal_macd_bis_is_bc(bis: list[BI], cd: ICL) -> tuple[bool, bool]:
         return False, False
 
     def get_macd_dump_info(start_fx: FX, end_fx: FX):
-        # 获取给定区间内，hist dif dea 最大值，hist 出现的驼峰值列表
+        # 获取给定区间内，hist dif dea 最大值，hist 出现的驼峰面积列表
         start_k_index = start_fx.klines[0].k_index
         end_k_index = (
             end_fx.klines[-1].k_index
@@ -174,37 +163,25 @@ def cal_macd_bis_is_bc(bis: list[BI], cd: ICL) -> tuple[bool, bool]:
                 else:
                     break
 
-        macd_hists = macd_idx["hist"][start_k_index : end_k_index + 1]
-        macd_difs = macd_idx["dif"][start_k_index : end_k_index + 1]
-        macd_deas = macd_idx["dea"][start_k_index : end_k_index + 1]
-
-        max_hist = max_dif = max_dea = 0
-        hist_dumps = []
-        _temp_dumps = []
-        for i in range(len(macd_hists)):
-            _hist = macd_hists[i]
-            _dif = macd_difs[i]
-            _dea = macd_deas[i]
-            if direction == "up" and _hist > 0:
-                _temp_dumps.append(_hist)
-                max_hist = max(max_hist, _hist)
-            if direction == "up" and _dif > 0:
-                max_dif = max(max_dif, _dif)
-            if direction == "up" and _dea > 0:
-                max_dea = max(max_dea, _dea)
-            if direction == "down" and _hist < 0:
-                _temp_dumps.append(abs(_hist))
-                max_hist = max(max_hist, abs(_hist))
-            if direction == "down" and _dif < 0:
-                max_dif = max(max_dif, abs(_dif))
-            if direction == "down" and _dea < 0:
-                max_dea = max(max_dea, abs(_dea))
-            if (direction == "up" and _hist < 0) or (direction == "down" and _hist > 0):
-                if len(_temp_dumps) > 0:
-                    hist_dumps.append(_temp_dumps)
-                    _temp_dumps = []
-        if len(_temp_dumps) > 0:
-            hist_dumps.append(_temp_dumps)
+        end_k_index = min(end_k_index, index.n - 1)
+        # 极值通过 macd 索引查询，向下的取负值后比较
+        if direction == "up":
+            max_hist = max(0, index.range_max("hist", start_k_index, end_k_index))
+            max_dif = max(0, index.range_max("dif", start_k_index, end_k_index))
+            max_dea = max(0, index.range_max("dea", start_k_index, end_k_index))
+        else:
+            max_hist = max(0, -index.range_min("hist", start_k_index, end_k_index))
+            max_dif = max(0, -index.range_min("dif", start_k_index, end_k_index))
+            max_dea = max(0, -index.range_min("dea", start_k_index, end_k_index))
+
+        # 驼峰面积：同向的柱子累加，遇到反向的柱子则开始新的驼峰
+        hists = index.raw[2, start_k_index : end_k_index + 1]
+        if direction == "down":
+            hists = -hists
+        dump_ids = np.cumsum(hists < 0)
+        dump_nums = np.bincount(dump_ids, weights=hists > 0)
+        dump_sums = np.bincount(dump_ids, weights=np.where(hists > 0, hists, 0))
+        hist_dumps = dump_sums[dump_nums > 0].tolist()
 
         return max_hist, max_dif, max_dea, hist_dumps
 
@@ -215,7 +192,7 @@ def cal_macd_bis_is_bc(bis: list[BI], cd: ICL) -> tuple[bool, bool]:
         last_bi_max_dea,
         last_bi_hist_dumps,
     ) = get_macd_dump_info(bis[-1].start, bis[-1].end)
-    last_bi_sum_hist = sum([sum(_hists) for _hists in last_bi_hist_dumps])
+    last_bi_sum_hist = sum(last_bi_hist_dumps)
     # print(
     #     f'最后一笔macd 信息： max_hist {last_bi_max_hist} max_dif {last_bi_max_dif} max_dea {last_bi_max_dea} sum_hist {last_bi_sum_hist}')
     # 根据中枢数量，来获取要比较的部分
@@ -241,7 +218,7 @@ def cal_macd_bis_is_bc(bis: list[BI], cd: ICL) -> tuple[bool, bool]:
         compare_max_dea,
         compare_hist_dumps,
     ) = get_macd_dump_info(compare_start_fx, compare_end_fx)
-    compare_max_sum_hist = max([sum(_hists) for _hists in compare_hist_dumps])
+    compare_max_sum_hist = max(compare_hist_dumps)
     # print(
     #     f'要比较的macd信息： max_hist {compare_max_hist} max_dif {compare_max_dif} max_dea {compare_max_dea} sum_hist {compare_max_sum_hist}')
 
@@ -259,26 +236,7 @@ def cal_zs_macd_infos(zs: ZS, cd: ICL) -> MACD_INFOS:
     """
     计算中枢的macd信息
     """
-    infos = MACD_INFOS()
-    dea = np.array(
-        cd.get_idx()["macd"]["dea"][zs.start.k.k_index : zs.end.k.k_index + 1]
-    )
-    dif = np.array(
-        cd.get_idx()["macd"]["dif"][zs.start.k.k_index : zs.end.k.k_index + 1]
-    )
-    if len(dea) < 2 or len(dif) < 2:
-        return infos
-    zero = np.zeros(len(dea))
-
-    infos.dif_up_cross_num = len(up_cross(dif, zero))
-    infos.dif_down_cross_num = len(down_cross(dif, zero))
-    infos.dea_up_cross_num = len(up_cross(dea, zero))
-    infos.dea_down_cross_num = len(down_cross(dea, zero))
-    infos.gold_cross_num = len(up_cross(dif, dea))
-    infos.die_cross_num = len(down_cross(dif, dea))
-    infos.last_dif = dif[-1]
-    infos.last_dea = dea[-1]
-    return infos
+    return _range_macd_infos(cd, zs.start.k.k_index, zs.end.k.k_index)
 
 
 def query_cl_chart_config(
@@ -636,292 +594,6 @@ def prices_jiaodu(prices):
     return j if prices[-1] > prices[0] else -j
 
 
-def cl_data_to_tv_chart(
-    cd: ICL, config: dict, to_frequency: str | None = None
-) -> dict | None:
-    """
-    将缠论数据，转换成 tv 画图的坐标数据
-    """
-    # K线
-    klines = [
-        {
-            "date": k.date,
-            "high": k.h,
-            "low": k.l,
-            "open": k.o,
-            "close": k.c,
-            "volume": k.a,
-        }
-        for k in cd.get_klines()
-    ]
-    klines = pd.DataFrame(klines)
-    if len(klines) == 0:
-        return None
-    klines.loc[:, "code"] = cd.get_code()
-    if to_frequency is not None:
-        # 将数据转换成指定的周期数据
-        market = to_frequency.split(":")[0]
-        frequency = to_frequency.split(":")[1]
-        if market == "a":
-            klines = exchange.convert_stock_kline_frequency(klines, frequency)
-        elif market == "futures":
-            klines = exchange.convert_futures_kline_frequency(klines, frequency)
-        elif market == "currency":
-            klines = exchange.convert_currency_kline_frequency(klines, frequency)
-        else:
-            raise Exception(f"图表周期数据转换，不支持的市场 {market}")
-
-    # K 线数据
-    kline_ts = klines["date"].map(fun.datetime_to_int).tolist()
-    kline_cs = klines["close"].tolist()
-    kline_os = klines["open"].tolist()
-    kline_hs = klines["high"].tolist()
-    kline_ls = klines["low"].tolist()
-    kline_vs = klines["volume"].tolist()
-
-    fx_data = []
-    if config["chart_show_fx"] == "1":
-        for fx in cd.get_fxs():
-            fx_data.append(
-                {
-                    "points": [
-                        {"time": fun.datetime_to_int(fx.k.date), "price": fx.val},
-                        {"time": fun.datetime_to_int(fx.k.date), "price": fx.val},
-                    ],
-                    "text": fx.type,
-                }
-            )
-
-    bi_chart_data = []
-    if config["chart_show_bi"] == "1":
-        for bi in cd.get_bis():
-            bi_chart_data.append(
-                {
-                    "points": [
-                        {
-                            "time": fun.datetime_to_int(bi.start.k.date),
-                            "price": bi.start.val,
-                        },
-                        {
-                            "time": fun.datetime_to_int(bi.end.k.date),
-                            "price": bi.end.val,
-                        },
-                    ],
-                    "linestyle": "0" if bi.is_done() else "1",
-                }
-            )
-
-    xd_chart_data = []
-    if config["chart_show_xd"] == "1":
-        for xd in cd.get_xds():
-            xd_chart_data.append(
-                {
-                    "points": [
-                        {
-                            "time": fun.datetime_to_int(xd.start.k.date),
-                            "price": xd.start.val,
-                        },
-                        {
-                            "time": fun.datetime_to_int(xd.end.k.date),
-                            "price": xd.end.val,
-                        },
-                    ],
-                    "linestyle": "0" if xd.is_done() else "1",
-                }
-            )
-
-    zsd_chart_data = []
-    if config["chart_show_zsd"] == "1":
-        for zsd in cd.get_zsds():
-            zsd_chart_data.append(
-                {
-                    "points": [
-                        {
-                            "time": fun.datetime_to_int(zsd.start.k.date),
-                            "price": zsd.start.val,
-                        },
-                        {
-                            "time": fun.datetime_to_int(zsd.end.k.date),
-                            "price": zsd.end.val,
-                        },
-                    ],
-                    "linestyle": "0" if zsd.is_done() else "1",
-                }
-            )
-
-    bi_zs_chart_data = []
-    if config["chart_show_bi_zs"] == "1":
-        for zs_type in config["zs_bi_type"]:
-            for zs in cd.get_bi_zss(zs_type):
-                bi_zs_chart_data.append(
-                    {
-                        "points": [
-                            {
-                                "time": fun.datetime_to_int(zs.start.k.date),
-                                "price": zs.zg,
-                            },
-                            {
-                                "time": fun.datetime_to_int(zs.end.k.date),
-                                "price": zs.zd,
-                            },
-                        ],
-                        "linestyle": "0" if zs.done else "1",
-                    }
-                )
-
-    xd_zs_chart_data = []
-    if config["chart_show_xd_zs"] == "1":
-        for zs_type in config["zs_xd_type"]:
-            for zs in cd.get_xd_zss(zs_type):
-                xd_zs_chart_data.append(
-                    {
-                        "points": [
-                            {
-                                "time": fun.datetime_to_int(zs.start.k.date),
-                                "price": zs.zg,
-                            },
-                            {
-                                "time": fun.datetime_to_int(zs.end.k.date),
-                                "price": zs.zd,
-                            },
-                        ],
-                        "linestyle": "0" if zs.done else "1",
-                    }
-                )
-
-    zsd_zs_chart_data = []
-    if config["chart_show_zsd_zs"] == "1":
-        for zs in cd.get_zsd_zss():
-            zsd_zs_chart_data.append(
-                {
-                    "points": [
-                        {"time": fun.datetime_to_int(zs.start.k.date), "price": zs.zg},
-                        {"time": fun.datetime_to_int(zs.end.k.date), "price": zs.zd},
-                    ],
-                    "linestyle": "0" if zs.done else "1",
-                }
-            )
-
-    # 背驰信息
-    bc_infos = {}
-    # 买卖点信息
-    mmd_infos = {}
-
-    lines = {
-        "bi": cd.get_bis(),
-        "xd": cd.get_xds(),
-        "zsd": cd.get_zsds(),
-    }
-    line_type_map = {"bi": "笔", "xd": "段", "zsd": "走", "qsd": "趋"}
-    bc_type_map = {
-        "bi": "BI",
-        "xd": "XD",
-        "zsd": "ZSD",
-        "qsd": "QSD",
-        "pz": "PZ",
-        "qs": "QS",
-    }
-    mmd_type_map = {
-        "1buy": "1B",
-        "2buy": "2B",
-        "l2buy": "L2B",
-        "3buy": "3B",
-        "l3buy": "L3B",
-        "1sell": "1S",
-        "2sell": "2S",
-        "l2sell": "L2S",
-        "3sell": "3S",
-        "l3sell": "L3S",
-    }
-    for line_type, ls in lines.items():
-        for l in ls:
-            bcs = l.line_bcs("|")
-            if len(bcs) != 0 and l.end.k.date not in bc_infos:
-                bc_infos[l.end.k.date] = {
-                    "price": l.end.val,
-                    "bc_infos": {_type: [] for _type in line_type_map},
-                }
-            if config[f"chart_show_{line_type}_bc"] == "1":
-                for bc in bcs:
-                    bc_infos[l.end.k.date]["bc_infos"][line_type].append(
-                        bc_type_map[bc]
-                    )
-
-            mmds = l.line_mmds("|")
-            if len(mmds) != 0 and l.end.k.date not in mmd_infos:
-                mmd_infos[l.end.k.date] = {
-                    "price": l.end.val,
-                    "mmd_infos": {_type: [] for _type in line_type_map},
-                }
-            if config[f"chart_show_{line_type}_mmd"] == "1":
-                for mmd in mmds:
-                    mmd_infos[l.end.k.date]["mmd_infos"][line_type].append(
-                        mmd_type_map[mmd]
-                    )
-
-    bc_chart_data = []
-    for dt, bc in bc_infos.items():
-        bc_text = "/".join(
-            [
-                f"{line_type_map[_type]}:{','.join(list(set(_bcs)))}"
-                for _type, _bcs in bc["bc_infos"].items()
-                if len(_bcs) > 0
-            ]
-        )
-        if len(bc_text) > 0:
-            bc_chart_data.append(
-                {
-                    "points": {"time": fun.datetime_to_int(dt), "price": bc["price"]},
-                    "text": bc_text,
-                }
-            )
-
-    mmd_chart_data = []
-    for dt, mmd in mmd_infos.items():
-        mmd_text = "/".join(
-            [
-                f"{line_type_map[_type]}:{','.join(list(set(_mmds)))}"
-                for _type, _mmds in mmd["mmd_infos"].items()
-                if len(_mmds) > 0
-            ]
-        )
-        if len(mmd_text) > 0:
-            mmd_chart_data.append(
-                {
-                    "points": {"time": fun.datetime_to_int(dt), "price": mmd["price"]},
-                    "text": mmd_text,
-                }
-            )
-
-    fx_data.sort(key=lambda v: v["points"][0]["time"], reverse=False)
-    bi_chart_data.sort(key=lambda v: v["points"][0]["time"], reverse=False)
-    xd_chart_data.sort(key=lambda v: v["points"][0]["time"], reverse=False)
-    zsd_chart_data.sort(key=lambda v: v["points"][0]["time"], reverse=False)
-    bi_zs_chart_data.sort(key=lambda v: v["points"][0]["time"], reverse=False)
-    xd_zs_chart_data.sort(key=lambda v: v["points"][0]["time"], reverse=False)
-    zsd_zs_chart_data.sort(key=lambda v: v["points"][0]["time"], reverse=False)
-    bc_chart_data.sort(key=lambda v: v["points"]["time"], reverse=False)
-    mmd_chart_data.sort(key=lambda v: v["points"]["time"], reverse=False)
-
-    return {
-        "t": kline_ts,
-        "c": kline_cs,
-        "o": kline_os,
-        "h": kline_hs,
-        "l": kline_ls,
-        "v": kline_vs,
-        "fxs": fx_data,
-        "bis": bi_chart_data,
-        "xds": xd_chart_data,
-        "zsds": zsd_chart_data,
-        "bi_zss": bi_zs_chart_data,
-        "xd_zss": xd_zs_chart_data,
-        "zsd_zss": zsd_zs_chart_data,
-        "bcs": bc_chart_data,
-        "mmds": mmd_chart_data,
-    }
-
-
 def bi_td(bi: BI, cd: ICL):
     """
     判断是否笔停顿
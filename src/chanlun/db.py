@@ -2,7 +2,7 @@ import datetime
 import json
 import time
 import warnings
-from typing import List, Union
+from typing import Dict, List, Union
 
 import numpy as np
 import pandas as pd
@@ -16,8 +16,10 @@ from sqlalchemy import (
     UniqueConstraint,
     create_engine,
     func,
+    select,
 )
 from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.pool import QueuePool
 
@@ -359,6 +361,84 @@ class DB(object):
                 query = query.limit(limit)
             return query.all()
 
+    def klines_query_columns(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        start_date: datetime.datetime = None,
+        end_date: datetime.datetime = None,
+        limit: int = 5000,
+        order: str = "desc",
+    ) -> Dict[str, np.ndarray]:
+        """
+        获取k线数据，使用 Core select 直接查询列值，不创建 ORM 对象
+        返回按照 dt 正序排列的列数组 {"dt": datetime64, "o"/"c"/"h"/"l"/"v"[/"p"]: float64}
+        :param market:
+        :param code:
+        :param frequency:
+        :param start_date:
+        :param end_date:
+        :param limit:
+        :param order: desc 则返回最后的 limit 条数据，asc 返回最开始的 limit 条数据
+        :return:
+        """
+        table = self.klines_tables(market, code)
+        columns = ["dt", "o", "c", "h", "l", "v"]
+        if market == Market.FUTURES.value:
+            columns.append("p")
+        query = select(*[getattr(table, _c) for _c in columns]).where(
+            table.code == code, table.f == frequency
+        )
+        if start_date is not None:
+            query = query.where(table.dt >= start_date)
+        if end_date is not None:
+            query = query.where(table.dt <= end_date)
+        if order == "desc":
+            query = query.order_by(table.dt.desc())
+        else:
+            query = query.order_by(table.dt.asc())
+        if limit is not None:
+            query = query.limit(limit)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        if order == "desc":
+            rows.reverse()
+
+        values = list(zip(*rows)) if len(rows) > 0 else [[] for _ in columns]
+        res = {"dt": np.array(values[0], dtype="datetime64[us]")}
+        for _c, _v in zip(columns[1:], values[1:]):
+            res[_c] = np.array(_v, dtype=np.float64)
+        return res
+
+    def klines_range_stats(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        start_date: datetime.datetime = None,
+        end_date: datetime.datetime = None,
+    ) -> Dict[str, Union[int, float, datetime.datetime, None]]:
+        """
+        查询日期范围内K线的统计信息，用于判断缓存的K线数据是否有变化
+        :return: {"rows": 数量, "last_dt": 最后一条的日期, "checksum": 收盘价与成交量的总和}
+        """
+        table = self.klines_tables(market, code)
+        query = select(
+            func.count(), func.max(table.dt), func.sum(table.c), func.sum(table.v)
+        ).where(table.code == code, table.f == frequency)
+        if start_date is not None:
+            query = query.where(table.dt >= start_date)
+        if end_date is not None:
+            query = query.where(table.dt <= end_date)
+        with self.engine.connect() as conn:
+            rows, last_dt, sum_c, sum_v = conn.execute(query).one()
+        return {
+            "rows": int(rows),
+            "last_dt": last_dt,
+            "checksum": float(sum_c or 0) + float(sum_v or 0),
+        }
+
     def klines_last_datetime(self, market, code, frequency):
         """
         查询k线表中最后一条记录的日期
@@ -394,70 +474,53 @@ class DB(object):
         :param klines:
         :return:
         """
-        with self.Session() as session:
-            table = self.klines_tables(market, code)
+        if len(klines) == 0:
+            return True
+        table = self.klines_tables(market, code)
+        in_position = "position" in klines.columns
+
+        # 按列整体转换数据，避免逐行遍历 DataFrame
+        dts = pd.to_datetime(klines["date"])
+        if dts.dt.tz is not None:
+            dts = dts.dt.tz_localize(None)  # 去除时区信息
+        # 相同时间的K线保留最后一条
+        keep = ~dts.duplicated(keep="last").to_numpy()
+        columns = {
+            "dt": dts.dt.to_pydatetime()[keep],
+            "o": klines["open"].to_numpy(dtype=float)[keep],
+            "c": klines["close"].to_numpy(dtype=float)[keep],
+            "h": klines["high"].to_numpy(dtype=float)[keep],
+            "l": klines["low"].to_numpy(dtype=float)[keep],
+            "v": klines["volume"].to_numpy(dtype=float)[keep],
+        }
+        if in_position:
+            columns["p"] = klines["position"].to_numpy(dtype=float)[keep]
+        # 使用各列的数组直接组合每行的参数（tolist 转换为 Python 的数据类型）
+        keys = ["code", "f", *columns.keys()]
+        insert_klines = [
+            dict(zip(keys, (code, frequency, *_row)))
+            for _row in zip(*[_col.tolist() for _col in columns.values()])
+        ]
 
-            # 如果是 sqlite ，则慢慢更新吧
-            if config.DB_TYPE == "sqlite":
-                for _, _k in klines.iterrows():
-                    _in_k = {
-                        "code": code,
-                        "f": frequency,
-                        "dt": _k["date"].replace(tzinfo=None),  # 去除时区信息
-                        "o": _k["open"],
-                        "c": _k["close"],
-                        "h": _k["high"],
-                        "l": _k["low"],
-                        "v": _k["volume"],
-                    }
-                    if "position" in _k.keys():
-                        _in_k["p"] = _k["position"]
-                    db_k = (
-                        session.query(table)
-                        .filter(
-                            table.code == code,
-                            table.f == frequency,
-                            table.dt == _in_k["dt"],
-                        )
-                        .first()
-                    )
-                    if db_k is None:
-                        session.add(table(**_in_k))
-                    else:
-                        session.query(table).filter(
-                            table.code == code,
-                            table.f == frequency,
-                            table.dt == _in_k["dt"],
-                        ).update(_in_k)
-                session.commit()
-                return True
+        update_keys = ["o", "c", "h", "l", "v"]
+        if in_position:
+            update_keys.append("p")
 
-            # 将 klines 数据拆分为每 500 条一组，批量插入
-            group = np.arange(len(klines)) // 500
-            groups = [
-                group.reset_index(drop=True) for _, group in klines.groupby(group)
-            ]
-            in_position = "position" in klines.columns
-            for g_klines in groups:
-                insert_klines = []
-                for _, _k in g_klines.iterrows():
-                    _insert_k = {
-                        "code": code,
-                        "dt": _k["date"].replace(tzinfo=None),  # 去除时区信息
-                        "f": frequency,
-                        "o": _k["open"],
-                        "c": _k["close"],
-                        "h": _k["high"],
-                        "l": _k["low"],
-                        "v": _k["volume"],
-                    }
-                    if in_position:
-                        _insert_k["p"] = _k["position"]
-                    insert_klines.append(_insert_k)
-                insert_stmt = insert(table).values(insert_klines)
-                update_keys = ["o", "c", "h", "l", "v"]
-                if in_position:
-                    update_keys.append("p")
+        # sqlite 在一个事务中，使用 INSERT ... ON CONFLICT DO UPDATE 批量写入
+        if config.DB_TYPE == "sqlite":
+            insert_stmt = sqlite_insert(table)
+            upsert_stmt = insert_stmt.on_conflict_do_update(
+                index_elements=["code", "dt", "f"],
+                set_={_k: insert_stmt.excluded[_k] for _k in update_keys},
+            )
+            with self.engine.begin() as conn:
+                conn.execute(upsert_stmt, insert_klines)
+            return True
+
+        # 将 klines 数据拆分为每 500 条一组，批量插入
+        with self.Session() as session:
+            for i in range(0, len(insert_klines), 500):
+                insert_stmt = insert(table).values(insert_klines[i : i + 500])
                 update_columns = {
                     x.name: x for x in insert_stmt.inserted if x.name in update_keys
                 }
@@ -1,11 +1,12 @@
 import datetime
 from typing import Dict, List, Union
 
+import numpy as np
 import pandas as pd
 import pytz
 from tzlocal import get_localzone
 
-from chanlun import fun
+from chanlun import config, fun
 from chanlun.base import Market
 from chanlun.db import db
 from chanlun.exchange.exchange import (
@@ -38,6 +39,14 @@ class ExchangeDB(Exchange):
         if self.market in ["currency", "currency_spot"]:
             self.tz = pytz.timezone(str(get_localzone()))
 
+        # K线数据的存储方式，db 使用数据库表存储，parquet 使用列式文件存储（按年分区）
+        self.klines_store = getattr(config, "KLINES_STORE", "db")
+        self.store = None
+        if self.klines_store == "parquet":
+            from chanlun.klines_store import KlinesParquetStore
+
+            self.store = KlinesParquetStore()
+
     def default_code(self):
         if self.market == Market.A.value:
             return "SH.000001"
@@ -152,8 +161,33 @@ class ExchangeDB(Exchange):
         :param code:
         :return:
         """
+        if self.store is not None:
+            return self.store.last_datetime(self.market, code, frequency)
         return db.klines_last_datetime(self.market, code, frequency)
 
+    def klines_stats(
+        self, code: str, frequency: str, start_date: str = None, end_date: str = None
+    ) -> Dict[str, Union[int, float, str, None]]:
+        """
+        查询日期范围内K线的统计信息（数量、最后日期、收盘价与成交量的总和），不读取K线数据
+        用于判断根据K线生成的缓存文件是否需要重新生成（补充数据或者修正K线后统计信息会变化）
+        """
+        if start_date is not None:
+            start_date = fun.str_to_datetime(start_date)
+        if end_date is not None:
+            end_date = fun.str_to_datetime(end_date)
+        if self.store is not None:
+            stats = self.store.range_stats(
+                self.market, code, frequency, start_date, end_date
+            )
+        else:
+            stats = db.klines_range_stats(
+                self.market, code, frequency, start_date, end_date
+            )
+        if stats["last_dt"] is not None:
+            stats["last_dt"] = stats["last_dt"].strftime("%Y-%m-%d %H:%M:%S")
+        return stats
+
     def insert_klines(self, code, frequency, klines):
         """
         批量添加交易对儿Kline数据
@@ -162,6 +196,9 @@ class ExchangeDB(Exchange):
         :param klines:
         :return:
         """
+        if self.store is not None:
+            self.store.insert(self.market, code, frequency, klines)
+            return True
         db.klines_insert(self.market, code, frequency, klines)
         return True
 
@@ -169,14 +206,23 @@ class ExchangeDB(Exchange):
         """
         删除一条记录
         """
+        if self.store is not None:
+            self.store.delete(self.market, code, frequency, _datetime)
+            return
         db.klines_delete(self.market, code, frequency, _datetime)
         return
 
     def del_klines_by_code(self, code):
+        if self.store is not None:
+            self.store.delete(self.market, code)
+            return
         db.klines_delete(self.market, code)
         return
 
     def del_klines_by_code_freq(self, code, freq):
+        if self.store is not None:
+            self.store.delete(self.market, code, frequency=freq)
+            return
         db.klines_delete(self.market, code, frequency=freq)
         return
 
@@ -188,6 +234,52 @@ class ExchangeDB(Exchange):
         end_date: str = None,
         args=None,
     ) -> Union[pd.DataFrame, None]:
+        values = self.klines_arrays(code, frequency, start_date, end_date, args)
+        if len(values["date"]) == 0:
+            kline_pd = pd.DataFrame(
+                [], columns=["date", "code", "high", "low", "open", "close", "volume"]
+            )
+            return kline_pd
+
+        return self.klines_from_arrays(code, values)
+
+    def klines_from_arrays(
+        self, code: str, values: Dict[str, np.ndarray]
+    ) -> pd.DataFrame:
+        """
+        将 klines_arrays 返回的列数组转换成K线 DataFrame
+        """
+        kline_pd = pd.DataFrame(
+            {
+                "code": code,
+                "date": pd.to_datetime(values["date"], unit="s", utc=True).tz_convert(
+                    self.tz
+                ),
+                "open": values["open"],
+                "high": values["high"],
+                "low": values["low"],
+                "close": values["close"],
+                "volume": values["volume"],
+            }
+        )
+        if "position" in values:
+            kline_pd["position"] = values["position"]
+
+        return kline_pd
+
+    def klines_arrays(
+        self,
+        code: str,
+        frequency: str,
+        start_date: str = None,
+        end_date: str = None,
+        args=None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        获取K线的列数组，不构建 DataFrame，适用于只需要数组计算的回测与选股
+        返回按照日期正序排列的 {"date": int64 时间戳（秒）, "open"/"high"/"low"/"close"/"volume"[/"position"]: float64}
+        参数与 klines 方法一致
+        """
         if args is None:
             args = {}
 
@@ -204,59 +296,51 @@ class ExchangeDB(Exchange):
             start_date = fun.str_to_datetime(start_date)
         if end_date is not None:
             end_date = fun.str_to_datetime(end_date)
-        klines = db.klines_query(
-            self.market, code, frequency, start_date, end_date, limit, order
-        )
-        kline_pd = []
-        for _k in klines:
-            _kline = {
-                "code": _k.code,
-                "date": _k.dt,
-                "open": _k.o,
-                "high": _k.h,
-                "low": _k.l,
-                "close": _k.c,
-                "volume": _k.v,
-            }
-            if self.market == Market.FUTURES.value:
-                _kline["position"] = _k.p
-            kline_pd.append(_kline)
-        if len(kline_pd) == 0:
-            kline_pd = pd.DataFrame(
-                [], columns=["date", "code", "high", "low", "open", "close", "volume"]
+        if self.store is not None:
+            columns = self.store.query(
+                self.market, code, frequency, start_date, end_date, limit, order
+            )
+            columns = {_c: columns[_c].to_numpy() for _c in columns.columns}
+        else:
+            columns = db.klines_query_columns(
+                self.market, code, frequency, start_date, end_date, limit, order
             )
-            return kline_pd
-
-        kline_pd = pd.DataFrame(kline_pd)
-        kline_pd["code"] = code
-        kline_pd["date"] = pd.to_datetime(kline_pd["date"]).dt.tz_localize(
-            self.tz, ambiguous=True
-        )  # .map(lambda d: d.to_pydatetime())
-        kline_pd["date"] = kline_pd["date"].apply(self.__convert_date)
-        kline_pd.sort_values(by="date", inplace=True)
-        kline_pd = kline_pd.reset_index(drop=True)
 
-        return kline_pd
+        dates = pd.DatetimeIndex(columns["dt"])
+        if len(dates) > 0:
+            dates = self._convert_dates(dates).tz_localize(self.tz, ambiguous=True)
+        values = {
+            "date": dates.as_unit("s").asi8,
+            "open": np.asarray(columns["o"], dtype=np.float64),
+            "high": np.asarray(columns["h"], dtype=np.float64),
+            "low": np.asarray(columns["l"], dtype=np.float64),
+            "close": np.asarray(columns["c"], dtype=np.float64),
+            "volume": np.asarray(columns["v"], dtype=np.float64),
+        }
+        if self.market == Market.FUTURES.value:
+            values["position"] = np.asarray(columns["p"], dtype=np.float64)
+        return values
 
-    def __convert_date(self, dt: datetime.datetime):
+    def _convert_dates(self, dates: pd.DatetimeIndex) -> pd.DatetimeIndex:
         """
-        统一各个市场的时间格式
+        统一各个市场的时间格式（dates 为不带时区的本地时间）
         TODO 需要根据自己数据源的数据格式进行调整
         TODO 将日及以上周期（大多数这类的时间都是 0点0分），修改为交易日结束或开始时间（根据日期是前对其还是后对其来决定是开盘时间还是收盘时间）
         """
-        if self.market == Market.A.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=15, minute=0)
-        if self.market == Market.HK.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=16, minute=0)
-        if self.market == Market.FUTURES.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=9, minute=0)
-        if self.market == Market.US.value:
-            if dt.hour == 0 and dt.minute == 0:
-                return dt.replace(hour=9, minute=30)
-        return dt
+        day_times = {
+            Market.A.value: pd.Timedelta(hours=15),
+            Market.HK.value: pd.Timedelta(hours=16),
+            Market.FUTURES.value: pd.Timedelta(hours=9),
+            Market.US.value: pd.Timedelta(hours=9, minutes=30),
+        }
+        if self.market not in day_times:
+            return dates
+        is_day = (dates.hour == 0) & (dates.minute == 0)
+        if not is_day.any():
+            return dates
+        offsets = np.zeros(len(dates), dtype="timedelta64[ns]")
+        offsets[is_day] = day_times[self.market].to_timedelta64()
+        return dates + offsets
 
     def convert_kline_frequency(self, klines: pd.DataFrame, to_f: str) -> pd.DataFrame:
         """
@@ -1,7 +1,6 @@
-import copy
 import datetime
+import multiprocessing
 import traceback
-import warnings
 from typing import Dict, List, Union
 
 import pandas as pd
@@ -10,13 +9,16 @@ from pytdx.errors import TdxConnectionError
 from pytdx.hq import TdxHq_API
 from tenacity import retry, retry_if_result, stop_after_attempt, wait_random
 
-from chanlun import fun
+from chanlun import config, fun
 from chanlun.base import Market
 from chanlun.config import get_data_path
 from chanlun.db import db
+from chanlun.exchange import tdx_fq
 from chanlun.exchange.exchange import Exchange, Tick, convert_stock_kline_frequency
 from chanlun.exchange.stocks_bkgn import StocksBKGN
 from chanlun.exchange.tdx_a_codes import tdx_codes_by_bj, tdx_codes_by_error
+from chanlun.exchange.tdx_pool import TdxConnectionPool
+from chanlun.exchange.tdx_servers import TdxServerTracker
 from chanlun.file_db import FileCacheDB
 from chanlun.tools import tdx_best_ip as best_ip
 
@@ -28,11 +30,33 @@ class ExchangeTDX(Exchange):
     """
 
     g_all_stocks = []
+    # 所有实例共用的连接池
+    g_pool: TdxConnectionPool = None
+    # 所有实例共用的服务器延迟跟踪
+    g_tracker: TdxServerTracker = None
+    # 除权除息事件的缓存 {(市场, 代码): (日期, 事件数组)}，每个代码每天解析一次
+    g_xdxr_events: Dict[tuple, tuple] = {}
 
     def __init__(self):
         # super().__init__()
 
+        # 连接池的连接数量，获取K线时多页数据并发请求
+        self.pool_size = int(getattr(config, "TDX_POOL_SIZE", 4))
+
         try:
+            if ExchangeTDX.g_tracker is None:
+                # 后台定时 ping 所有服务器，服务器排名保存在 cache 中
+                ExchangeTDX.g_tracker = TdxServerTracker(
+                    best_ip.stock_ip,
+                    best_ip.ping_seconds,
+                    cache_key="tdx_server_scores",
+                    probe_seconds=float(getattr(config, "TDX_PROBE_MINUTES", 5)) * 60,
+                    on_probe=ExchangeTDX.update_pool_servers,
+                )
+                # 只在主进程（web 服务、定时脚本）中后台 ping，选股、回测等子进程只读取保存的服务器排名
+                if multiprocessing.parent_process() is None:
+                    ExchangeTDX.g_tracker.start()
+
             # 选择最优的服务器，并保存到 cache 中
             self.connect_info = db.cache_get("tdx_connect_ip")
             # self.connect_info = None  # 手动重新选择最优服务器
@@ -40,6 +64,19 @@ class ExchangeTDX(Exchange):
             if self.connect_info is None:
                 self.connect_info = self.reset_tdx_ip()
             # print(f"最优服务器：{self.connect_info}")
+            if ExchangeTDX.g_pool is None:
+                ExchangeTDX.g_pool = TdxConnectionPool(
+                    lambda: TdxHq_API(
+                        raise_exception=True,
+                        auto_retry=True,
+                        multithread=True,
+                        heartbeat=True,
+                    ),
+                    self.pool_servers(),
+                    size=self.pool_size,
+                    health_check=lambda _api: _api.get_security_count(0) is not None,
+                    on_connect_error=ExchangeTDX.report_server_error,
+                )
         except Exception:
             print(traceback.format_exc())
             print("通达信 沪深行情接口初始化失败，沪深行情不可用")
@@ -56,13 +93,54 @@ class ExchangeTDX(Exchange):
     def reset_tdx_ip(self):
         """
         重新选择tdx最优ip，并返回
+        当前服务器记录一次失败后，按照服务器的延迟排名选择（没有排名则先并发 ping 所有服务器）
         """
-        connect_info = best_ip.select_best_ip("stock")
-        connect_info = {"ip": connect_info["ip"], "port": int(connect_info["port"])}
+        if self.g_tracker.thread is None:
+            # 没有后台 ping 的进程，读取主进程最新保存的服务器排名
+            self.g_tracker.load()
+        if getattr(self, "connect_info", None) is not None:
+            self.g_tracker.report_error(self.connect_info)
+        if not self.g_tracker.has_scores():
+            self.g_tracker.probe()
+        connect_info = self.g_tracker.ranked(1)[0]
         db.cache_set("tdx_connect_ip", connect_info)
         self.connect_info = connect_info
+        if ExchangeTDX.g_pool is not None:
+            ExchangeTDX.g_pool.set_servers(self.pool_servers())
         return connect_info
 
+    def pool_servers(self):
+        """
+        连接池使用的服务器列表，当前的最优服务器排在第一个，其余的按照服务器的延迟排名
+        """
+        return [self.connect_info] + [
+            _ip
+            for _ip in self.g_tracker.ranked(self.pool_size)
+            if _ip != self.connect_info
+        ][: self.pool_size - 1]
+
+    @staticmethod
+    def report_server_error(server: dict, error: Exception):
+        """
+        连接池连接服务器失败，记录到服务器的延迟跟踪中，降低服务器排名
+        """
+        ExchangeTDX.g_tracker.report_error(server)
+
+    @staticmethod
+    def update_pool_servers(ranked: list[dict]):
+        """
+        后台 ping 完成后，最优的几个服务器发生变化，更新连接池的服务器列表
+        """
+        pool = ExchangeTDX.g_pool
+        if pool is None or len(ranked) == 0:
+            return
+        servers = ranked[: pool.size]
+        if {TdxServerTracker.server_key(_s) for _s in servers} != {
+            TdxServerTracker.server_key(_s) for _s in pool.servers
+        }:
+            pool.set_servers(servers)
+            db.cache_set("tdx_connect_ip", servers[0])
+
     def default_code(self):
         return "SH.000001"
 
@@ -90,8 +168,7 @@ class ExchangeTDX(Exchange):
         __codes = []
         try:
             for market in range(2):
-                client = TdxHq_API(raise_exception=True, auto_retry=True)
-                with client.connect(self.connect_info["ip"], self.connect_info["port"]):
+                with self.g_pool.connection() as client:
                     count = client.get_security_count(market)
                     data = pd.concat(
                         [
@@ -223,50 +300,33 @@ class ExchangeTDX(Exchange):
             return None
 
         try:
-            client = TdxHq_API(raise_exception=True, auto_retry=True)
-            with client.connect(self.connect_info["ip"], self.connect_info["port"]):
-                if "index" in _type:
-                    get_bars = client.get_index_bars
-                else:
-                    get_bars = client.get_security_bars
+            bars_fn = "get_index_bars" if "index" in _type else "get_security_bars"
 
-                ks: pd.DataFrame = self.fdb.get_tdx_klines(
-                    Market.A.value, code, frequency
-                )
-                if ks is None or len(ks) == 0:
-                    # 获取 8*700 = 5600 条数据
-                    ks = pd.concat(
-                        [
-                            client.to_df(
-                                get_bars(
-                                    frequency_map[frequency],
-                                    market,
-                                    tdx_code,
-                                    (i - 1) * 700,
-                                    700,
-                                )
-                            )
-                            for i in range(1, args["pages"] + 1)
-                        ],
-                        axis=0,
-                        sort=False,
+            def get_page(_client, _page: int) -> pd.DataFrame:
+                # 获取第 _page 页（从 0 开始）的 700 条数据
+                return _client.to_df(
+                    getattr(_client, bars_fn)(
+                        frequency_map[frequency], market, tdx_code, _page * 700, 700
                     )
-                    if len(ks) == 0:
-                        return pd.DataFrame([])
-                    ks.loc[:, "date"] = pd.to_datetime(ks["datetime"])
-                    ks.sort_values("date", inplace=True)
-                else:
-                    for i in range(1, args["pages"] + 1):
+                )
+
+            ks: pd.DataFrame = self.fdb.get_tdx_klines(Market.A.value, code, frequency)
+            if ks is None or len(ks) == 0:
+                # 获取 8*700 = 5600 条数据，各页使用连接池中的不同连接并发请求
+                ks = pd.concat(
+                    self.g_pool.map(get_page, range(args["pages"])),
+                    axis=0,
+                    sort=False,
+                )
+                if len(ks) == 0:
+                    return pd.DataFrame([])
+                ks.loc[:, "date"] = pd.to_datetime(ks["datetime"])
+                ks.sort_values("date", inplace=True)
+            else:
+                with self.g_pool.connection() as client:
+                    for i in range(args["pages"]):
                         # print(f'{code} 使用缓存，更新获取第 {i} 页')
-                        _ks = client.to_df(
-                            get_bars(
-                                frequency_map[frequency],
-                                market,
-                                tdx_code,
-                                (i - 1) * 700,
-                                700,
-                            )
-                        )
+                        _ks = get_page(client, i)
                         if len(_ks) == 0:
                             break
                         _ks.loc[:, "date"] = pd.to_datetime(_ks["datetime"])
@@ -308,7 +368,9 @@ class ExchangeTDX(Exchange):
             ks = ks.drop_duplicates(["date"], keep="last").sort_values("date")
 
             if args["fq"] in ["qfq", "hfq"]:
-                ks = self.klines_fq(ks, self.xdxr(market, code, tdx_code), args["fq"])
+                ks = self.klines_fq(
+                    ks, self.xdxr_events(market, code, tdx_code), args["fq"]
+                )
 
             ks.reset_index(inplace=True)
             if frequency in ["w", "120m", "10m", "2m"]:
@@ -366,8 +428,7 @@ class ExchangeTDX(Exchange):
                     continue
                 query_stocks.append((_m, _c))
                 stock_types[_c] = _t
-        client = TdxHq_API(raise_exception=True, auto_retry=True)
-        with client.connect(self.connect_info["ip"], self.connect_info["port"]):
+        with self.g_pool.connection() as client:
             # 获取总数据量
             total_quotes = len(query_stocks)
             # 分批次获取数据
@@ -584,14 +645,35 @@ class ExchangeTDX(Exchange):
     def order(self, code: str, o_type: str, amount: float, args=None):
         raise Exception("交易所不支持")
 
+    @staticmethod
+    def xdxr_file(market: int, project_code: str):
+        xdxr_path = get_data_path() / "xdxr"
+        if xdxr_path.is_dir() is False:
+            xdxr_path.mkdir()
+        return xdxr_path / f"new_xdxr_{market}_{project_code}.pkl"
+
+    @staticmethod
+    def save_xdxr(xdxr_file, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        格式化除权除息日期，并保存到缓存文件
+        """
+        if len(data) > 0:
+            data.loc[:, "date"] = (
+                data["year"].map(str)
+                + "-"
+                + data["month"].map(str)
+                + "-"
+                + data["day"].map(str)
+            )
+            data["date"] = pd.to_datetime(data["date"])
+        data.to_pickle(str(xdxr_file))
+        return data
+
     def xdxr(self, market: int, project_code: str, code: str):
         """
         读取除权除息信息
         """
-        xdxr_path = get_data_path() / "xdxr"
-        if xdxr_path.is_dir() is False:
-            xdxr_path.mkdir()
-        xdxr_file = xdxr_path / f"new_xdxr_{market}_{project_code}.pkl"
+        xdxr_file = self.xdxr_file(market, project_code)
         now_day = fun.datetime_to_str(datetime.datetime.now(), "%Y-%m-%d")
         need_update = False  # 判断是否需要更新
         if (
@@ -600,161 +682,86 @@ class ExchangeTDX(Exchange):
         ):
             need_update = True
         if need_update:
-            client = TdxHq_API(raise_exception=True, auto_retry=True)
-            with client.connect(self.connect_info["ip"], self.connect_info["port"]):
+            with self.g_pool.connection() as client:
                 data = client.to_df(client.get_xdxr_info(market, code))
-            if len(data) > 0:
-                data.loc[:, "date"] = (
-                    data["year"].map(str)
-                    + "-"
-                    + data["month"].map(str)
-                    + "-"
-                    + data["day"].map(str)
-                )
-                data["date"] = pd.to_datetime(data["date"])
-            data.to_pickle(str(xdxr_file))
+            data = self.save_xdxr(xdxr_file, data)
         else:
             # print('直接读取缓存')
             data = pd.read_pickle(str(xdxr_file))
 
         return data
 
-    def klines_fq(self, fq_klines: pd.DataFrame, xdxr_data, fq_type: str):
+    def xdxr_events(self, market: int, project_code: str, code: str) -> dict:
         """
-        对行情进行复权处理
+        获取复权使用的除权除息事件数组，在内存中缓存，每个代码每天只读取解析一次
+        """
+        now_day = fun.datetime_to_str(datetime.datetime.now(), "%Y-%m-%d")
+        cache = self.g_xdxr_events.get((market, project_code))
+        if cache is not None and cache[0] == now_day:
+            return cache[1]
+        events = tdx_fq.xdxr_events(self.xdxr(market, project_code, code), self.tz)
+        self.g_xdxr_events[(market, project_code)] = (now_day, events)
+        return events
+
+    def xdxr_refresh_all(self, codes: List[str] = None) -> int:
         """
-        if len(xdxr_data) == 0:
-            return fq_klines
+        批量更新除权除息信息，使用连接池并发请求，并更新内存中的事件缓存
+        选股等需要获取大量代码行情的场景，先批量更新，获取行情时不需要再逐个请求
+        当天已经更新过的代码不再请求；单个代码请求失败不影响其他代码，获取行情时再单独请求
 
-        # 先处理扩缩股数据 (category==11)
-        suogu_info = copy.deepcopy(xdxr_data.query("category==11"))
-        if len(suogu_info) > 0:
-            # 处理扩缩股数据，对日期之前的行情数据进行缩股处理
-            suogu_info.loc[:, "idx_date"] = (
-                suogu_info["date"].dt.tz_localize(self.tz).dt.tz_convert("UTC")
-            )
-            suogu_info.set_index("idx_date", inplace=True)
-
-            fq_klines = fq_klines.assign(if_trade=1)
-            fq_klines.loc[:, "idx_date"] = fq_klines["date"].dt.tz_convert("UTC")
-            fq_klines.set_index("idx_date", inplace=True)
-
-            # 对每个扩缩股事件，将日期之前的行情数据除以suogu值
-            for idx, row in suogu_info.iterrows():
-                if "suogu" in row and row["suogu"] > 0:
-                    # 找到该日期之前的所有K线数据
-                    before_data = fq_klines.loc[fq_klines.index < idx]
-                    if len(before_data) > 0:
-                        # 对价格数据进行缩股处理
-                        for col in ["open", "high", "low", "close"]:
-                            if col in before_data.columns:
-                                fq_klines.loc[fq_klines.index < idx, col] = (
-                                    fq_klines.loc[fq_klines.index < idx, col]
-                                    / row["suogu"]
-                                )
-                        # 对成交量数据进行扩股处理（成交量应该乘以suogu）
-                        if "volume" in before_data.columns:
-                            fq_klines.loc[fq_klines.index < idx, "volume"] = (
-                                fq_klines.loc[fq_klines.index < idx, "volume"]
-                                * row["suogu"]
-                            )
-                        elif "vol" in before_data.columns:
-                            fq_klines.loc[fq_klines.index < idx, "vol"] = (
-                                fq_klines.loc[fq_klines.index < idx, "vol"]
-                                * row["suogu"]
-                            )
-
-            # 重置索引，准备后续处理
-            fq_klines = fq_klines.reset_index(drop=True)
-            fq_klines = fq_klines.drop(columns=["idx_date"], errors="ignore")
-
-        # 再处理除权除息数据 (category==1)
-        info = copy.deepcopy(xdxr_data.query("category==1"))
-        if len(info) == 0:
-            return fq_klines
-        info.loc[:, "idx_date"] = (
-            info["date"].dt.tz_localize(self.tz).dt.tz_convert("UTC")
+        @param codes: 需要更新的代码列表，默认为所有非指数的代码
+        @return: 更新的代码数量
+        """
+        if codes is None:
+            codes = [
+                _s["code"] for _s in self.all_stocks() if "index" not in _s["type"]
+            ]
+        now_day = fun.datetime_to_str(datetime.datetime.now(), "%Y-%m-%d")
+        stocks = []
+        for _code in codes:
+            market, tdx_code, _type = self.to_tdx_code(_code)
+            if market is None or _type is None:
+                continue
+            cache = self.g_xdxr_events.get((market, _code))
+            xdxr_file = self.xdxr_file(market, _code)
+            if (cache is not None and cache[0] == now_day) or (
+                xdxr_file.is_file()
+                and fun.timeint_to_str(int(xdxr_file.stat().st_mtime), "%Y-%m-%d")
+                == now_day
+            ):
+                continue
+            stocks.append((market, _code, tdx_code))
+
+        results = self.g_pool.map(
+            lambda _client, _s: _client.to_df(_client.get_xdxr_info(_s[0], _s[2])),
+            stocks,
+            return_exceptions=True,
         )
-        info.set_index("idx_date", inplace=True)
-
-        # 如果之前没有处理扩缩股，需要重新设置索引
-        if "idx_date" not in fq_klines.columns:
-            fq_klines = fq_klines.assign(if_trade=1)
-            fq_klines.loc[:, "idx_date"] = fq_klines["date"].dt.tz_convert("UTC")
-            fq_klines.set_index("idx_date", inplace=True)
-
-        if len(info) > 0:
-            # 有除权数据
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore", category=FutureWarning)
-                data = pd.concat(
-                    [
-                        fq_klines,
-                        info.loc[
-                            fq_klines.index[0] : fq_klines.index[-1], ["category"]
-                        ],
-                    ],
-                    axis=1,
-                )
-                data["if_trade"].fillna(value=0, inplace=True)
-                data = data.fillna(method="ffill")
-                data = pd.concat(
-                    [
-                        data,
-                        info.loc[
-                            fq_klines.index[0] : fq_klines.index[-1],
-                            ["fenhong", "peigu", "peigujia", "songzhuangu"],
-                        ],
-                    ],
-                    axis=1,
+        refresh_nums = 0
+        for (market, project_code, _), data in zip(stocks, results):
+            if isinstance(data, Exception):
+                print(f"{project_code} 获取除权除息信息异常：{data}")
+                continue
+            try:
+                data = self.save_xdxr(self.xdxr_file(market, project_code), data)
+                self.g_xdxr_events[(market, project_code)] = (
+                    now_day,
+                    tdx_fq.xdxr_events(data, self.tz),
                 )
-        else:
-            data = pd.concat(
-                [
-                    fq_klines,
-                    info.loc[
-                        :, ["category", "fenhong", "peigu", "peigujia", "songzhuangu"]
-                    ],
-                ],
-                axis=1,
-            )
-
-        # 数据补全
-        data = data.fillna(0)
-
-        # 计算前日收盘
-        data["preclose"] = (
-            data["close"].shift(1) * 10
-            - data["fenhong"]
-            + data["peigu"] * data["peigujia"]
-        ) / (10 + data["peigu"] + data["songzhuangu"])
+                refresh_nums += 1
+            except Exception as e:  # noqa: BLE001
+                print(f"{project_code} 保存除权除息信息异常：{e}")
+        return refresh_nums
 
-        # 前复权
-        if fq_type == "qfq":
-            data["adj"] = (
-                (data["preclose"].shift(-1) / data["close"]).fillna(1)[::-1].cumprod()
-            )
-            # ohlc 数据进行复权计算
-            for col in ["open", "high", "low", "close"]:
-                data[col] = round(data[col] * data["adj"], 3)
-
-        # 后复权
-        if fq_type == "hfq":
-            data["adj"] = (
-                (data["close"] / data["preclose"].shift(-1))
-                .cumprod()
-                .shift(1)
-                .fillna(1)
-            )
-            # ohlc 数据进行复权计算
-            for col in ["open", "high", "low", "close"]:
-                data[col] = round(data[col] / data["adj"], 3)
-
-        # data['volume'] = data['volume'] / data['adj'] if 'volume' in data.columns else data['vol'] / data['adj']
-
-        data = data.query("if_trade==1 and open != 0")
+    def klines_fq(self, fq_klines: pd.DataFrame, xdxr_data, fq_type: str):
+        """
+        对行情进行复权处理
 
-        return data[["code", "date", "open", "close", "high", "low", "volume"]]
+        @param xdxr_data: 除权除息事件数组（xdxr_events），或者除权除息信息（xdxr）
+        """
+        if isinstance(xdxr_data, pd.DataFrame):
+            xdxr_data = tdx_fq.xdxr_events(xdxr_data, self.tz)
+        return tdx_fq.klines_fq(fq_klines, xdxr_data, fq_type)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+"""
+通达信行情的复权计算
+
+除权除息数据按照代码解析一次，得到按日期排序的扩缩股与除权除息事件数组；
+复权时通过 searchsorted 找到每根K线之后（或之前）的事件，使用累积的复权因子一次性相乘，
+不需要将除权数据与K线合并后再逐行计算
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _dates_to_ns(dates, tz=None) -> np.ndarray:
+    """
+    时间转换成 UTC 纳秒时间戳，没有时区的时间按照 tz 时区处理
+    """
+    idx = pd.DatetimeIndex(dates)
+    if idx.tz is None:
+        idx = idx.tz_localize(tz)
+    return idx.tz_convert("UTC").as_unit("ns").asi8
+
+
+def xdxr_events(xdxr_data: pd.DataFrame, tz) -> dict:
+    """
+    解析除权除息数据，返回扩缩股（category==11）与除权除息（category==1）事件的数组
+
+    @param xdxr_data: ExchangeTDX.xdxr 返回的除权除息数据
+    @param tz: 除权除息日期的时区
+    """
+    events = {
+        "has_xdxr": len(xdxr_data) > 0,
+        "suogu_dates": np.array([], dtype=np.int64),
+        "suogu": np.array([], dtype=float),
+        "has_dividend": False,
+        "dividend_dates": np.array([], dtype=np.int64),
+    }
+    for _col in ["fenhong", "peigu", "peigujia", "songzhuangu"]:
+        events[_col] = np.array([], dtype=float)
+    if len(xdxr_data) == 0:
+        return events
+
+    suogu_info = xdxr_data[xdxr_data["category"] == 11]
+    if len(suogu_info) > 0 and "suogu" in suogu_info.columns:
+        suogu_info = suogu_info[suogu_info["suogu"] > 0].sort_values("date")
+        events["suogu_dates"] = _dates_to_ns(suogu_info["date"], tz)
+        events["suogu"] = suogu_info["suogu"].to_numpy(dtype=float)
+
+    info = xdxr_data[xdxr_data["category"] == 1].sort_values("date")
+    events["has_dividend"] = len(info) > 0
+    if len(info) > 0:
+        events["dividend_dates"] = _dates_to_ns(info["date"], tz)
+        for _col in ["fenhong", "peigu", "peigujia", "songzhuangu"]:
+            events[_col] = info[_col].fillna(0).to_numpy(dtype=float)
+    return events
+
+
+def _suffix_cumprod(values: np.ndarray) -> np.ndarray:
+    """
+    后缀累乘，结果比 values 多一个元素：out[i] = values[i] * values[i+1] * ... ，out[-1] = 1
+    """
+    return np.append(np.cumprod(values[::-1])[::-1], 1.0)
+
+
+def klines_fq(klines: pd.DataFrame, events: dict, fq_type: str) -> pd.DataFrame:
+    """
+    对K线进行复权处理
+
+    先处理扩缩股：事件日期之前的K线，价格除以缩股比例，成交量乘以缩股比例；
+    再处理除权除息：每个K线范围内的除权事件，按照事件前最后一根K线的收盘价计算复权因子，
+    前复权将事件之前的K线乘以之后所有事件的因子，后复权将事件之后的K线乘以之前所有事件的因子
+
+    @param klines: K线数据（date 为有时区的时间）
+    @param events: xdxr_events 返回的事件数组
+    @param fq_type: qfq 前复权 / hfq 后复权
+    """
+    if not events["has_xdxr"] or len(klines) == 0:
+        return klines
+
+    klines = klines.copy()
+    k_dates = _dates_to_ns(klines["date"])
+
+    # 扩缩股，K线时间小于事件时间的，使用之后所有事件的缩股比例
+    if len(events["suogu"]) > 0:
+        suogu = _suffix_cumprod(events["suogu"])[
+            np.searchsorted(events["suogu_dates"], k_dates, side="right")
+        ]
+        for _col in ["open", "high", "low", "close"]:
+            klines[_col] = klines[_col].to_numpy(dtype=float) / suogu
+        vol_col = "volume" if "volume" in klines.columns else "vol"
+        if vol_col in klines.columns:
+            klines[vol_col] = klines[vol_col].to_numpy(dtype=float) * suogu
+
+    if not events["has_dividend"]:
+        return klines
+
+    # 只处理K线时间范围内的除权事件，与第一根K线时间相同的事件之前没有K线，不处理
+    dividend_dates = events["dividend_dates"]
+    start = np.searchsorted(dividend_dates, k_dates[0], side="right")
+    end = np.searchsorted(dividend_dates, k_dates[-1], side="right")
+    dividend_dates = dividend_dates[start:end]
+
+    factors = np.array([], dtype=float)
+    if len(dividend_dates) > 0:
+        closes = klines["close"].to_numpy(dtype=float)
+        # 事件之前最后一根K线的收盘价
+        pre_close = closes[np.searchsorted(k_dates, dividend_dates, side="left") - 1]
+        fenhong = events["fenhong"][start:end]
+        peigu = events["peigu"][start:end]
+        peigujia = events["peigujia"][start:end]
+        songzhuangu = events["songzhuangu"][start:end]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factors = (pre_close * 10 - fenhong + peigu * peigujia) / (
+                (10 + peigu + songzhuangu) * pre_close
+            )
+        factors = np.where(np.isfinite(factors), factors, 1.0)
+
+    # 每根K线之后的第一个事件位置
+    k_pos = np.searchsorted(dividend_dates, k_dates, side="right")
+    if fq_type == "qfq":
+        adj = _suffix_cumprod(factors)[k_pos]
+    elif fq_type == "hfq":
+        adj = np.append(1.0, np.cumprod(factors))[k_pos]
+    else:
+        adj = None
+    if adj is not None:
+        for _col in ["open", "high", "low", "close"]:
+            klines[_col] = np.round(klines[_col].to_numpy(dtype=float) * adj, 3)
+
+    return klines[klines["open"] != 0]
@@ -0,0 +1,185 @@
+"""
+通达信行情服务器的连接池
+
+保持到多个服务器的长连接，请求时取出一个空闲的连接，用完后放回，不需要每次请求都重新建立连接；
+空闲超过一定时间的连接，取出时先进行检查，不可用则重新连接；请求中出现异常的连接直接关闭，不再放回。
+
+通过 map 方法，可以使用多个连接并发请求（比如同时获取多页K线数据）
+"""
+
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class TdxConnectionPool:
+    """
+    通达信连接池
+    """
+
+    def __init__(
+        self,
+        api_factory: Callable[[], object],
+        servers: list[dict],
+        size: int = 4,
+        health_check: Callable[[object], bool] | None = None,
+        check_idle_seconds: float = 30,
+        on_connect_error: Callable[[dict, Exception], None] | None = None,
+    ):
+        """
+        @param api_factory: 创建 api 对象的方法（比如 TdxHq_API），对象需要有 connect(ip, port) 与 disconnect() 方法
+        @param servers: 服务器列表 [{"ip": "", "port": 7709}]，按照优先级排序，新建连接时轮流使用
+        @param size: 最大连接数量
+        @param health_check: 检查连接是否可用的方法，返回 False 或者抛出异常则重新连接
+        @param check_idle_seconds: 空闲超过该时间的连接，使用前需要进行检查
+        @param on_connect_error: 连接服务器失败的回调 on_connect_error(服务器, 异常)
+        """
+        self.api_factory = api_factory
+        self.servers = list(servers)
+        self.size = size
+        self.health_check = health_check
+        self.check_idle_seconds = check_idle_seconds
+        self.on_connect_error = on_connect_error
+
+        # 空闲的连接 (api, 服务器, 最后使用时间)，后放回的先取出，保持常用的连接活跃
+        self.idle: deque[tuple[object, dict, float]] = deque()
+        self.semaphore = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.server_index = 0
+        self.executor: ThreadPoolExecutor | None = None
+
+        # 统计信息
+        self.stats = {"connects": 0, "reuses": 0, "discards": 0, "check_fails": 0}
+
+    def set_servers(self, servers: list[dict]):
+        """
+        更换服务器列表，并关闭现有的空闲连接
+        """
+        with self.lock:
+            self.servers = list(servers)
+            self.server_index = 0
+            idle = list(self.idle)
+            self.idle.clear()
+        for _api, _, _ in idle:
+            self._close(_api)
+
+    @contextmanager
+    def connection(self):
+        """
+        获取一个连接，使用完成后自动放回连接池，使用中出现异常的连接会被关闭
+        """
+        self.semaphore.acquire()
+        try:
+            api, server = self._get()
+            try:
+                yield api
+            except BaseException:
+                self._discard(api)
+                raise
+            with self.lock:
+                self.idle.append((api, server, time.time()))
+        finally:
+            self.semaphore.release()
+
+    def map(
+        self,
+        func: Callable[[object, object], object],
+        items: Iterable,
+        return_exceptions: bool = False,
+    ) -> list:
+        """
+        使用多个连接并发执行，返回的结果与 items 的顺序一致
+
+        @param func: 执行的方法 func(api, item)
+        @param items: 参数列表
+        @param return_exceptions: 是否将执行异常作为结果返回（不影响其他参数的执行），False 直接抛出异常
+        """
+        items = list(items)
+
+        def run(_item):
+            try:
+                with self.connection() as _api:
+                    return func(_api, _item)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        if len(items) <= 1:
+            return [run(_item) for _item in items]
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix="tdx_pool"
+                )
+        return list(self.executor.map(run, items))
+
+    def close(self):
+        """
+        关闭所有空闲的连接
+        """
+        self.set_servers(self.servers)
+
+    def _get(self) -> tuple[object, dict]:
+        while True:
+            with self.lock:
+                if len(self.idle) == 0:
+                    break
+                api, server, last_time = self.idle.pop()
+            if (
+                self.health_check is not None
+                and time.time() - last_time > self.check_idle_seconds
+            ):
+                try:
+                    ok = self.health_check(api)
+                except Exception:  # noqa: BLE001
+                    ok = False
+                if not ok:
+                    self.stats["check_fails"] += 1
+                    self._discard(api)
+                    continue
+            self.stats["reuses"] += 1
+            return api, server
+        return self._connect()
+
+    def _connect(self) -> tuple[object, dict]:
+        """
+        新建连接，从下一个服务器开始依次尝试，所有服务器都连接失败，抛出最后的异常
+        """
+        with self.lock:
+            servers = self.servers
+            start_index = self.server_index
+            self.server_index += 1
+        if len(servers) == 0:
+            raise ConnectionError("没有可用的通达信服务器")
+        error = None
+        for _i in range(len(servers)):
+            server = servers[(start_index + _i) % len(servers)]
+            api = self.api_factory()
+            try:
+                if api.connect(server["ip"], server["port"]) is False:
+                    raise ConnectionError(f"连接通达信服务器失败 {server}")
+            except Exception as e:  # noqa: BLE001
+                error = e
+                self._close(api)
+                if self.on_connect_error is not None:
+                    self.on_connect_error(server, e)
+                continue
+            self.stats["connects"] += 1
+            return api, server
+        raise error
+
+    def _discard(self, api):
+        self.stats["discards"] += 1
+        self._close(api)
+
+    @staticmethod
+    def _close(api):
+        try:
+            api.disconnect()
+        except Exception:  # noqa: BLE001, S110
+            pass
@@ -0,0 +1,192 @@
+"""
+通达信行情服务器的延迟跟踪
+
+后台定时并发 ping 所有服务器，记录每个服务器延迟与失败率的指数加权移动平均（EWMA），
+按照得分（延迟 + 失败率 * 惩罚时间）排序，返回最优的服务器列表；
+使用中连接失败的服务器通过 report_error 立即降低排名，下次连接自动使用其他服务器。
+
+统计结果保存在 db 缓存中，重启后直接使用之前的排名，不需要重新 ping 所有服务器
+"""
+
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from chanlun.db import db
+
+
+class TdxServerTracker:
+    """
+    通达信服务器延迟跟踪
+    """
+
+    def __init__(
+        self,
+        servers: list[dict],
+        ping: Callable[[dict], float | None],
+        cache_key: str | None = None,
+        probe_seconds: float = 300,
+        alpha: float = 0.3,
+        fail_penalty: float = 10,
+        workers: int = 16,
+        on_probe: Callable[[list[dict]], None] | None = None,
+    ):
+        """
+        @param servers: 服务器列表 [{"ip": "", "port": 7709}]
+        @param ping: ping 服务器的方法，返回延迟的秒数，失败返回 None 或者抛出异常
+        @param cache_key: 保存统计结果的 db 缓存 key，None 不进行保存
+        @param probe_seconds: 后台 ping 的间隔时间（秒）
+        @param alpha: EWMA 的权重，越大越看重最近的结果
+        @param fail_penalty: 失败率的惩罚时间（秒），得分 = 延迟 + 失败率 * 惩罚时间
+        @param workers: 并发 ping 的线程数量
+        @param on_probe: 每次 ping 完成后的回调，参数为排序后的服务器列表
+        """
+        self.servers = [{"ip": _s["ip"], "port": int(_s["port"])} for _s in servers]
+        self.ping = ping
+        self.cache_key = cache_key
+        self.probe_seconds = probe_seconds
+        self.alpha = alpha
+        self.fail_penalty = fail_penalty
+        self.workers = workers
+        self.on_probe = on_probe
+
+        # 服务器的统计信息 {ip:port: {latency, error, probes, fails, last_time}}
+        self.scores: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+        self.load()
+
+    @staticmethod
+    def server_key(server: dict) -> str:
+        return f"{server['ip']}:{int(server['port'])}"
+
+    def load(self):
+        """
+        从 db 缓存中读取之前的统计结果，只保留当前服务器列表中的服务器
+        """
+        if self.cache_key is None:
+            return
+        cache = db.cache_get(self.cache_key) or {}
+        keys = {self.server_key(_s) for _s in self.servers}
+        with self.lock:
+            self.scores = {_k: _v for _k, _v in cache.items() if _k in keys}
+
+    def save(self):
+        if self.cache_key is None:
+            return
+        with self.lock:
+            scores = {_k: dict(_v) for _k, _v in self.scores.items()}
+        db.cache_set(self.cache_key, scores)
+
+    def update(self, server: dict, latency: float | None):
+        """
+        记录一次 ping 或请求的结果
+
+        @param latency: 延迟的秒数，None 表示失败
+        """
+        key = self.server_key(server)
+        with self.lock:
+            score = self.scores.get(key)
+            if score is None:
+                score = {
+                    "latency": latency,
+                    "error": 0.0 if latency is not None else 1.0,
+                    "probes": 0,
+                    "fails": 0,
+                    "last_time": 0,
+                }
+                self.scores[key] = score
+            else:
+                if latency is not None:
+                    score["latency"] = (
+                        latency
+                        if score["latency"] is None
+                        else self.alpha * latency + (1 - self.alpha) * score["latency"]
+                    )
+                score["error"] = self.alpha * (latency is None) + (
+                    1 - self.alpha
+                ) * float(score["error"])
+            score["probes"] += 1
+            score["fails"] += latency is None
+            score["last_time"] = int(time.time())
+
+    def report_error(self, server: dict):
+        """
+        使用中连接服务器失败，立即记录失败，降低排名
+        """
+        self.update(server, None)
+
+    def score(self, server: dict) -> float:
+        """
+        服务器的得分，越小越好；没有统计过的服务器，按照失败率 0.5 计算，排在正常服务器的后面
+        """
+        with self.lock:
+            score = self.scores.get(self.server_key(server))
+        if score is None:
+            return self.fail_penalty * 0.5
+        latency = self.fail_penalty if score["latency"] is None else score["latency"]
+        return latency + float(score["error"]) * self.fail_penalty
+
+    def ranked(self, nums: int | None = None) -> list[dict]:
+        """
+        按照得分排序的服务器列表
+
+        @param nums: 返回的数量，None 返回全部
+        """
+        servers = sorted(self.servers, key=self.score)
+        return servers if nums is None else servers[:nums]
+
+    def has_scores(self) -> bool:
+        with self.lock:
+            return len(self.scores) > 0
+
+    def probe(self) -> list[dict]:
+        """
+        并发 ping 所有的服务器，更新统计并保存，返回排序后的服务器列表
+        """
+
+        def ping_server(_server):
+            try:
+                latency = self.ping(_server)
+            except Exception:  # noqa: BLE001
+                latency = None
+            self.update(_server, latency)
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.workers, len(self.servers))),
+            thread_name_prefix="tdx_probe",
+        ) as executor:
+            list(executor.map(ping_server, self.servers))
+
+        self.save()
+        ranked = self.ranked()
+        if self.on_probe is not None:
+            self.on_probe(ranked)
+        return ranked
+
+    def start(self):
+        """
+        启动后台定时 ping 的线程，重复调用只启动一次
+        """
+        if self.probe_seconds <= 0 or (
+            self.thread is not None and self.thread.is_alive()
+        ):
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._run, name="tdx_server_tracker", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.wait(self.probe_seconds):
+            try:
+                self.probe()
+            except Exception as e:  # noqa: BLE001
+                print(f"通达信服务器 ping 异常：{e}")
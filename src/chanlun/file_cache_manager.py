@@ -0,0 +1,309 @@
+"""
+文件缓存管理
+
+记录缓存文件（缠论对象缓存、通达信K线缓存等）的大小与最后访问时间，保存在 sqlite 索引文件中，
+后台线程定时将访问记录写入索引，并删除超过保存天数的文件，总大小超过限制时，按照最久未访问的顺序删除文件；
+请求中只在内存中记录访问信息，不需要遍历缓存目录。
+
+后台清理线程需要在主进程（比如 web 服务）中显式调用 start 启动，其他进程（回测、选股等子进程）只记录访问信息，
+按照清理间隔将访问记录写入索引，由主进程统一清理，避免多个进程同时扫描与删除缓存文件。
+
+同时记录各类缓存的 命中/未命中/淘汰 次数，可以通过 stats() 查看，用于调整缓存的大小设置
+"""
+
+import atexit
+import pathlib
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from chanlun import config
+from chanlun.config import get_data_path
+
+
+class FileCacheManager:
+    """
+    文件缓存管理
+    """
+
+    def __init__(
+        self,
+        index_file: str | pathlib.Path,
+        max_bytes: int,
+        max_age_seconds: int,
+        clean_seconds: int = 600,
+    ):
+        """
+        @param index_file: 索引文件路径
+        @param max_bytes: 所有缓存文件的总大小限制
+        @param max_age_seconds: 超过该时间未访问的文件会被删除
+        @param clean_seconds: 后台线程清理的间隔
+        """
+        self.index_file = pathlib.Path(index_file)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.clean_seconds = clean_seconds
+
+        # 需要管理的缓存目录 {目录: (缓存类型, 文件匹配规则)}，第一次清理时扫描已存在的文件加入索引
+        self.roots: dict[pathlib.Path, tuple[str, str]] = {}
+        # 等待写入索引的访问记录 {文件: (缓存类型, 文件大小（None 表示没有变化）, 访问时间)}
+        self.pending: dict[str, tuple[str, int | None, float]] = {}
+        # 等待从索引中删除的文件
+        self.pending_removes: set[str] = set()
+        # 各类缓存的计数器 {缓存类型: {计数名称: 次数}}
+        self.counters: dict[str, dict[str, int]] = {}
+        # 最后一次清理后的索引信息
+        self.total_files = 0
+        self.total_bytes = 0
+        # 上次将访问记录写入索引的时间
+        self.last_flush_time = time.time()
+
+        self.lock = threading.Lock()
+        self.clean_lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.stop_event = threading.Event()
+
+    def watch(self, root: pathlib.Path, kind: str, pattern: str = "*/*.*"):
+        """
+        添加需要管理的缓存目录
+        """
+        with self.lock:
+            self.roots[pathlib.Path(root)] = (kind, pattern)
+
+    def start(self):
+        """
+        启动后台清理线程（已经启动则跳过）
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(
+                target=self._run, name="file_cache_manager", daemon=True
+            )
+            self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        停止后台线程，并将未写入的访问记录写入索引
+        """
+        self.stop_event.set()
+        try:
+            self.flush()
+        except Exception:  # noqa: BLE001, S110
+            pass
+
+    def hit(self, kind: str, file: pathlib.Path | str | None = None):
+        """
+        记录缓存命中，file 不为空则同时更新文件的访问时间
+        """
+        self.incr(kind, "hits")
+        if file is not None:
+            with self.lock:
+                _, size, _ = self.pending.get(str(file), (kind, None, 0))
+                self.pending[str(file)] = (kind, size, time.time())
+            self._maybe_flush()
+
+    def miss(self, kind: str):
+        """
+        记录缓存未命中
+        """
+        self.incr(kind, "misses")
+
+    def write(self, kind: str, file: pathlib.Path | str, size: int | None = None):
+        """
+        记录缓存文件的写入（更新文件大小与访问时间）
+        """
+        if size is None:
+            try:
+                size = pathlib.Path(file).stat().st_size
+            except OSError:
+                return
+        self.incr(kind, "writes")
+        with self.lock:
+            self.pending[str(file)] = (kind, size, time.time())
+            self.pending_removes.discard(str(file))
+        self._maybe_flush()
+
+    def remove(self, file: pathlib.Path | str):
+        """
+        缓存文件已经被删除，从索引中移除
+        """
+        with self.lock:
+            self.pending.pop(str(file), None)
+            self.pending_removes.add(str(file))
+        self._maybe_flush()
+
+    def incr(self, kind: str, name: str, nums: int = 1):
+        with self.lock:
+            counter = self.counters.setdefault(kind, {})
+            counter[name] = counter.get(name, 0) + nums
+
+    def stats(self) -> dict:
+        """
+        缓存的统计信息
+        """
+        with self.lock:
+            counters = {_k: dict(_v) for _k, _v in self.counters.items()}
+        for _c in counters.values():
+            _total = _c.get("hits", 0) + _c.get("misses", 0)
+            _c["hit_rate"] = round(_c.get("hits", 0) / _total, 4) if _total else None
+        return {
+            "files": self.total_files,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "counters": counters,
+        }
+
+    def flush(self):
+        """
+        将内存中的访问记录写入索引
+        """
+        with self.lock:
+            pending = self.pending
+            removes = self.pending_removes
+            self.pending = {}
+            self.pending_removes = set()
+            self.last_flush_time = time.time()
+        if len(pending) == 0 and len(removes) == 0:
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO cache_files (path, kind, size, atime) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET kind = excluded.kind, "
+                "size = COALESCE(excluded.size, cache_files.size), atime = excluded.atime",
+                [(_f, _k, _s, _t) for _f, (_k, _s, _t) in pending.items()],
+            )
+            conn.executemany(
+                "DELETE FROM cache_files WHERE path = ?", [(_f,) for _f in removes]
+            )
+
+    def _maybe_flush(self):
+        """
+        没有启动后台线程的进程，超过清理间隔后将访问记录写入索引（只写入，不清理）
+        """
+        if self.thread is not None or (
+            time.time() - self.last_flush_time < self.clean_seconds
+        ):
+            return
+        try:
+            self.flush()
+        except Exception as e:  # noqa: BLE001
+            print(f"缓存文件访问记录写入异常 - {e}")
+
+    def clean(self) -> int:
+        """
+        写入访问记录，并删除过期以及超过总大小限制的文件
+
+        @return: 删除的文件数量
+        """
+        with self.clean_lock:
+            self._scan_roots()
+            self.flush()
+            evict_rows = []
+            with closing(self._connect()) as conn, conn:
+                # 访问记录中没有大小的（比如只有命中记录，文件不是通过 write 写入的），获取文件大小
+                for _path, _kind in conn.execute(
+                    "SELECT path, kind FROM cache_files WHERE size IS NULL"
+                ).fetchall():
+                    try:
+                        _size = pathlib.Path(_path).stat().st_size
+                        conn.execute(
+                            "UPDATE cache_files SET size = ? WHERE path = ?",
+                            (_size, _path),
+                        )
+                    except OSError:
+                        conn.execute("DELETE FROM cache_files WHERE path = ?", (_path,))
+
+                evict_rows += conn.execute(
+                    "SELECT path, kind, size FROM cache_files WHERE atime < ?",
+                    (time.time() - self.max_age_seconds,),
+                ).fetchall()
+                total_bytes = conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM cache_files WHERE atime >= ?",
+                    (time.time() - self.max_age_seconds,),
+                ).fetchone()[0]
+                if total_bytes > self.max_bytes:
+                    for _path, _kind, _size in conn.execute(
+                        "SELECT path, kind, size FROM cache_files WHERE atime >= ? ORDER BY atime",
+                        (time.time() - self.max_age_seconds,),
+                    ):
+                        if total_bytes <= self.max_bytes:
+                            break
+                        evict_rows.append((_path, _kind, _size))
+                        total_bytes -= _size
+
+                for _path, _kind, _size in evict_rows:
+                    try:
+                        pathlib.Path(_path).unlink(missing_ok=True)
+                    except OSError:
+                        # 文件正在使用（windows 下无法删除打开的文件），下次再删除
+                        continue
+                    conn.execute("DELETE FROM cache_files WHERE path = ?", (_path,))
+                    self.incr(_kind, "evictions")
+                    self.incr(_kind, "evicted_bytes", _size)
+
+                self.total_files, self.total_bytes = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_files"
+                ).fetchone()
+            return len(evict_rows)
+
+    def _run(self):
+        while True:
+            try:
+                self.clean()
+            except Exception as e:  # noqa: BLE001
+                print(f"缓存文件清理异常 - {e}")
+            if self.stop_event.wait(self.clean_seconds):
+                break
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.index_file, timeout=30)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_files "
+            "(path TEXT PRIMARY KEY, kind TEXT, size INTEGER, atime REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_atime ON cache_files (atime)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_roots (root TEXT PRIMARY KEY, scan_time REAL)"
+        )
+        return conn
+
+    def _scan_roots(self):
+        """
+        扫描还未加入索引的缓存目录，将已存在的文件加入索引（使用文件的修改时间作为访问时间）
+        """
+        with self.lock:
+            roots = dict(self.roots)
+        with closing(self._connect()) as conn, conn:
+            scanned = {
+                _r for (_r,) in conn.execute("SELECT root FROM cache_roots").fetchall()
+            }
+            for _root, (_kind, _pattern) in roots.items():
+                if str(_root) in scanned:
+                    continue
+                rows = []
+                for _f in _root.glob(_pattern):
+                    try:
+                        _stat = _f.stat()
+                    except OSError:
+                        continue
+                    rows.append((str(_f), _kind, _stat.st_size, _stat.st_mtime))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO cache_files (path, kind, size, atime) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_roots (root, scan_time) VALUES (?, ?)",
+                    (str(_root), time.time()),
+                )
+
+
+cache_manager = FileCacheManager(
+    get_data_path() / "cache_index.db",
+    max_bytes=int(getattr(config, "FILE_CACHE_MAX_MB", 4096)) * 1024 * 1024,
+    max_age_seconds=int(getattr(config, "FILE_CACHE_MAX_DAYS", 15)) * 24 * 60 * 60,
+    clean_seconds=int(getattr(config, "FILE_CACHE_CLEAN_SECONDS", 600)),
+)
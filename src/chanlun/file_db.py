@@ -1,20 +1,26 @@
+import atexit
 import datetime
 import hashlib
 import pathlib
 import pickle
-import random
+import threading
 import time
-from decimal import Decimal
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
 
 import pandas as pd
 import pytz
 
-from chanlun import cl, fun
+from chanlun import cl, cl_serialize, config, fun
 from chanlun.base import Market
 from chanlun.cl_interface import ICL, Config
 from chanlun.config import get_data_path
 from chanlun.db import db
+from chanlun.file_cache_manager import cache_manager
 from chanlun.exchange import Exchange
+from chanlun.klines_file import KlinesBinFile
+from chanlun.klines_fingerprint import KlinesFingerprint
 from chanlun.tools.klines_tool import klines_to_heikin_ashi_klines
 
 
@@ -98,6 +104,31 @@ class FileCacheDB:
             "idx_macd_signal",
         ]
 
+        # 内存中缓存的缠论数据对象（LRU），key 为缓存文件路径（包含 市场/代码/周期/配置），按照占用的内存大小淘汰
+        # 修改后不会立即写入文件，在淘汰、超过保存间隔或进程退出时才写入
+        self.cl_cache_max_bytes = (
+            int(getattr(config, "WEB_CL_CACHE_MB", 512)) * 1024 * 1024
+        )
+        self.cl_cache_save_seconds = int(
+            getattr(config, "WEB_CL_CACHE_SAVE_SECONDS", 300)
+        )
+        self.cl_cache: OrderedDict[str, dict] = OrderedDict()
+        self.cl_cache_bytes = 0
+        # 每根K线序列化后（未压缩）的大约字节数，用于估算缠论对象占用的内存，每次写入文件时更新
+        self.cl_cache_kline_bytes = 2048
+        # 缠论对象缓存文件的压缩方式（None / zlib / zstd / lz4），见 cl_serialize
+        self.cl_data_compress = getattr(config, "CL_DATA_COMPRESS", "") or None
+        self.cl_cache_lock = threading.Lock()
+        # 同一个缠论对象同时只能有一个线程进行计算或读取，按照 key 分段加锁（可重入，读取时可以再调用计算）
+        self.cl_data_locks = [threading.RLock() for _ in range(64)]
+        atexit.register(self.save_cache_cl_data)
+
+        # 缓存文件的管理（按照总大小与最后访问时间，在后台线程中清理），见 file_cache_manager
+        # 后台清理线程由主进程（web 服务）启动，这里只记录访问信息
+        self.cache_manager = cache_manager
+        self.cache_manager.watch(self.cl_data_path, "cl_data")
+        self.cache_manager.watch(self.klines_path, "tdx_klines")
+
         # 缠论的更新时间，如果与当前保存不一致，需要清空缓存的计算结果，重新计算
         self.cl_update_date = "2025-06-15"
         cache_cl_update_date = db.cache_get("__cl_update_date")
@@ -111,40 +142,61 @@ class FileCacheDB:
         """
         获取缓存在文件中的股票数据
         """
-        file_pathname = (
-            self.klines_path / market / f"{code.replace('.', '_')}_{frequency}.csv"
-        )
-        if file_pathname.is_file() is False:
-            return None
-        try:
-            _klines = pd.read_csv(file_pathname)
-        except Exception:  # noqa: BLE001
-            file_pathname.unlink()
-            return None
+        klines_file = self._tdx_klines_file(market, code, frequency)
+        bin_file = KlinesBinFile(klines_file)
+        _klines = bin_file.read()
+        if _klines is None:
+            # 之前保存的 csv 文件，读取后转换成二进制文件
+            _klines = self._migrate_tdx_csv_klines(market, code, frequency, bin_file)
+            if _klines is None:
+                self.cache_manager.miss("tdx_klines")
+                return None
+        self.cache_manager.hit("tdx_klines", klines_file)
         if len(_klines) > 0:
-            _klines["date"] = pd.to_datetime(_klines["date"])
             # 如果 date 有 Nan 则返回 None
             if _klines["date"].isnull().any():
                 return None
             # 不返回最后一行
             _klines = _klines.iloc[0:-1:]
 
-        # 加一个随机概率，去清理历史的缓存，避免太多占用空间
-        if random.randint(0, 1000) <= 5:
-            self.clear_tdx_old_klines(market)
         return _klines
 
     def save_tdx_klines(
         self, market: str, code: str, frequency: str, kline: pd.DataFrame
     ):
         """
-        保存通达信k线数据对象到文件中
+        保存通达信k线数据对象到文件中（与文件中相同的K线不会重写，只追加新的K线）
         """
-        file_pathname = (
+        klines_file = self._tdx_klines_file(market, code, frequency)
+        KlinesBinFile(klines_file).write(kline)
+        self.cache_manager.write("tdx_klines", klines_file)
+        return True
+
+    def _tdx_klines_file(self, market: str, code: str, frequency: str) -> pathlib.Path:
+        return self.klines_path / market / f"{code.replace('.', '_')}_{frequency}.kbin"
+
+    def _migrate_tdx_csv_klines(
+        self, market: str, code: str, frequency: str, bin_file: KlinesBinFile
+    ) -> None | pd.DataFrame:
+        """
+        读取之前保存的 csv 格式缓存，保存成二进制文件，并删除 csv 文件
+        """
+        csv_file = (
             self.klines_path / market / f"{code.replace('.', '_')}_{frequency}.csv"
         )
-        kline.to_csv(file_pathname, index=False)
-        return True
+        if csv_file.is_file() is False:
+            return None
+        try:
+            _klines = pd.read_csv(csv_file)
+            _klines["date"] = pd.to_datetime(_klines["date"])
+        except Exception:  # noqa: BLE001
+            csv_file.unlink()
+            return None
+        bin_file.write(_klines)
+        csv_file.unlink()
+        self.cache_manager.remove(csv_file)
+        self.cache_manager.write("tdx_klines", bin_file.file)
+        return _klines
 
     def clear_tdx_old_klines(self, market):
         """
@@ -153,7 +205,7 @@ class FileCacheDB:
         del_lt_times = fun.datetime_to_int(datetime.datetime.now()) - (  # noqa: DTZ005
             15 * 24 * 60 * 60
         )
-        for filename in (self.klines_path / market).glob("*.csv"):
+        for filename in (self.klines_path / market).glob("*.*"):
             try:
                 if filename.stat().st_mtime < del_lt_times:
                     filename.unlink()
@@ -161,6 +213,49 @@ class FileCacheDB:
                 pass
         return True
 
+    def web_cl_data_file(
+        self, market: str, code: str, frequency: str, cl_config: dict
+    ) -> pathlib.Path:
+        """
+        web缓存的缠论数据对象的缓存文件（文件路径也是内存缓存的 key）
+        """
+        unique_md5_str = (
+            f"{[f'{k}:{v}' for k, v in cl_config.items() if k in self.config_keys]}"
+        )
+        key = hashlib.md5(unique_md5_str.encode("UTF-8")).hexdigest()
+
+        return (
+            self.cl_data_path
+            / market
+            / f"{market}_{code.replace('/', '_').replace('.', '_')}_{frequency}_{key}.pkl"
+        )
+
+    @contextmanager
+    def web_cl_data(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        cl_config: dict,
+        klines: pd.DataFrame,
+    ) -> Iterator[ICL]:
+        """
+        获取web缓存的缠论数据对象，在 with 代码块中持有对象的计算锁，其他线程不能同时更新这个对象
+        多线程使用（web 请求、后台预热）时，读取或转换缠论对象的数据需要在 with 代码块中进行
+        """
+        cache_key = str(self.web_cl_data_file(market, code, frequency, cl_config))
+        evict_items = []
+        try:
+            with self.cl_data_locks[hash(cache_key) % len(self.cl_data_locks)]:
+                cd, evict_items = self._get_web_cl_data(
+                    market, code, frequency, cl_config, klines
+                )
+                yield cd
+        finally:
+            # 被淘汰的对象，有修改的写入到文件中（需要在释放当前对象的锁之后，避免同时持有多个锁）
+            for _key, _item in evict_items:
+                self.save_cache_cl_data(_key, _item)
+
     def get_web_cl_data(
         self,
         market: str,
@@ -171,120 +266,207 @@ class FileCacheDB:
     ) -> ICL:
         """
         获取web缓存的的缠论数据对象
+        内存缓存中的对象会被其他线程（web 请求、后台预热）继续增量计算，这里返回在持有锁的情况下复制的对象，调用方可以随意读取；
+        只需要更新缓存，或者在锁内读取共用对象的，使用 web_cl_data 可以省去复制的开销
         """
-        unique_md5_str = (
-            f"{[f'{k}:{v}' for k, v in cl_config.items() if k in self.config_keys]}"
-        )
-        key = hashlib.md5(unique_md5_str.encode("UTF-8")).hexdigest()
+        with self.web_cl_data(market, code, frequency, cl_config, klines) as cd:
+            return cl_serialize.loads(cl_serialize.dumps(cd))
 
-        file_pathname = (
-            self.cl_data_path
-            / market
-            / f"{market}_{code.replace('/', '_').replace('.', '_')}_{frequency}_{key}.pkl"
-        )
-        cd: ICL = cl.CL(code, frequency, cl_config)
+    def _get_web_cl_data(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        cl_config: dict,
+        klines: pd.DataFrame,
+    ) -> tuple[ICL, list]:
+        """
+        计算缓存的缠论数据对象，返回对象与被淘汰的缓存对象列表（由调用方在释放锁之后写入文件）
+        """
+        file_pathname = self.web_cl_data_file(market, code, frequency, cl_config)
+        cache_key = str(file_pathname)
         # 如果K线类型是平均K线，则对k线进行转换
         if cl_config.get("kline_type") == Config.KLINE_TYPE_HEIKIN_ASHI.value:
             klines = klines_to_heikin_ashi_klines(klines)
-        try:
-            if file_pathname.is_file():
-                # print(f'{market}-{code}-{frequency} {key} K-Nums {len(klines)} 使用缓存')
-                try_num = 0
-                while True:
-                    try:
-                        with open(file_pathname, "rb") as fp:
-                            cd = pickle.load(fp)
-                        break
-                    except Exception as e:
-                        try_num += 1
-                        time.sleep(0.5)
-                        if try_num > 5:
-                            raise e
-                # 判断缓存中的最后k线是否大于给定的最新一根k线时间，如果小于说明直接有断档，不连续，重新全量重新计算
-                if (
-                    len(cd.get_src_klines()) > 0
-                    and len(klines) > 0
-                    and (
-                        cd.get_src_klines()[-1].date < klines.iloc[0]["date"]
-                        or cd.get_src_klines()[0].date > klines.iloc[0]["date"]
-                    )
-                ):
+        with self.cl_data_locks[hash(cache_key) % len(self.cl_data_locks)]:
+            cd: ICL | None = None
+            fingerprint: KlinesFingerprint | None = None
+            klines_fingerprint = KlinesFingerprint.from_klines(klines)
+            try:
+                # 优先使用内存中的缓存对象，没有再读取缓存文件
+                cd, fingerprint = self.get_cache_cl_data(cache_key)
+                if cd is not None:
+                    self.cache_manager.hit("cl_data", file_pathname)
+                    self.cache_manager.incr("cl_data", "memory_hits")
+                elif file_pathname.is_file():
+                    self.cache_manager.hit("cl_data", file_pathname)
+                    # print(f'{market}-{code}-{frequency} {key} K-Nums {len(klines)} 使用缓存')
+                    try_num = 0
+                    while True:
+                        try:
+                            with open(file_pathname, "rb") as fp:
+                                cd = cl_serialize.loads(fp.read())
+                            break
+                        except Exception as e:
+                            try_num += 1
+                            time.sleep(0.5)
+                            if try_num > 5:
+                                raise e
+                if cd is None:
+                    self.cache_manager.miss("cl_data")
+                    cd = cl.CL(code, frequency, cl_config)
+                # 缓存对象计算时使用的K线指纹，没有（从文件读取的）或者数量不一致，根据缠论对象中的K线重新计算
+                if fingerprint is None or len(fingerprint) != len(cd.get_src_klines()):
+                    fingerprint = KlinesFingerprint.from_cl_klines(cd.get_src_klines())
+                # 判断缓存中的K线与给定的K线是否连续，以及重叠部分的K线是否完全一致（比如复权会产生变化），不一致则重新全量计算
+                if fingerprint.can_update(klines_fingerprint) is False:
                     # print(
-                    #     f"{market}-{code}-{frequency} {key} K-Nums {len(klines)} 历史数据有错位，重新计算"
+                    #     f"{market}--{code}--{frequency} {key} 计算前的数据有差异，重新计算"
                     # )
+                    self.cache_manager.incr("cl_data", "invalidations")
                     cd = cl.CL(code, frequency, cl_config)
-                # 判断缓存中的数据，与给定的K线数据是否有差异，有则表示数据有变（比如复权会产生变化），则重新全量计算
-                if len(cd.get_src_klines()) >= 2 and len(klines) >= 2:
-                    cd_pre_kline = cd.get_src_klines()[-2]
-                    src_klines = klines[klines["date"] == cd_pre_kline.date]
-                    # 计算后的数据没有最开始的日期或者 开高低收其中有不同的，则重新计算
-                    if (
-                        len(src_klines) == 0
-                        or Decimal(src_klines.iloc[0]["close"])
-                        != Decimal(cd_pre_kline.c)
-                        or Decimal(src_klines.iloc[0]["high"])
-                        != Decimal(cd_pre_kline.h)
-                        or Decimal(src_klines.iloc[0]["low"]) != Decimal(cd_pre_kline.l)
-                        or Decimal(src_klines.iloc[0]["open"])
-                        != Decimal(cd_pre_kline.o)
-                        or Decimal(src_klines.iloc[0]["volume"])
-                        != Decimal(cd_pre_kline.a)
-                    ):
-                        # print(
-                        #     f"{market}--{code}--{frequency} {key}",
-                        #     cd_pre_kline,
-                        #     src_klines.iloc[0].to_dict(),
-                        # )
-                        # print(
-                        #     f"{market}--{code}--{frequency} {key} 计算前的数据有差异，重新计算"
-                        # )
-                        # print(cd_pre_kline, src_klines)
-                        cd = cl.CL(code, frequency, cl_config)
-                # 判断缓存中的最近一百根时间范围内的数量是否一致
-                if len(cd.get_src_klines()) >= 100 and len(klines) >= 100:
-                    _valid_cd_klines = cd.get_src_klines()[-100:]
-                    _valid_src_klines = klines[
-                        (klines["date"] >= _valid_cd_klines[0].date)
-                        & (klines["date"] <= _valid_cd_klines[-1].date)
-                    ]
-                    if len(_valid_cd_klines) != len(_valid_src_klines):
-                        # print(
-                        #     f"{market}--{code}--{frequency} {key} 计算后的缠论数据有丢失数据 [{len(_valid_cd_klines)} - {len(_valid_src_klines)}]，重新计算"
-                        # )
-                        cd = cl.CL(code, frequency, cl_config)
-        except Exception:  # noqa: BLE001
-            if file_pathname.is_file():
-                # print(
-                #     f"获取 web 缓存的缠论数据对象异常 {market} {code} {frequency} - {e}，尝试删除缓存文件重新计算"
-                # )
-                try:
-                    file_pathname.unlink()
-                except Exception:  # noqa: BLE001, S110
-                    pass
+                    fingerprint = None
+            except Exception:  # noqa: BLE001
+                self.del_cache_cl_data(cache_key)
+                if file_pathname.is_file():
+                    # print(
+                    #     f"获取 web 缓存的缠论数据对象异常 {market} {code} {frequency} - {e}，尝试删除缓存文件重新计算"
+                    # )
+                    try:
+                        file_pathname.unlink()
+                    except Exception:  # noqa: BLE001, S110
+                        pass
+                if cd is None:
+                    cd = cl.CL(code, frequency, cl_config)
+                fingerprint = None
 
-        cd.process_klines(klines)
+            try:
+                cd.process_klines(klines)
+            except Exception:
+                # 计算异常的对象可能只更新了一部分，不再使用
+                self.del_cache_cl_data(cache_key)
+                raise
+
+            fingerprint = (
+                klines_fingerprint
+                if fingerprint is None
+                else fingerprint.update(klines_fingerprint)
+            )
+            evict_items = self.set_cache_cl_data(cache_key, cd, fingerprint)
+
+        return cd, evict_items
+
+    def get_cache_cl_data(
+        self, cache_key: str
+    ) -> tuple[ICL | None, KlinesFingerprint | None]:
+        """
+        获取内存中缓存的缠论数据对象及计算时使用的K线指纹，并标记为最近使用
+        """
+        with self.cl_cache_lock:
+            if cache_key not in self.cl_cache:
+                return None, None
+            self.cl_cache.move_to_end(cache_key)
+            item = self.cl_cache[cache_key]
+            return item["cd"], item["fingerprint"]
+
+    def set_cache_cl_data(
+        self, cache_key: str, cd: ICL, fingerprint: KlinesFingerprint
+    ) -> list:
+        """
+        将计算后的缠论数据对象放入内存缓存，超过保存间隔的写入文件，并淘汰超过内存限制的最久未使用对象
 
-        try:
-            with open(file_pathname, "wb") as fp:
-                pickle.dump(cd, fp)
-        except Exception as e:  # noqa: BLE001
-            print(f"写入缓存异常 {market} {code} {frequency} - {e}")
+        @param cache_key: 缓存 key（缓存文件路径）
+        @param cd: 缠论数据对象
+        @param fingerprint: 缠论对象计算使用的K线指纹
+        @return: 被淘汰的缓存对象列表 [(key, item)]，由调用方写入文件
+        """
+        nbytes = len(cd.get_src_klines()) * self.cl_cache_kline_bytes
+        with self.cl_cache_lock:
+            item = self.cl_cache.pop(cache_key, None)
+            if item is None:
+                # 新计算的对象，立即写入一次文件
+                item = {"cd": cd, "nbytes": 0, "save_time": 0}
+            self.cl_cache_bytes += nbytes - item["nbytes"]
+            item.update(
+                {"cd": cd, "fingerprint": fingerprint, "nbytes": nbytes, "dirty": True}
+            )
+            self.cl_cache[cache_key] = item
+
+        if time.time() - item["save_time"] >= self.cl_cache_save_seconds:
+            self.save_cache_cl_data(cache_key, item, lock=False)
+
+        evict_items = []
+        with self.cl_cache_lock:
+            while (
+                self.cl_cache_bytes > self.cl_cache_max_bytes and len(self.cl_cache) > 1
+            ):
+                _key, _item = self.cl_cache.popitem(last=False)
+                self.cl_cache_bytes -= _item["nbytes"]
+                if _item["dirty"]:
+                    evict_items.append((_key, _item))
+        return evict_items
+
+    def del_cache_cl_data(self, cache_key: str):
+        """
+        删除内存中缓存的缠论数据对象（不写入文件）
+        """
+        with self.cl_cache_lock:
+            item = self.cl_cache.pop(cache_key, None)
+            if item is not None:
+                self.cl_cache_bytes -= item["nbytes"]
 
-        # 加一个随机概率，去清理历史的缓存，避免太多占用空间
-        if random.randint(0, 1000) <= 5:
-            self.clear_old_web_cl_data()
+    def save_cache_cl_data(
+        self, cache_key: str = None, item: dict = None, lock: bool = True
+    ):
+        """
+        将内存中修改过的缠论数据对象写入文件，不传参数则写入所有修改过的对象（进程退出时调用）
 
-        return cd
+        @param cache_key: 缓存 key（缓存文件路径）
+        @param item: 缓存信息
+        @param lock: 是否需要获取对象的计算锁（调用方已经持有则为 False）
+        """
+        if cache_key is None:
+            with self.cl_cache_lock:
+                items = list(self.cl_cache.items())
+            for _key, _item in items:
+                if _item["dirty"]:
+                    self.save_cache_cl_data(_key, _item)
+            return True
+
+        data_lock = self.cl_data_locks[hash(cache_key) % len(self.cl_data_locks)]
+        if lock:
+            data_lock.acquire()
+        try:
+            data = cl_serialize.dumps(item["cd"])
+            # 根据序列化后的大小，更新每根K线的字节数估算值（使用压缩前的大小）
+            klines_num = len(item["cd"].get_src_klines())
+            if klines_num > 0:
+                self.cl_cache_kline_bytes = max(1, len(data) // klines_num)
+            data = cl_serialize.compress_dumps(data, self.cl_data_compress)
+            with open(cache_key, "wb") as fp:
+                fp.write(data)
+            self.cache_manager.write("cl_data", cache_key, len(data))
+            item["dirty"] = False
+            item["save_time"] = time.time()
+        except Exception as e:  # noqa: BLE001
+            print(f"写入缓存异常 {cache_key} - {e}")
+        finally:
+            if lock:
+                data_lock.release()
+        return True
 
     def clear_web_cl_data(self, market: str, code: str):
         """
         清除指定市场下标的缠论缓存对象
         """
+        code_key = f"{market}_{code.replace('/', '_').replace('.', '_')}"
+        with self.cl_cache_lock:
+            cache_keys = [_k for _k in self.cl_cache.keys() if code_key in _k]
+        for _k in cache_keys:
+            self.del_cache_cl_data(_k)
         for filename in (self.cl_data_path / market).glob("*.pkl"):
             try:
-                if f"{market}_{code.replace('/', '_').replace('.', '_')}" in str(
-                    filename
-                ):
+                if code_key in str(filename):
                     filename.unlink()
             except Exception:  # noqa: BLE001, S110
                 pass
@@ -311,6 +493,9 @@ class FileCacheDB:
         """
         删除所有缓存的计算结果文件
         """
+        with self.cl_cache_lock:
+            self.cl_cache.clear()
+            self.cl_cache_bytes = 0
         for _market in Market:
             for filename in (self.cl_data_path / _market.value).glob("*.pkl"):
                 try:
@@ -340,14 +525,14 @@ class FileCacheDB:
             cd = cl.CL(code, frequency, cl_config)
         else:
             with open(filename, "rb") as fp:
-                cd = pickle.load(fp)
+                cd = cl_serialize.loads(fp.read())
         limit = 200000
         if len(cd.get_klines()) > 10000:
             limit = 1000
         klines = db_ex.klines(code, frequency, args={"limit": limit})
         cd.process_klines(klines)
         with open(filename, "wb") as fp:
-            pickle.dump(cd, fp)
+            fp.write(cl_serialize.dumps(cd, self.cl_data_compress))
         return cd
 
     def cache_pkl_to_file(self, filename: str, data: object):
@@ -0,0 +1,118 @@
+"""
+K线数据的二进制文件缓存
+
+每个文件保存一个 代码/周期 的K线，文件开头是列信息，之后是定长的记录（numpy 结构化数组）：
+    [4 字节头长度][头信息 json][记录 1][记录 2]...
+date 列保存为 int64 的纳秒时间戳，读取时不需要再解析日期字符串；字符串列保存为定长的 unicode。
+
+保存时与文件中已有的记录比较，只截断并重写从第一条不同记录开始的部分，一般情况下只追加新的K线
+"""
+
+import json
+import os
+import pathlib
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+class KlinesBinFile:
+    """
+    K线二进制文件
+    """
+
+    HEADER_SIZE = struct.Struct("<I")
+
+    def __init__(self, file: pathlib.Path):
+        self.file = pathlib.Path(file)
+
+    def read(self) -> pd.DataFrame | None:
+        """
+        读取文件中所有的K线，文件不存在或格式错误返回 None
+        """
+        header = self._read_header()
+        if header is None:
+            return None
+        dtype, offset, tz = header
+        records = np.fromfile(self.file, dtype=dtype, offset=offset)
+        klines = pd.DataFrame({_n: records[_n] for _n in dtype.names})
+        klines["date"] = pd.to_datetime(records["date"])
+        if tz is not None:
+            klines["date"] = klines["date"].dt.tz_localize("UTC").dt.tz_convert(tz)
+        return klines
+
+    def write(self, klines: pd.DataFrame) -> int:
+        """
+        保存K线，返回实际写入的记录数量
+        文件中已经存在且相同的记录不会重写，只从第一条不同的记录开始截断文件后追加
+        """
+        records, tz = self._to_records(klines)
+        header = self._read_header()
+        if header is None or header[0] != records.dtype or header[2] != tz:
+            # 文件不存在或列信息有变化，全部重写
+            self._write_all(records, tz)
+            return len(records)
+
+        dtype, offset, _ = header
+        stored = np.memmap(self.file, dtype=dtype, mode="r", offset=offset)
+        same_nums = min(len(stored), len(records))
+        diff_i = np.flatnonzero(stored[:same_nums] != records[:same_nums])
+        keep_nums = int(diff_i[0]) if len(diff_i) > 0 else same_nums
+        del stored
+
+        with open(self.file, "r+b") as fp:
+            fp.truncate(offset + keep_nums * dtype.itemsize)
+            fp.seek(0, os.SEEK_END)
+            records[keep_nums:].tofile(fp)
+        return len(records) - keep_nums
+
+    def _read_header(self):
+        if self.file.is_file() is False:
+            return None
+        try:
+            with open(self.file, "rb") as fp:
+                header_len = self.HEADER_SIZE.unpack(fp.read(self.HEADER_SIZE.size))[0]
+                header = json.loads(fp.read(header_len).decode("utf-8"))
+            dtype = np.dtype([tuple(_d) for _d in header["descr"]])
+        except Exception:  # noqa: BLE001
+            return None
+        return dtype, self.HEADER_SIZE.size + header_len, header.get("tz")
+
+    def _write_all(self, records: np.ndarray, tz: str | None):
+        header = json.dumps({"descr": records.dtype.descr, "tz": tz}).encode("utf-8")
+        # 先写入临时文件再替换，避免写入过程中读取到不完整的文件
+        tmp_file = self.file.with_suffix(self.file.suffix + ".tmp")
+        with open(tmp_file, "wb") as fp:
+            fp.write(self.HEADER_SIZE.pack(len(header)))
+            fp.write(header)
+            records.tofile(fp)
+        tmp_file.replace(self.file)
+
+    @staticmethod
+    def _to_records(klines: pd.DataFrame) -> tuple[np.ndarray, str | None]:
+        """
+        DataFrame 转换成结构化数组，date 转换为纳秒时间戳（带时区的转换为 UTC 时间戳，并记录时区）
+        """
+        dates = klines["date"]
+        if pd.api.types.is_datetime64_any_dtype(dates) is False:
+            dates = pd.to_datetime(dates)
+        tz = None
+        if dates.dt.tz is not None:
+            tz = str(dates.dt.tz)
+            dates = dates.dt.tz_convert("UTC").dt.tz_localize(None)
+        columns = {}
+        for _c in klines.columns:
+            if _c == "date":
+                columns["date"] = dates.to_numpy(dtype="datetime64[ns]").view(np.int64)
+                continue
+            _v = klines[_c].to_numpy()
+            if _v.dtype.kind not in "biuf":
+                _v = klines[_c].fillna("").astype(str).to_numpy(dtype=str)
+            columns[str(_c)] = _v
+        records = np.empty(
+            len(klines), dtype=[(_c, _v.dtype) for _c, _v in columns.items()]
+        )
+        for _c, _v in columns.items():
+            records[_c] = _v
+        return records, tz
@@ -0,0 +1,134 @@
+"""
+K线内容指纹
+
+对每根K线的 (date, open, high, low, close, volume) 计算一个 64 位哈希值，并保存哈希值的前缀和，
+任意一段连续K线的指纹，都可以通过前缀和相减得到，比较两段K线是否一致只需要一次向量化计算。
+
+用于判断缓存的缠论对象，计算时使用的K线与新获取的K线是否一致（比如复权后历史K线会发生变化），不一致则需要重新计算
+"""
+
+import numpy as np
+import pandas as pd
+
+from chanlun.cl_interface import Kline
+
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 的混合函数（uint64 溢出按照取模处理）
+    """
+    x = (x ^ (x >> np.uint64(30))) * _MIX_1
+    x = (x ^ (x >> np.uint64(27))) * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+class KlinesFingerprint:
+    """
+    K线指纹
+    """
+
+    def __init__(self, dates: np.ndarray, prefix: np.ndarray):
+        """
+        @param dates: K线的时间戳（纳秒，正序）
+        @param prefix: K线哈希值的前缀和，长度比 dates 多 1，prefix[i] 是前 i 根K线的哈希值之和
+        """
+        self.dates = dates
+        self.prefix = prefix
+
+    def __len__(self):
+        return len(self.dates)
+
+    @classmethod
+    def from_values(
+        cls,
+        dates: np.ndarray,
+        o: np.ndarray,
+        h: np.ndarray,
+        l: np.ndarray,  # noqa: E741
+        c: np.ndarray,
+        v: np.ndarray,
+    ) -> "KlinesFingerprint":
+        dates = np.asarray(dates, dtype=np.int64)
+        hashes = _mix(dates.view(np.uint64))
+        for _v in (o, h, l, c, v):
+            hashes = _mix(hashes ^ np.asarray(_v, dtype=np.float64).view(np.uint64))
+        prefix = np.zeros(len(dates) + 1, dtype=np.uint64)
+        np.cumsum(hashes, out=prefix[1:])
+        return cls(dates, prefix)
+
+    @classmethod
+    def from_klines(cls, klines: pd.DataFrame) -> "KlinesFingerprint":
+        """
+        计算 DataFrame 格式K线的指纹
+        """
+        return cls.from_values(
+            klines["date"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+            klines["open"].to_numpy(),
+            klines["high"].to_numpy(),
+            klines["low"].to_numpy(),
+            klines["close"].to_numpy(),
+            klines["volume"].to_numpy(),
+        )
+
+    @classmethod
+    def from_cl_klines(cls, klines: list[Kline]) -> "KlinesFingerprint":
+        """
+        计算缠论对象中原始K线的指纹
+        """
+        if len(klines) == 0:
+            dates = np.array([], dtype=np.int64)
+        else:
+            dates = pd.DatetimeIndex([_k.date for _k in klines]).as_unit("ns").asi8
+        return cls.from_values(
+            dates,
+            [_k.o for _k in klines],
+            [_k.h for _k in klines],
+            [_k.l for _k in klines],
+            [_k.c for _k in klines],
+            [_k.a for _k in klines],
+        )
+
+    def can_update(self, new: "KlinesFingerprint") -> bool:
+        """
+        判断是否可以使用新的K线进行增量更新
+        新K线的开始时间需要在已有K线的范围内，并且重叠部分的K线（已有K线的最后一根可能还未完成，不进行比较）完全一致
+
+        @param new: 新K线的指纹
+        @return: 是否可以增量更新，False 需要重新全量计算
+        """
+        if len(self) == 0 or len(new) == 0:
+            return True
+        first_date = new.dates[0]
+        if self.dates[-1] < first_date or self.dates[0] > first_date:
+            return False
+        if len(self) < 2 or len(new) < 2:
+            return True
+        # 比较已有K线中 [start_i, end_i) 的部分（从新K线的开始时间，到倒数第二根）
+        start_i = int(np.searchsorted(self.dates, first_date, side="left"))
+        end_i = len(self) - 1
+        if start_i >= end_i:
+            return False
+        new_nums = int(np.searchsorted(new.dates, self.dates[end_i - 1], side="right"))
+        if new_nums != end_i - start_i:
+            return False
+        with np.errstate(over="ignore"):
+            return bool(
+                new.prefix[new_nums] == self.prefix[end_i] - self.prefix[start_i]
+            )
+
+    def update(self, new: "KlinesFingerprint") -> "KlinesFingerprint":
+        """
+        增量更新后的指纹：已有K线中早于新K线开始时间的部分，加上新K线
+        """
+        if len(new) == 0:
+            return self
+        start_i = int(np.searchsorted(self.dates, new.dates[0], side="left"))
+        with np.errstate(over="ignore"):
+            new_prefix = self.prefix[start_i] + new.prefix[1:]
+        return KlinesFingerprint(
+            np.concatenate([self.dates[:start_i], new.dates]),
+            np.concatenate([self.prefix[: start_i + 1], new_prefix]),
+        )
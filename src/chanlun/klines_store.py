@@ -0,0 +1,318 @@
+"""
+列式 K线 存储（Parquet）
+
+按照 市场/周期/代码 分目录，每个目录下按年分区保存 parquet 文件，查询时只读取日期范围内的年份文件，
+并将 dt 条件下推到 parquet 的行组统计信息中，避免通过 ORM 对象逐行构建 DataFrame
+
+目录结构：{DATA_PATH}/klines_store/{market}/{frequency}/{code}/{year}.parquet
+"""
+
+import datetime
+import pathlib
+import shutil
+from typing import List, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import MetaData, Table, inspect, select
+
+from chanlun.base import Market
+from chanlun.config import get_data_path
+
+# 存储的列，与数据库 K线 表结构保持一致
+STORE_COLUMNS = ["dt", "o", "c", "h", "l", "v"]
+# DataFrame 列名与存储列名的对应关系
+DF_COLUMNS_MAP = {
+    "date": "dt",
+    "open": "o",
+    "close": "c",
+    "high": "h",
+    "low": "l",
+    "volume": "v",
+    "position": "p",
+}
+
+
+class KlinesParquetStore:
+    """
+    Parquet 列式 K线 存储
+    """
+
+    def __init__(self, store_path: Union[str, pathlib.Path, None] = None):
+        if store_path is None:
+            store_path = get_data_path() / "klines_store"
+        self.store_path = pathlib.Path(store_path)
+        if self.store_path.is_dir() is False:
+            self.store_path.mkdir(parents=True)
+
+    @staticmethod
+    def code_to_dirname(code: str) -> str:
+        return (
+            code.replace(".", "_")
+            .replace("-", "_")
+            .replace("/", "_")
+            .replace("@", "_")
+            .lower()
+        )
+
+    def store_columns(self, market: str) -> List[str]:
+        if market == Market.FUTURES.value:
+            # 期货市场，添加持仓列
+            return STORE_COLUMNS + ["p"]
+        return STORE_COLUMNS
+
+    def code_path(self, market: str, code: str, frequency: str) -> pathlib.Path:
+        return self.store_path / market / frequency / self.code_to_dirname(code)
+
+    def year_files(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        start_date: datetime.datetime = None,
+        end_date: datetime.datetime = None,
+    ) -> List[pathlib.Path]:
+        """
+        获取代码周期下，日期范围内的年份分区文件（按年份正序）
+        """
+        code_path = self.code_path(market, code, frequency)
+        if code_path.is_dir() is False:
+            return []
+        files = []
+        for _f in code_path.glob("*.parquet"):
+            try:
+                year = int(_f.stem)
+            except ValueError:
+                continue
+            if start_date is not None and year < start_date.year:
+                continue
+            if end_date is not None and year > end_date.year:
+                continue
+            files.append((year, _f))
+        files.sort(key=lambda _yf: _yf[0])
+        return [_yf[1] for _yf in files]
+
+    def query(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        start_date: datetime.datetime = None,
+        end_date: datetime.datetime = None,
+        limit: int = 5000,
+        order: str = "desc",
+    ) -> pd.DataFrame:
+        """
+        获取k线数据，返回的 DataFrame 列与数据库表一致（dt/o/c/h/l/v[/p]），dt 为不带时区的时间，按照 dt 正序排列
+        :param market:
+        :param code:
+        :param frequency:
+        :param start_date:
+        :param end_date:
+        :param limit:
+        :param order: desc 则返回最后的 limit 条数据，asc 返回最开始的 limit 条数据
+        :return:
+        """
+        start_date = self._naive_dt(start_date)
+        end_date = self._naive_dt(end_date)
+        filters = []
+        if start_date is not None:
+            filters.append(("dt", ">=", pd.Timestamp(start_date)))
+        if end_date is not None:
+            filters.append(("dt", "<=", pd.Timestamp(end_date)))
+
+        files = self.year_files(market, code, frequency, start_date, end_date)
+        # 按照排序方向读取年份文件，读取的数量满足 limit 后就不用再继续读取
+        if order == "desc":
+            files = files[::-1]
+        tables = []
+        read_nums = 0
+        for _f in files:
+            _t = pq.read_table(
+                _f,
+                columns=self.store_columns(market),
+                filters=filters if len(filters) > 0 else None,
+            )
+            tables.append(_t)
+            read_nums += _t.num_rows
+            if limit is not None and read_nums >= limit:
+                break
+
+        if len(tables) == 0:
+            return pd.DataFrame([], columns=self.store_columns(market))
+        if order == "desc":
+            tables = tables[::-1]
+        df = pa.concat_tables(tables).to_pandas()
+        if limit is not None and len(df) > limit:
+            df = df.iloc[-limit:] if order == "desc" else df.iloc[:limit]
+        return df.reset_index(drop=True)
+
+    def range_stats(
+        self,
+        market: str,
+        code: str,
+        frequency: str,
+        start_date: datetime.datetime = None,
+        end_date: datetime.datetime = None,
+    ) -> dict:
+        """
+        查询日期范围内K线的统计信息，返回格式与 DB.klines_range_stats 一致
+        """
+        start_date = self._naive_dt(start_date)
+        end_date = self._naive_dt(end_date)
+        filters = []
+        if start_date is not None:
+            filters.append(("dt", ">=", pd.Timestamp(start_date)))
+        if end_date is not None:
+            filters.append(("dt", "<=", pd.Timestamp(end_date)))
+        stats = {"rows": 0, "last_dt": None, "checksum": 0.0}
+        for _f in self.year_files(market, code, frequency, start_date, end_date):
+            _t = pq.read_table(
+                _f,
+                columns=["dt", "c", "v"],
+                filters=filters if len(filters) > 0 else None,
+            )
+            if _t.num_rows == 0:
+                continue
+            stats["rows"] += _t.num_rows
+            stats["last_dt"] = pc.max(_t.column("dt")).as_py()
+            stats["checksum"] += float(pc.sum(_t.column("c")).as_py() or 0) + float(
+                pc.sum(_t.column("v")).as_py() or 0
+            )
+        return stats
+
+    def last_datetime(self, market: str, code: str, frequency: str):
+        """
+        查询最后一条记录的日期，返回格式与 DB.klines_last_datetime 一致
+        """
+        files = self.year_files(market, code, frequency)
+        if len(files) == 0:
+            return None
+        _t = pq.read_table(files[-1], columns=["dt"])
+        if _t.num_rows == 0:
+            return None
+        last_date = _t.column("dt")[-1].as_py()
+        if market == "a":
+            return last_date.strftime("%Y-%m-%d")
+        else:
+            return last_date.strftime("%Y-%m-%d %H:%M:%S")
+
+    def insert(self, market: str, code: str, frequency: str, klines: pd.DataFrame):
+        """
+        写入k线数据，相同时间的k线会被新数据覆盖
+        """
+        if len(klines) == 0:
+            return True
+        columns = self.store_columns(market)
+        in_klines = klines.rename(columns=DF_COLUMNS_MAP)
+        in_klines = in_klines[[_c for _c in columns if _c in in_klines.columns]].copy()
+        dts = pd.to_datetime(in_klines["dt"])
+        if dts.dt.tz is not None:
+            dts = dts.dt.tz_localize(None)  # 去除时区信息
+        in_klines["dt"] = dts.astype("datetime64[us]")
+
+        code_path = self.code_path(market, code, frequency)
+        if code_path.is_dir() is False:
+            code_path.mkdir(parents=True)
+        for year, y_klines in in_klines.groupby(in_klines["dt"].dt.year):
+            year_file = code_path / f"{year}.parquet"
+            if year_file.is_file():
+                y_klines = pd.concat(
+                    [pq.read_table(year_file).to_pandas(), y_klines],
+                    ignore_index=True,
+                )
+            y_klines = (
+                y_klines.drop_duplicates(subset=["dt"], keep="last")
+                .sort_values("dt")
+                .reset_index(drop=True)
+            )
+            self._write_table(year_file, y_klines)
+        return True
+
+    def delete(
+        self,
+        market: str,
+        code: str,
+        frequency: str = None,
+        dt: datetime.datetime = None,
+    ):
+        """
+        删除k线
+        """
+        if frequency is None:
+            for freq_path in (self.store_path / market).glob("*"):
+                code_path = freq_path / self.code_to_dirname(code)
+                if code_path.is_dir():
+                    shutil.rmtree(code_path, ignore_errors=True)
+            return True
+
+        if dt is None:
+            shutil.rmtree(self.code_path(market, code, frequency), ignore_errors=True)
+            return True
+
+        dt = self._naive_dt(dt)
+        for year_file in self.year_files(market, code, frequency, dt, dt):
+            y_klines = pq.read_table(year_file).to_pandas()
+            y_klines = y_klines[y_klines["dt"] != pd.Timestamp(dt)]
+            self._write_table(year_file, y_klines.reset_index(drop=True))
+        return True
+
+    def import_from_db(self, market: str, db_engine=None, codes: List[str] = None):
+        """
+        将数据库中已有的 {market}_klines_* 表数据，迁移到列式存储中
+        :param market: 市场
+        :param db_engine: 数据库连接，默认使用 chanlun.db 中的连接
+        :param codes: 只迁移指定的代码，默认迁移全部
+        :return: 迁移的 (代码, 周期) 数量
+        """
+        if db_engine is None:
+            from chanlun.db import db
+
+            db_engine = db.engine
+
+        table_prefix = f"{market}_klines_"
+        columns = self.store_columns(market)
+        import_nums = 0
+        for table_name in inspect(db_engine).get_table_names():
+            if table_name.startswith(table_prefix) is False:
+                continue
+            table = Table(table_name, MetaData(), autoload_with=db_engine)
+            with db_engine.connect() as conn:
+                code_freqs = conn.execute(
+                    select(table.c.code, table.c.f).distinct()
+                ).all()
+                for _code, _f in code_freqs:
+                    if codes is not None and _code not in codes:
+                        continue
+                    rows = conn.execute(
+                        select(*[table.c[_c] for _c in columns])
+                        .where(table.c.code == _code, table.c.f == _f)
+                        .order_by(table.c.dt.asc())
+                    ).all()
+                    if len(rows) == 0:
+                        continue
+                    self.insert(market, _code, _f, pd.DataFrame(rows, columns=columns))
+                    import_nums += 1
+        return import_nums
+
+    @staticmethod
+    def _naive_dt(dt: Union[datetime.datetime, None]):
+        if dt is None:
+            return None
+        return dt.replace(tzinfo=None)
+
+    @staticmethod
+    def _write_table(file: pathlib.Path, klines: pd.DataFrame):
+        # 先写入临时文件再替换，避免写入过程中读取到不完整的文件
+        tmp_file = file.with_suffix(".parquet.tmp")
+        pq.write_table(pa.Table.from_pandas(klines, preserve_index=False), tmp_file)
+        tmp_file.replace(file)
+
+
+if __name__ == "__main__":
+    store = KlinesParquetStore()
+    # 迁移数据库中的 A股 K线数据
+    print(store.import_from_db(Market.A.value))
+    print(store.query(Market.A.value, "SH.000001", "d", limit=10))
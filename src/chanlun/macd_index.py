@@ -0,0 +1,283 @@
+"""
+缠论数据对象的 MACD 区间索引
+
+每个缠论数据对象（ICL）对应一个 MACD 索引，保存：
+    红绿柱子（hist）、dif、dea 的前缀和，以及 dif/dea 穿越零轴、金叉死叉次数的前缀和
+    hist、dif、dea 的稀疏表（Sparse Table），用于区间最大值、最小值的查询
+任意区间的 macd 面积、极值、穿越次数都是 O(1) 的查询，不需要再遍历区间内的K线。
+
+新增K线时只追加计算新的部分；最后几根K线的 macd 发生变化（比如最后一根K线的价格更新），从变化的位置重新计算
+"""
+
+import math
+import threading
+import weakref
+
+import numpy as np
+
+# 每次同步时，检查缓存中最后几个 macd 值是否发生变化
+CHECK_NUMS = 8
+
+# 前缀和的行
+SUM_NAMES = ("hist_up", "hist_down", "dif", "dea")
+CROSS_NAMES = (
+    "dif_up_cross",
+    "dif_down_cross",
+    "dea_up_cross",
+    "dea_down_cross",
+    "gold_cross",
+    "die_cross",
+)
+# 稀疏表的行，与 macd 数据的行一致
+SERIES_NAMES = ("dif", "dea", "hist")
+
+# 各对象的 MACD 索引 {缠论对象: MACDIndex}，对象释放后自动删除
+_indexes: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def _reserve(arr: np.ndarray, nums: int, fill: float = np.nan) -> np.ndarray:
+    """
+    数组容量不足时，按照两倍扩容（最后一个维度）
+    """
+    if arr.shape[-1] >= nums:
+        return arr
+    new_arr = np.full(
+        arr.shape[:-1] + (max(nums, arr.shape[-1] * 2, 64),), fill, dtype=float
+    )
+    new_arr[..., : arr.shape[-1]] = arr
+    return new_arr
+
+
+def _same(a: float, b: float) -> bool:
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+class MACDIndex:
+    """
+    MACD 的前缀和与稀疏表索引，查询的区间 [start, end] 都包含结束位置
+    """
+
+    def __init__(self):
+        self.n = 0
+        # dif dea hist 原始值
+        self.raw = np.full((3, 0), np.nan, dtype=float)
+        # 前缀和，sums[:, i] 为前 i 个值的和，长度比 n 多一个
+        self.sums = np.zeros((len(SUM_NAMES), 1), dtype=float)
+        # 穿越次数的前缀和，crosses[:, i] 为位置 i 之前（不包含 i）发生的穿越次数
+        self.crosses = np.zeros((len(CROSS_NAMES), 1), dtype=float)
+        # 稀疏表，第 k 层的 [:, j] 为区间 [j, j + 2^k) 的最大值、最小值
+        self.st_max: list[np.ndarray] = []
+        self.st_min: list[np.ndarray] = []
+        self.lock = threading.RLock()
+
+    def sync(self, macd: dict):
+        """
+        同步 macd 数据：检查最后 CHECK_NUMS 个值，从第一个发生变化的位置开始更新，追加新的值
+        检查范围内的第一个值也发生变化（或者第一个值不同），则全部重新计算
+
+        @param macd: 缠论数据对象的 macd 指标 {"dif": [], "dea": [], "hist": []}
+        """
+        series = [macd[_n] for _n in SERIES_NAMES]
+        nums = min(len(_s) for _s in series)
+        start = max(0, self.n - CHECK_NUMS)
+
+        def same(_i):
+            return all(
+                _same(float(_s[_i]), self.raw[_r, _i]) for _r, _s in enumerate(series)
+            )
+
+        if self.n == 0 or nums <= start or not same(0) or not same(start):
+            change_idx = 0
+        else:
+            change_idx = min(self.n, nums)
+            for i in range(start + 1, min(self.n, nums)):
+                if not same(i):
+                    change_idx = i
+                    break
+        if change_idx == self.n == nums:
+            return
+        self._extend(series, change_idx, nums)
+
+    def _extend(self, series: list, start: int, nums: int):
+        """
+        重新计算 [start, nums) 位置的索引
+        """
+        self.raw = _reserve(self.raw, nums)
+        self.sums = _reserve(self.sums, nums + 1, 0.0)
+        self.crosses = _reserve(self.crosses, nums + 1, 0.0)
+        self.n = nums
+        if nums <= start:
+            return
+        for _r, _s in enumerate(series):
+            self.raw[_r, start:nums] = np.asarray(_s[start:nums], dtype=float)
+        dif, dea, hist = self.raw[:, :nums]
+
+        # 前缀和，nan 按照 0 计算
+        values = np.array(
+            [
+                np.where(hist[start:] > 0, hist[start:], 0),
+                np.where(hist[start:] < 0, hist[start:], 0),
+                np.nan_to_num(dif[start:]),
+                np.nan_to_num(dea[start:]),
+            ]
+        )
+        self.sums[:, start + 1 : nums + 1] = self.sums[
+            :, start : start + 1
+        ] + np.cumsum(values, axis=1)
+
+        # 位置 i 的穿越，需要与上一个位置比较，第一个位置没有穿越
+        self.crosses[:, 1] = 0
+        c_start = max(start, 1)
+        if c_start < nums:
+            p, c = slice(c_start - 1, nums - 1), slice(c_start, nums)
+            crosses = np.array(
+                [
+                    (dif[p] < 0) & (dif[c] > 0),
+                    (dif[p] > 0) & (dif[c] < 0),
+                    (dea[p] < 0) & (dea[c] > 0),
+                    (dea[p] > 0) & (dea[c] < 0),
+                    (dif[p] < dea[p]) & (dif[c] > dea[c]),
+                    (dif[p] > dea[p]) & (dif[c] < dea[c]),
+                ],
+                dtype=float,
+            )
+            self.crosses[:, c_start + 1 : nums + 1] = self.crosses[
+                :, c_start : c_start + 1
+            ] + np.cumsum(crosses, axis=1)
+
+        # 稀疏表，第 k 层只有 [start - 2^k + 1, nums - 2^k + 1) 的区间需要重新计算
+        level = 0
+        while (1 << level) <= nums:
+            if level == len(self.st_max):
+                self.st_max.append(np.full((3, 0), np.nan, dtype=float))
+                self.st_min.append(np.full((3, 0), np.nan, dtype=float))
+            self.st_max[level] = _reserve(self.st_max[level], nums)
+            self.st_min[level] = _reserve(self.st_min[level], nums)
+            if level == 0:
+                self.st_max[0][:, start:nums] = self.raw[:, start:nums]
+                self.st_min[0][:, start:nums] = self.raw[:, start:nums]
+            else:
+                half = 1 << (level - 1)
+                lo = max(0, start - (1 << level) + 1)
+                hi = nums - (1 << level) + 1
+                self.st_max[level][:, lo:hi] = np.fmax(
+                    self.st_max[level - 1][:, lo:hi],
+                    self.st_max[level - 1][:, lo + half : hi + half],
+                )
+                self.st_min[level][:, lo:hi] = np.fmin(
+                    self.st_min[level - 1][:, lo:hi],
+                    self.st_min[level - 1][:, lo + half : hi + half],
+                )
+            level += 1
+
+    def _range(self, start: int, end: int) -> tuple[int, int]:
+        """
+        区间限制在已有数据的范围内，返回 [start, end + 1)
+        """
+        return max(0, start), min(end + 1, self.n)
+
+    def value(self, name: str, i: int) -> float:
+        return self.raw[SERIES_NAMES.index(name), i]
+
+    def range_max(self, name: str, start: int, end: int) -> float:
+        """
+        区间最大值（忽略 nan），区间为空返回 nan
+        """
+        return self._st_query(self.st_max, np.fmax, name, start, end)
+
+    def range_min(self, name: str, start: int, end: int) -> float:
+        """
+        区间最小值（忽略 nan），区间为空返回 nan
+        """
+        return self._st_query(self.st_min, np.fmin, name, start, end)
+
+    def _st_query(self, st: list, func, name: str, start: int, end: int) -> float:
+        s, e = self._range(start, end)
+        if e <= s:
+            return np.nan
+        level = (e - s).bit_length() - 1
+        row = SERIES_NAMES.index(name)
+        return func(st[level][row, s], st[level][row, e - (1 << level)])
+
+    def range_sum(self, name: str, start: int, end: int) -> float:
+        """
+        区间的和
+
+        @param name: hist_up 红柱子的和 / hist_down 绿柱子的和（负数） / dif / dea
+        """
+        s, e = self._range(start, end)
+        if e <= s:
+            return 0.0
+        row = SUM_NAMES.index(name)
+        return self.sums[row, e] - self.sums[row, s]
+
+    def cross_nums(self, start: int, end: int) -> dict[str, int]:
+        """
+        区间内的穿越次数（区间第一个位置与之前的比较不计算在内）
+        """
+        s, e = self._range(start, end)
+        if e - s < 2:
+            return {_n: 0 for _n in CROSS_NAMES}
+        return {
+            _n: int(self.crosses[_i, e] - self.crosses[_i, s + 1])
+            for _i, _n in enumerate(CROSS_NAMES)
+        }
+
+    def ld(self, start: int, end: int) -> dict:
+        """
+        区间的 macd 力度，与 cl_interface.query_macd_ld 返回的格式一致
+        """
+        s, e = self._range(start, end)
+        if e <= s:
+            return {
+                "dea": {"end": 0, "max": 0, "min": 0},
+                "dif": {"end": 0, "max": 0, "min": 0},
+                "hist": {
+                    "sum": 0,
+                    "up_sum": 0,
+                    "down_sum": 0,
+                    "max": 0,
+                    "min": 0,
+                    "end": 0,
+                },
+            }
+        e -= 1
+        up_sum = self.range_sum("hist_up", s, e)
+        down_sum = abs(self.range_sum("hist_down", s, e))
+        ld = {
+            _n: {
+                "end": self.value(_n, e),
+                "max": self.range_max(_n, s, e),
+                "min": self.range_min(_n, s, e),
+            }
+            for _n in ("dea", "dif")
+        }
+        ld["hist"] = {
+            "sum": up_sum + down_sum,
+            "up_sum": up_sum,
+            "down_sum": down_sum,
+            "max": self.range_max("hist", s, e),
+            "min": self.range_min("hist", s, e),
+            "end": self.value("hist", e),
+        }
+        return ld
+
+
+def macd_index(cd) -> MACDIndex:
+    """
+    获取缠论数据对象同步到最新 macd 数据的索引，对象不支持弱引用时，每次新建索引
+
+    @param cd: 缠论数据对象（ICL）
+    """
+    try:
+        with _indexes_lock:
+            index = _indexes.get(cd)
+            if index is None:
+                index = MACDIndex()
+                _indexes[cd] = index
+    except TypeError:
+        index = MACDIndex()
+    with index.lock:
+        index.sync(cd.get_idx()["macd"])
+    return index
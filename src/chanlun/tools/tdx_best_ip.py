@@ -163,7 +163,8 @@ future_ip = [
 ]
 
 
-def ping(ip, port=7709, type_="stock"):
+def ping(ip, port=7709, type_="stock", verbose=True):
+    _print = print if verbose else lambda *args: None
     api = TdxHq_API()
     apix = TdxExHq_API()
     __time1 = datetime.datetime.now()
@@ -173,48 +174,50 @@ def ping(ip, port=7709, type_="stock"):
                 res = api.get_security_list(0, 1)
                 if res is not None:
                     if len(res) > 800:
-                        print("GOOD RESPONSE {}".format(ip))
+                        _print("GOOD RESPONSE {}".format(ip))
                         return datetime.datetime.now() - __time1
                     else:
-                        print("BAD RESPONSE {}".format(ip))
+                        _print("BAD RESPONSE {}".format(ip))
                         return datetime.timedelta(9, 9, 0)
 
                 else:
-                    print("BAD RESPONSE {}".format(ip))
+                    _print("BAD RESPONSE {}".format(ip))
                     return datetime.timedelta(9, 9, 0)
         elif type_ in ["future"]:
             with apix.connect(ip, port, time_out=0.7):
                 res = apix.get_instrument_count()
                 if res is not None:
                     if res > 20000:
-                        print("GOOD RESPONSE {}".format(ip))
+                        _print("GOOD RESPONSE {}".format(ip))
                         return datetime.datetime.now() - __time1
                     else:
-                        print("️Bad FUTUREIP REPSONSE {}".format(ip))
+                        _print("️Bad FUTUREIP REPSONSE {}".format(ip))
                         return datetime.timedelta(9, 9, 0)
                 else:
-                    print("️Bad FUTUREIP REPSONSE {}".format(ip))
+                    _print("️Bad FUTUREIP REPSONSE {}".format(ip))
                     return datetime.timedelta(9, 9, 0)
     except Exception as e:
         if isinstance(e, TypeError):
             pass
         else:
-            print("BAD RESPONSE {}".format(ip))
+            _print("BAD RESPONSE {}".format(ip))
         return datetime.timedelta(9, 9, 0)
 
 
-def select_best_ip(_type="stock"):
-    """目前这里给的是单线程的选优, 如果需要多进程的选优/ 最优ip缓存 可以参考
-    https://github.com/QUANTAXIS/QUANTAXIS/blob/master/QUANTAXIS/QAFetch/QATdx.py#L106
+def ping_seconds(server, type_="stock"):
+    """
+    ping 服务器（不输出信息），返回延迟的秒数，失败返回 None
+    """
+    delay = ping(server["ip"], server["port"], type_, verbose=False)
+    if delay >= datetime.timedelta(0, 9, 0):
+        return None
+    return delay.total_seconds()
 
 
-    Keyword Arguments:
-        _type {str} -- [description] (default: {'stock'})
-
-    Returns:
-        [type] -- [description]
+def select_best_ips(_type="stock", nums=1):
+    """
+    按照 ping 值从小到大排序，返回最优的 nums 个服务器（删除 ping 不通的服务器）
     """
-
     ip_list = stock_ip if _type == "stock" else future_ip
 
     data = [ping(x["ip"], x["port"], _type) for x in ip_list]
@@ -227,7 +230,22 @@ def select_best_ip(_type="stock"):
     # 按照ping值从小大大排序
     results = [x[1] for x in sorted(results, key=lambda x: x[0])]
 
-    return results[0]
+    return results[:nums]
+
+
+def select_best_ip(_type="stock"):
+    """目前这里给的是单线程的选优, 如果需要多进程的选优/ 最优ip缓存 可以参考
+    https://github.com/QUANTAXIS/QUANTAXIS/blob/master/QUANTAXIS/QAFetch/QATdx.py#L106
+
+
+    Keyword Arguments:
+        _type {str} -- [description] (default: {'stock'})
+
+    Returns:
+        [type] -- [description]
+    """
+
+    return select_best_ips(_type, 1)[0]
 
 
 if __name__ == "__main__":
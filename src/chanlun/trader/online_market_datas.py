@@ -9,7 +9,7 @@ import pandas as pd
 from chanlun.backtesting.base import MarketDatas
 from chanlun.cl_interface import ICL
 from chanlun.exchange.exchange import Exchange
-from chanlun.file_db import FileCacheDB
+from chanlun.file_db import fdb
 
 
 class OnlineMarketDatas(MarketDatas):
@@ -31,7 +31,7 @@ class OnlineMarketDatas(MarketDatas):
         """
         super().__init__(market, frequencys, cl_config)
         self.ex = ex
-        self.fdb = FileCacheDB()
+        self.fdb = fdb
 
         self.use_cache = use_cache
 
@@ -0,0 +1,356 @@
+"""
+缠论数据转换成 tv 图表的坐标数据
+
+K线数据直接从缠论对象中按列读取，时间戳批量转换；
+已完成的分型、笔、线段、中枢，图表数据不会再变化，按照对象缓存（对象被释放后自动删除），
+缠论对象在内存中缓存并增量计算，每次请求只需要生成最后未完成部分的图表数据
+
+前端轮询更新时，可以只转换最后 tail 个K线与缠论对象（tv_chart_diff 计算增量），转换的耗时与图表长度无关
+"""
+
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from chanlun import fun
+from chanlun.cl_interface import FX, ICL, LINE, ZS
+from chanlun.exchange import exchange
+
+# 已完成对象的图表数据缓存 {对象: (对象的关键属性, 图表数据)}
+_fx_charts: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_line_charts: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_zs_charts: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+_EPOCH = pd.Timestamp(0, tz="UTC")
+
+LINE_TYPE_MAP = {"bi": "笔", "xd": "段", "zsd": "走", "qsd": "趋"}
+BC_TYPE_MAP = {
+    "bi": "BI",
+    "xd": "XD",
+    "zsd": "ZSD",
+    "qsd": "QSD",
+    "pz": "PZ",
+    "qs": "QS",
+}
+MMD_TYPE_MAP = {
+    "1buy": "1B",
+    "2buy": "2B",
+    "l2buy": "L2B",
+    "3buy": "3B",
+    "l3buy": "L3B",
+    "1sell": "1S",
+    "2sell": "2S",
+    "l2sell": "L2S",
+    "3sell": "3S",
+    "l3sell": "L3S",
+}
+
+
+def datetimes_to_ints(dates) -> list[int]:
+    """
+    批量将时间转换成时间戳（秒），与 fun.datetime_to_int 结果一致
+    有时区的时间直接使用 UTC 纳秒值计算，没有时区的时间（按照本地时区转换）逐个转换
+    """
+    if isinstance(dates, pd.Series) and isinstance(dates.dtype, pd.DatetimeTZDtype):
+        return ((dates - _EPOCH) // pd.Timedelta(seconds=1)).tolist()
+    if all(isinstance(_d, pd.Timestamp) and _d.tzinfo is not None for _d in dates):
+        return [_d.value // 1_000_000_000 for _d in dates]
+    return [fun.datetime_to_int(_d) for _d in dates]
+
+
+def _cache_chart(cache: weakref.WeakKeyDictionary, obj, check: tuple, make_chart):
+    """
+    获取已完成对象的图表数据，缓存中没有，或者对象的关键属性发生变化（check 不一致）则重新生成
+
+    @param cache: 缓存的字典
+    @param obj: 缠论对象
+    @param check: 对象的关键属性（起止分型、价格、是否完成等）
+    @param make_chart: 生成图表数据的方法
+    """
+    cache_item = cache.get(obj)
+    if cache_item is not None and cache_item[0] == check:
+        return cache_item[1]
+    chart = make_chart()
+    # 最后一个元素是对象是否完成，只缓存已经完成的对象
+    if check[-1]:
+        cache[obj] = (check, chart)
+    return chart
+
+
+def fx_chart(fx: FX) -> dict:
+    def make_chart():
+        _t = fun.datetime_to_int(fx.k.date)
+        return {
+            "points": [{"time": _t, "price": fx.val}, {"time": _t, "price": fx.val}],
+            "text": fx.type,
+        }
+
+    return _cache_chart(_fx_charts, fx, (fx.k, fx.val, fx.done), make_chart)
+
+
+def line_chart(line: LINE) -> dict:
+    done = line.is_done()
+
+    def make_chart():
+        return {
+            "points": [
+                {
+                    "time": fun.datetime_to_int(line.start.k.date),
+                    "price": line.start.val,
+                },
+                {
+                    "time": fun.datetime_to_int(line.end.k.date),
+                    "price": line.end.val,
+                },
+            ],
+            "linestyle": "0" if done else "1",
+        }
+
+    return _cache_chart(_line_charts, line, (line.start, line.end, done), make_chart)
+
+
+def zs_chart(zs: ZS) -> dict:
+    def make_chart():
+        return {
+            "points": [
+                {"time": fun.datetime_to_int(zs.start.k.date), "price": zs.zg},
+                {"time": fun.datetime_to_int(zs.end.k.date), "price": zs.zd},
+            ],
+            "linestyle": "0" if zs.done else "1",
+        }
+
+    return _cache_chart(
+        _zs_charts, zs, (zs.start, zs.end, zs.zg, zs.zd, zs.done), make_chart
+    )
+
+
+def _objs_charts(objs_list: list[list], make_chart, tail: int | None) -> tuple:
+    """
+    将多组缠论对象（每组按照开始时间排序）转换成图表数据，并按照开始时间排序
+
+    @param objs_list: 缠论对象列表的列表
+    @param make_chart: 对象转换成图表数据的方法
+    @param tail: 每组只转换最后的对象数量，None 转换全部
+    @return: (图表数据列表, 截断的时间点)，截断时只返回开始时间大于截断时间点的数据，没有截断返回 None
+    """
+    charts = []
+    cutoff = None
+    for objs in objs_list:
+        truncated = tail is not None and len(objs) > tail
+        _charts = [make_chart(_o) for _o in (objs[-tail:] if truncated else objs)]
+        if truncated:
+            _t = _charts[0]["points"][0]["time"]
+            cutoff = _t if cutoff is None else max(cutoff, _t)
+        charts += _charts
+    if cutoff is not None:
+        # 截断时间点之后的数据，每组都已经完整包含（与全部转换的结果一致）
+        charts = [_c for _c in charts if _c["points"][0]["time"] > cutoff]
+    charts.sort(key=lambda v: v["points"][0]["time"], reverse=False)
+    return charts, cutoff
+
+
+def cl_data_to_tv_chart(
+    cd: ICL, config: dict, to_frequency: str | None = None, tail: int | None = None
+) -> dict | None:
+    """
+    将缠论数据，转换成 tv 画图的坐标数据
+
+    @param cd: 缠论数据对象
+    @param config: 缠论图表配置
+    @param to_frequency: 转换成指定的周期图表
+    @param tail: 只转换最后 tail 个K线与缠论对象，返回的每个列表都是全量数据的末尾部分，
+        并增加 cutoffs 字段 {字段: 截断的时间点}，列表是全量数据中时间大于截断时间点的部分，None 表示没有截断
+    """
+    cl_klines = cd.get_klines()
+    if len(cl_klines) == 0:
+        return None
+    bars_cut = tail is not None and to_frequency is None and len(cl_klines) > tail
+    if bars_cut:
+        cl_klines = cl_klines[-tail:]
+    kline_dates = [_k.date for _k in cl_klines]
+    kline_hs = np.asarray([_k.h for _k in cl_klines])
+    kline_ls = np.asarray([_k.l for _k in cl_klines])
+    kline_os = np.asarray([_k.o for _k in cl_klines])
+    kline_cs = np.asarray([_k.c for _k in cl_klines])
+    kline_vs = np.asarray([_k.a for _k in cl_klines])
+    if to_frequency is not None:
+        # 将数据转换成指定的周期数据
+        klines = pd.DataFrame(
+            {
+                "date": kline_dates,
+                "high": kline_hs,
+                "low": kline_ls,
+                "open": kline_os,
+                "close": kline_cs,
+                "volume": kline_vs,
+            }
+        )
+        klines.loc[:, "code"] = cd.get_code()
+        market = to_frequency.split(":")[0]
+        frequency = to_frequency.split(":")[1]
+        if market == "a":
+            klines = exchange.convert_stock_kline_frequency(klines, frequency)
+        elif market == "futures":
+            klines = exchange.convert_futures_kline_frequency(klines, frequency)
+        elif market == "currency":
+            klines = exchange.convert_currency_kline_frequency(klines, frequency)
+        else:
+            raise Exception(f"图表周期数据转换，不支持的市场 {market}")
+        kline_dates = klines["date"]
+        kline_hs = klines["high"]
+        kline_ls = klines["low"]
+        kline_os = klines["open"]
+        kline_cs = klines["close"]
+        kline_vs = klines["volume"]
+        bars_cut = tail is not None and len(klines) > tail
+        if bars_cut:
+            kline_dates = kline_dates.iloc[-tail:]
+            kline_hs = kline_hs.iloc[-tail:]
+            kline_ls = kline_ls.iloc[-tail:]
+            kline_os = kline_os.iloc[-tail:]
+            kline_cs = kline_cs.iloc[-tail:]
+            kline_vs = kline_vs.iloc[-tail:]
+
+    bars = {
+        "t": datetimes_to_ints(kline_dates),
+        "c": kline_cs.tolist(),
+        "o": kline_os.tolist(),
+        "h": kline_hs.tolist(),
+        "l": kline_ls.tolist(),
+        "v": kline_vs.tolist(),
+    }
+    cutoffs = {"t": None}
+    if bars_cut:
+        # 第一根K线作为截断时间点，返回之后的K线
+        cutoffs["t"] = bars["t"][0]
+        bars = {_k: _v[1:] for _k, _v in bars.items()}
+
+    show_objs = {
+        "fxs": (config["chart_show_fx"] == "1", fx_chart, lambda: [cd.get_fxs()]),
+        "bis": (config["chart_show_bi"] == "1", line_chart, lambda: [cd.get_bis()]),
+        "xds": (config["chart_show_xd"] == "1", line_chart, lambda: [cd.get_xds()]),
+        "zsds": (
+            config["chart_show_zsd"] == "1",
+            line_chart,
+            lambda: [cd.get_zsds()],
+        ),
+        "bi_zss": (
+            config["chart_show_bi_zs"] == "1",
+            zs_chart,
+            lambda: [cd.get_bi_zss(_t) for _t in config["zs_bi_type"]],
+        ),
+        "xd_zss": (
+            config["chart_show_xd_zs"] == "1",
+            zs_chart,
+            lambda: [cd.get_xd_zss(_t) for _t in config["zs_xd_type"]],
+        ),
+        "zsd_zss": (
+            config["chart_show_zsd_zs"] == "1",
+            zs_chart,
+            lambda: [cd.get_zsd_zss()],
+        ),
+    }
+    objs_chart_data = {}
+    for _k, (show, make_chart, get_objs) in show_objs.items():
+        objs_chart_data[_k], cutoffs[_k] = (
+            _objs_charts(get_objs(), make_chart, tail) if show else ([], None)
+        )
+
+    # 背驰信息
+    bc_infos = {}
+    # 买卖点信息
+    mmd_infos = {}
+
+    lines = {
+        "bi": cd.get_bis(),
+        "xd": cd.get_xds(),
+        "zsd": cd.get_zsds(),
+    }
+    # 只转换最后的线段时，背驰与买卖点的截断时间点（之后的每类线段都已经完整包含）
+    bc_cutoff_date = None
+    for line_type, ls in lines.items():
+        if tail is not None and len(ls) > tail:
+            ls = ls[-tail:]
+            if bc_cutoff_date is None or ls[0].end.k.date > bc_cutoff_date:
+                bc_cutoff_date = ls[0].end.k.date
+        show_bc = config[f"chart_show_{line_type}_bc"] == "1"
+        show_mmd = config[f"chart_show_{line_type}_mmd"] == "1"
+        for l in ls:
+            bcs = l.line_bcs("|")
+            if len(bcs) != 0 and l.end.k.date not in bc_infos:
+                bc_infos[l.end.k.date] = {
+                    "price": l.end.val,
+                    "bc_infos": {_type: [] for _type in LINE_TYPE_MAP},
+                }
+            if show_bc:
+                for bc in bcs:
+                    bc_infos[l.end.k.date]["bc_infos"][line_type].append(
+                        BC_TYPE_MAP[bc]
+                    )
+
+            mmds = l.line_mmds("|")
+            if len(mmds) != 0 and l.end.k.date not in mmd_infos:
+                mmd_infos[l.end.k.date] = {
+                    "price": l.end.val,
+                    "mmd_infos": {_type: [] for _type in LINE_TYPE_MAP},
+                }
+            if show_mmd:
+                for mmd in mmds:
+                    mmd_infos[l.end.k.date]["mmd_infos"][line_type].append(
+                        MMD_TYPE_MAP[mmd]
+                    )
+
+    bc_chart_data = []
+    for dt, bc in bc_infos.items():
+        if bc_cutoff_date is not None and dt <= bc_cutoff_date:
+            continue
+        bc_text = "/".join(
+            [
+                f"{LINE_TYPE_MAP[_type]}:{','.join(list(set(_bcs)))}"
+                for _type, _bcs in bc["bc_infos"].items()
+                if len(_bcs) > 0
+            ]
+        )
+        if len(bc_text) > 0:
+            bc_chart_data.append(
+                {
+                    "points": {"time": fun.datetime_to_int(dt), "price": bc["price"]},
+                    "text": bc_text,
+                }
+            )
+
+    mmd_chart_data = []
+    for dt, mmd in mmd_infos.items():
+        if bc_cutoff_date is not None and dt <= bc_cutoff_date:
+            continue
+        mmd_text = "/".join(
+            [
+                f"{LINE_TYPE_MAP[_type]}:{','.join(list(set(_mmds)))}"
+                for _type, _mmds in mmd["mmd_infos"].items()
+                if len(_mmds) > 0
+            ]
+        )
+        if len(mmd_text) > 0:
+            mmd_chart_data.append(
+                {
+                    "points": {"time": fun.datetime_to_int(dt), "price": mmd["price"]},
+                    "text": mmd_text,
+                }
+            )
+
+    bc_chart_data.sort(key=lambda v: v["points"]["time"], reverse=False)
+    mmd_chart_data.sort(key=lambda v: v["points"]["time"], reverse=False)
+    bc_cutoff = None if bc_cutoff_date is None else fun.datetime_to_int(bc_cutoff_date)
+    cutoffs["bcs"] = bc_cutoff
+    cutoffs["mmds"] = bc_cutoff
+
+    chart_data = {
+        **bars,
+        **objs_chart_data,
+        "bcs": bc_chart_data,
+        "mmds": mmd_chart_data,
+    }
+    if tail is not None:
+        chart_data["cutoffs"] = cutoffs
+    return chart_data
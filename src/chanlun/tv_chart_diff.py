@@ -0,0 +1,254 @@
+"""
+TV 图表数据的增量更新
+
+按照 (代码, 周期, 缠论配置) 保存最近几个版本的图表数据摘要：每个列表（K线、分型、笔、中枢等）的长度，
+以及最后 2 * tail_nums 个元素的时间与哈希值，不保存完整的图表数据。
+
+前端轮询时带上已有的版本号，服务端只转换最后 tail_nums 个K线与缠论对象（cl_data_to_tv_chart 的 tail 参数），
+按照时间与版本摘要对齐，计算出新增、变化以及删除的数据，转换与比较的耗时都只与 tail_nums 有关，与图表长度无关。
+
+增量数据的格式：每一类数据列表，保留前端已有列表的前 keep 个，之后替换为 items
+    {"bars_keep": 保留的K线数量, "t": [...], "o": [...], ..., "diffs": {"fxs": {"keep": n, "items": [...]}, ...}}
+变化超出摘要的范围（比如复权后历史K线变化），或者缠论对象被重新创建，返回 None，需要返回全量数据
+"""
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+# K线数据的字段
+BAR_KEYS = ["t", "o", "h", "l", "c", "v"]
+# 缠论图形数据的字段
+OBJ_KEYS = [
+    "fxs",
+    "bis",
+    "xds",
+    "zsds",
+    "bi_zss",
+    "xd_zss",
+    "zsd_zss",
+    "bcs",
+    "mmds",
+]
+
+
+def _item_time(item: dict) -> int:
+    """
+    缠论图形数据的开始时间
+    """
+    points = item["points"]
+    return points[0]["time"] if isinstance(points, list) else points["time"]
+
+
+def _chart_lists(chart_data: dict) -> dict:
+    """
+    图表数据中的各个列表 {字段: (时间列表, 元素列表)}，K线的各个字段合并为 bars
+    """
+    lists = {"bars": (chart_data["t"], list(zip(*[chart_data[_k] for _k in BAR_KEYS])))}
+    for _k in OBJ_KEYS:
+        lists[_k] = ([_item_time(_i) for _i in chart_data[_k]], chart_data[_k])
+    return lists
+
+
+def _hashes(items: list) -> list[int]:
+    return [hash(repr(_i)) for _i in items]
+
+
+def _same_summary(a: dict, b: dict) -> bool:
+    """
+    两个版本摘要是否一致：列表长度相同，并且重叠部分的哈希值相同（删除对象后摘要的元素数量会减少）
+    """
+    for _k, (_len, _, _hs) in a.items():
+        b_len, _, b_hs = b[_k]
+        nums = min(len(_hs), len(b_hs))
+        if _len != b_len or _hs[len(_hs) - nums :] != b_hs[len(b_hs) - nums :]:
+            return False
+    return True
+
+
+def _source_ref(source):
+    """
+    图表数据来源对象（缠论对象）的引用，不能弱引用的对象使用 id
+    """
+    if source is None:
+        return None
+    try:
+        return weakref.ref(source)
+    except TypeError:
+        return id(source)
+
+
+def _is_source(ref, source) -> bool:
+    if isinstance(ref, weakref.ref):
+        return ref() is source
+    return ref == (None if source is None else id(source))
+
+
+class TVChartDiff:
+    """
+    TV 图表数据的版本记录与增量计算
+    """
+
+    def __init__(
+        self, max_charts: int = 200, max_versions: int = 3, tail_nums: int = 100
+    ):
+        """
+        @param max_charts: 最多保存的图表数量，超过后删除最久未使用的
+        @param max_versions: 每个图表保存的历史版本数量（同一个图表在多个页面打开时，各自的版本号不同）
+        @param tail_nums: 轮询时转换的K线与缠论对象数量
+        """
+        self.max_charts = max_charts
+        self.max_versions = max_versions
+        self.tail_nums = tail_nums
+        # 版本摘要中保存的每个列表最后元素的数量，多于转换的数量，删除最后的对象（转换的范围向前移动）时也可以对齐
+        self.summary_nums = tail_nums * 2
+        # {图表 key: [(版本号, 版本摘要), ...]}，最新的版本在最后
+        # 版本摘要 {"source": 来源对象的引用, "lists": {字段: (列表长度, 最后元素的时间列表, 最后元素的哈希值列表)}}
+        self.charts: OrderedDict[str, list[tuple[int, dict]]] = OrderedDict()
+        self.version_seq = int(time.time() * 1000)
+        self.lock = threading.Lock()
+
+    def _summary(self, lists: dict) -> dict:
+        return {
+            _k: (_len, _ts[-self.summary_nums :], _hs[-self.summary_nums :])
+            for _k, (_len, _ts, _hs) in lists.items()
+        }
+
+    @staticmethod
+    def _align(lists: dict, key: str, cutoff: int | None) -> tuple[int, int] | None:
+        """
+        截断时间点在版本摘要中的位置
+
+        @param lists: 版本摘要中的列表 {字段: (列表长度, 时间列表, 哈希值列表)}
+        @param key: 列表的字段
+        @param cutoff: 截断时间点，None 表示没有截断
+        @return: (截断时间点之前的元素数量, 在摘要中的索引)，摘要没有覆盖截断时间点返回 None
+        """
+        old_len, old_ts, _ = lists[key]
+        if cutoff is None:
+            return (0, 0) if len(old_ts) == old_len else None
+        # 截断时间点需要在版本的最后一根K线（可能还未完成）之前，之后新增或变化的数据才都在截断时间点之后
+        bar_ts = lists["bars"][1]
+        if len(bar_ts) == 0 or bar_ts[-1] <= cutoff:
+            return None
+        if len(old_ts) < old_len and (len(old_ts) == 0 or old_ts[0] > cutoff):
+            return None
+        idx = next((_i for _i, _t in enumerate(old_ts) if _t > cutoff), len(old_ts))
+        return old_len - len(old_ts) + idx, idx
+
+    def _add_version(self, key: str, source_ref, summary: dict) -> int:
+        """
+        添加图表的新版本（调用时需要持有锁），与最新版本的摘要一致则不生成新的版本
+        """
+        versions = self.charts.get(key, [])
+        self.charts[key] = versions
+        self.charts.move_to_end(key)
+        if (
+            len(versions) > 0
+            and versions[-1][1]["source"] == source_ref
+            and _same_summary(versions[-1][1]["lists"], summary)
+        ):
+            return versions[-1][0]
+        self.version_seq += 1
+        versions.append((self.version_seq, {"source": source_ref, "lists": summary}))
+        del versions[: -self.max_versions]
+        while len(self.charts) > self.max_charts:
+            self.charts.popitem(last=False)
+        return self.version_seq
+
+    def save(self, key: str, chart_data: dict, source=None) -> int:
+        """
+        保存全量图表数据的版本摘要
+
+        @param key: 图表 key
+        @param chart_data: 全量的图表数据
+        @param source: 图表数据的来源对象（缠论对象），对象变化后之前的版本不再计算增量
+        @return: 图表数据的版本号
+        """
+        lists = {}
+        for _k, (_ts, _items) in _chart_lists(chart_data).items():
+            lists[_k] = (
+                len(_items),
+                _ts[-self.summary_nums :],
+                _hashes(_items[-self.summary_nums :]),
+            )
+        with self.lock:
+            return self._add_version(key, _source_ref(source), lists)
+
+    def update(
+        self, key: str, version: int | str | None, tail_data: dict, source=None
+    ) -> tuple[dict | None, int | None]:
+        """
+        使用只转换了末尾部分的图表数据，记录新的版本，并计算与指定版本之间的增量数据
+
+        @param key: 图表 key
+        @param version: 前端已有数据的版本号
+        @param tail_data: cl_data_to_tv_chart 指定 tail 参数转换的图表数据
+        @param source: 图表数据的来源对象（缠论对象）
+        @return: (增量数据, 最新的版本号)
+            无法计算最新版本（没有记录或来源对象变化）返回 (None, None)，需要转换全量数据并 save；
+            前端的版本不存在（比如服务重启或已被淘汰）或者变化超出摘要范围，增量数据为 None，需要返回全量数据
+        """
+        new_lists = {}
+        for _k, (_ts, _items) in _chart_lists(tail_data).items():
+            cutoff = tail_data["cutoffs"]["t" if _k == "bars" else _k]
+            new_lists[_k] = (cutoff, _ts, _items, _hashes(_items))
+
+        with self.lock:
+            versions = self.charts.get(key, [])
+            if len(versions) == 0 or not _is_source(versions[-1][1]["source"], source):
+                return None, None
+            # 与最新版本对齐，得到各个列表的长度，以及新版本的摘要
+            summary = {}
+            for _k, (cutoff, _ts, _items, _hs) in new_lists.items():
+                old = versions[-1][1]["lists"][_k]
+                pos = self._align(versions[-1][1]["lists"], _k, cutoff)
+                if pos is None:
+                    return None, None
+                summary[_k] = (
+                    pos[0] + len(_items),
+                    old[1][: pos[1]] + _ts,
+                    old[2][: pos[1]] + _hs,
+                )
+            new_version = self._add_version(
+                key, versions[-1][1]["source"], self._summary(summary)
+            )
+            try:
+                version = int(version)
+            except (TypeError, ValueError):
+                return None, new_version
+            old_summary = next(
+                (_s for _v, _s in self.charts[key] if _v == version), None
+            )
+        if old_summary is None or not _is_source(old_summary["source"], source):
+            return None, new_version
+
+        diffs = {}
+        for _k, (cutoff, _ts, _items, _hs) in new_lists.items():
+            pos = self._align(old_summary["lists"], _k, cutoff)
+            if pos is None:
+                return None, new_version
+            old_hs = old_summary["lists"][_k][2][pos[1] :]
+            same = next(
+                (_i for _i, (_o, _n) in enumerate(zip(old_hs, _hs)) if _o != _n),
+                min(len(old_hs), len(_hs)),
+            )
+            diffs[_k] = (pos[0], same, _items)
+
+        # K线至少返回最后两根（前端更新时需要判断是否是新的K线）
+        start, same, bars = diffs.pop("bars")
+        same = min(same, len(bars) - 2)
+        if same < 0:
+            return None, new_version
+        diff_data = {"bars_keep": start + same}
+        for _i, _k in enumerate(BAR_KEYS):
+            diff_data[_k] = [_b[_i] for _b in bars[same:]]
+        diff_data["diffs"] = {
+            _k: {"keep": start + same, "items": _items[same:]}
+            for _k, (start, same, _items) in diffs.items()
+        }
+        return diff_data, new_version
+
+
+tv_chart_diff = TVChartDiff()
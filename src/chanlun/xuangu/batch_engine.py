@@ -0,0 +1,287 @@
+"""
+选股的批量执行引擎
+
+主进程先批量更新除权除息信息，再使用多个线程批量获取所有代码的K线数据，按照代码固定分配给常驻的子进程（同一个代码每次都由同一个子进程计算），
+子进程一直保留计算过的缠论数据对象（file_db 的内存缓存），下次选股只需要增量计算；
+每个代码计算完成后立即返回结果，不需要等待全部代码完成。
+
+选股方法声明了预筛选条件的（见 prefilter），先获取所有代码的K线进行横截面的预筛选，只计算通过的代码
+"""
+
+import os
+import queue
+import threading
+import zlib
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+
+from chanlun.exchange import Exchange, Market, get_exchange
+from chanlun.trader.online_market_datas import OnlineMarketDatas
+from chanlun.xuangu.prefilter import apply_prefilter
+
+
+def _worker_main(in_queue, out_queue, exchange_fun=get_exchange):
+    """
+    常驻的选股子进程
+    接收 (选股编号, 市场, 周期列表, 选股方法, 选股类型, 缠论配置, [(代码, {周期: K线})])，
+    每个代码计算完成后返回 (选股编号, 代码, 选股结果, 异常信息)，收到 None 退出
+    """
+    # 每个市场与周期共用一个行情数据对象，缠论数据对象缓存在 file_db 的内存中
+    mk_datas: dict[tuple, OnlineMarketDatas] = {}
+    while True:
+        task = in_queue.get()
+        if task is None:
+            break
+        scan_id, market, frequencys, task_fun, opt_types, cl_config, items = task
+        key = (market, tuple(frequencys))
+        if key not in mk_datas:
+            mk_datas[key] = OnlineMarketDatas(
+                market,
+                frequencys,
+                exchange_fun(Market(market)),
+                cl_config,
+                use_cache=True,
+            )
+        datas = mk_datas[key]
+        datas.cl_config = cl_config
+        for code, klines in items:
+            # 使用主进程获取的K线，没有的周期再通过交易所获取
+            datas.cache_klines = {f"{code}_{_f}": _k for _f, _k in klines.items()}
+            try:
+                out_queue.put((scan_id, code, task_fun(code, datas, opt_types), None))
+            except Exception as e:  # noqa: BLE001
+                out_queue.put((scan_id, code, None, str(e)))
+            finally:
+                datas.clear_cache()
+
+
+class XuanguBatchEngine:
+    """
+    选股批量执行引擎，子进程在第一次选股时启动，之后一直保留；同时只执行一个选股任务
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        load_workers: int = 8,
+        batch_size: int = 10,
+        exchange_fun: Callable[[Market], Exchange] = get_exchange,
+    ):
+        """
+        @param workers: 选股子进程数量，None 使用 CPU 数量的一半
+        @param load_workers: 主进程获取K线数据的线程数量
+        @param batch_size: 每次发送给子进程的代码数量
+        @param exchange_fun: 获取市场交易所对象的方法，主进程与子进程中都会调用，需要是模块级别的方法
+        """
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 2) // 2)
+        self.workers = workers
+        self.load_workers = load_workers
+        self.batch_size = batch_size
+        self.exchange_fun = exchange_fun
+
+        self.ctx = get_context("spawn")
+        self.processes: list = [None] * workers
+        self.in_queues: list = [None] * workers
+        self.out_queue = None
+        self.scan_id = 0
+        self.lock = threading.Lock()
+
+    def worker_index(self, code: str) -> int:
+        """
+        代码固定分配的子进程，保证每次选股都使用同一个子进程中缓存的缠论数据对象
+        """
+        return zlib.crc32(code.encode("utf-8")) % self.workers
+
+    def _start_worker(self, i: int):
+        self.in_queues[i] = self.ctx.Queue()
+        self.processes[i] = self.ctx.Process(
+            target=_worker_main,
+            args=(self.in_queues[i], self.out_queue, self.exchange_fun),
+            name=f"xuangu_worker_{i}",
+            daemon=True,
+        )
+        self.processes[i].start()
+
+    def _ensure_workers(self):
+        if self.out_queue is None:
+            self.out_queue = self.ctx.Queue()
+        for i in range(self.workers):
+            if self.processes[i] is None or not self.processes[i].is_alive():
+                self._start_worker(i)
+
+    def scan(
+        self,
+        market: str,
+        codes: list[str],
+        frequencys: list[str],
+        task_fun: Callable,
+        opt_types: list[str],
+        cl_config: dict,
+    ) -> Iterator[tuple[str, dict | None, str | None]]:
+        """
+        执行选股，按照完成的顺序返回 (代码, 选股结果, 异常信息)
+
+        @param market: 市场
+        @param codes: 选股的代码列表
+        @param frequencys: 选股的周期列表
+        @param task_fun: 选股方法 task_fun(code, mk_datas, opt_types)，需要是模块级别的方法（可以传递给子进程）
+        @param opt_types: 选股类型
+        @param cl_config: 缠论配置
+        """
+        with self.lock:
+            yield from self._scan(
+                market, codes, frequencys, task_fun, opt_types, cl_config
+            )
+
+    def _scan(self, market, codes, frequencys, task_fun, opt_types, cl_config):
+        codes = list(dict.fromkeys(codes))
+        self._ensure_workers()
+        self.scan_id += 1
+        scan_id = self.scan_id
+        ex = self.exchange_fun(Market(market))
+
+        # 等待发送给子进程的代码与K线，已经发送但还没有返回的代码 {代码: 子进程}
+        batches: list[list] = [[] for _ in range(self.workers)]
+        pending: dict[str, int] = {}
+        batch_lock = threading.Lock()
+        # 获取了K线还没有返回结果的代码数量，避免获取K线的速度过快占用太多内存（预筛选时不限制）
+        in_flight = threading.Semaphore(self.workers * self.batch_size * 4)
+        stop = threading.Event()
+        loader_errors = []
+
+        def send(_i):
+            for _code, _ in batches[_i]:
+                pending[_code] = _i
+            self.in_queues[_i].put(
+                (
+                    scan_id,
+                    market,
+                    frequencys,
+                    task_fun,
+                    opt_types,
+                    cl_config,
+                    batches[_i],
+                )
+            )
+            batches[_i] = []
+
+        def add(_code, _klines):
+            _i = self.worker_index(_code)
+            with batch_lock:
+                batches[_i].append((_code, _klines))
+                if len(batches[_i]) >= self.batch_size:
+                    send(_i)
+
+        def load(_code):
+            if stop.is_set():
+                return None
+            try:
+                return {_f: ex.klines(_code, _f) for _f in frequencys}
+            except Exception as e:  # noqa: BLE001
+                self.out_queue.put((scan_id, _code, None, f"获取K线数据失败：{e}"))
+                return None
+
+        def load_and_add(_code):
+            _klines = load(_code)
+            if _klines is not None:
+                add(_code, _klines)
+
+        def loader():
+            try:
+                # 批量更新除权除息信息（通达信行情），获取K线复权时不需要再逐个代码请求
+                xdxr_refresh_all = getattr(ex, "xdxr_refresh_all", None)
+                if xdxr_refresh_all is not None:
+                    try:
+                        xdxr_refresh_all(codes)
+                    except Exception as e:  # noqa: BLE001
+                        print(f"批量更新除权除息信息异常：{e}")
+                with ThreadPoolExecutor(
+                    self.load_workers, thread_name_prefix="xuangu_load"
+                ) as executor:
+                    if getattr(task_fun, "prefilter", None) is not None:
+                        # 有预筛选条件的，先获取所有代码的K线，通过预筛选的代码才发送给子进程计算
+                        all_klines = {
+                            _c: _k
+                            for _c, _k in zip(codes, executor.map(load, codes))
+                            if _k is not None
+                        }
+                        selected = apply_prefilter(
+                            task_fun, all_klines, frequencys, opt_types, cl_config
+                        )
+                        for _code, _klines in all_klines.items():
+                            if stop.is_set():
+                                return
+                            if _code in selected:
+                                add(_code, _klines)
+                            else:
+                                self.out_queue.put((scan_id, _code, None, None))
+                    else:
+                        for _code in codes:
+                            while not in_flight.acquire(timeout=1):
+                                if stop.is_set():
+                                    return
+                            if stop.is_set():
+                                return
+                            executor.submit(load_and_add, _code)
+                with batch_lock:
+                    for _i in range(self.workers):
+                        if len(batches[_i]) > 0:
+                            send(_i)
+            except Exception as e:  # noqa: BLE001
+                loader_errors.append(e)
+
+        loader_thread = threading.Thread(
+            target=loader, name="xuangu_loader", daemon=True
+        )
+        loader_thread.start()
+
+        done = set()
+        try:
+            while len(done) < len(codes):
+                try:
+                    _scan_id, code, result, error = self.out_queue.get(timeout=5)
+                except queue.Empty:
+                    if len(loader_errors) > 0:
+                        raise loader_errors[0]
+                    # 子进程异常退出，已经发送的代码记为失败，重新启动子进程
+                    for _i in range(self.workers):
+                        if self.processes[_i].is_alive():
+                            continue
+                        with batch_lock:
+                            lost = [_c for _c, _w in pending.items() if _w == _i]
+                            for _c in lost:
+                                pending.pop(_c)
+                            self._start_worker(_i)
+                        for _c in lost:
+                            if _c not in done:
+                                done.add(_c)
+                                in_flight.release()
+                                yield _c, None, "选股子进程异常退出"
+                    continue
+                if _scan_id != scan_id or code in done:
+                    continue
+                with batch_lock:
+                    pending.pop(code, None)
+                done.add(code)
+                in_flight.release()
+                yield code, result, error
+        finally:
+            stop.set()
+
+    def close(self):
+        """
+        停止所有子进程
+        """
+        with self.lock:
+            for i in range(self.workers):
+                if self.processes[i] is not None and self.processes[i].is_alive():
+                    self.in_queues[i].put(None)
+            for i in range(self.workers):
+                if self.processes[i] is not None:
+                    self.processes[i].join(timeout=5)
+                    if self.processes[i].is_alive():
+                        self.processes[i].terminate()
+                self.processes[i] = None
+                self.in_queues[i] = None
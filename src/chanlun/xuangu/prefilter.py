@@ -0,0 +1,136 @@
+"""
+选股的横截面预筛选
+
+选股方法可以通过 prefilter 装饰器声明一个低成本的预筛选条件：
+条件方法接收所有代码K线组成的 (代码 x 时间) 面板数组，一次向量化计算出每个代码是否可能被选中，
+只有通过预筛选的代码，才进行缠论数据的计算与后续的判断。
+
+预筛选条件只能排除一定不会被选中的代码（与选股方法中的判断一致或更宽松），不能改变选股的结果
+"""
+
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+
+from chanlun.cl_interface import Config
+
+
+class KlinesPanel:
+    """
+    多个代码的K线面板，每个列的数组为 (代码数量 x 时间长度)，按照最新K线右对齐，K线数量不足的在左侧填充 nan
+    """
+
+    def __init__(self, klines: dict[str, pd.DataFrame], length: int):
+        """
+        @param klines: 代码的K线 {代码: K线}
+        @param length: 面板的时间长度（取每个代码最后 length 根K线）
+        """
+        self.codes = list(klines.keys())
+        self.length = length
+        # 每个代码的K线数量（不受 length 限制）
+        self.nums = np.array([len(_k) for _k in klines.values()], dtype=int)
+        for _col in ["open", "high", "low", "close", "volume"]:
+            values = np.full((len(self.codes), length), np.nan, dtype=float)
+            for _i, _k in enumerate(klines.values()):
+                if _col not in _k.columns or len(_k) == 0:
+                    continue
+                _v = _k[_col].to_numpy(dtype=float)[-length:]
+                values[_i, length - len(_v) :] = _v
+            setattr(self, _col, values)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def ma(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    最后一根K线的均线值，数量不足的为 nan
+    """
+    return np.mean(values[:, -period:], axis=1)
+
+
+def ema(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    按照时间逐列计算所有代码的 EMA，使用前 period 个值的均值作为初始值（与 talib 一致）
+    """
+    out = np.full(values.shape, np.nan, dtype=float)
+    counts = np.cumsum(~np.isnan(values), axis=1)
+    sums = np.cumsum(np.nan_to_num(values), axis=1)
+    alpha = 2 / (period + 1)
+    prev = np.full(values.shape[0], np.nan, dtype=float)
+    for t in range(values.shape[1]):
+        first_sum = sums[:, t] - (sums[:, t - period] if t >= period else 0)
+        prev = np.where(
+            counts[:, t] == period,
+            first_sum / period,
+            prev + alpha * (values[:, t] - prev),
+        )
+        out[:, t] = prev
+    return out
+
+
+def macd(
+    values: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    所有代码的 dif 与 dea
+    """
+    dif = ema(values, fast) - ema(values, slow)
+    return dif, ema(dif, signal)
+
+
+def prefilter(
+    func: Callable[[KlinesPanel, list, dict], np.ndarray],
+    frequency_index: int = 0,
+    length: int = 300,
+):
+    """
+    声明选股方法的预筛选条件
+
+    @param func: 预筛选条件 func(K线面板, 选股类型, 缠论配置)，返回每个代码是否通过的 bool 数组
+    @param frequency_index: 使用选股周期列表中的第几个周期的K线
+    @param length: K线面板的时间长度
+    """
+
+    def decorator(xg_fun):
+        xg_fun.prefilter = {
+            "func": func,
+            "frequency_index": frequency_index,
+            "length": length,
+        }
+        return xg_fun
+
+    return decorator
+
+
+def apply_prefilter(
+    task_fun: Callable,
+    klines: dict[str, dict[str, pd.DataFrame]],
+    frequencys: list[str],
+    opt_types: list[str],
+    cl_config: dict,
+) -> set[str]:
+    """
+    执行选股方法声明的预筛选，返回通过的代码；没有声明预筛选条件的，全部通过
+
+    @param task_fun: 选股方法
+    @param klines: 所有代码的K线 {代码: {周期: K线}}
+    @param frequencys: 选股的周期列表
+    @param opt_types: 选股类型
+    @param cl_config: 缠论配置
+    """
+    setting = getattr(task_fun, "prefilter", None)
+    # 平均K线计算的缠论数据，与原始K线不一致，不进行预筛选
+    if (
+        setting is None
+        or len(klines) == 0
+        or cl_config.get("kline_type") == Config.KLINE_TYPE_HEIKIN_ASHI.value
+    ):
+        return set(klines.keys())
+    frequency = frequencys[setting["frequency_index"]]
+    panel = KlinesPanel(
+        {_c: _k[frequency] for _c, _k in klines.items()}, setting["length"]
+    )
+    mask = np.asarray(setting["func"](panel, opt_types, cl_config), dtype=bool)
+    return {_c for _c, _ok in zip(panel.codes, mask) if _ok}
@@ -0,0 +1,324 @@
+"""
+相似度选股的特征索引
+
+保存所有代码（按照市场、周期、缠论配置区分）标准化后的 笔/线段/K线 特征数组，以及最后一笔的买卖点与背驰，
+保存在数据目录的 npz 文件中；每次收盘后只需要更新最新K线有变化的代码。
+
+查询时在特征矩阵上一次向量化计算所有代码的 DTW 距离与相似度（与 XuanguBySame.combined_similarity 的计算方式一致）；
+代码数量较多时，可以使用近似查询：先用逐点对齐的欧式距离（DTW 距离的上界）计算相似度的下界，
+只对排名靠前的候选代码计算准确的 DTW 距离
+"""
+
+import pathlib
+
+import numpy as np
+
+from chanlun.config import get_data_path
+
+# 计算 DTW 时，每次计算的代码数量（限制内存的占用）
+DTW_CHUNK_SIZE = 1024
+
+
+def normalize_features(values: np.ndarray) -> np.ndarray:
+    """
+    特征按照每一列（价格、时间）标准化到 0-1 范围，没有变化的列为 0
+
+    @param values: (..., 数量, 2) 的特征数组
+    """
+    values = np.asarray(values, dtype=float)
+    v_min = values.min(axis=-2, keepdims=True)
+    v_range = values.max(axis=-2, keepdims=True) - v_min
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized = (values - v_min) / v_range
+    return np.where(v_range > 0, normalized, 0.0)
+
+
+def dtw_distances(query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    多维序列的 DTW 距离（点之间使用欧式距离的平方累加，结果开方，与 dtaidistance.dtw_ndim.distance 一致）
+    按照反对角线递推，只保留最近两条对角线，每条对角线上的所有单元格与所有代码一起计算
+
+    @param query: (n, d) 目标序列
+    @param candidates: (N, m, d) 比较的序列
+    @return: (N,) 距离
+    """
+    query = np.asarray(query, dtype=float)
+    n, m = len(query), candidates.shape[1]
+    distances = np.zeros(len(candidates), dtype=float)
+    for start in range(0, len(candidates), DTW_CHUNK_SIZE):
+        chunk = candidates[start : start + DTW_CHUNK_SIZE]
+        # 对角线 i + j = s 上的累计距离，按照 i 保存（0 ~ n），无效的单元格为 inf
+        prev2 = np.full((len(chunk), n + 1), np.inf)
+        prev2[:, 0] = 0
+        prev1 = np.full((len(chunk), n + 1), np.inf)
+        for s in range(2, n + m + 1):
+            lo, hi = max(1, s - m), min(n, s - 1)
+            # 单元格 (i, j) 对应 query[i - 1] 与 chunk[:, j - 1]，i 递增时 j 递减
+            points = chunk[:, s - hi - 1 : s - lo][:, ::-1]
+            cost = ((points - query[None, lo - 1 : hi]) ** 2).sum(axis=-1)
+            cur = np.full((len(chunk), n + 1), np.inf)
+            cur[:, lo : hi + 1] = cost + np.minimum(
+                np.minimum(prev1[:, lo - 1 : hi], prev1[:, lo : hi + 1]),
+                prev2[:, lo - 1 : hi],
+            )
+            prev2, prev1 = prev1, cur
+        distances[start : start + len(chunk)] = np.sqrt(prev1[:, n])
+    return distances
+
+
+def lockstep_distances(query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    逐点对齐的欧式距离（序列长度相同时，是 DTW 距离的上界）
+    """
+    return np.sqrt(((candidates - query[None, :, :]) ** 2).sum(axis=(1, 2)))
+
+
+def segment_similarity(distances: np.ndarray, n: int, m: int) -> np.ndarray:
+    """
+    笔/线段的距离转换为相似度，与 XuanguBySame.calculate_similarity 一致
+    """
+    return np.clip(1 - distances / (np.sqrt(2) * max(n, m)), 0, 1)
+
+
+def kline_similarity(distances: np.ndarray, n: int, m: int, dims: int) -> np.ndarray:
+    """
+    K线的距离转换为相似度，与 XuanguBySame.calculate_kline_similarity 一致
+    """
+    if min(n, m) < 30:
+        return 1 - distances / (np.sqrt(dims) * max(n, m))
+    divisor = 10 * (dims / 2) * (np.mean([n, m]) / 100)
+    return np.maximum(0, 1 - distances / divisor)
+
+
+class SameFeatureIndex:
+    """
+    相似度选股的特征索引
+    """
+
+    def __init__(
+        self,
+        market: str,
+        frequency: str,
+        key: str,
+        k_num: int,
+        bi_num: int,
+        xd_num: int,
+        path: pathlib.Path | None = None,
+    ):
+        """
+        @param market: 市场
+        @param frequency: 周期
+        @param key: 缠论配置的标识（不同的缠论配置使用不同的索引）
+        @param k_num: K线特征的数量
+        @param bi_num: 笔特征的数量
+        @param xd_num: 线段特征的数量
+        @param path: 索引文件路径，默认保存在数据目录的 xuangu_same 目录中
+        """
+        self.market = market
+        self.frequency = frequency
+        self.nums = (k_num, bi_num, xd_num)
+        if path is None:
+            path = (
+                get_data_path()
+                / "xuangu_same"
+                / f"{market}_{frequency}_{key}_{k_num}_{bi_num}_{xd_num}.npz"
+            )
+        self.path = path
+
+        # 代码的特征 {代码: {date, k, bi, xd, mmds, bcs}}，特征为标准化后的数组
+        self.items: dict[str, dict] = {}
+        # 特征矩阵的缓存，更新后重新生成
+        self._matrix: dict | None = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, code: str):
+        return code in self.items
+
+    def get_date(self, code: str) -> int | None:
+        """
+        代码计算特征时最后一根K线的时间戳，没有的返回 None
+        """
+        item = self.items.get(code)
+        return None if item is None else item["date"]
+
+    def set(
+        self,
+        code: str,
+        date: int,
+        k_features: list,
+        bi_features: list,
+        xd_features: list,
+        bi_mmds: list[str],
+        bi_bcs: list[str],
+    ):
+        """
+        更新代码的特征（XGFeatures 中的原始特征）
+
+        @param date: 最后一根K线的时间戳
+        """
+        self.items[code] = {
+            "date": int(date),
+            "k": normalize_features(k_features),
+            "bi": normalize_features(bi_features),
+            "xd": normalize_features(xd_features),
+            "mmds": set(bi_mmds),
+            "bcs": set(bi_bcs),
+        }
+        self._matrix = None
+
+    def remove(self, code: str):
+        if self.items.pop(code, None) is not None:
+            self._matrix = None
+
+    def matrix(self) -> dict:
+        """
+        所有代码的特征矩阵 {codes, k, bi, xd, mmds, bcs}
+        """
+        if self._matrix is None:
+            codes = list(self.items.keys())
+            k_num, bi_num, xd_num = self.nums
+            self._matrix = {
+                "codes": codes,
+                "mmds": [self.items[_c]["mmds"] for _c in codes],
+                "bcs": [self.items[_c]["bcs"] for _c in codes],
+            }
+            for _name, _num in [("k", k_num), ("bi", bi_num), ("xd", xd_num)]:
+                self._matrix[_name] = (
+                    np.stack([self.items[_c][_name] for _c in codes])
+                    if len(codes) > 0
+                    else np.zeros((0, _num, 2))
+                )
+        return self._matrix
+
+    def load(self) -> bool:
+        """
+        读取索引文件，文件不存在或者特征数量不一致，返回 False
+        """
+        if self.path.is_file() is False:
+            return False
+        with np.load(self.path, allow_pickle=False) as data:
+            if tuple(data["nums"].tolist()) != self.nums:
+                return False
+            self.items = {
+                str(_c): {
+                    "date": int(data["dates"][_i]),
+                    "k": data["k"][_i],
+                    "bi": data["bi"][_i],
+                    "xd": data["xd"][_i],
+                    "mmds": set(filter(None, str(data["mmds"][_i]).split("|"))),
+                    "bcs": set(filter(None, str(data["bcs"][_i]).split("|"))),
+                }
+                for _i, _c in enumerate(data["codes"])
+            }
+        self._matrix = None
+        return True
+
+    def save(self):
+        """
+        保存索引文件（先写入临时文件再替换，避免读取到不完整的文件）
+        """
+        matrix = self.matrix()
+        codes = matrix["codes"]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as fp:
+            np.savez(
+                fp,
+                nums=np.array(self.nums),
+                codes=np.array(codes, dtype=str),
+                dates=np.array(
+                    [self.items[_c]["date"] for _c in codes], dtype=np.int64
+                ),
+                k=matrix["k"],
+                bi=matrix["bi"],
+                xd=matrix["xd"],
+                mmds=np.array(
+                    ["|".join(sorted(_m)) for _m in matrix["mmds"]], dtype=str
+                ),
+                bcs=np.array(["|".join(sorted(_b)) for _b in matrix["bcs"]], dtype=str),
+            )
+        tmp_path.replace(self.path)
+
+    def query(
+        self,
+        k_features: list,
+        bi_features: list,
+        xd_features: list,
+        bi_mmds: list[str],
+        bi_bcs: list[str],
+        weights: tuple[float, float, float] = (0.3, 0.6, 0.1),
+        codes: list[str] | None = None,
+        exclude_codes: list[str] | None = None,
+        ann_candidates: int | None = None,
+    ) -> list[dict]:
+        """
+        查询与目标特征相似的代码，按照相似度从高到低排序
+
+        @param k_features/bi_features/xd_features/bi_mmds/bi_bcs: 目标的特征（XGFeatures）
+        @param weights: K线、笔、线段相似度的权重，权重为 0 的不进行计算
+        @param codes: 只在这些代码中查询，None 查询索引中的所有代码
+        @param exclude_codes: 排除的代码
+        @param ann_candidates: 近似查询的候选数量，None 对所有代码计算准确的 DTW 距离
+        @return: [{"code": 代码, "similarity": 相似度}]
+        """
+        matrix = self.matrix()
+        rows = np.arange(len(matrix["codes"]))
+        if codes is not None:
+            codes = set(codes)
+            rows = rows[[matrix["codes"][_r] in codes for _r in rows]]
+        if exclude_codes is not None:
+            exclude_codes = set(exclude_codes)
+            rows = rows[[matrix["codes"][_r] not in exclude_codes for _r in rows]]
+
+        # 目标最后一笔有买卖点或背驰的，比对的代码最后一笔也要有其中任意一个买卖点或背驰
+        mmds, bcs = set(bi_mmds), set(bi_bcs)
+        if len(rows) > 0 and (len(mmds) > 0 or len(bcs) > 0):
+            rows = rows[
+                [
+                    len(mmds & matrix["mmds"][_r]) > 0
+                    or len(bcs & matrix["bcs"][_r]) > 0
+                    for _r in rows
+                ]
+            ]
+        if len(rows) == 0:
+            return []
+
+        targets = {
+            "k": normalize_features(k_features),
+            "bi": normalize_features(bi_features),
+            "xd": normalize_features(xd_features),
+        }
+
+        if ann_candidates is not None and len(rows) > ann_candidates:
+            scores = self._scores(targets, matrix, rows, weights, lockstep_distances)
+            rows = rows[np.argsort(-scores, kind="stable")[:ann_candidates]]
+        scores = self._scores(targets, matrix, rows, weights, dtw_distances)
+
+        order = np.argsort(-scores, kind="stable")
+        return [
+            {"code": matrix["codes"][rows[_i]], "similarity": float(scores[_i])}
+            for _i in order
+        ]
+
+    @staticmethod
+    def _scores(targets, matrix, rows, weights, distance_fun) -> np.ndarray:
+        """
+        计算加权的组合相似度
+        """
+        k_weight, bi_weight, xd_weight = weights
+        total = np.zeros(len(rows), dtype=float)
+        for _name, _weight in [("k", k_weight), ("bi", bi_weight), ("xd", xd_weight)]:
+            if _weight == 0:
+                continue
+            target = targets[_name]
+            candidates = matrix[_name][rows]
+            distances = distance_fun(target, candidates)
+            n, m = len(target), candidates.shape[1]
+            if _name == "k":
+                similarity = kline_similarity(distances, n, m, target.shape[1])
+            else:
+                similarity = segment_similarity(distances, n, m)
+            total += _weight * similarity
+        return np.clip(total, 0, 1)
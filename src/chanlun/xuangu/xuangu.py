@@ -1,4 +1,5 @@
 import itertools
+from collections.abc import Callable
 from typing import List, Union
 
 import numpy as np
@@ -13,6 +14,7 @@ from chanlun.cl_utils import (
     cal_zs_macd_infos,
     last_done_bi,
 )
+from chanlun.xuangu.prefilter import KlinesPanel, ma, macd, prefilter
 
 """
 根据缠论数据，选择自己所需要的形态方法集合
@@ -35,6 +37,25 @@ def get_opt_types(opt_type: list = []):
     return opt_direction, opt_mmd
 
 
+def _prefilter_macd_reject(
+    panel: KlinesPanel, cl_config: dict, reject: Callable
+) -> np.ndarray:
+    """
+    根据最新K线的 dif、dea 排除代码，K线数量不足的不排除（初始值的计算方式不同，与缠论数据中的 macd 有差异）
+    比较时预留价格万分之一的误差，避免排除掉临界的代码
+
+    @param reject: reject(dif, dea, 误差) 返回需要排除的 bool 数组
+    """
+    dif, dea = macd(
+        panel.close,
+        int(cl_config.get("idx_macd_fast", 12)),
+        int(cl_config.get("idx_macd_slow", 26)),
+        int(cl_config.get("idx_macd_signal", 9)),
+    )
+    tolerance = np.abs(panel.close[:, -1]) * 1e-4
+    return ~((panel.nums >= 250) & reject(dif[:, -1], dea[:, -1], tolerance))
+
+
 def xg_single_xd_and_bi_mmd(code: str, mk_datas: MarketDatas, opt_type: list = []):
     """
     线段和笔都有出现买点
@@ -170,6 +191,18 @@ def xg_single_xd_bi_23_overlapped(
     return None
 
 
+def _day_bc_and_up_jincha_prefilter(
+    panel: KlinesPanel, opt_type: list, cl_config: dict
+) -> np.ndarray:
+    """
+    预筛选：黄白线要在零轴上方
+    """
+    return _prefilter_macd_reject(
+        panel, cl_config, lambda dif, dea, tol: (dif < -tol) | (dea < -tol)
+    )
+
+
+@prefilter(_day_bc_and_up_jincha_prefilter, length=500)
 def xg_single_day_bc_and_up_jincha(
     code: str, mk_datas: MarketDatas, opt_type: list = []
 ):
@@ -528,6 +561,23 @@ def xg_single_find_3buy_by_zhuanzhe(
     return None
 
 
+def _ma_250_prefilter(panel: KlinesPanel, opt_type: list, cl_config: dict):
+    """
+    预筛选：最新价格在 ma 250 线的上下（预留计算误差）
+    """
+    opt_direction, opt_mmd = get_opt_types(opt_type)
+    close = panel.close[:, -1]
+    ma250 = ma(panel.close, 250)
+    tolerance = np.abs(ma250) * 1e-9
+    selected = np.zeros(len(panel), dtype=bool)
+    if "up" in opt_direction:
+        selected |= close > ma250 - tolerance
+    if "down" in opt_direction:
+        selected |= close < ma250 + tolerance
+    return selected
+
+
+@prefilter(_ma_250_prefilter, length=250)
 def xg_single_ma_250(code: str, mk_datas: MarketDatas, opt_type: list = []):
     """
     找最新价格在 ma 250 线的上下
@@ -686,6 +736,16 @@ def xg_single_xdzs_bimmdbc(code: str, mk_datas: MarketDatas, opt_type: list = []
         }
 
 
+def _week_k_overlap_prefilter(panel: KlinesPanel, opt_type: list, cl_config: dict):
+    """
+    预筛选：K线数量不少于 100 根，并且最新三根K线有重叠
+    """
+    return (panel.nums >= 100) & (
+        np.max(panel.low[:, -3:], axis=1) <= np.min(panel.high[:, -3:], axis=1)
+    )
+
+
+@prefilter(_week_k_overlap_prefilter, length=3)
 def xg_single_week_k_overlap(code: str, mk_datas: MarketDatas, opt_type: list = []):
     """
     周线级别，k线重叠；理论与操作，在周线长时间盘整，积聚理论，一旦突破重叠区间，往往有可观的上涨区间
@@ -840,6 +900,23 @@ def xg_single_xd_zs_nei_3mmds(
     }
 
 
+def _tupo_zs_prefilter(panel: KlinesPanel, opt_type: list, cl_config: dict):
+    """
+    预筛选：只做多要求 macd 柱子不小于 0，只做空要求 macd 柱子不大于 0
+    """
+    opt_direction, opt_mmd = get_opt_types(opt_type)
+    if "down" in opt_direction and "up" not in opt_direction:
+        return _prefilter_macd_reject(
+            panel, cl_config, lambda dif, dea, tol: dif - dea < -tol
+        )
+    if "up" in opt_direction and "down" not in opt_direction:
+        return _prefilter_macd_reject(
+            panel, cl_config, lambda dif, dea, tol: dif - dea > tol
+        )
+    return np.ones(len(panel), dtype=bool)
+
+
+@prefilter(_tupo_zs_prefilter, length=500)
 def xg_single_tupo_zs(
     code: str, mk_datas: MarketDatas, opt_type: list = []
 ) -> Union[None, dict]:
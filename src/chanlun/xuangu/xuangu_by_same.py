@@ -3,6 +3,7 @@
 """
 
 import datetime
+import hashlib
 import json
 import math
 from concurrent.futures import ProcessPoolExecutor
@@ -19,6 +20,8 @@ from chanlun.base import Market
 from chanlun.cl_interface import ICL
 from chanlun.cl_utils import query_cl_chart_config, web_batch_get_cl_datas
 from chanlun.exchange import get_exchange
+from chanlun.file_db import fdb
+from chanlun.xuangu.same_index import SameFeatureIndex
 
 
 @dataclass
@@ -54,6 +57,15 @@ class XuanguBySame:
 
         self.logger = fun.get_logger("xuangu_by_same.log")
 
+        # 特征索引 {(周期, 缠论配置标识): SameFeatureIndex}
+        self.indexes: Dict[Tuple[str, str], SameFeatureIndex] = {}
+
+    def __getstate__(self):
+        # 多进程执行时会序列化对象，不传递已经加载的特征索引
+        state = self.__dict__.copy()
+        state["indexes"] = {}
+        return state
+
     def run(
         self,
         target_code: str,
@@ -62,7 +74,14 @@ class XuanguBySame:
         find_codes: List[str],
         cl_config: dict,
         run_type: str = "process",
+        ann_candidates: Union[int, None] = None,
     ) -> List[Dict[str, Any]]:
+        """
+        查找与目标代码相似的代码
+
+        @param run_type: single 单进程 / process 多进程 / index 使用特征索引查询（需要先调用 refresh_index 更新索引）
+        @param ann_candidates: 使用特征索引时，近似查询的候选数量，None 计算所有代码的准确相似度
+        """
         # 获取目标代码的k线，并计算缠论数据
         target_klines = get_exchange(Market(self.market)).klines(target_code, frequency)
         if target_end_datetime:
@@ -77,6 +96,24 @@ class XuanguBySame:
             )
             return []
 
+        if run_type == "index":
+            index = self.feature_index(frequency, cl_config)
+            if len(index) == 0:
+                self.logger.warning(
+                    f"{self.market} {frequency} 特征索引为空，需要先调用 refresh_index 更新索引"
+                )
+            return index.query(
+                k_features=target_features.k_features,
+                bi_features=target_features.bi_features,
+                xd_features=target_features.xd_features,
+                bi_mmds=target_features.bi_mmds,
+                bi_bcs=target_features.bi_bcs,
+                weights=(self.k_weight, self.bi_weight, self.xd_weight),
+                codes=find_codes,
+                exclude_codes=[target_code],
+                ann_candidates=ann_candidates,
+            )
+
         same_similar_codes = []
         run_args = [
             {
@@ -141,6 +178,106 @@ class XuanguBySame:
             self.logger.error(f"{code} 处理异常：{e}")
             return None
 
+    def feature_index(self, frequency: str, cl_config: dict) -> SameFeatureIndex:
+        """
+        获取周期与缠论配置对应的特征索引（第一次获取时读取索引文件）
+        """
+        unique_str = (
+            f"{[f'{k}:{v}' for k, v in cl_config.items() if k in fdb.config_keys]}"
+        )
+        key = hashlib.md5(unique_str.encode("UTF-8")).hexdigest()
+        index = self.indexes.get((frequency, key))
+        if index is None or index.nums != (self.k_num, self.bi_num, self.xd_num):
+            index = SameFeatureIndex(
+                self.market, frequency, key, self.k_num, self.bi_num, self.xd_num
+            )
+            index.load()
+            self.indexes[(frequency, key)] = index
+        return index
+
+    def refresh_index(
+        self,
+        frequency: str,
+        codes: List[str],
+        cl_config: dict,
+        run_type: str = "process",
+    ) -> SameFeatureIndex:
+        """
+        更新特征索引，只重新计算最新K线有变化的代码（建议在收盘后执行）
+
+        @param run_type: single 单进程 / process 多进程
+        """
+        index = self.feature_index(frequency, cl_config)
+        run_args = [
+            {
+                "code": _c,
+                "frequency": frequency,
+                "cl_config": cl_config,
+                "index_date": index.get_date(_c),
+            }
+            for _c in codes
+        ]
+        if run_type == "single":
+            results = map(self.index_features_by_code, run_args)
+        else:
+            executor = ProcessPoolExecutor(5, mp_context=get_context("spawn"))
+            results = executor.map(self.index_features_by_code, run_args)
+        error_codes = []
+        for _r in tqdm(results, total=len(run_args), desc="更新特征索引"):
+            if _r is None:
+                continue
+            if _r["error"] is not None:
+                # 计算异常的代码，从索引中删除，避免使用过期的特征
+                error_codes.append(_r["code"])
+                index.remove(_r["code"])
+                continue
+            if _r["features"] is None:
+                index.remove(_r["code"])
+                continue
+            index.set(
+                _r["code"],
+                _r["date"],
+                k_features=_r["features"].k_features,
+                bi_features=_r["features"].bi_features,
+                xd_features=_r["features"].xd_features,
+                bi_mmds=_r["features"].bi_mmds,
+                bi_bcs=_r["features"].bi_bcs,
+            )
+        if run_type != "single":
+            executor.shutdown()
+        if len(error_codes) > 0:
+            self.logger.warning(
+                f"{len(error_codes)} 个代码计算特征异常，已从索引中删除：{error_codes[:20]}"
+            )
+        index.save()
+        return index
+
+    def index_features_by_code(self, args: dict) -> Union[Dict[str, Any], None]:
+        """
+        计算代码的特征，最新K线与索引中的一致返回 None，异常的返回 error 异常信息
+        """
+        code = args["code"]
+        frequency = args["frequency"]
+        try:
+            klines = get_exchange(Market(self.market)).klines(code, frequency)
+            if len(klines) == 0:
+                return None
+            date = fun.datetime_to_int(klines.iloc[-1]["date"])
+            if args["index_date"] == date:
+                return None
+            cd = web_batch_get_cl_datas(
+                self.market, code, {frequency: klines}, args["cl_config"]
+            )[0]
+            return {
+                "code": code,
+                "date": date,
+                "features": self.extract_cd_features(cd),
+                "error": None,
+            }
+        except Exception as e:
+            self.logger.error(f"{code} 计算特征异常：{e}")
+            return {"code": code, "date": None, "features": None, "error": str(e)}
+
     def extract_cd_features(self, cd: ICL) -> Union[XGFeatures, None]:
         if (
             len(cd.get_src_klines()) < self.k_num
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+try:
+    from chanlun.backtesting.backtest import BackTest
+except Exception:  # noqa: BLE001
+    # 缠论计算模块需要授权后才能导入
+    pytest.skip("chanlun.backtesting.backtest 无法导入", allow_module_level=True)
+
+
+class FakeKlines:
+    """
+    不读取数据库的回测数据对象
+    """
+
+    def load_klines_arrays(self, code):
+        return {"d": {"close": np.arange(3, dtype=float)}}
+
+    def set_klines_shm(self, code, shm_name, shm_layout):
+        pass
+
+    def use_times_per_step(self):
+        return 0
+
+
+class CountBackTest(BackTest):
+    """
+    每个代码的回测结果固定为代码的序号
+    """
+
+    def run(self, next_frequency=None, begin_start_dt=None, loop_callback_fun=None):
+        num = int(self.base_code[1:])
+        self.trader.results["1buy"]["win_num"] += num
+        self.trader.hold_profit_history["2024-01-01"] = num
+        self.trader.orders[self.base_code] = [num]
+        self.trader.positions_history[self.base_code] = []
+        self.trader.balance_history = {"2024-01-01": num}
+        self.trader.fee_total += num
+        return True
+
+
+def make_backtest(codes):
+    bt = CountBackTest()
+    bt.mode = "signal"
+    bt.market = "a"
+    bt.codes = codes
+    bt.frequencys = ["d"]
+    bt.init_balance = 100000
+    bt.fee_rate = 0.0005
+    bt.max_pos = 10
+    bt.strategy = None
+    bt.datas = FakeKlines()
+    bt.next_frequency = "d"
+    bt.trader = bt.new_trader()
+    return bt
+
+
+def test_run_process_shm_merge_each_code_once():
+    # 代码数量超过预先提交的任务数量（2 * max_workers），后提交的任务不能带入已经合并的结果
+    codes = [f"C{_i}" for _i in range(1, 11)]
+    bt = make_backtest(codes)
+    bt.run_process_shm("d", max_workers=2)
+
+    total = sum(range(1, 11))
+    assert bt.trader.fee_total == total
+    assert bt.trader.results["1buy"]["win_num"] == total
+    assert bt.trader.hold_profit_history["2024-01-01"] == total
+    assert bt.trader.balance_history.iloc[-1] == total
+    assert bt.trader.orders == {_c: [int(_c[1:])] for _c in codes}
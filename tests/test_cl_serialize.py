@@ -0,0 +1,109 @@
+import datetime
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from chanlun import cl_serialize
+from chanlun.cl_interface import BI, FX, CLKline, Kline
+
+
+def make_cl_objects(nums=30):
+    dates = pd.date_range(
+        "2024-01-02 09:35", periods=nums, freq="5min", tz="Asia/Shanghai"
+    )
+    klines = [
+        Kline(_i, _d, _i + 1.0, _i - 1.0, float(_i), _i + 0.5, _i * 10.0)
+        for _i, _d in enumerate(dates)
+    ]
+    cl_klines = []
+    for _i in range(0, nums, 2):
+        _ks = klines[_i : _i + 2]
+        cl_klines.append(
+            CLKline(
+                _ks[0].index,
+                _ks[-1].date,
+                max(_k.h for _k in _ks),
+                min(_k.l for _k in _ks),
+                _ks[0].o,
+                _ks[-1].c,
+                sum(_k.a for _k in _ks),
+                _ks,
+                len(cl_klines),
+                len(_ks),
+                False,
+            )
+        )
+    fxs = [
+        FX(
+            "di" if _i % 2 else "ding",
+            cl_klines[_i],
+            cl_klines[_i - 1 : _i + 2],
+            1.0,
+            _i,
+        )
+        for _i in range(1, len(cl_klines) - 1, 3)
+    ]
+    bis = [BI(fxs[_i], fxs[_i + 1], "up", _i) for _i in range(len(fxs) - 1)]
+    return {"klines": klines, "cl_klines": cl_klines, "fxs": fxs, "bis": bis}
+
+
+@pytest.mark.parametrize("compress", [None, "zlib"])
+def test_dumps_loads(compress):
+    data = make_cl_objects()
+    load_data = cl_serialize.loads(cl_serialize.dumps(data, compress))
+
+    for _k, _load_k in zip(data["klines"], load_data["klines"]):
+        assert _load_k.__dict__ == _k.__dict__
+        assert type(_load_k.h) is float and type(_load_k.date) is pd.Timestamp
+    for _ck, _load_ck in zip(data["cl_klines"], load_data["cl_klines"]):
+        assert str(_load_ck) == str(_ck)
+        assert [_k.index for _k in _load_ck.klines] == [_k.index for _k in _ck.klines]
+
+    # 对象之间的引用关系保持不变
+    load_klines = load_data["klines"]
+    load_cl_klines = load_data["cl_klines"]
+    assert load_cl_klines[3].klines[0] is load_klines[6]
+    assert load_cl_klines[3].date is load_klines[7].date
+    for _bi in load_data["bis"]:
+        assert _bi.start.k is load_cl_klines[_bi.start.k.index]
+        assert _bi.start.klines[1] is _bi.start.k
+
+
+def test_compress_dumps():
+    data = make_cl_objects()
+    raw = cl_serialize.dumps(data)
+    compressed = cl_serialize.compress_dumps(raw, "zlib")
+    assert compressed == cl_serialize.dumps(data, "zlib")
+    assert cl_serialize.compress_dumps(raw, None) is raw
+    with pytest.raises(ValueError):
+        cl_serialize.compress_dumps(compressed, "zlib")
+
+
+def test_loads_other_types():
+    tz = datetime.timezone(datetime.timedelta(hours=8))
+    dates = [
+        datetime.datetime(2024, 1, 2, 9, 35, tzinfo=tz),
+        datetime.datetime(2024, 1, 2, 9, 40),
+        datetime.datetime(2024, 1, 2, 9, 45),
+    ]
+    klines = [
+        Kline(_i, _d, float(_i), 1.0, 1.5, 1.8, np.float64(10.0))
+        for _i, _d in enumerate(dates)
+    ]
+    klines[1].h = np.float64(2.0)
+    # 动态添加了属性的对象，按照普通对象保存
+    klines[2].extra = "x"
+    load_klines = cl_serialize.loads(cl_serialize.dumps(klines))
+    assert [_k.__dict__ for _k in load_klines] == [_k.__dict__ for _k in klines]
+    assert [type(_k.h) for _k in load_klines] == [float, np.float64, float]
+    assert type(load_klines[0].a) is np.float64
+    assert load_klines[0].date.utcoffset() == datetime.timedelta(hours=8)
+    assert load_klines[1].date.tzinfo is None
+
+
+def test_loads_pickle():
+    data = make_cl_objects(10)
+    load_data = cl_serialize.loads(pickle.dumps(data))
+    assert str(load_data["cl_klines"][-1]) == str(data["cl_klines"][-1])
@@ -0,0 +1,78 @@
+import os
+import time
+from contextlib import closing
+
+from chanlun.file_cache_manager import FileCacheManager
+
+
+def write_file(path, size, mtime=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"0" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_clean(tmp_path):
+    root = tmp_path / "cl_data"
+    old_file = write_file(root / "a" / "old.pkl", 100, time.time() - 20 * 86400)
+    exist_file = write_file(root / "a" / "exist.pkl", 100, time.time() - 3600)
+
+    manager = FileCacheManager(
+        tmp_path / "cache_index.db", max_bytes=250, max_age_seconds=15 * 86400
+    )
+    manager.watch(root, "cl_data")
+
+    # 已存在的文件加入索引，超过保存天数的删除
+    assert manager.clean() == 1
+    assert old_file.exists() is False and exist_file.exists()
+
+    # 超过总大小，删除最久未访问的文件
+    new_file = write_file(root / "a" / "new.pkl", 100)
+    manager.write("cl_data", new_file)
+    manager.hit("cl_data", exist_file)
+    manager.miss("cl_data")
+    last_file = write_file(root / "b" / "last.pkl", 100)
+    manager.write("cl_data", last_file)
+    assert manager.clean() == 1
+    assert new_file.exists() is False
+    assert exist_file.exists() and last_file.exists()
+
+    stats = manager.stats()
+    assert stats["files"] == 2 and stats["bytes"] == 200
+    counters = stats["counters"]["cl_data"]
+    assert counters["hits"] == 1 and counters["misses"] == 1
+    assert counters["hit_rate"] == 0.5
+    assert counters["evictions"] == 2 and counters["evicted_bytes"] == 200
+
+    # 索引保存在文件中，重新创建后不需要重新扫描目录
+    write_file(root / "c" / "not_index.pkl", 1000)
+    manager = FileCacheManager(
+        tmp_path / "cache_index.db", max_bytes=250, max_age_seconds=15 * 86400
+    )
+    manager.watch(root, "cl_data")
+    assert manager.clean() == 0
+    assert manager.stats()["files"] == 2
+
+
+def test_flush_without_thread(tmp_path):
+    root = tmp_path / "cl_data"
+    manager = FileCacheManager(
+        tmp_path / "cache_index.db",
+        max_bytes=1000,
+        max_age_seconds=86400,
+        clean_seconds=60,
+    )
+    manager.watch(root, "cl_data")
+    file = write_file(root / "a" / "new.pkl", 100)
+
+    # 没有启动后台线程的进程（比如子进程），超过清理间隔后将访问记录写入索引，主进程清理时使用
+    manager.write("cl_data", file)
+    assert len(manager.pending) == 1
+    manager.last_flush_time -= 60
+    manager.hit("cl_data", file)
+    assert len(manager.pending) == 0
+    with closing(manager._connect()) as conn:
+        assert conn.execute("SELECT path, size FROM cache_files").fetchall() == [
+            (str(file), 100)
+        ]
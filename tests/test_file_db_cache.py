@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pytest
+
+from chanlun.base import Market
+from chanlun.cl_interface import Kline
+
+try:
+    from chanlun import file_db
+except Exception:  # noqa: BLE001
+    # 缠论计算模块需要授权后才能导入
+    pytest.skip("chanlun.file_db 无法导入", allow_module_level=True)
+
+
+class FakeCL:
+    """
+    只保存K线的缠论对象，记录计算的次数
+    """
+
+    def __init__(self, code, frequency, config=None):
+        self.code = code
+        self.frequency = frequency
+        self.klines: list[Kline] = []
+        self.process_nums = 0
+
+    def process_klines(self, klines: pd.DataFrame):
+        self.process_nums += 1
+        first_date = klines.iloc[0]["date"]
+        self.klines = [_k for _k in self.klines if _k.date < first_date]
+        for _, _k in klines.iterrows():
+            self.klines.append(
+                Kline(
+                    len(self.klines),
+                    _k["date"],
+                    _k["high"],
+                    _k["low"],
+                    _k["open"],
+                    _k["close"],
+                    _k["volume"],
+                )
+            )
+        return self
+
+    def get_src_klines(self):
+        return self.klines
+
+
+def make_klines(nums, start="2024-01-02"):
+    dates = pd.date_range(start, periods=nums, freq="D", tz="Asia/Shanghai")
+    return pd.DataFrame(
+        {
+            "date": dates,
+            "open": [float(_i) for _i in range(nums)],
+            "high": [_i + 1.0 for _i in range(nums)],
+            "low": [_i - 1.0 for _i in range(nums)],
+            "close": [_i + 0.5 for _i in range(nums)],
+            "volume": [10.0] * nums,
+        }
+    )
+
+
+@pytest.fixture
+def fdb(tmp_path, monkeypatch):
+    fdb = file_db.fdb
+    monkeypatch.setattr(file_db.cl, "CL", FakeCL, raising=False)
+    monkeypatch.setattr(fdb, "cl_data_path", tmp_path)
+    monkeypatch.setattr(fdb, "cl_cache", OrderedDict())
+    monkeypatch.setattr(fdb, "cl_cache_bytes", 0)
+    monkeypatch.setattr(fdb, "cl_cache_save_seconds", 3600)
+    for market in Market:
+        (tmp_path / market.value).mkdir()
+    return fdb
+
+
+def test_get_web_cl_data_copy(fdb):
+    klines = make_klines(20)
+    cd = fdb.get_web_cl_data("a", "SH.600000", "d", {}, klines)
+    cd_2 = fdb.get_web_cl_data("a", "SH.600000", "d", {}, klines.iloc[-5:])
+    with fdb.web_cl_data("a", "SH.600000", "d", {}, klines.iloc[-5:]) as shared_cd:
+        # 缓存中的对象增量计算，返回给调用方的是复制的对象
+        assert shared_cd.process_nums == 3
+        assert shared_cd is not cd and shared_cd is not cd_2
+    assert cd.process_nums == 1 and cd_2.process_nums == 2
+    assert len(cd_2.get_src_klines()) == 20
+    cd_2.klines.clear()
+    assert len(shared_cd.get_src_klines()) == 20
+
+
+def test_web_cl_data_lock(fdb):
+    klines = make_klines(20)
+    entered = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def hold_lock():
+        with fdb.web_cl_data("a", "SH.600000", "d", {}, klines):
+            entered.set()
+            release.wait(5)
+
+    def get_data():
+        results.append(fdb.get_web_cl_data("a", "SH.600000", "d", {}, klines))
+
+    t_hold = threading.Thread(target=hold_lock)
+    t_hold.start()
+    assert entered.wait(5)
+    t_get = threading.Thread(target=get_data)
+    t_get.start()
+    # 其他线程持有对象的锁时，不能同时计算或复制这个对象
+    t_get.join(0.3)
+    assert t_get.is_alive() and results == []
+    release.set()
+    t_hold.join(5)
+    t_get.join(5)
+    assert len(results) == 1 and results[0].process_nums == 2
+
+
+def test_cache_evict_save(fdb, monkeypatch):
+    # 内存中只能放下一个对象，淘汰的对象写入缓存文件，之后从文件读取继续增量计算
+    monkeypatch.setattr(fdb, "cl_cache_kline_bytes", 100)
+    monkeypatch.setattr(fdb, "cl_cache_max_bytes", 3000)
+    klines = make_klines(20)
+    fdb.get_web_cl_data("a", "SH.600000", "d", {}, klines)
+    fdb.get_web_cl_data("a", "SH.600001", "d", {}, klines)
+    cache_file = fdb.web_cl_data_file("a", "SH.600000", "d", {})
+    assert list(fdb.cl_cache.keys()) == [
+        str(fdb.web_cl_data_file("a", "SH.600001", "d", {}))
+    ]
+    assert cache_file.is_file()
+
+    cd = fdb.get_web_cl_data("a", "SH.600000", "d", {}, klines.iloc[-5:])
+    assert cd.process_nums == 2 and len(cd.get_src_klines()) == 20
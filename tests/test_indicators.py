@@ -0,0 +1,117 @@
+import datetime
+
+import MyTT
+import numpy as np
+import talib
+
+from chanlun.backtesting import indicators
+from chanlun.cl_interface import Kline
+
+
+class FakeCL:
+    def __init__(self, klines):
+        self.klines = klines
+
+    def get_klines(self):
+        return self.klines
+
+
+def make_klines(nums=600):
+    rng = np.random.default_rng(0)
+    c = 10 + np.cumsum(rng.normal(0, 0.1, nums))
+    h = c + rng.uniform(0, 0.3, nums)
+    l = c - rng.uniform(0, 0.3, nums)
+    # 一段没有波动的K线，KDJ 的 RSV 为空值
+    c[100:115] = h[100:115] = l[100:115] = c[99]
+    start = datetime.datetime(2024, 1, 1)
+    return [
+        Kline(_i, start + datetime.timedelta(days=_i), h[_i], l[_i], c[_i], c[_i], 100)
+        for _i in range(nums)
+    ]
+
+
+def assert_close(a, b):
+    assert np.array_equal(np.isnan(a), np.isnan(b))
+    assert np.allclose(a[~np.isnan(a)], b[~np.isnan(b)], rtol=0, atol=1e-9)
+
+
+def check_talib(cd):
+    klines = cd.get_klines()
+    c = np.array([_k.c for _k in klines])
+    h = np.array([_k.h for _k in klines])
+    l = np.array([_k.l for _k in klines])
+
+    def values(cls, params):
+        return indicators.indicator_values(cd, cls, params)
+
+    assert_close(values(indicators.MA, (5,))["ma"], talib.MA(c, 5))
+    assert_close(values(indicators.EMA, (10,))["ema"], talib.EMA(c, 10))
+    up, mid, low = talib.BBANDS(c, 20)
+    boll = values(indicators.BOLL, (20,))
+    assert_close(boll["up"], up)
+    assert_close(boll["mid"], mid)
+    assert_close(boll["low"], low)
+    assert_close(values(indicators.RSI, (14,))["rsi"], talib.RSI(c, 14))
+    assert_close(values(indicators.ATR, (14,))["atr"], talib.ATR(h, l, c, 14))
+    assert_close(values(indicators.CCI, (14,))["cci"], talib.CCI(h, l, c, 14))
+    k, d, j = MyTT.KDJ(c, h, l, 9, 3, 3)
+    kdj = values(indicators.KDJ, (9, 3, 3))
+    assert_close(kdj["k"], k)
+    assert_close(kdj["d"], d)
+    assert_close(kdj["j"], j)
+    dif, dea, hist = talib.MACD(c, 12, 26, 9)
+    macd = values(indicators.MACD, (12, 26, 9))
+    assert_close(macd["dif"], dif)
+    assert_close(macd["dea"], dea)
+    assert_close(macd["hist"], hist)
+
+
+def test_incremental_same_as_talib():
+    klines = make_klines()
+    cd = FakeCL(klines[:300])
+    check_talib(cd)
+    # 逐根追加K线，增量计算
+    for _i in range(300, len(klines)):
+        cd.klines = klines[: _i + 1]
+        indicators.indicator_values(cd, indicators.MACD, (12, 26, 9))
+        indicators.indicator_values(cd, indicators.KDJ, (9, 3, 3))
+    check_talib(cd)
+
+    # 最后几根K线发生变化，从变化的位置重新计算
+    cd.klines = list(klines)
+    for _i in [-3, -1]:
+        _k = klines[_i]
+        cd.klines[_i] = Kline(_k.index, _k.date, _k.h + 1, _k.l, _k.o, _k.c + 0.5, 1)
+    check_talib(cd)
+
+    # 重新加载的K线
+    cd.klines = klines[50:]
+    check_talib(cd)
+
+
+def test_window_and_end_datetime():
+    klines = make_klines(200)
+    cd = FakeCL(klines)
+    full = indicators.indicator_values(cd, indicators.MA, (5,))["ma"]
+    tail = indicators.indicator_values(cd, indicators.MA, (5,), window=50)["ma"]
+    assert np.array_equal(tail, full[-50:])
+    # 返回的是副本，修改不影响缓存
+    tail[:] = 0
+    assert np.array_equal(
+        indicators.indicator_values(cd, indicators.MA, (5,), window=50)["ma"],
+        full[-50:],
+    )
+    end = indicators.indicator_values(
+        cd, indicators.MA, (5,), window=50, end_datetime=klines[-11].date
+    )["ma"]
+    assert np.array_equal(end, full[-50:-10])
+
+
+def test_fill_history():
+    # 历史K线一次性计算，之后逐根追加计算，结果都与 talib 一致（包括各个指标开始计算的位置，以及 KDJ 的空值）
+    klines = make_klines(130)
+    for nums in [*range(indicators.CHECK_NUMS + 1, 45), *range(100, 126)]:
+        cd = FakeCL(klines[:nums])
+        check_talib(cd)
+        cd.klines = klines[: nums + 3]
+        check_talib(cd)
@@ -0,0 +1,55 @@
+import importlib.util
+import pathlib
+
+import numpy as np
+import pytest
+
+flask = pytest.importorskip("flask")
+orjson = pytest.importorskip("orjson")
+
+# 直接加载模块文件，不导入 cl_app 包（包初始化时会创建定时任务等）
+_spec = importlib.util.spec_from_file_location(
+    "json_provider",
+    pathlib.Path(__file__).parents[1]
+    / "web"
+    / "chanlun_chart"
+    / "cl_app"
+    / "json_provider.py",
+)
+json_provider = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(json_provider)
+
+
+def make_app():
+    app = flask.Flask(__name__)
+    app.json = json_provider.FastJSONProvider(app)
+
+    @app.route("/data")
+    def data():
+        return {"b": np.float64(1.5), "a": [1, 2], "n": np.arange(2)}
+
+    return app
+
+
+def test_response_use_orjson(monkeypatch):
+    calls = []
+    dumps = orjson.dumps
+
+    def count_dumps(*args, **kwargs):
+        calls.append(1)
+        return dumps(*args, **kwargs)
+
+    monkeypatch.setattr(json_provider.orjson, "dumps", count_dumps)
+    app = make_app()
+    rs = app.test_client().get("/data")
+    # 路由返回的结果使用 orjson 编码，与 Flask 默认一样按照 key 排序
+    assert len(calls) == 1
+    assert rs.mimetype == "application/json"
+    assert rs.data == b'{"a":[1,2],"b":1.5,"n":[0,1]}\n'
+
+    # 调试模式下缩进两个空格，与 Flask 默认的格式一致
+    app.debug = True
+    rs = app.test_client().get("/data")
+    assert len(calls) == 2
+    assert rs.data.decode("utf-8").startswith('{\n  "a": [\n    1,')
+    assert rs.json == {"a": [1, 2], "b": 1.5, "n": [0, 1]}
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from chanlun.backtesting.klines_aggregator import KlinesFrequencyAggregator
+from chanlun.exchange.exchange import convert_stock_kline_frequency
+
+
+def make_5m_klines(days):
+    dates = []
+    for _d in pd.bdate_range("2023-03-01", periods=days):
+        for _s, _e in [("09:35", "11:30"), ("13:05", "15:00")]:
+            dates.extend(
+                pd.date_range(f"{_d.date()} {_s}", f"{_d.date()} {_e}", freq="5min")
+            )
+    prices = np.random.default_rng(0).random(len(dates)) * 10 + 10
+    return pd.DataFrame(
+        {
+            "code": "SH.600000",
+            "date": pd.DatetimeIndex(dates).tz_localize("Asia/Shanghai"),
+            "open": prices,
+            "high": prices + 1,
+            "low": prices - 1,
+            "close": prices + 0.5,
+            "volume": 100.0,
+        }
+    )
+
+
+def test_update_forming_bar_same_as_convert():
+    ex = SimpleNamespace(
+        market="a", convert_kline_frequency=convert_stock_kline_frequency
+    )
+    min_klines = make_5m_klines(3)
+    min_ts = pd.DatetimeIndex(min_klines["date"]).as_unit("ns").asi8
+
+    for to_f in ["30m", "60m", "d"]:
+        aggregator = KlinesFrequencyAggregator(ex)
+        assert aggregator.build(f"5m_{to_f}", min_klines, min_ts, to_f)
+        all_max = convert_stock_kline_frequency(min_klines.copy(), to_f)
+        all_max = all_max[["code", "date", "open", "close", "high", "low", "volume"]]
+
+        for i in range(1, len(min_klines)):
+            klines = min_klines.iloc[: i + 1]
+            # 大周期K线截止到当前时间（后对其，包含当前时间）
+            max_klines = all_max[all_max["date"] <= klines["date"].iloc[-1]]
+            if len(max_klines) == 0:
+                continue
+            new_max = aggregator.update(f"5m_{to_f}", klines, max_klines)
+            expected = convert_stock_kline_frequency(klines.copy(), to_f).iloc[-1]
+
+            assert new_max["date"].is_monotonic_increasing
+            last = new_max.iloc[-1]
+            assert last["date"] == expected["date"]
+            for _c in ["open", "close", "high", "low", "volume"]:
+                assert last[_c] == expected[_c]
+
+
+def test_build_fail_out_of_session():
+    ex = SimpleNamespace(
+        market="a", convert_kline_frequency=convert_stock_kline_frequency
+    )
+    min_klines = make_5m_klines(1)
+    min_klines.loc[0, "date"] = pd.Timestamp("2023-03-01 08:00", tz="Asia/Shanghai")
+    min_ts = pd.DatetimeIndex(min_klines["date"]).as_unit("ns").asi8
+
+    aggregator = KlinesFrequencyAggregator(ex)
+    # 60m 周期转换不支持交易时间之外的K线，使用原来的转换方式
+    assert aggregator.build("5m_60m", min_klines, min_ts, "60m") is False
+    assert aggregator.update("5m_60m", min_klines, min_klines) is None
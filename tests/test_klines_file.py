@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from chanlun.klines_file import KlinesBinFile
+
+
+def make_tdx_klines(start, periods):
+    dates = pd.date_range(start, periods=periods, freq="5min")
+    prices = np.arange(periods, dtype=float)
+    return pd.DataFrame(
+        {
+            "open": prices,
+            "close": prices + 0.5,
+            "high": prices + 1,
+            "low": prices - 1,
+            "vol": np.arange(periods, dtype=np.int64) * 100,
+            "datetime": dates.strftime("%Y-%m-%d %H:%M"),
+            "date": dates,
+        }
+    )
+
+
+def test_write_read(tmp_path):
+    klines = make_tdx_klines("2024-01-02 09:35", 100)
+    bin_file = KlinesBinFile(tmp_path / "SH_600000_5m.kbin")
+    assert bin_file.write(klines) == 100
+
+    read_klines = bin_file.read()
+    pd.testing.assert_frame_equal(read_klines, klines, check_dtype=False)
+    assert read_klines["date"].dtype == "datetime64[ns]"
+    assert read_klines["vol"].dtype == np.int64
+
+
+def test_write_only_append_new_klines(tmp_path):
+    bin_file = KlinesBinFile(tmp_path / "SH_600000_5m.kbin")
+    klines = make_tdx_klines("2024-01-02 09:35", 100)
+    bin_file.write(klines)
+
+    # 最后一根K线更新，并增加了 10 根新的K线
+    new_klines = make_tdx_klines("2024-01-02 09:35", 110)
+    new_klines.loc[99, "close"] = 1000.0
+    assert bin_file.write(new_klines) == 11
+    pd.testing.assert_frame_equal(bin_file.read(), new_klines, check_dtype=False)
+
+    # 没有变化不会写入
+    assert bin_file.write(new_klines) == 0
+
+    # 列有变化，全部重写
+    new_klines["amount"] = 1.0
+    assert bin_file.write(new_klines) == 110
+    assert "amount" in bin_file.read().columns
+
+
+def test_tz_date(tmp_path):
+    klines = make_tdx_klines("2024-01-02 09:35", 10)
+    klines["date"] = klines["date"].dt.tz_localize("Asia/Shanghai")
+    bin_file = KlinesBinFile(tmp_path / "SH_600000_5m.kbin")
+    bin_file.write(klines)
+    assert (bin_file.read()["date"] == klines["date"]).all()
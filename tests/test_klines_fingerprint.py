@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from chanlun.cl_interface import Kline
+from chanlun.klines_fingerprint import KlinesFingerprint
+
+
+def make_klines(start, periods):
+    dates = pd.date_range(start, periods=periods, freq="5min", tz="Asia/Shanghai")
+    prices = np.arange(periods, dtype=float) + 10
+    return pd.DataFrame(
+        {
+            "code": "SH.600000",
+            "date": dates,
+            "open": prices,
+            "high": prices + 1,
+            "low": prices - 1,
+            "close": prices + 0.5,
+            "volume": np.arange(periods, dtype=np.int64) * 100,
+        }
+    )
+
+
+def test_from_cl_klines():
+    klines = make_klines("2024-01-02 09:35", 50)
+    cl_klines = [
+        Kline(_i, _k.date, _k.high, _k.low, _k.open, _k.close, float(_k.volume))
+        for _i, _k in enumerate(klines.itertuples())
+    ]
+    fp = KlinesFingerprint.from_klines(klines)
+    cl_fp = KlinesFingerprint.from_cl_klines(cl_klines)
+    assert np.array_equal(fp.dates, cl_fp.dates)
+    assert np.array_equal(fp.prefix, cl_fp.prefix)
+    assert len(KlinesFingerprint.from_cl_klines([])) == 0
+
+
+def test_can_update():
+    klines = make_klines("2024-01-02 09:35", 100)
+    fp = KlinesFingerprint.from_klines(klines.iloc[:80])
+
+    # 新的K线从中间开始，最后一根K线有变化
+    new_klines = klines.iloc[30:].copy()
+    new_klines.loc[79, "close"] = 100
+    new_fp = KlinesFingerprint.from_klines(new_klines)
+    assert fp.can_update(new_fp)
+    update_fp = fp.update(new_fp)
+    full_fp = KlinesFingerprint.from_klines(new_klines.combine_first(klines))
+    assert np.array_equal(update_fp.dates, full_fp.dates)
+    assert np.array_equal(update_fp.prefix, full_fp.prefix)
+
+    # 重叠部分的历史K线有变化（复权）
+    change_klines = klines.iloc[30:].copy()
+    change_klines.loc[40, "open"] += 0.01
+    assert fp.can_update(KlinesFingerprint.from_klines(change_klines)) is False
+
+    # 重叠部分缺少K线
+    assert fp.can_update(KlinesFingerprint.from_klines(klines.drop(index=50))) is False
+
+    # 不连续
+    assert fp.can_update(KlinesFingerprint.from_klines(klines.iloc[85:])) is False
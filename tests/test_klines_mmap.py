@@ -0,0 +1,58 @@
+import os
+import time
+
+import numpy as np
+
+from chanlun.backtesting.klines_mmap import KlinesMmapCache
+
+
+class FakeExchange:
+    """
+    模拟的数据库行情，记录读取K线的次数
+    """
+
+    market = "a"
+
+    def __init__(self):
+        self.close = np.arange(10, dtype=float)
+        self.reads = 0
+
+    def klines_arrays(self, code, frequency, start_date, end_date, args=None):
+        self.reads += 1
+        return {"date": np.arange(len(self.close), dtype=np.int64), "close": self.close}
+
+    def klines_stats(self, code, frequency, start_date, end_date):
+        return {
+            "rows": len(self.close),
+            "last_dt": str(len(self.close) - 1),
+            "checksum": float(self.close.sum()),
+        }
+
+
+def test_rebuild_when_data_changed(tmp_path):
+    ex = FakeExchange()
+    args = ("SH.600000", "d", "2024-01-01", "2024-12-31")
+    cache = KlinesMmapCache(ex, tmp_path)
+    path_1 = cache.build(*args)
+    assert cache.build(*args) == path_1 and ex.reads == 1
+
+    # 修正K线数据后，重新生成并删除旧版本
+    ex.close = ex.close.copy()
+    ex.close[5] = 100
+    path_2 = cache.build(*args)
+    assert path_2 != path_1 and ex.reads == 2
+    assert path_1.exists() is False
+    assert np.load(path_2 / "close.npy")[5] == 100
+
+
+def test_clean_unused(tmp_path):
+    ex = FakeExchange()
+    cache = KlinesMmapCache(ex, tmp_path)
+    old_path = cache.build("SH.600000", "d", "2024-01-01", "2024-12-31")
+    new_path = cache.build("SH.600001", "d", "2024-01-01", "2024-12-31")
+    old_time = time.time() - 10 * 86400
+    os.utime(old_path, (old_time, old_time))
+
+    # 创建缓存对象时，删除超过保留天数没有使用的目录
+    KlinesMmapCache(ex, tmp_path, keep_days=7)
+    assert old_path.exists() is False and new_path.exists()
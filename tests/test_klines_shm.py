@@ -0,0 +1,38 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from chanlun.backtesting.klines_shm import KlinesSharedMemory
+
+
+def read_shm(name, layout):
+    shm, values = KlinesSharedMemory.attach(name, layout)
+    res = {_f: {_c: _v.copy() for _c, _v in _cs.items()} for _f, _cs in values.items()}
+    del values
+    shm.close()
+    return res
+
+
+def test_create_and_attach_in_process():
+    values = {
+        "d": {
+            "date": np.arange(10, dtype=np.int64) * 86400,
+            "close": np.linspace(1, 2, 10),
+        },
+        "5m": {
+            "date": np.arange(100, dtype=np.int64) * 300,
+            "close": np.linspace(1, 2, 100),
+        },
+    }
+    shm, layout = KlinesSharedMemory.create(values)
+    try:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            res = executor.submit(read_shm, shm.name, layout).result()
+        for _f, _columns in values.items():
+            for _c, _v in _columns.items():
+                assert res[_f][_c].dtype == _v.dtype
+                np.testing.assert_array_equal(res[_f][_c], _v)
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from chanlun.klines_store import KlinesParquetStore
+
+
+def make_klines(start, periods):
+    dates = pd.date_range(start, periods=periods, freq="D").tz_localize("Asia/Shanghai")
+    prices = np.arange(periods, dtype=float)
+    return pd.DataFrame(
+        {
+            "code": "SH.000001",
+            "date": dates,
+            "open": prices,
+            "high": prices + 1,
+            "low": prices - 1,
+            "close": prices,
+            "volume": 1.0,
+        }
+    )
+
+
+def test_insert_partitions_by_year_and_queries_range(tmp_path):
+    store = KlinesParquetStore(tmp_path)
+    store.insert("a", "SH.000001", "d", make_klines("2022-12-01", 100))
+
+    files = store.year_files("a", "SH.000001", "d")
+    assert [f.stem for f in files] == ["2022", "2023"]
+
+    df = store.query(
+        "a",
+        "SH.000001",
+        "d",
+        start_date=pd.Timestamp("2022-12-25").to_pydatetime(),
+        end_date=pd.Timestamp("2023-01-05").to_pydatetime(),
+        limit=None,
+    )
+    assert len(df) == 12
+    assert df["dt"].is_monotonic_increasing
+
+
+def test_query_limit_and_upsert_keep_last(tmp_path):
+    store = KlinesParquetStore(tmp_path)
+    klines = make_klines("2022-12-01", 100)
+    store.insert("a", "SH.000001", "d", klines)
+
+    update = klines.iloc[-1:].copy()
+    update["close"] = 1000.0
+    store.insert("a", "SH.000001", "d", update)
+
+    last = store.query("a", "SH.000001", "d", limit=3)
+    assert len(last) == 3
+    assert last.iloc[-1]["c"] == 1000.0
+
+    first = store.query("a", "SH.000001", "d", limit=3, order="asc")
+    assert first.iloc[0]["dt"] == pd.Timestamp("2022-12-01")
+
+    assert store.last_datetime("a", "SH.000001", "d") == "2023-03-10"
+
+
+def test_delete(tmp_path):
+    store = KlinesParquetStore(tmp_path)
+    klines = make_klines("2023-01-01", 10)
+    store.insert("a", "SH.000001", "d", klines)
+
+    store.delete("a", "SH.000001", "d", pd.Timestamp("2023-01-10").to_pydatetime())
+    assert store.last_datetime("a", "SH.000001", "d") == "2023-01-09"
+
+    store.delete("a", "SH.000001")
+    assert len(store.query("a", "SH.000001", "d")) == 0
+
+
+def test_range_stats(tmp_path):
+    store = KlinesParquetStore(tmp_path)
+    klines = make_klines("2022-12-01", 100)
+    store.insert("a", "SH.000001", "d", klines)
+
+    stats = store.range_stats(
+        "a",
+        "SH.000001",
+        "d",
+        start_date=pd.Timestamp("2022-12-25").to_pydatetime(),
+        end_date=pd.Timestamp("2023-01-05").to_pydatetime(),
+    )
+    assert stats["rows"] == 12
+    assert stats["last_dt"] == pd.Timestamp("2023-01-05")
+
+    # 修正K线后统计信息变化
+    update = klines.iloc[30:31].copy()
+    update["close"] = 1000.0
+    store.insert("a", "SH.000001", "d", update)
+    new_stats = store.range_stats(
+        "a",
+        "SH.000001",
+        "d",
+        start_date=pd.Timestamp("2022-12-25").to_pydatetime(),
+        end_date=pd.Timestamp("2023-01-05").to_pydatetime(),
+    )
+    assert new_stats["rows"] == 12 and new_stats["checksum"] != stats["checksum"]
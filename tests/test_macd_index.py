@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import numpy as np
+import talib
+
+from chanlun import macd_index
+from chanlun.cl_interface import query_macd_ld
+
+
+class FakeCL:
+    def __init__(self, closes):
+        self.set_closes(closes)
+
+    def set_closes(self, closes):
+        dif, dea, hist = talib.MACD(np.array(closes), 12, 26, 9)
+        self.macd = {"dif": list(dif), "dea": list(dea), "hist": list(hist * 2)}
+
+    def get_idx(self):
+        return {"macd": self.macd}
+
+
+def make_closes(nums=800):
+    rng = np.random.default_rng(0)
+    return list(10 + np.cumsum(rng.normal(0, 0.1, nums)))
+
+
+def cross_nums(one, two):
+    return int(np.sum((one[:-1] < two[:-1]) & (one[1:] > two[1:])))
+
+
+def check_ranges(cd, ranges):
+    index = macd_index.macd_index(cd)
+    dif, dea, hist = (np.array(cd.macd[_n]) for _n in ("dif", "dea", "hist"))
+    for s, e in ranges:
+        d, a, h = dif[s : e + 1], dea[s : e + 1], hist[s : e + 1]
+        assert np.isclose(index.range_max("hist", s, e), np.nanmax(h))
+        assert np.isclose(index.range_min("dif", s, e), np.nanmin(d))
+        assert np.isclose(index.range_max("dea", s, e), np.nanmax(a))
+        assert np.isclose(index.range_sum("hist_up", s, e), h[h > 0].sum())
+        assert np.isclose(index.range_sum("hist_down", s, e), h[h < 0].sum())
+
+        zero = np.zeros(len(d))
+        nums = index.cross_nums(s, e)
+        assert nums["dif_up_cross"] == cross_nums(d, zero)
+        assert nums["dea_down_cross"] == cross_nums(zero, a)
+        assert nums["gold_cross"] == cross_nums(d, a)
+        assert nums["die_cross"] == cross_nums(a, d)
+
+        fx_s = SimpleNamespace(index=0, k=SimpleNamespace(k_index=s))
+        fx_e = SimpleNamespace(index=1, k=SimpleNamespace(k_index=e))
+        ld = query_macd_ld(cd, fx_s, fx_e)
+        assert np.isclose(ld["hist"]["sum"], np.nansum(np.abs(h)))
+        assert np.isclose(ld["hist"]["down_sum"], abs(h[h < 0].sum()))
+        assert ld["dif"]["end"] == d[-1]
+        assert ld["dea"]["min"] == np.nanmin(a)
+
+
+def test_macd_index_ranges():
+    closes = make_closes()
+    cd = FakeCL(closes)
+    rng = np.random.default_rng(1)
+    ranges = [(0, 799), (40, 40), (40, 41), (100, 357)]
+    for _ in range(200):
+        s = int(rng.integers(33, 799))
+        ranges.append((s, int(rng.integers(s, 800))))
+    check_ranges(cd, ranges)
+
+
+def test_macd_index_incremental():
+    closes = make_closes(900)
+    cd = FakeCL(closes[:500])
+    index = macd_index.macd_index(cd)
+    assert index.n == 500
+
+    # 追加K线，以及最后一根K线价格变化
+    for nums in range(501, 900, 37):
+        cd.set_closes(closes[: nums - 1] + [closes[nums - 1] + 0.5])
+        check_ranges(cd, [(33, nums - 1), (nums - 20, nums - 1)])
+        cd.set_closes(closes[:nums])
+        check_ranges(cd, [(33, nums - 1), (nums - 3, nums - 1), (200, 400)])
+    assert macd_index.macd_index(cd) is index
+
+    # 数据全部变化，重新计算
+    cd.set_closes([_c + 1 for _c in closes[:600]])
+    check_ranges(cd, [(33, 599), (300, 450)])
+
+
+def test_macd_index_empty_range():
+    cd = FakeCL(make_closes(100))
+    index = macd_index.macd_index(cd)
+    assert np.isnan(index.range_max("hist", 200, 300))
+    assert index.range_sum("hist_up", 200, 300) == 0
+    assert index.ld(200, 300)["hist"]["sum"] == 0
+    assert index.cross_nums(50, 50)["gold_cross"] == 0
@@ -0,0 +1,38 @@
+from chanlun.backtesting.optimize import OptimizationSetting, TPESampler
+
+
+def make_setting():
+    setting = OptimizationSetting()
+    setting.add_cl_parameter("a", list(range(20)))
+    setting.add_cl_parameter("b", list(range(20)))
+    setting.add_cl_parameter("c", list(range(20)))
+    return setting
+
+
+def objective(s):
+    return -((s["a"] - 13) ** 2) - (s["b"] - 4) ** 2 - (s["c"] - 17) ** 2
+
+
+def test_tpe_ask_unique_and_exhaust_space():
+    sampler = TPESampler({"a": [1, 2], "b": [True, False]}, n_startup_trials=2, seed=1)
+    keys = set()
+    for _ in range(10):
+        for _s in sampler.ask(3):
+            keys.add(repr(sorted(_s.items())))
+            sampler.tell(_s, 0)
+    assert len(keys) == 4
+    assert len(sampler.trials) == 4
+    assert sampler.ask(1) == []
+
+
+def test_tpe_find_best_area():
+    setting = make_setting()
+    assert len(setting.generate_cl_settings()) == 8000
+
+    sampler = TPESampler(setting.cl_config_params, seed=0)
+    for _ in range(20):
+        for _s in sampler.ask(3):
+            sampler.tell(_s, objective(_s))
+    best = max(sampler.trials, key=lambda _t: _t[1])
+    # 只试验 60 个组合，应该找到接近最优的组合
+    assert best[1] >= -10
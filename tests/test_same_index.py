@@ -0,0 +1,109 @@
+import math
+
+import numpy as np
+
+from chanlun.xuangu import same_index
+
+
+def reference_dtw(s1, s2):
+    n, m = len(s1), len(s2)
+    acc = np.full((n + 1, m + 1), np.inf)
+    acc[0, 0] = 0
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            cost = float(((s1[i - 1] - s2[j - 1]) ** 2).sum())
+            acc[i, j] = cost + min(acc[i - 1, j], acc[i, j - 1], acc[i - 1, j - 1])
+    return math.sqrt(acc[n, m])
+
+
+def make_features(rng, nums):
+    prices = 10 + np.cumsum(rng.normal(0, 0.5, nums))
+    times = np.sort(rng.choice(1000, nums, replace=False))
+    return list(zip(prices.tolist(), times.tolist()))
+
+
+def make_index(tmp_path, nums=40):
+    rng = np.random.default_rng(0)
+    index = same_index.SameFeatureIndex(
+        "a", "d", "test", 40, 9, 3, path=tmp_path / "index.npz"
+    )
+    for _i in range(nums):
+        index.set(
+            f"C{_i}",
+            1700000000 + _i,
+            k_features=make_features(rng, 40),
+            bi_features=make_features(rng, 9),
+            xd_features=make_features(rng, 3),
+            bi_mmds=["1buy"] if _i % 2 == 0 else [],
+            bi_bcs=["bi"] if _i % 3 == 0 else [],
+        )
+    return index
+
+
+def test_dtw_distances_match_reference():
+    rng = np.random.default_rng(1)
+    query = rng.random((9, 2))
+    candidates = rng.random((300, 9, 2))
+    distances = same_index.dtw_distances(query, candidates)
+    for _i in [0, 1, 150, 299]:
+        assert np.isclose(distances[_i], reference_dtw(query, candidates[_i]))
+    # DTW 距离不大于逐点对齐的距离
+    assert (distances <= same_index.lockstep_distances(query, candidates) + 1e-12).all()
+
+
+def test_normalize_features():
+    norm = same_index.normalize_features([(10, 5), (20, 5), (15, 5)])
+    assert np.allclose(norm, [[0, 0], [1, 0], [0.5, 0]])
+
+
+def test_index_query(tmp_path):
+    index = make_index(tmp_path)
+    target = index.items["C4"]
+    kwargs = {
+        "k_features": target["k"],
+        "bi_features": target["bi"],
+        "xd_features": target["xd"],
+        "bi_mmds": [],
+        "bi_bcs": [],
+    }
+    res = index.query(**kwargs)
+    assert len(res) == 40
+    assert res[0]["code"] == "C4"
+    assert np.isclose(res[0]["similarity"], 1)
+    assert all(res[_i]["similarity"] >= res[_i + 1]["similarity"] for _i in range(39))
+
+    # 排除代码，以及买卖点背驰的过滤
+    res = index.query(**kwargs, exclude_codes=["C4"])
+    assert "C4" not in [_r["code"] for _r in res]
+    res = index.query(**{**kwargs, "bi_mmds": ["1buy"], "bi_bcs": ["bi"]})
+    assert {_r["code"] for _r in res} == {
+        f"C{_i}" for _i in range(40) if _i % 2 == 0 or _i % 3 == 0
+    }
+
+    # 近似查询，只计算候选代码
+    res = index.query(**kwargs, ann_candidates=5)
+    assert len(res) == 5
+    assert res[0]["code"] == "C4"
+
+
+def test_index_save_load(tmp_path):
+    index = make_index(tmp_path)
+    index.remove("C1")
+    index.save()
+
+    loaded = same_index.SameFeatureIndex(
+        "a", "d", "test", 40, 9, 3, path=tmp_path / "index.npz"
+    )
+    assert loaded.load()
+    assert len(loaded) == 39
+    assert "C1" not in loaded
+    assert loaded.get_date("C2") == 1700000002
+    assert loaded.items["C0"]["mmds"] == {"1buy"}
+    assert loaded.items["C5"]["mmds"] == set()
+    assert np.array_equal(loaded.matrix()["k"], index.matrix()["k"])
+
+    # 特征数量不同，不使用索引文件
+    other = same_index.SameFeatureIndex(
+        "a", "d", "test", 50, 9, 3, path=tmp_path / "index.npz"
+    )
+    assert not other.load()
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytz
+
+from chanlun.exchange import tdx_fq
+
+TZ = pytz.timezone("Asia/Shanghai")
+
+
+def make_klines():
+    dates = pd.DatetimeIndex(
+        ["2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05", "2024-01-08"]
+    ) + pd.Timedelta(hours=15)
+    closes = np.array([10.0, 11.0, 5.0, 6.0, 6.5])
+    return pd.DataFrame(
+        {
+            "code": "SH.600000",
+            "date": dates.tz_localize(TZ),
+            "open": closes,
+            "close": closes,
+            "high": closes + 0.5,
+            "low": closes - 0.5,
+            "volume": 100.0,
+        }
+    )
+
+
+def make_xdxr():
+    return pd.DataFrame(
+        [
+            # 01-04 除权：每 10 股分红 2 元，送转 10 股
+            {
+                "category": 1,
+                "date": pd.Timestamp("2024-01-04"),
+                "fenhong": 2.0,
+                "peigu": 0.0,
+                "peigujia": 0.0,
+                "songzhuangu": 10.0,
+                "suogu": np.nan,
+            },
+            # 01-08 缩股：2 股合 1 股
+            {
+                "category": 11,
+                "date": pd.Timestamp("2024-01-08"),
+                "fenhong": np.nan,
+                "peigu": np.nan,
+                "peigujia": np.nan,
+                "songzhuangu": np.nan,
+                "suogu": 2.0,
+            },
+            # K线范围之后的除权不处理
+            {
+                "category": 1,
+                "date": pd.Timestamp("2024-02-01"),
+                "fenhong": 5.0,
+                "peigu": 0.0,
+                "peigujia": 0.0,
+                "songzhuangu": 0.0,
+                "suogu": np.nan,
+            },
+        ]
+    )
+
+
+def test_klines_fq():
+    events = tdx_fq.xdxr_events(make_xdxr(), TZ)
+    klines = make_klines()
+
+    qfq = tdx_fq.klines_fq(klines, events, "qfq")
+    # 缩股之前的价格除以 2，成交量乘以 2；除权因子 = (5.5 * 10 - 2) / (20 * 5.5)
+    factor = (5.5 * 10 - 2) / (20 * 5.5)
+    assert qfq["close"].tolist() == [
+        round(5.0 * factor, 3),
+        round(5.5 * factor, 3),
+        2.5,
+        3.0,
+        6.5,
+    ]
+    assert qfq["volume"].tolist() == [200.0, 200.0, 200.0, 200.0, 100.0]
+
+    hfq = tdx_fq.klines_fq(klines, events, "hfq")
+    assert hfq["close"].tolist() == [
+        5.0,
+        5.5,
+        round(2.5 * factor, 3),
+        round(3.0 * factor, 3),
+        round(6.5 * factor, 3),
+    ]
+    # 原始数据不变
+    assert klines["close"].tolist() == [10.0, 11.0, 5.0, 6.0, 6.5]
+
+
+def test_klines_fq_empty():
+    events = tdx_fq.xdxr_events(pd.DataFrame([]), TZ)
+    klines = make_klines()
+    assert tdx_fq.klines_fq(klines, events, "qfq") is klines
+
+
+def test_klines_fq_dividend_at_first_kline():
+    # 除权日期与第一根K线时间相同，之前没有K线，不处理
+    xdxr = make_xdxr().iloc[[0]].copy()
+    xdxr["date"] = pd.Timestamp("2024-01-02 15:00")
+    events = tdx_fq.xdxr_events(xdxr, TZ)
+    klines = make_klines()
+    for _fq in ["qfq", "hfq"]:
+        res = tdx_fq.klines_fq(klines, events, _fq)
+        assert res["close"].tolist() == klines["close"].tolist()
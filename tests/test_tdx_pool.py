@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from chanlun.exchange.tdx_pool import TdxConnectionPool
+
+# 无法连接的服务器
+BAD_SERVERS = set()
+
+
+class FakeApi:
+    """
+    模拟的通达信接口，记录连接的服务器与请求的线程
+    """
+
+    def __init__(self):
+        self.server = None
+        self.alive = True
+        self.calls = 0
+
+    def connect(self, ip, port):
+        if (ip, port) in BAD_SERVERS:
+            raise ConnectionError(f"connect {ip}:{port} fail")
+        self.server = (ip, port)
+        return self
+
+    def disconnect(self):
+        self.alive = False
+
+    def get_security_count(self, market):
+        return 100 if self.alive else None
+
+    def get_page(self, page):
+        self.calls += 1
+        time.sleep(0.05)
+        return (page, threading.get_ident())
+
+
+SERVERS = [{"ip": "127.0.0.1", "port": 7709}, {"ip": "127.0.0.2", "port": 7709}]
+
+
+def test_reuse_connection():
+    pool = TdxConnectionPool(FakeApi, SERVERS, size=2)
+    with pool.connection() as api_1:
+        pass
+    with pool.connection() as api_2:
+        pass
+    assert api_1 is api_2
+    assert pool.stats["connects"] == 1 and pool.stats["reuses"] == 1
+
+    # 使用中出现异常的连接被关闭，不会放回
+    with pytest.raises(ValueError), pool.connection() as api_3:
+        raise ValueError("error")
+    assert api_3.alive is False
+    with pool.connection() as api_4:
+        pass
+    assert api_4 is not api_3
+
+
+def test_health_check_and_servers():
+    BAD_SERVERS.add(("127.0.0.1", 7709))
+    try:
+        pool = TdxConnectionPool(
+            FakeApi,
+            SERVERS,
+            size=2,
+            health_check=lambda _api: _api.get_security_count(0) is not None,
+            check_idle_seconds=0,
+        )
+        # 第一个服务器连接失败，使用下一个服务器
+        with pool.connection() as api:
+            assert api.server == ("127.0.0.2", 7709)
+        # 空闲的连接检查不可用，重新连接
+        api.alive = False
+        with pool.connection() as new_api:
+            pass
+        assert new_api is not api and pool.stats["check_fails"] == 1
+
+        BAD_SERVERS.add(("127.0.0.2", 7709))
+        pool.set_servers(SERVERS)
+        with pytest.raises(ConnectionError), pool.connection():
+            pass
+    finally:
+        BAD_SERVERS.clear()
+
+
+def test_map_concurrent():
+    pool = TdxConnectionPool(FakeApi, SERVERS, size=4)
+    s_time = time.time()
+    results = pool.map(lambda _api, _p: _api.get_page(_p), range(8))
+    assert [_r[0] for _r in results] == list(range(8))
+    # 8 页分 4 个连接并发请求，用时大约为 2 页
+    assert time.time() - s_time < 0.05 * 6
+    assert len({_r[1] for _r in results}) > 1
+    assert pool.stats["connects"] <= 4
+    assert len(pool.idle) == pool.stats["connects"]
+
+
+def test_map_return_exceptions():
+    pool = TdxConnectionPool(FakeApi, SERVERS, size=2)
+
+    def get_page(_api, _p):
+        if _p == 2:
+            raise ValueError("error")
+        return _api.get_page(_p)[0]
+
+    with pytest.raises(ValueError):
+        pool.map(get_page, range(4))
+    # 异常作为结果返回，其他参数的结果不受影响
+    results = pool.map(get_page, range(4), return_exceptions=True)
+    assert [_r for _i, _r in enumerate(results) if _i != 2] == [0, 1, 3]
+    assert isinstance(results[2], ValueError)
+    assert all(_api.alive for _api, _, _ in pool.idle)
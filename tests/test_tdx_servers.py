@@ -0,0 +1,64 @@
+import time
+
+from chanlun.db import db
+from chanlun.exchange.tdx_servers import TdxServerTracker
+
+SERVERS = [
+    {"ip": "127.0.0.1", "port": 7709},
+    {"ip": "127.0.0.2", "port": 7709},
+    {"ip": "127.0.0.3", "port": 7709, "name": "测试"},
+]
+
+
+def fake_ping(latencys: dict):
+    def ping(server):
+        time.sleep(0.1)
+        latency = latencys[server["ip"]]
+        if latency is None:
+            raise ConnectionError("ping fail")
+        return latency
+
+    return ping
+
+
+def test_probe_and_rank():
+    latencys = {"127.0.0.1": 0.3, "127.0.0.2": 0.1, "127.0.0.3": None}
+    probe_results = []
+    tracker = TdxServerTracker(
+        SERVERS, fake_ping(latencys), on_probe=probe_results.append
+    )
+    assert tracker.has_scores() is False
+
+    # 并发 ping 所有服务器
+    s_time = time.time()
+    ranked = tracker.probe()
+    assert time.time() - s_time < 0.25
+    assert [_s["ip"] for _s in ranked] == ["127.0.0.2", "127.0.0.1", "127.0.0.3"]
+    assert probe_results == [ranked]
+    assert tracker.ranked(1) == [{"ip": "127.0.0.2", "port": 7709}]
+
+    # 延迟按照 EWMA 更新
+    latencys["127.0.0.2"] = 0.2
+    tracker.probe()
+    assert abs(tracker.scores["127.0.0.2:7709"]["latency"] - 0.13) < 1e-6
+
+    # 连接失败的服务器降低排名，自动切换到下一个服务器
+    tracker.report_error({"ip": "127.0.0.2", "port": 7709})
+    assert tracker.ranked(1) == [{"ip": "127.0.0.1", "port": 7709}]
+    assert tracker.scores["127.0.0.2:7709"]["fails"] == 1
+
+
+def test_persist():
+    cache_key = "test_tdx_server_scores"
+    try:
+        latencys = {"127.0.0.1": 0.3, "127.0.0.2": None, "127.0.0.3": 0.1}
+        tracker = TdxServerTracker(SERVERS, fake_ping(latencys), cache_key=cache_key)
+        tracker.probe()
+
+        # 重启后直接使用保存的排名，不需要重新 ping
+        new_tracker = TdxServerTracker(SERVERS, fake_ping({}), cache_key=cache_key)
+        assert new_tracker.has_scores()
+        assert new_tracker.ranked() == tracker.ranked()
+        assert new_tracker.ranked(1) == [{"ip": "127.0.0.3", "port": 7709}]
+    finally:
+        db.cache_del(cache_key)
@@ -0,0 +1,145 @@
+import datetime
+
+import pandas as pd
+
+from chanlun import fun
+from chanlun.cl_interface import BI, FX, ZS, CLKline
+from chanlun.tv_chart import cl_data_to_tv_chart, datetimes_to_ints
+
+CHART_CONFIG = {
+    "chart_show_fx": "1",
+    "chart_show_bi": "1",
+    "chart_show_xd": "1",
+    "chart_show_zsd": "0",
+    "chart_show_bi_zs": "1",
+    "chart_show_xd_zs": "0",
+    "chart_show_zsd_zs": "0",
+    "zs_bi_type": ["common"],
+    "zs_xd_type": [],
+    "chart_show_bi_bc": "1",
+    "chart_show_xd_bc": "1",
+    "chart_show_zsd_bc": "1",
+    "chart_show_bi_mmd": "1",
+    "chart_show_xd_mmd": "1",
+    "chart_show_zsd_mmd": "1",
+}
+
+
+class FakeCL:
+    def __init__(self, nums=20):
+        dates = pd.date_range(
+            "2024-01-02 09:35", periods=nums, freq="5min", tz="Asia/Shanghai"
+        )
+        self.klines = [
+            CLKline(_i, _d, _i + 1.0, _i - 1.0, float(_i), _i + 0.5, 10, [], _i)
+            for _i, _d in enumerate(dates)
+        ]
+        self.fxs = [
+            FX("ding" if _i % 2 else "di", self.klines[_i * 4], [], float(_i), _i)
+            for _i in range(nums // 4)
+        ]
+        self.fxs[-1].done = False
+        self.bis = [
+            BI(self.fxs[_i], self.fxs[_i + 1], "up", _i)
+            for _i in range(len(self.fxs) - 1)
+        ]
+        self.zss = [ZS("bi", self.fxs[0], self.fxs[3], 3.0, 1.0)]
+        self.zss[0].done = True
+
+    def get_code(self):
+        return "SH.600000"
+
+    def get_klines(self):
+        return self.klines
+
+    def get_fxs(self):
+        return self.fxs
+
+    def get_bis(self):
+        return self.bis
+
+    def get_xds(self):
+        return []
+
+    def get_zsds(self):
+        return []
+
+    def get_bi_zss(self, zs_type=None):
+        return self.zss
+
+    def get_xd_zss(self, zs_type=None):
+        return []
+
+    def get_zsd_zss(self):
+        return []
+
+
+def test_datetimes_to_ints():
+    tz = datetime.timezone(datetime.timedelta(hours=8))
+    dates = [
+        pd.Timestamp("2024-01-02 09:35:10.6", tz="Asia/Shanghai"),
+        datetime.datetime(2024, 1, 2, 9, 40, tzinfo=tz),
+    ]
+    assert datetimes_to_ints(dates) == [fun.datetime_to_int(_d) for _d in dates]
+    naive_dates = [datetime.datetime(2024, 1, 2, 9, 40)]
+    assert datetimes_to_ints(naive_dates) == [fun.datetime_to_int(naive_dates[0])]
+    assert datetimes_to_ints([]) == []
+
+
+def test_cl_data_to_tv_chart():
+    cd = FakeCL()
+    chart_data = cl_data_to_tv_chart(cd, CHART_CONFIG)
+    assert chart_data["t"] == [fun.datetime_to_int(_k.date) for _k in cd.klines]
+    assert chart_data["c"] == [_k.c for _k in cd.klines]
+    assert len(chart_data["fxs"]) == 5 and len(chart_data["bis"]) == 4
+    assert chart_data["bis"][0] == {
+        "points": [
+            {"time": fun.datetime_to_int(cd.klines[0].date), "price": 0.0},
+            {"time": fun.datetime_to_int(cd.klines[4].date), "price": 1.0},
+        ],
+        "linestyle": "0",
+    }
+    assert chart_data["bis"][-1]["linestyle"] == "1"
+    assert chart_data["bi_zss"][0]["points"][0]["price"] == 3.0
+
+    # 已完成的对象使用缓存的图表数据，未完成的重新生成
+    cd.fxs[-1].val = 10.0
+    new_chart_data = cl_data_to_tv_chart(cd, CHART_CONFIG)
+    assert new_chart_data["bis"][0] is chart_data["bis"][0]
+    assert new_chart_data["bi_zss"][0] is chart_data["bi_zss"][0]
+    assert new_chart_data["bis"][-1]["points"][1]["price"] == 10.0
+    assert new_chart_data["fxs"][-1]["points"][0]["price"] == 10.0
+
+    # 已完成的对象，起止分型发生变化，重新生成
+    cd.bis[0].end = cd.fxs[2]
+    new_chart_data = cl_data_to_tv_chart(cd, CHART_CONFIG)
+    assert new_chart_data["bis"][0]["points"][1]["price"] == 2.0
+
+
+def test_cl_data_to_tv_chart_tail():
+    cd = FakeCL(40)
+    chart_data = cl_data_to_tv_chart(cd, CHART_CONFIG)
+    tail_data = cl_data_to_tv_chart(cd, CHART_CONFIG, tail=5)
+    # 只转换最后部分，返回的数据是全量数据中时间大于截断时间点的部分
+    for _k, cutoff in tail_data["cutoffs"].items():
+        if _k == "t":
+            full = [_t for _t in chart_data["t"] if cutoff is None or _t > cutoff]
+            assert tail_data["t"] == full
+            assert tail_data["c"] == chart_data["c"][-len(full) :]
+            continue
+        full = [
+            _i
+            for _i in chart_data[_k]
+            if cutoff is None
+            or (
+                _i["points"][0]["time"]
+                if isinstance(_i["points"], list)
+                else _i["points"]["time"]
+            )
+            > cutoff
+        ]
+        assert tail_data[_k] == full
+    assert tail_data["cutoffs"]["t"] == chart_data["t"][-5]
+    assert len(tail_data["t"]) == 4 and len(tail_data["fxs"]) == 4
+    assert tail_data["cutoffs"]["bi_zss"] is None
+    assert "cutoffs" not in chart_data
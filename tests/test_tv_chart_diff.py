@@ -0,0 +1,130 @@
+import copy
+
+from chanlun.tv_chart_diff import BAR_KEYS, OBJ_KEYS, TVChartDiff
+
+
+def make_chart_data(nums=20):
+    chart_data = {_k: [float(_i) for _i in range(nums)] for _k in BAR_KEYS}
+    for _k in OBJ_KEYS:
+        chart_data[_k] = [
+            {
+                "points": [{"time": _i, "price": 1.0}, {"time": _i + 1, "price": 2.0}],
+                "linestyle": "0",
+            }
+            for _i in range(0, nums, 4)
+        ]
+    return chart_data
+
+
+def tail_chart_data(chart_data, tail):
+    """
+    模拟 cl_data_to_tv_chart 的 tail 参数，只返回最后部分的数据
+    """
+    tail_data = {"cutoffs": {}}
+    if len(chart_data["t"]) > tail:
+        tail_data["cutoffs"]["t"] = chart_data["t"][-tail]
+        for _k in BAR_KEYS:
+            tail_data[_k] = chart_data[_k][-tail + 1 :]
+    else:
+        tail_data["cutoffs"]["t"] = None
+        for _k in BAR_KEYS:
+            tail_data[_k] = chart_data[_k]
+    for _k in OBJ_KEYS:
+        items = chart_data[_k]
+        cutoff = items[-tail]["points"][0]["time"] if len(items) > tail else None
+        tail_data["cutoffs"][_k] = cutoff
+        tail_data[_k] = [
+            _i for _i in items if cutoff is None or _i["points"][0]["time"] > cutoff
+        ]
+    return tail_data
+
+
+def apply_diff(chart_data, diff_data):
+    new_data = {
+        _k: chart_data[_k][: diff_data["bars_keep"]] + diff_data[_k] for _k in BAR_KEYS
+    }
+    for _k, _diff in diff_data["diffs"].items():
+        new_data[_k] = chart_data[_k][: _diff["keep"]] + _diff["items"]
+    return new_data
+
+
+def test_diff():
+    chart_diff = TVChartDiff(max_charts=2, tail_nums=3)
+    chart_data = make_chart_data()
+    version = chart_diff.save("a", chart_data)
+    # 只保存版本摘要
+    assert len(chart_diff.charts["a"][0][1]["lists"]["bars"][1]) == 6
+
+    # 数据没有变化，版本号不变，只返回最后两根K线
+    diff_data, new_version = chart_diff.update(
+        "a", version, tail_chart_data(chart_data, 3)
+    )
+    assert new_version == version
+    assert diff_data["bars_keep"] == 18 and diff_data["t"] == [18.0, 19.0]
+    assert all(_d["items"] == [] for _d in diff_data["diffs"].values())
+    assert chart_diff.save("a", copy.deepcopy(chart_data)) == version
+
+    # 最后一根K线变化，新增一根K线，最后一笔变化，删除最后一个中枢
+    new_data = copy.deepcopy(chart_data)
+    new_data["c"][-1] = 100.0
+    for _k in BAR_KEYS:
+        new_data[_k].append(20.0)
+    new_data["bis"][-1]["linestyle"] = "1"
+    new_data["bi_zss"].pop()
+    diff_data, new_version = chart_diff.update(
+        "a", str(version), tail_chart_data(new_data, 3)
+    )
+    assert new_version != version
+    assert diff_data["bars_keep"] == 19 and diff_data["c"] == [100.0, 20.0]
+    assert diff_data["diffs"]["bis"]["keep"] == 4
+    assert diff_data["diffs"]["bi_zss"] == {"keep": 4, "items": []}
+    assert apply_diff(chart_data, diff_data) == new_data
+    # 新版本的摘要与全量数据的摘要一致
+    assert chart_diff.save("a", new_data) == new_version
+
+    # 之前的版本还保留，可以继续计算增量
+    newer_data = copy.deepcopy(new_data)
+    for _k in BAR_KEYS:
+        newer_data[_k].append(21.0)
+    diff_data, _ = chart_diff.update("a", version, tail_chart_data(newer_data, 4))
+    assert apply_diff(chart_data, diff_data) == newer_data
+    # 版本的最后一根K线（可能已经变化）在转换的范围之前，需要返回全量数据
+    assert chart_diff.update("a", version, tail_chart_data(newer_data, 3))[0] is None
+    diff_data, _ = chart_diff.update("a", new_version, tail_chart_data(newer_data, 3))
+    assert diff_data["bars_keep"] == 20 and diff_data["t"] == [20.0, 21.0]
+    assert apply_diff(new_data, diff_data) == newer_data
+
+    # 不存在的版本，需要返回全量数据
+    assert chart_diff.update("a", "abc", tail_chart_data(newer_data, 3))[0] is None
+    assert chart_diff.update("a", 1, tail_chart_data(newer_data, 3))[0] is None
+    chart_diff.save("b", chart_data)
+    chart_diff.save("c", chart_data)
+    assert chart_diff.update("a", new_version, tail_chart_data(newer_data, 3)) == (
+        None,
+        None,
+    )
+
+
+def test_diff_out_of_summary():
+    chart_diff = TVChartDiff(tail_nums=3)
+    chart_data = make_chart_data()
+    version = chart_diff.save("a", chart_data, source=chart_data)
+
+    # 变化超出摘要的范围（新增的K线数量超过摘要），无法对齐，需要转换全量数据
+    new_data = copy.deepcopy(chart_data)
+    for _k in BAR_KEYS:
+        new_data[_k] += [20.0, 21.0, 22.0, 23.0, 24.0]
+    assert chart_diff.update(
+        "a", version, tail_chart_data(new_data, 3), source=chart_data
+    ) == (None, None)
+
+    # 缠论对象重新创建后，之前的版本不再计算增量
+    assert chart_diff.update(
+        "a", version, tail_chart_data(chart_data, 3), source=new_data
+    ) == (None, None)
+    new_version = chart_diff.save("a", chart_data, source=new_data)
+    assert new_version != version
+    diff_data, _ = chart_diff.update(
+        "a", version, tail_chart_data(chart_data, 3), source=new_data
+    )
+    assert diff_data is None
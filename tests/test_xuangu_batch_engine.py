@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+try:
+    from chanlun.xuangu.batch_engine import XuanguBatchEngine
+    from chanlun.xuangu.prefilter import prefilter
+except Exception:  # noqa: BLE001
+    # 缠论计算模块需要授权后才能导入
+    pytest.skip("chanlun.xuangu.batch_engine 无法导入", allow_module_level=True)
+
+
+class FakeExchange:
+    """
+    不请求行情的交易所，收盘价为代码的序号，记录获取K线的次数
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_nums = 0
+
+    def klines(self, code, frequency):
+        with self.lock:
+            self.load_nums += 1
+        num = float(code[1:])
+        return pd.DataFrame(
+            {
+                "date": pd.date_range("2024-01-02", periods=3, freq="D"),
+                "open": np.full(3, num),
+                "high": np.full(3, num),
+                "low": np.full(3, num),
+                "close": np.full(3, num),
+                "volume": np.full(3, 100.0),
+            }
+        )
+
+
+_fake_exchange = FakeExchange()
+
+
+def fake_get_exchange(market):
+    return _fake_exchange
+
+
+def xg_pid(code, mk_datas, opt_types):
+    """
+    返回计算的子进程，C0 计算较慢
+    """
+    if code == "C0":
+        time.sleep(1)
+    return {
+        "pid": os.getpid(),
+        "opt": opt_types[0],
+        "close": float(mk_datas.klines(code, "d")["close"].iloc[-1]),
+    }
+
+
+def xg_slow(code, mk_datas, opt_types):
+    time.sleep(0.2)
+    return {"opt": opt_types[0]}
+
+
+def xg_exit(code, mk_datas, opt_types):
+    # 模拟子进程异常退出
+    if code == "C3":
+        os._exit(1)
+    return {"pid": os.getpid()}
+
+
+def _close_even(panel, opt_types, cl_config):
+    return panel.close[:, -1] % 2 == 0
+
+
+@prefilter(_close_even, length=2)
+def xg_even(code, mk_datas, opt_types):
+    return {"close": float(mk_datas.klines(code, "d")["close"].iloc[-1])}
+
+
+def make_engine(load_workers=2, **kwargs):
+    return XuanguBatchEngine(
+        load_workers=load_workers, exchange_fun=fake_get_exchange, **kwargs
+    )
+
+
+def test_scan_stream_and_pin_workers():
+    engine = make_engine(workers=2, batch_size=1)
+    codes = [f"C{_i}" for _i in range(10)]
+    try:
+        results = list(engine.scan("a", codes, ["d"], xg_pid, ["1"], {}))
+        # 每个代码只返回一次，按照完成的顺序返回（C0 较慢，不是第一个返回）
+        order = [_c for _c, _, _ in results]
+        assert sorted(order) == sorted(codes) and order[0] != "C0"
+        assert all(_e is None for _, _, _e in results)
+        assert all(_r["close"] == float(_c[1:]) for _c, _r, _ in results)
+        pids = {_c: _r["pid"] for _c, _r, _ in results}
+        for _c, _pid in pids.items():
+            assert _pid == engine.processes[engine.worker_index(_c)].pid
+
+        # 第二次选股，同一个代码仍然由同一个子进程计算
+        results = list(engine.scan("a", codes, ["d"], xg_pid, ["2"], {}))
+        assert {_c: _r["pid"] for _c, _r, _ in results} == pids
+        assert all(_r["opt"] == "2" for _, _r, _ in results)
+    finally:
+        engine.close()
+
+
+def test_scan_ignore_stale_results():
+    engine = make_engine(workers=1, batch_size=1)
+    codes = [f"C{_i}" for _i in range(6)]
+    try:
+        scan = engine.scan("a", codes, ["d"], xg_slow, ["1"], {})
+        next(scan)
+        # 提前结束选股，子进程中还没有计算完成的结果，不能出现在下一次选股中
+        scan.close()
+        results = list(engine.scan("a", codes, ["d"], xg_slow, ["2"], {}))
+        assert sorted(_c for _c, _, _ in results) == codes
+        assert all(_r["opt"] == "2" for _, _r, _ in results)
+    finally:
+        engine.close()
+
+
+def test_scan_in_flight_limit():
+    engine = make_engine(workers=1, batch_size=1)
+    codes = [f"C{_i}" for _i in range(30)]
+    limit = engine.workers * engine.batch_size * 4
+    try:
+        start_nums = _fake_exchange.load_nums
+        yield_nums = 0
+        for _ in engine.scan("a", codes, ["d"], xg_pid, ["1"], {}):
+            yield_nums += 1
+            # 获取了K线还没有返回结果的代码数量，不能超过限制
+            assert _fake_exchange.load_nums - start_nums <= yield_nums + limit
+            time.sleep(0.01)
+        assert yield_nums == len(codes)
+    finally:
+        engine.close()
+
+
+def test_scan_worker_exit():
+    # 单线程获取K线，发送给子进程的代码按照列表的顺序
+    engine = make_engine(load_workers=1, workers=2, batch_size=100)
+    codes = [f"C{_i}" for _i in range(10)]
+    exit_i = engine.worker_index("C3")
+    exit_codes = [_c for _c in codes if engine.worker_index(_c) == exit_i]
+    try:
+        results = {
+            _c: (_r, _e)
+            for _c, _r, _e in engine.scan("a", codes, ["d"], xg_exit, [], {})
+        }
+        assert sorted(results.keys()) == sorted(codes)
+        # 异常退出的子进程中，C3 以及之后的代码返回异常信息；
+        # 之前的代码可能已经返回（也可能结果还在子进程的发送缓冲中，同样记为异常退出），其他子进程的代码正常返回
+        lost = exit_codes[exit_codes.index("C3") :]
+        for _c in codes:
+            if _c in lost:
+                assert results[_c] == (None, "选股子进程异常退出")
+            elif _c in exit_codes:
+                assert results[_c][1] in (None, "选股子进程异常退出")
+            else:
+                assert results[_c][1] is None
+
+        # 子进程重新启动，之后的选股可以正常执行
+        results = list(engine.scan("a", ["C1", "C2"], ["d"], xg_pid, ["1"], {}))
+        assert sorted(_c for _c, _, _ in results) == ["C1", "C2"]
+        assert all(_e is None for _, _, _e in results)
+    finally:
+        engine.close()
+
+
+def test_scan_prefilter():
+    engine = make_engine(workers=2, batch_size=2)
+    codes = [f"C{_i}" for _i in range(10)]
+    try:
+        results = {
+            _c: _r for _c, _r, _e in engine.scan("a", codes, ["d"], xg_even, [], {})
+        }
+        assert sorted(results.keys()) == sorted(codes)
+        # 没有通过预筛选的代码，不计算直接返回空结果
+        for _c, _r in results.items():
+            if int(_c[1:]) % 2 == 0:
+                assert _r == {"close": float(_c[1:])}
+            else:
+                assert _r is None
+    finally:
+        engine.close()
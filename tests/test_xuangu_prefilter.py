@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import talib
+
+from chanlun.cl_interface import Config
+from chanlun.xuangu import prefilter
+
+
+def make_klines(nums, seed=0):
+    rng = np.random.default_rng(seed)
+    c = 10 + np.cumsum(rng.normal(0, 0.1, nums))
+    return pd.DataFrame(
+        {
+            "open": c,
+            "high": c + 0.2,
+            "low": c - 0.2,
+            "close": c,
+            "volume": np.full(nums, 100.0),
+        }
+    )
+
+
+def test_klines_panel_right_aligned():
+    panel = prefilter.KlinesPanel(
+        {"A": make_klines(50), "B": make_klines(400, 1)}, length=300
+    )
+    assert panel.codes == ["A", "B"]
+    assert panel.nums.tolist() == [50, 400]
+    assert panel.close.shape == (2, 300)
+    assert np.isnan(panel.close[0, :250]).all()
+    assert panel.close[0, -1] == make_klines(50)["close"].iloc[-1]
+    assert not np.isnan(panel.close[1]).any()
+
+
+def test_panel_indicators_match_talib():
+    klines = {"A": make_klines(60), "B": make_klines(300, 1)}
+    panel = prefilter.KlinesPanel(klines, length=300)
+    for _i, _k in enumerate(klines.values()):
+        c = _k["close"].to_numpy()
+        ema = prefilter.ema(panel.close, 26)[_i, -len(c) :]
+        assert np.allclose(ema, talib.EMA(c, 26), equal_nan=True)
+    dif, dea = prefilter.macd(panel.close)
+    t_dif, t_dea, _ = talib.MACD(klines["B"]["close"].to_numpy(), 12, 26, 9)
+    assert np.isclose(dif[1, -1], t_dif[-1])
+    assert np.isclose(dea[1, -1], t_dea[-1])
+    ma = prefilter.ma(panel.close, 250)
+    assert np.isnan(ma[0])
+    assert np.isclose(ma[1], talib.MA(klines["B"]["close"].to_numpy(), 250)[-1])
+
+
+def test_apply_prefilter():
+    def last_up(panel, opt_types, cl_config):
+        return panel.close[:, -1] > panel.close[:, -2]
+
+    @prefilter.prefilter(last_up, length=2)
+    def xg_fun(code, mk_datas, opt_type):
+        return None
+
+    klines = {}
+    for _i in range(10):
+        _k = make_klines(100, _i)
+        _k.loc[99, "close"] = _k.loc[98, "close"] + (1 if _i % 2 == 0 else -1)
+        klines[f"C{_i}"] = {"d": _k}
+
+    selected = prefilter.apply_prefilter(xg_fun, klines, ["d"], ["long"], {})
+    assert selected == {"C0", "C2", "C4", "C6", "C8"}
+
+    # 没有声明预筛选，或者使用平均K线的，全部通过
+    assert prefilter.apply_prefilter(
+        lambda *args: None, klines, ["d"], ["long"], {}
+    ) == set(klines)
+    ha_config = {"kline_type": Config.KLINE_TYPE_HEIKIN_ASHI.value}
+    assert prefilter.apply_prefilter(xg_fun, klines, ["d"], ["long"], ha_config) == set(
+        klines
+    )
@@ -1,5 +1,7 @@
 import datetime
+import hashlib
 import json
+import multiprocessing
 import os
 import time
 import traceback
@@ -35,19 +37,22 @@ from chanlun.cl_utils import (
     kcharts_frequency_h_l_map,
     query_cl_chart_config,
     set_cl_chart_config,
-    web_batch_get_cl_datas,
 )
 from chanlun.config import get_data_path
 from chanlun.db import db
 from chanlun.exchange import get_exchange
 from chanlun.exchange.stocks_bkgn import StocksBKGN
+from chanlun.file_db import fdb
 from chanlun.tools.ai_analyse import AIAnalyse
 from chanlun.tools.ai_predict import AITrendPredict
+from chanlun.tv_chart_diff import tv_chart_diff
 from chanlun.zixuan import ZiXuan
 
 from .alert_tasks import AlertTasks
 from .backtest_routes import register_backtest_routes
+from .json_provider import FastJSONProvider
 from .other_tasks import OtherTasks
+from .prewarm_tasks import PrewarmTasks
 from .xuangu_tasks import XuanguTasks
 
 
@@ -202,10 +207,18 @@ def create_app(test_config=None):
 
     _other_tasks = OtherTasks(scheduler)
 
+    _prewarm_tasks = PrewarmTasks(scheduler)
+
+    # 缓存文件的后台清理只在主进程中启动，子进程只记录访问信息
+    if multiprocessing.parent_process() is None:
+        fdb.cache_manager.start()
+
     __log = fun.get_logger()
 
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
+    # 返回结果使用 orjson 编码（如果已安装）
+    app.json = FastJSONProvider(app)
     app.logger.addFilter(
         lambda record: "/static/" not in record.getMessage().lower()
     )  # 过滤静态资源请求日志
@@ -466,6 +479,8 @@ def create_app(test_config=None):
         _to = request.args.get("to")
         resolution = request.args.get("resolution")
         firstDataRequest = request.args.get("firstDataRequest", "false")
+        # 前端已有图表数据的版本号，有则返回与该版本之间的增量数据
+        version = request.args.get("version")
 
         _symbol_res_old_k_time_key = f"{symbol}_{resolution}"
 
@@ -517,6 +532,8 @@ def create_app(test_config=None):
             return {"s": "no_data", "nextTime": int(now_time + (10 * 60))}
 
         frequency = resolution_maps[resolution]
+        # 记录访问的代码与周期，后台预热时优先更新
+        _prewarm_tasks.touch(market, code, frequency)
         cl_config = query_cl_chart_config(market, code)
         frequency_low, kchart_to_frequency = kcharts_frequency_h_l_map(
             market, frequency
@@ -527,37 +544,71 @@ def create_app(test_config=None):
         ):
             # 如果开启并设置的该级别的低级别数据，获取低级别数据，并在转换成高级图表展示
             # s_time = time.time()
+            cd_frequency = frequency_low
             klines = ex.klines(code, frequency_low)
             # __log.info(f'{code} - {frequency_low} enable low to high get klines time : {time.time() - s_time}')
-            # s_time = time.time()
-            cd = web_batch_get_cl_datas(
-                market, code, {frequency_low: klines}, cl_config
-            )[0]
-            # __log.info(f'{code} - {frequency_low} enable low to high get cd time : {time.time() - s_time}')
         else:
             kchart_to_frequency = None
             # s_time = time.time()
+            cd_frequency = frequency
             klines = ex.klines(code, frequency)
             # __log.info(f'{code} - {frequency} get klines time : {time.time() - s_time}')
-            # s_time = time.time()
-            cd = web_batch_get_cl_datas(market, code, {frequency: klines}, cl_config)[0]
-            # __log.info(f'{code} - {frequency} get cd time : {time.time() - s_time}')
 
-        # 如果图表指定返回的时间太早，直接返回无数据
-        if int(_to) <= fun.datetime_to_int(klines.iloc[0]["date"]):
-            __set_symbol_no_data(_symbol_res_old_k_time_key, True)
-            return {"s": "no_data"}
+        # 图表数据的版本，按照代码、周期与缠论配置区分
+        chart_key = hashlib.md5(
+            f"{symbol}_{resolution}_{json.dumps(cl_config, sort_keys=True, default=str)}".encode(
+                "UTF-8"
+            )
+        ).hexdigest()
+        diff_data = None
+        chart_version = None
+        # 缠论对象可能同时被后台预热或其他请求更新，在持有对象锁的情况下计算并转换成图表数据
+        with fdb.web_cl_data(market, code, cd_frequency, cl_config, klines) as cd:
+            # 如果图表指定返回的时间太早，直接返回无数据
+            if int(_to) <= fun.datetime_to_int(klines.iloc[0]["date"]):
+                __set_symbol_no_data(_symbol_res_old_k_time_key, True)
+                return {"s": "no_data"}
+
+            if (
+                version is not None
+                and firstDataRequest == "false"
+                and __get_symbol_no_data(_symbol_res_old_k_time_key) is False
+            ):
+                # 前端支持增量更新（请求中有版本号），只转换最后部分的图表数据，计算与前端版本之间的增量数据
+                tail_chart_data = cl_data_to_tv_chart(
+                    cd,
+                    cl_config,
+                    to_frequency=kchart_to_frequency,
+                    tail=tv_chart_diff.tail_nums,
+                )
+                diff_data, chart_version = tv_chart_diff.update(
+                    chart_key, version, tail_chart_data, cd
+                )
 
-        # 将缠论数据，转换成 tv 画图的坐标数据
-        # s_time = time.time()
-        cl_chart_data = cl_data_to_tv_chart(
-            cd, cl_config, to_frequency=kchart_to_frequency
-        )
-        # __log.info(f'{code} - {frequency} to tv chart data time : {time.time() - s_time}')
+            if diff_data is None:
+                # 将缠论数据，转换成 tv 画图的坐标数据
+                # s_time = time.time()
+                cl_chart_data = cl_data_to_tv_chart(
+                    cd, cl_config, to_frequency=kchart_to_frequency
+                )
+                # __log.info(f'{code} - {frequency} to tv chart data time : {time.time() - s_time}')
+                if chart_version is None:
+                    chart_version = tv_chart_diff.save(chart_key, cl_chart_data, cd)
+
+        if diff_data is not None:
+            return {
+                "s": s,
+                **diff_data,
+                "update": True,
+                "diff": True,
+                "version": chart_version,
+            }
 
         # 根据 from_time 和 to_time 来获取对应的K线数据
+        # 前端带有版本号，但是版本已经不存在的，返回全量数据
         if (
             firstDataRequest == "false"
+            and version is None
             and __get_symbol_no_data(_symbol_res_old_k_time_key) is False
         ):
             _t = cl_chart_data["t"][-10:]
@@ -611,8 +662,9 @@ def create_app(test_config=None):
             "bcs": _bcs,
             "mmds": _mmds,
             "update": (
-                False if firstDataRequest == "true" else True
+                False if firstDataRequest == "true" or version is not None else True
             ),  # 是否是后续更新数据
+            "version": chart_version,
         }
         return info
 
@@ -1418,7 +1470,24 @@ def create_app(test_config=None):
     @app.route("/jobs")
     @login_required
     def jobs():
-        return render_template("jobs.html", jobs=list(scheduler.my_task_list.values()))
+        # 缓存文件的统计信息，每类缓存一行
+        cache_stats = fdb.cache_manager.stats()
+        cache_rows = [
+            {
+                "kind": _kind,
+                "files": cache_stats["files"],
+                "mb": round(cache_stats["bytes"] / 1024 / 1024, 1),
+                "max_mb": round(cache_stats["max_bytes"] / 1024 / 1024, 1),
+                **_counter,
+            }
+            for _kind, _counter in cache_stats["counters"].items()
+        ]
+        return render_template(
+            "jobs.html",
+            jobs=list(scheduler.my_task_list.values()),
+            prewarm=_prewarm_tasks.metrics(),
+            cache_rows=cache_rows,
+        )
 
     @app.route("/xuangu/task_list/<market>")
     @login_required
@@ -0,0 +1,62 @@
+"""
+接口返回结果的 JSON 编码
+
+安装了 orjson 则使用 orjson 进行编码（图表数据等较大的返回结果，编码速度快很多），没有安装或者 orjson 不支持的数据，使用 Flask 默认的编码
+
+Flask 的 DefaultJSONProvider.response 总是带着 separators（调试模式下是 indent=2）参数调用 dumps，
+所以需要重写 response，直接使用 orjson 编码成 bytes 并生成返回对象
+"""
+
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    优先使用 orjson 的 JSON 编码
+    """
+
+    def _orjson_dumps(self, obj, indent: bool = False) -> bytes:
+        """
+        使用 orjson 编码，不支持的数据抛出 TypeError
+
+        @param obj: 编码的数据
+        @param indent: 是否缩进两个空格格式化
+        """
+        option = (
+            orjson.OPT_SERIALIZE_NUMPY
+            | orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs) -> str:
+        # orjson 只支持两个空格的缩进，其他缩进使用默认的编码；orjson 的结果本身就是紧凑格式，忽略 separators
+        indent = kwargs.get("indent")
+        if orjson is None or indent not in (None, 2):
+            return super().dumps(obj, **kwargs)
+        try:
+            return self._orjson_dumps(obj, indent=indent == 2).decode("utf-8")
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs) -> Response:
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # 与 Flask 默认的判断一致，调试模式下缩进格式化
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            data = self._orjson_dumps(obj, indent=indent)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(data + b"\n", mimetype=self.mimetype)
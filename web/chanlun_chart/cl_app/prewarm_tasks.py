@@ -0,0 +1,212 @@
+import datetime
+import threading
+import time
+from collections import deque
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from chanlun import config, fun
+from chanlun.base import Market
+from chanlun.cl_utils import kcharts_frequency_h_l_map, query_cl_chart_config
+from chanlun.db import db
+from chanlun.exchange import get_exchange
+from chanlun.file_db import fdb
+from chanlun.zixuan import ZiXuan
+
+
+class PrewarmTasks:
+    """
+    缠论数据预热
+
+    定时遍历自选分组与警报任务中的代码，获取最新的K线并更新缓存的缠论数据对象，
+    用户打开图表或执行警报时，只需要进行增量计算；最近访问过的代码优先更新
+    """
+
+    def __init__(self, scheduler: BackgroundScheduler):
+        self.scheduler = scheduler
+        self.log = fun.get_logger()
+
+        # 预热的间隔（分钟），0 不进行预热
+        self.interval_minutes = int(getattr(config, "PREWARM_INTERVAL_MINUTES", 10))
+        # 每次预热的最大数量（代码 + 周期）
+        self.max_nums = int(getattr(config, "PREWARM_MAX_NUMS", 300))
+        # 自选代码需要预热的周期 {市场: [周期]}，没有设置的市场，使用最近访问过的周期
+        self.frequencys: dict[str, list[str]] = getattr(
+            config, "PREWARM_FREQUENCYS", {}
+        )
+
+        # 访问记录保留的时间（秒），超过时间没有再访问的删除
+        self.access_ttl_seconds = (
+            float(getattr(config, "PREWARM_ACCESS_HOURS", 24)) * 60 * 60
+        )
+
+        # 最近访问的时间 {(市场, 代码, 周期): 时间}
+        self.access_times: dict[tuple[str, str, str], float] = {}
+        # 最近一次预热的时间 {(市场, 代码, 周期, 是否图表): 时间}
+        self.warm_times: dict[tuple[str, str, str, bool], float] = {}
+        # 等待预热的队列 [((市场, 代码, 周期, 是否图表), 应该预热的时间)]
+        # 应该预热的时间为上次预热时间加上预热间隔，没有预热过的为加入队列的时间
+        self.queue: deque[tuple[tuple[str, str, str, bool], float]] = deque()
+        self.lock = threading.Lock()
+
+        self.last_run_dt = "--"
+        self.last_run_seconds = 0.0
+        self.last_run_nums = 0
+        self.last_run_errors = 0
+
+        self.run()
+
+    def run(self):
+        if self.interval_minutes <= 0:
+            return
+        self.scheduler.add_job(
+            self.prewarm_run,
+            trigger="interval",
+            minutes=self.interval_minutes,
+            next_run_time=datetime.datetime.now() + datetime.timedelta(seconds=30),
+            id="prewarm_cl_datas",
+            name="预热自选与警报的缠论数据",
+            max_instances=1,
+            coalesce=True,
+        )
+
+    def touch(self, market: str, code: str, frequency: str):
+        """
+        记录代码的访问时间，预热时优先更新
+        """
+        self.access_times[(market, code, frequency)] = time.time()
+
+    def prewarm_codes(self) -> list[tuple[str, str, str, bool]]:
+        """
+        获取需要预热的 (市场, 代码, 周期, 是否图表) 列表，按照最近访问时间排序
+        图表数据按照图表的方式获取（可能使用低级别K线），警报任务直接使用任务的周期
+        """
+        # 删除超过保留时间没有再访问的记录
+        expire_time = time.time() - self.access_ttl_seconds
+        for _k, _t in list(self.access_times.items()):
+            if _t < expire_time:
+                self.access_times.pop(_k, None)
+
+        keys = set()
+        # 警报任务中的代码与周期
+        for _t in db.task_query():
+            if _t.is_run != 1:
+                continue
+            for _s in ZiXuan(_t.market).zx_stocks(_t.zx_group):
+                keys.add((_t.market, _s["code"], _t.frequency, False))
+
+        # 自选中的代码，预热设置的周期或最近访问过的周期
+        access_frequencys: dict[str, set] = {}
+        for _m, _, _f in list(self.access_times):
+            access_frequencys.setdefault(_m, set()).add(_f)
+        for _market in Market:
+            _frequencys = self.frequencys.get(
+                _market.value, access_frequencys.get(_market.value, [])
+            )
+            if len(_frequencys) == 0:
+                continue
+            for _zx in ZiXuan(_market.value).query_all_zs_stocks():
+                for _s in _zx["stocks"]:
+                    for _f in _frequencys:
+                        keys.add((_market.value, _s["code"], _f, True))
+
+        # 最近访问过的代码
+        access_times = dict(self.access_times)
+        keys.update((*_k, True) for _k in access_times)
+
+        keys = sorted(keys, key=lambda _k: -access_times.get(_k[:3], 0))
+        keys = keys[: self.max_nums]
+
+        # 不再需要预热的代码，删除预热时间的记录
+        keep_keys = set(keys)
+        for _k in list(self.warm_times):
+            if _k not in keep_keys:
+                self.warm_times.pop(_k, None)
+        return keys
+
+    def prewarm_run(self):
+        s_time = time.time()
+        interval_seconds = self.interval_minutes * 60
+        keys = self.prewarm_codes()
+        with self.lock:
+            self.queue = deque(
+                (
+                    _k,
+                    (
+                        self.warm_times[_k] + interval_seconds
+                        if _k in self.warm_times
+                        else s_time
+                    ),
+                )
+                for _k in keys
+            )
+        nums = 0
+        errors = 0
+        trading_markets = {}
+        while True:
+            with self.lock:
+                if len(self.queue) == 0:
+                    break
+                key, _ = self.queue.popleft()
+            market, code, frequency, chart = key
+            try:
+                if market not in trading_markets:
+                    trading_markets[market] = get_exchange(Market(market)).now_trading()
+                # 非交易时间，已经预热过的不需要再更新
+                if trading_markets[market] is False and key in self.warm_times:
+                    continue
+                self.prewarm_code(market, code, frequency, chart)
+                self.warm_times[key] = time.time()
+                nums += 1
+            except Exception as e:  # noqa: BLE001
+                errors += 1
+                self.log.error(f"预热 {market} {code} {frequency} 缠论数据异常 {e}")
+
+        self.last_run_dt = fun.datetime_to_str(datetime.datetime.now())
+        self.last_run_seconds = round(time.time() - s_time, 1)
+        self.last_run_nums = nums
+        self.last_run_errors = errors
+        return True
+
+    @staticmethod
+    def prewarm_code(market: str, code: str, frequency: str, chart: bool = True):
+        """
+        获取最新K线并更新缓存的缠论数据对象
+
+        @param chart: 是否按照图表的方式获取（与 /tv/history 一致，开启低级别转高级别图表的，使用低级别K线）
+        """
+        ex = get_exchange(Market(market))
+        cl_config = query_cl_chart_config(market, code)
+        frequency_low, kchart_to_frequency = kcharts_frequency_h_l_map(
+            market, frequency
+        )
+        if (
+            chart
+            and cl_config["enable_kchart_low_to_high"] == "1"
+            and kchart_to_frequency is not None
+        ):
+            frequency = frequency_low
+        klines = ex.klines(code, frequency)
+        # 只更新缓存中的对象，不需要复制
+        with fdb.web_cl_data(market, code, frequency, cl_config, klines):
+            pass
+
+    def metrics(self) -> dict:
+        """
+        预热的统计信息：队列中等待的数量、最大的延迟时间（超过应该预热时间的秒数），以及上次执行的情况
+        """
+        now = time.time()
+        with self.lock:
+            queue_depth = len(self.queue)
+            lag_seconds = round(max([now - _due for _, _due in self.queue] + [0]), 1)
+        return {
+            "enable": self.interval_minutes > 0,
+            "interval_minutes": self.interval_minutes,
+            "queue_depth": queue_depth,
+            "lag_seconds": lag_seconds,
+            "warm_nums": len(self.warm_times),
+            "last_run_dt": self.last_run_dt,
+            "last_run_seconds": self.last_run_seconds,
+            "last_run_nums": self.last_run_nums,
+            "last_run_errors": self.last_run_errors,
+        }
@@ -77,6 +77,7 @@
             this._requester = requester;
             this._limitedServerResponse = limitedServerResponse;
             this.bars_result = new Map();
+            this._versions = new Map();
         }
         getBars(symbolInfo, resolution, periodParams) {
             const requestParams = {
@@ -91,6 +92,10 @@
             if (periodParams.firstDataRequest !== undefined) {
                 requestParams.firstDataRequest = periodParams.firstDataRequest;
             }
+            const version = this._versions.get(this._resultKey(requestParams));
+            if (periodParams.firstDataRequest === false && version !== undefined) {
+                requestParams.version = version;
+            }
             if (symbolInfo.currency_code !== undefined) {
                 requestParams.currencyCode = symbolInfo.currency_code;
             }
@@ -204,10 +209,47 @@
                     bars.push(barValue);
                 }
                 // 设置保存的key
-                const res_key = requestParams["symbol"].toString().toLowerCase() +
-                    requestParams["resolution"].toString().toLowerCase();
+                const res_key = this._resultKey(requestParams);
                 // 保存数据
                 let obj_res = this.bars_result.get(res_key);
+                if (response.diff === true) {
+                    // 增量数据，保留已有数据的前 keep 个，之后替换为返回的数据
+                    if (obj_res == undefined) {
+                        // 没有已有的数据，下次请求全量数据
+                        this._versions.delete(res_key);
+                    }
+                    else {
+                        const diffs = response.diffs;
+                        const applyDiff = (existing, diff) => (existing || []).slice(0, diff.keep).concat(diff.items);
+                        obj_res.fxs = applyDiff(obj_res.fxs, diffs.fxs);
+                        obj_res.bis = applyDiff(obj_res.bis, diffs.bis);
+                        obj_res.xds = applyDiff(obj_res.xds, diffs.xds);
+                        obj_res.zsds = applyDiff(obj_res.zsds, diffs.zsds);
+                        obj_res.bi_zss = applyDiff(obj_res.bi_zss, diffs.bi_zss);
+                        obj_res.xd_zss = applyDiff(obj_res.xd_zss, diffs.xd_zss);
+                        obj_res.zsd_zss = applyDiff(obj_res.zsd_zss, diffs.zsd_zss);
+                        obj_res.bcs = applyDiff(obj_res.bcs, diffs.bcs);
+                        obj_res.mmds = applyDiff(obj_res.mmds, diffs.mmds);
+                        this.bars_result.set(res_key, obj_res);
+                        this._versions.set(res_key, response.version);
+                    }
+                    return {
+                        bars: bars,
+                        meta: meta,
+                        fxs: response.diffs.fxs.items,
+                        bis: response.diffs.bis.items,
+                        xds: response.diffs.xds.items,
+                        zsds: response.diffs.zsds.items,
+                        bi_zss: response.diffs.bi_zss.items,
+                        xd_zss: response.diffs.xd_zss.items,
+                        zsd_zss: response.diffs.zsd_zss.items,
+                        bcs: response.diffs.bcs.items,
+                        mmds: response.diffs.mmds.items,
+                    };
+                }
+                if (response.version !== undefined) {
+                    this._versions.set(res_key, response.version);
+                }
                 if (response.update == false || obj_res == undefined) {
                     this.bars_result.set(res_key, {
                         bars: bars,
@@ -324,6 +366,10 @@
             };
             return result;
         }
+        _resultKey(requestParams) {
+            return (requestParams["symbol"].toString().toLowerCase() +
+                requestParams["resolution"].toString().toLowerCase());
+        }
     }
 
     class DataPulseProvider {
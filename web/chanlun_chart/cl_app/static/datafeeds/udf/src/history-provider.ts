@@ -44,6 +44,40 @@ interface HistoryFullDataResponse extends UdfOkResponse {
   mmds: TextPoint[];
   update: boolean;
   chart_color?: Map<string, string>;
+  version?: number;
+  diff?: false;
+}
+
+// 增量更新的列表数据：保留已有列表的前 keep 个，之后替换为 items
+interface ListDiff<T> {
+  keep: number;
+  items: T[];
+}
+
+// 增量更新的数据（请求中带有 version 时，返回与该版本之间的变化）
+interface HistoryDiffResponse extends UdfOkResponse {
+  t: number[];
+  c: number[];
+  o: number[];
+  h: number[];
+  l: number[];
+  v: number[];
+  bars_keep: number;
+  diffs: {
+    fxs: ListDiff<TextPoint>;
+    bis: ListDiff<LineSegment>;
+    xds: ListDiff<LineSegment>;
+    zsds: ListDiff<LineSegment>;
+    bi_zss: ListDiff<LineSegment>;
+    xd_zss: ListDiff<LineSegment>;
+    zsd_zss: ListDiff<LineSegment>;
+    bcs: ListDiff<TextPoint>;
+    mmds: ListDiff<TextPoint>;
+  };
+  update: true;
+  diff: true;
+  version: number;
+  chart_color?: never;
 }
 
 // tslint:enable: no-any
@@ -54,6 +88,7 @@ interface HistoryNoDataResponse extends UdfResponse {
 
 type HistoryResponse =
   | HistoryFullDataResponse
+  | HistoryDiffResponse
   | HistoryPartialDataResponse
   | HistoryNoDataResponse;
 
@@ -117,6 +152,8 @@ export class HistoryProvider {
   private readonly _requester: IRequester;
   private readonly _limitedServerResponse?: LimitedResponseConfiguration;
   public bars_result: Map<string, GetBarsResult>;
+  // 已有图表数据的版本号，后续请求时带上，只获取增量的数据
+  private _versions: Map<string, number>;
 
   public constructor(
     datafeedUrl: string,
@@ -127,6 +164,7 @@ export class HistoryProvider {
     this._requester = requester;
     this._limitedServerResponse = limitedServerResponse;
     this.bars_result = new Map();
+    this._versions = new Map();
   }
 
   public getBars(
@@ -148,6 +186,11 @@ export class HistoryProvider {
       requestParams.firstDataRequest = periodParams.firstDataRequest;
     }
 
+    const version = this._versions.get(this._resultKey(requestParams));
+    if (periodParams.firstDataRequest === false && version !== undefined) {
+      requestParams.version = version;
+    }
+
     if (symbolInfo.currency_code !== undefined) {
       requestParams.currencyCode = symbolInfo.currency_code;
     }
@@ -308,12 +351,50 @@ export class HistoryProvider {
       }
 
       // 设置保存的key
-      const res_key: string =
-        requestParams["symbol"].toString().toLowerCase() +
-        requestParams["resolution"].toString().toLowerCase();
+      const res_key: string = this._resultKey(requestParams);
 
       // 保存数据
       let obj_res = this.bars_result.get(res_key);
+      const diffResponse = response as HistoryDiffResponse;
+      if (diffResponse.diff === true) {
+        // 增量数据，保留已有数据的前 keep 个，之后替换为返回的数据
+        if (obj_res == undefined) {
+          // 没有已有的数据，下次请求全量数据
+          this._versions.delete(res_key);
+        } else {
+          const diffs = diffResponse.diffs;
+          const applyDiff = <T>(existing: T[], diff: ListDiff<T>): T[] =>
+            (existing || []).slice(0, diff.keep).concat(diff.items);
+          obj_res.fxs = applyDiff(obj_res.fxs, diffs.fxs);
+          obj_res.bis = applyDiff(obj_res.bis, diffs.bis);
+          obj_res.xds = applyDiff(obj_res.xds, diffs.xds);
+          obj_res.zsds = applyDiff(obj_res.zsds, diffs.zsds);
+          obj_res.bi_zss = applyDiff(obj_res.bi_zss, diffs.bi_zss);
+          obj_res.xd_zss = applyDiff(obj_res.xd_zss, diffs.xd_zss);
+          obj_res.zsd_zss = applyDiff(obj_res.zsd_zss, diffs.zsd_zss);
+          obj_res.bcs = applyDiff(obj_res.bcs, diffs.bcs);
+          obj_res.mmds = applyDiff(obj_res.mmds, diffs.mmds);
+          this.bars_result.set(res_key, obj_res);
+          this._versions.set(res_key, diffResponse.version);
+        }
+        return {
+          bars: bars,
+          meta: meta,
+          fxs: diffResponse.diffs.fxs.items,
+          bis: diffResponse.diffs.bis.items,
+          xds: diffResponse.diffs.xds.items,
+          zsds: diffResponse.diffs.zsds.items,
+          bi_zss: diffResponse.diffs.bi_zss.items,
+          xd_zss: diffResponse.diffs.xd_zss.items,
+          zsd_zss: diffResponse.diffs.zsd_zss.items,
+          bcs: diffResponse.diffs.bcs.items,
+          mmds: diffResponse.diffs.mmds.items,
+        };
+      }
+      const version = (response as HistoryFullDataResponse).version;
+      if (version !== undefined) {
+        this._versions.set(res_key, version);
+      }
       if (response.update == false || obj_res == undefined) {
         this.bars_result.set(res_key, {
           bars: bars,
@@ -472,4 +553,11 @@ export class HistoryProvider {
 
     return result;
   }
+
+  private _resultKey(requestParams: RequestParams): string {
+    return (
+      requestParams["symbol"].toString().toLowerCase() +
+      requestParams["resolution"].toString().toLowerCase()
+    );
+  }
 }
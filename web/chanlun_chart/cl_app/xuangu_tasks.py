@@ -1,20 +1,25 @@
 import datetime
-import os
-from concurrent.futures import ProcessPoolExecutor
-from multiprocessing import get_context
 from typing import Dict, List
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from tqdm.auto import tqdm
 
-from chanlun import fun, utils, zixuan
+from chanlun import config, fun, utils, zixuan
 from chanlun.cl_utils import query_cl_chart_config
 from chanlun.exchange import Market, get_exchange
 from chanlun.trader.online_market_datas import OnlineMarketDatas
 from chanlun.xuangu import xuangu
+from chanlun.xuangu.batch_engine import XuanguBatchEngine
 
 log = fun.get_logger()
 
+# 选股批量执行引擎，子进程在第一次选股时启动，之后一直保留计算过的缠论数据
+xuangu_engine = XuanguBatchEngine(
+    workers=getattr(config, "XUANGU_WORKERS", 0) or None,
+    load_workers=getattr(config, "XUANGU_LOAD_WORKERS", 8),
+    batch_size=getattr(config, "XUANGU_BATCH_SIZE", 10),
+)
+
 # 选股运行配置
 xuangu_task_configs: Dict[str, Dict[str, object]] = {
     "xg_single_bi_1mmd": {
@@ -131,24 +136,24 @@ def process_xuangu_task(
         tqdm.write(f"{market} {task_name} 选股任务开始，选股代码数量 {len(run_codes)}")
         zx.clear_zx_stocks(target_zx_group)
 
-        # 多进程版本
-        max_workers = int(os.cpu_count() / 2)
-        with ProcessPoolExecutor(
-            max_workers=max_workers,
-            mp_context=get_context("spawn"),
-        ) as executor:
-            bar = tqdm(run_codes, desc="选股进度")
-            for _xg_res in executor.map(
-                process_xuangu_by_code,
-                [(_c, market, freqs, task_name, opt_types) for _c in run_codes],
-                chunksize=5,
-            ):
-                bar.update(1)
-                if _xg_res is not None:
-                    tqdm.write(
-                        f"{market} {task_name} 选择 {_xg_res['code']} : {_xg_res['msg']}"
-                    )
-                    zx.add_stock(target_zx_group, _xg_res["code"], None)
+        # 批量执行版本，常驻的子进程保留缠论数据对象，每个代码完成后立即返回结果
+        cl_config = query_cl_chart_config(market, "----")
+        task_fun = xuangu_task_configs[task_name]["task_fun"]
+        bar = tqdm(total=len(run_codes), desc="选股进度")
+        for _code, _xg_res, _error in xuangu_engine.scan(
+            market, run_codes, freqs, task_fun, opt_types, cl_config
+        ):
+            bar.update(1)
+            if _error is not None:
+                tqdm.write(
+                    f"{market} {_code} {freqs} 执行选股任务 {task_name} 失败：{_error}"
+                )
+            if _xg_res is not None:
+                tqdm.write(
+                    f"{market} {task_name} 选择 {_xg_res['code']} : {_xg_res['msg']}"
+                )
+                zx.add_stock(target_zx_group, _xg_res["code"], None)
+        bar.close()
 
         # 单进程版本
         # for _code in tqdm(run_codes, desc="选股进度"):